@@ -13,6 +13,8 @@ from django.core.asgi import get_asgi_application
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 import sonos_control.routing
+import device_control.routing
+import vacation_mode.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BlackDiamondHub.settings')
 
@@ -21,6 +23,8 @@ application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
         URLRouter(
             sonos_control.routing.websocket_urlpatterns
+            + device_control.routing.websocket_urlpatterns
+            + vacation_mode.routing.websocket_urlpatterns
         )
     ),
 })
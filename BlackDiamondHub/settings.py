@@ -245,6 +245,11 @@ WIFI_PASSWORD_FOR_BDL_GUEST = os.environ.get('WIFI_PASSWORD_FOR_BDL_GUEST', 'def
 ###############################
 HOMEASSISTANT_URL = os.environ.get('HOMEASSISTANT_URL', 'http://homeassistant.local:8123')
 HOMEASSISTANT_ACCESS_TOKEN = os.environ.get('HOMEASSISTANT_ACCESS_TOKEN')
+# Mirror device_control entity states over HA's WebSocket API (REST is the fallback).
+HOMEASSISTANT_WS_MIRROR = os.environ.get('HOMEASSISTANT_WS_MIRROR', 'true').lower() in ('1', 'true', 'yes')
+# Keep-alive connections and retries for the shared REST client (device_control.ha_client).
+HOMEASSISTANT_POOL_SIZE = int(os.environ.get('HOMEASSISTANT_POOL_SIZE', 10))
+HOMEASSISTANT_RETRIES = int(os.environ.get('HOMEASSISTANT_RETRIES', 2))
 
 HOMEASSISTANT_URL_2 = os.environ.get('HOMEASSISTANT_URL_2', 'http://homeassistant.local:8123')
 HOMEASSISTANT_ACCESS_TOKEN_2 = os.environ.get('HOMEASSISTANT_ACCESS_TOKEN_2')
@@ -265,6 +270,17 @@ NAPOLEON_EUROPE = os.environ.get('NAPOLEON_EUROPE', 'false').lower() in ('1', 't
 # Leave unset to hide the Gemstone controls' live data.
 GEMSTONE_EMAIL = os.environ.get('GEMSTONE_EMAIL', '')
 GEMSTONE_PASSWORD = os.environ.get('GEMSTONE_PASSWORD', '')
+# Saved-pattern catalogue and last device states, kept across restarts so the
+# controls load before the cloud answers. Set to an empty string to disable.
+GEMSTONE_CACHE_FILE = os.environ.get('GEMSTONE_CACHE_FILE', os.path.join(BASE_DIR, 'gemstone_cache.json'))
+
+# Circuit breaker for the fireplace and Gemstone clouds: consecutive failed
+# calls before it opens, its first cooldown in seconds (doubled after each
+# failed probe, up to the max), and successful probes needed to close it.
+CLOUD_BREAKER_THRESHOLD = int(os.environ.get('CLOUD_BREAKER_THRESHOLD', 3))
+CLOUD_BREAKER_COOLDOWN = float(os.environ.get('CLOUD_BREAKER_COOLDOWN', 30))
+CLOUD_BREAKER_MAX_COOLDOWN = float(os.environ.get('CLOUD_BREAKER_MAX_COOLDOWN', 600))
+CLOUD_BREAKER_PROBES = int(os.environ.get('CLOUD_BREAKER_PROBES', 1))
 
 ###########################
 ### go2rtc Camera Settings ###
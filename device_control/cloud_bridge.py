@@ -0,0 +1,763 @@
+"""
+Shared async bridge between sync Django and the async vendor cloud clients.
+
+``pynapoleon`` and ``pygemstone`` talk to their clouds over aiohttp and are
+entirely ``async``. Django's request handling here is synchronous, so we cannot
+simply ``asyncio.run()`` a fresh coroutine per request: a logged-in client owns
+an aiohttp ``ClientSession`` bound to the event loop it was created on, and
+re-using it from a different loop raises ``RuntimeError: ... attached to a
+different loop``.
+
+So every cloud runs on **one dedicated background event loop** in a daemon
+thread, and every vendor client shares **one aiohttp session** (and with it one
+connection pool) on that loop. Sync callers submit coroutines to the loop via
+``asyncio.run_coroutine_threadsafe`` and block on the result.
+
+A vendor plugs in with a :class:`CloudAdapter` (login, discover, refresh,
+apply); wrapping it in a :class:`CloudBridge` adds everything else:
+
+* Reads are served from a **snapshot** kept fresh by a scheduler task on the
+  loop. It refreshes every ``fast_interval`` for a short while after an action,
+  every ``active_interval`` while someone is reading, and every
+  ``idle_interval`` otherwise. A read that finds the snapshot missing or older
+  than ``max_age`` waits for a refresh, and concurrent readers share that one
+  refresh. An adapter may persist its snapshot; after a restart the persisted
+  states are served (with their true age) until the first refresh lands.
+* **Optimistic actions.** An adapter whose ``apply`` only sends the command
+  gets the state it asked for back straight away (:meth:`CloudAdapter.optimistic`),
+  without a second round trip to read it. Rapid changes to a ``debounced``
+  action are coalesced per device into one cloud write after
+  ``debounce_window``. With a ``reconcile_delay`` the device is re-read that
+  long after its last write; listeners (:meth:`CloudBridge.add_listener`) get
+  the real state if a field the actions changed isn't what was promised.
+  Until then, scheduled refreshes keep showing the promised fields.
+* A failed call drops the cached client and is retried once after a fresh
+  login (stale cloud sessions are the usual cause), within the same
+  ``CALL_TIMEOUT`` budget; a call that timed out is not retried.
+* A :class:`CircuitBreaker` per backend. After a run of failures calls fail
+  fast instead of waiting on a dead cloud, and reads get the last known states
+  flagged as stale (see :meth:`CloudBridge.is_stale`). Once the cooldown
+  passes, probe calls are let through one at a time; a failed probe doubles
+  the cooldown. The ``CLOUD_BREAKER_*`` settings tune it.
+* Per-operation call counts, error counts and p50/p99/max latency.
+
+Public API:
+    * :class:`CloudAdapter` -> subclass once per vendor
+    * :class:`CloudBridge(adapter)` -> ``get_states()``, ``apply_action()``,
+      ``add_listener()``, ``snapshot_age()``, ``is_stale()``, ``status()``,
+      ``metrics()``
+    * :class:`CircuitBreaker`
+    * :class:`CloudError` -> base class of each adapter's error type
+    * :class:`UnknownDeviceError` -> base class of each adapter's unknown-device
+      error; a caller's mistake, so never retried or counted by the breaker
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Coroutine, Mapping
+
+from django.conf import settings
+
+from .ha_client import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# How long a sync caller will block on a coroutine submitted to the loop.
+CALL_TIMEOUT = 25  # seconds
+
+# Total timeout for one request on the shared aiohttp session.
+SESSION_TIMEOUT = 30  # seconds
+
+# Default refresh intervals: just after an action, while read recently, and
+# otherwise. Adapters may override them.
+FAST_INTERVAL = 2  # seconds
+ACTIVE_INTERVAL = 10  # seconds
+IDLE_INTERVAL = 5 * 60  # seconds
+
+# How long FAST_INTERVAL applies after an action.
+BOOST_WINDOW = 20  # seconds
+
+# Readers within this long keep the scheduler on ACTIVE_INTERVAL.
+READER_WINDOW = 60  # seconds
+
+# Reads never get a snapshot older than this; they wait for a refresh instead.
+MAX_AGE = 30  # seconds
+
+# Debounced actions wait this long for a newer value before writing.
+DEBOUNCE_WINDOW = 0.4  # seconds
+
+# Re-read a device this long after its last write to confirm the optimistic state.
+RECONCILE_DELAY = 3  # seconds
+
+# Breaker defaults (settings CLOUD_BREAKER_THRESHOLD / _COOLDOWN /
+# _MAX_COOLDOWN / _PROBES): consecutive failures that open it, how long it
+# first stays open (doubled per failed probe, up to the max), and successful
+# probes needed to close it again.
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 30  # seconds
+BREAKER_MAX_COOLDOWN = 10 * 60  # seconds
+BREAKER_PROBES = 1
+
+# Don't start the retry with less than this left of the CALL_TIMEOUT budget.
+MIN_RETRY_BUDGET = 2  # seconds
+
+
+class CloudError(Exception):
+    """Any failure talking to a vendor cloud (auth, network, value)."""
+
+
+class UnknownDeviceError(CloudError):
+    """The requested device isn't one the cloud reported (a bad key, not an outage)."""
+
+
+# ---------------------------------------------------------------------------
+# The shared background event-loop thread and aiohttp session
+# ---------------------------------------------------------------------------
+class _LoopThread:
+    """Owns a single asyncio loop running in a daemon thread."""
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="cloud-bridge", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def run(self, coro: Coroutine[Any, Any, Any], timeout: float = CALL_TIMEOUT) -> Any:
+        """Submit ``coro`` to the loop and block until it returns."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:  # pragma: no cover - network timing
+            future.cancel()
+            raise
+
+
+# Lazily created so importing this module (e.g. during `manage.py check`) never
+# spins up a thread.
+_loop_thread: _LoopThread | None = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> _LoopThread:
+    global _loop_thread
+    if _loop_thread is None:
+        with _loop_lock:
+            if _loop_thread is None:
+                _loop_thread = _LoopThread()
+    return _loop_thread
+
+
+# Created on the loop thread; vendor clients never close a session they were given.
+_session: Any = None  # aiohttp.ClientSession
+
+
+async def _shared_session() -> Any:
+    global _session
+    if _session is None or _session.closed:
+        import aiohttp
+
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=SESSION_TIMEOUT))
+    return _session
+
+
+# ---------------------------------------------------------------------------
+# Adapter interface
+# ---------------------------------------------------------------------------
+class CloudAdapter:
+    """One vendor's cloud. Subclass it and wrap an instance in a :class:`CloudBridge`.
+
+    The coroutines run on the bridge's loop thread. Exceptions listed by
+    :meth:`library_errors` are wrapped in :attr:`error` by the bridge.
+    """
+
+    label = "Cloud"  # vendor name for messages and logs
+    key = "id"  # state field that identifies a device
+    device_noun = "device"
+    error: type[CloudError] = CloudError
+    unknown_error: type[UnknownDeviceError] = UnknownDeviceError  # should also subclass error
+    # action name -> coroutine factory taking (device, value)
+    actions: Mapping[str, Callable[[Any, Any], Coroutine[Any, Any, None]]] = {}
+
+    fast_interval: float = FAST_INTERVAL
+    boost_window: float = BOOST_WINDOW
+    active_interval: float = ACTIVE_INTERVAL
+    idle_interval: float = IDLE_INTERVAL
+    max_age: float = MAX_AGE
+    # Actions whose rapid changes are coalesced into one write per device.
+    debounced: frozenset[str] = frozenset()
+    debounce_window: float = DEBOUNCE_WINDOW
+    # Re-read a device this long after a write (None: trust the scheduler).
+    reconcile_delay: float | None = None
+
+    def library_errors(self) -> tuple[type[BaseException], ...]:
+        """The vendor library's "cloud call failed" exceptions (import lazily)."""
+        return ()
+
+    async def login(self, session: Any) -> Any:
+        """Log in over the shared aiohttp ``session`` and return the vendor client."""
+        raise NotImplementedError
+
+    async def discover(self, client: Any) -> dict[str, Any]:
+        """``{key: device handle}`` for every device on the account."""
+        raise NotImplementedError
+
+    async def refresh(self, device: Any) -> dict[str, Any]:
+        """Fetch one device's state from the cloud and serialize it."""
+        raise NotImplementedError
+
+    async def apply(self, device: Any, action: str, value: Any) -> dict[str, Any] | None:
+        """Run ``actions[action]`` on ``device`` and return its new state.
+
+        Return None to have the bridge build the state with :meth:`optimistic`.
+        """
+        raise NotImplementedError
+
+    def optimistic(self, state: dict[str, Any], action: str, value: Any) -> dict[str, Any]:
+        """``state`` with ``action`` applied (by default: the field of that name)."""
+        return {**state, action: value}
+
+    async def close(self, client: Any) -> None:
+        """Release ``client`` (best effort; the shared session stays open)."""
+
+    async def restore(self) -> tuple[list[dict[str, Any]], float] | None:
+        """Persisted states and the ``time.time()`` they were fetched, if any."""
+        return None
+
+    async def persist(self, states: list[dict[str, Any]]) -> None:
+        """Called with the states after every successful refresh."""
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker
+# ---------------------------------------------------------------------------
+class CircuitBreaker:
+    """Closed -> open after ``threshold`` failures -> half-open after the cooldown.
+
+    While half-open one probe call at a time is allowed; ``probes`` successes
+    in a row close the breaker, and a failure reopens it with the cooldown
+    doubled (up to ``max_cooldown``). Thread-safe.
+    """
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_THRESHOLD,
+        cooldown: float = BREAKER_COOLDOWN,
+        max_cooldown: float = BREAKER_MAX_COOLDOWN,
+        probes: int = BREAKER_PROBES,
+        name: str = "cloud",
+    ) -> None:
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probes = probes
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0  # consecutive
+        self._open = False
+        self._open_until = float("-inf")
+        self._cooldown = cooldown
+        self._probing = False
+        self._probe_successes = 0
+
+    @classmethod
+    def from_settings(cls, name: str = "cloud") -> CircuitBreaker:
+        return cls(
+            threshold=getattr(settings, "CLOUD_BREAKER_THRESHOLD", BREAKER_THRESHOLD),
+            cooldown=getattr(settings, "CLOUD_BREAKER_COOLDOWN", BREAKER_COOLDOWN),
+            max_cooldown=getattr(settings, "CLOUD_BREAKER_MAX_COOLDOWN", BREAKER_MAX_COOLDOWN),
+            probes=getattr(settings, "CLOUD_BREAKER_PROBES", BREAKER_PROBES),
+            name=name,
+        )
+
+    @property
+    def state(self) -> str:
+        """``closed``, ``open`` or ``half-open``."""
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if not self._open:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half-open"
+
+    @property
+    def open_until(self) -> float:
+        """``time.monotonic()`` when calls may be tried again (-inf if closed)."""
+        return self._open_until if self._open else float("-inf")
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe may run (0 unless open)."""
+        return max(0.0, self.open_until - time.monotonic())
+
+    def allow(self) -> bool:
+        """May a call go ahead now? In half-open state, True makes it the probe."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "open" or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if not (self._open and self._probing):
+                return  # closed, or a call that started before the breaker opened
+            self._probing = False
+            self._probe_successes += 1
+            if self._probe_successes >= self.probes:
+                logger.info("%s cloud recovered; breaker closed", self.name)
+                self._open = False
+                self._cooldown = self.base_cooldown
+                self._probe_successes = 0
+
+    def release(self) -> None:
+        """End a call that says nothing about the cloud's health (e.g. a bad key)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._open:
+                if self._probing:
+                    # The probe failed: back off further
+                    self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                    self._open_until = time.monotonic() + self._cooldown
+                    self._probing = False
+                    self._probe_successes = 0
+            elif self._failures >= self.threshold:
+                logger.warning("%s cloud failing; breaker open for %.0f s", self.name, self._cooldown)
+                self._open = True
+                self._open_until = time.monotonic() + self._cooldown
+
+    def status(self) -> dict[str, Any]:
+        """State, consecutive failures and backoff, for the health endpoint."""
+        with self._lock:
+            return {
+                "state": self._state(),
+                "failures": self._failures,
+                "retry_in": round(max(0.0, self._open_until - time.monotonic()), 1) if self._open else 0.0,
+                "cooldown": self._cooldown,
+            }
+
+
+# ---------------------------------------------------------------------------
+# Bridge
+# ---------------------------------------------------------------------------
+class CloudBridge:
+    """Sync, snapshot-backed access to one adapter's devices (see module docs)."""
+
+    def __init__(self, adapter: CloudAdapter, breaker: CircuitBreaker | None = None) -> None:
+        self.adapter = adapter
+        self.breaker = breaker or CircuitBreaker.from_settings(adapter.label)
+        # Only touched from coroutines on the loop thread, except that
+        # snapshot_age() reads _snapshot_at (a float) from any thread.
+        self._client: Any = None
+        self._devices: dict[str, Any] = {}
+        self._snapshot: list[dict[str, Any]] | None = None
+        self._snapshot_at: float | None = None  # time.monotonic() of the last refresh
+        self._attempted_at = float("-inf")  # last refresh attempt, successful or not
+        self._last_read = float("-inf")
+        self._boost_until = float("-inf")
+        self._restore_tried = False
+        self._restored = False  # the snapshot came from adapter.restore()
+        self._refreshing: asyncio.Future | None = None
+        self._scheduler: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        # Optimistic actions: the fields each device was promised until reconciled,
+        # the latest value of each (device, action) waiting out its debounce
+        # window, and each device's pending reconciliation.
+        self._promised: dict[str, dict[str, Any]] = {}
+        self._queued: dict[tuple[str, str], Any] = {}
+        self._reconciling: dict[str, asyncio.Task] = {}
+        self._listeners: list[Callable[[dict[str, Any]], None]] = []
+        # Metrics, from any thread.
+        self._lock = threading.Lock()
+        self._stats: dict[str, LatencyStats] = {}
+
+    # -- public sync API ---------------------------------------------------
+
+    def get_states(self) -> list[dict[str, Any]]:
+        """Every device's state, at most ``max_age`` old unless :meth:`is_stale`.
+
+        When the cloud is failing (or the breaker is open) the last known
+        states are returned instead; the error is raised only if there are none.
+        """
+        # A probe has to reach the cloud, however fresh the snapshot is
+        probe = self.breaker.state == "half-open"
+        try:
+            return self._call(lambda: self._read_states(refresh=probe))
+        except self.adapter.error as exc:
+            snapshot = self._snapshot
+            if snapshot is None:
+                raise
+            logger.warning("%s: serving last known states (%s)", self.adapter.label, exc)
+            return [dict(state) for state in snapshot]
+
+    def apply_action(self, key: str, action: str, value: Any) -> dict[str, Any]:
+        """Apply one action and return the device's new state."""
+        if action not in self.adapter.actions:
+            raise self.adapter.error(f"Unknown action: {action}")
+        # Reject bad keys up front: they must not log in again or trip the breaker
+        snapshot = self._snapshot
+        if snapshot is not None and all(state[self.adapter.key] != key for state in snapshot):
+            raise self._unknown(key)
+        return self._call(lambda: self._apply(key, action, value))
+
+    def add_listener(self, callback: Callable[[dict[str, Any]], None]) -> None:
+        """Call ``callback(state)`` (worker thread) when reconciling corrects a device."""
+        self._listeners.append(callback)
+
+    def snapshot_age(self) -> float | None:
+        """Seconds since the states were fetched, or None if never."""
+        fetched_at = self._snapshot_at
+        return None if fetched_at is None else time.monotonic() - fetched_at
+
+    def is_stale(self) -> bool:
+        """True when reads may be out of date: breaker not closed, or old snapshot."""
+        age = self.snapshot_age()
+        return self.breaker.state != "closed" or age is None or age > self.adapter.max_age
+
+    def status(self) -> dict[str, Any]:
+        """Breaker, snapshot and metrics summary for the health endpoint."""
+        age = self.snapshot_age()
+        return {
+            "breaker": self.breaker.status(),
+            "snapshot_age": None if age is None else round(age, 1),
+            "stale": self.is_stale(),
+            "metrics": self.metrics(),
+        }
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        """Per-operation (login/refresh/apply) counts, errors and p50/p99/max latency (seconds)."""
+        with self._lock:
+            return {op: stats.snapshot() for op, stats in self._stats.items()}
+
+    def reset_metrics(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    # -- calls, retry and breaker ----------------------------------------
+
+    def _call(self, make_coro: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
+        """Run a coroutine on the loop, retrying once after a fresh login.
+
+        Both attempts share one CALL_TIMEOUT budget, so a dead cloud holds the
+        caller for CALL_TIMEOUT at most, and not at all while the breaker is open.
+        """
+        label = self.adapter.label
+        if not self.breaker.allow():
+            raise self.adapter.error(f"{label} cloud unavailable; retrying in {self.breaker.retry_in():.0f} s")
+        deadline = time.monotonic() + CALL_TIMEOUT
+        try:
+            try:
+                result = self._run(make_coro(), CALL_TIMEOUT)
+            except UnknownDeviceError:
+                raise
+            except self.adapter.error as exc:
+                budget = deadline - time.monotonic()
+                # After a timeout the retry would only wait out another one
+                if isinstance(exc.__cause__, TimeoutError) or budget < MIN_RETRY_BUDGET:
+                    raise
+                logger.warning("%s call failed; resetting client and retrying once", label)
+                self._run(self._reset(), budget)
+                result = self._run(make_coro(), deadline - time.monotonic())
+        except UnknownDeviceError:
+            self.breaker.release()
+            raise
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _run(self, coro: Coroutine[Any, Any, Any], timeout: float) -> Any:
+        try:
+            return get_loop().run(coro, timeout=max(timeout, 0.0))
+        except TimeoutError as exc:
+            raise self.adapter.error(f"{self.adapter.label} cloud request timed out") from exc
+
+    def _record(self, op: str, elapsed: float, failed: bool) -> None:
+        with self._lock:
+            stats = self._stats.get(op)
+            if stats is None:
+                stats = self._stats[op] = LatencyStats()
+            stats.count += 1
+            stats.errors += failed
+            stats.samples.append(elapsed)
+
+    # -- coroutines (run on the loop thread) ------------------------------
+
+    async def _cloud(self, op: str, what: str, coro: Coroutine[Any, Any, Any]) -> Any:
+        """Await one cloud operation, timing it and wrapping vendor errors."""
+        started = time.monotonic()
+        failed = True
+        try:
+            result = await coro
+            failed = False
+            return result
+        except self.adapter.library_errors() as exc:
+            raise self.adapter.error(f"{what} failed: {exc}") from exc
+        finally:
+            self._record(op, time.monotonic() - started, failed)
+
+    async def _login(self) -> tuple[Any, dict[str, Any]]:
+        client = await self.adapter.login(await _shared_session())
+        try:
+            return client, await self.adapter.discover(client)
+        except BaseException:
+            await self.adapter.close(client)
+            raise
+
+    async def _connect(self) -> None:
+        """Log in and discover devices if we don't have a live client yet."""
+        if self._client is not None and self._devices:
+            return
+        label = self.adapter.label
+        try:
+            client, devices = await self._cloud("login", f"{label} login/discovery", self._login())
+        except self.adapter.error:
+            raise
+        except Exception as exc:  # noqa: BLE001 - surface any startup failure cleanly
+            raise self.adapter.error(f"{label} login/discovery failed: {exc}") from exc
+        self._client, self._devices = client, devices
+        logger.info("%s: discovered %d %s(s)", label, len(devices), self.adapter.device_noun)
+
+    async def _reset(self) -> None:
+        """Drop the cached client (forces a fresh login on the next call)."""
+        client, self._client = self._client, None
+        self._devices = {}
+        if client is not None:
+            await self.adapter.close(client)
+
+    async def _fetch(self) -> list[dict[str, Any]]:
+        await self._connect()
+        devices = list(self._devices.values())
+        # Refresh all devices concurrently.
+        states = await self._cloud(
+            "refresh", "Refresh", asyncio.gather(*(self.adapter.refresh(d) for d in devices))
+        )
+        return list(states)
+
+    async def _do_refresh(self) -> None:
+        self._attempted_at = time.monotonic()
+        states = await self._fetch()
+        if self._promised:
+            # Devices with unconfirmed actions keep their promised state
+            key = self.adapter.key
+            states = [{**state, **self._promised.get(state[key], {})} for state in states]
+        self._snapshot, self._snapshot_at = states, time.monotonic()
+        self._restored = False
+        try:
+            await self.adapter.persist(states)
+        except Exception:  # noqa: BLE001 - persisting is best effort
+            logger.exception("%s: saving states failed", self.adapter.label)
+
+    async def _restore(self) -> None:
+        """Seed the snapshot from the adapter's persisted states (once)."""
+        self._restore_tried = True
+        try:
+            restored = await self.adapter.restore()
+        except Exception:  # noqa: BLE001 - fall back to a live refresh
+            logger.exception("%s: loading saved states failed", self.adapter.label)
+            return
+        if restored is not None and self._snapshot is None:
+            states, fetched_at = restored
+            self._snapshot = states
+            self._snapshot_at = time.monotonic() - max(0.0, time.time() - fetched_at)
+            self._restored = True
+
+    async def _refresh(self) -> None:
+        """Refresh the snapshot, joining a refresh already in flight."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._do_refresh())
+        # Shielded so a reader giving up doesn't cancel everyone else's refresh
+        await asyncio.shield(self._refreshing)
+
+    def _interval(self) -> float:
+        adapter, now = self.adapter, time.monotonic()
+        if now < self._boost_until:
+            return adapter.fast_interval
+        if now - self._last_read < READER_WINDOW:
+            return adapter.active_interval
+        return adapter.idle_interval
+
+    async def _schedule(self) -> None:
+        """Refresh whenever the current interval has passed since the last attempt."""
+        while True:
+            due_at = max(self._attempted_at + self._interval(), self.breaker.open_until)
+            due_in = due_at - time.monotonic()
+            if due_in <= 0 and not self.breaker.allow():
+                due_in = self._interval()  # a caller's probe is in flight
+            if due_in > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=due_in)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            try:
+                await self._refresh()
+            except self.adapter.error as exc:
+                logger.warning("%s background refresh failed: %s", self.adapter.label, exc)
+                self.breaker.record_failure()
+                await self._reset()
+            except Exception:  # noqa: BLE001 - keep the scheduler alive
+                logger.exception("%s background refresh failed", self.adapter.label)
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    def _ensure_scheduler(self) -> None:
+        if self._scheduler is None or self._scheduler.done():
+            self._wake = asyncio.Event()
+            self._scheduler = asyncio.ensure_future(self._schedule())
+
+    def _boost(self) -> None:
+        """Switch to the fast interval for a while (called after an action)."""
+        self._boost_until = time.monotonic() + self.adapter.boost_window
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _read_states(self, refresh: bool = False) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        idle = now - self._last_read >= READER_WINDOW
+        self._last_read = now
+        self._ensure_scheduler()
+        if idle:
+            self._wake.set()  # drop from the idle to the active interval now
+        if self._snapshot is None and not self._restore_tried:
+            await self._restore()
+        if refresh:
+            await self._refresh()
+        elif self._snapshot is None or time.monotonic() - self._snapshot_at > self.adapter.max_age:
+            if self._restored:
+                self._wake.set()  # serve the saved states; the scheduler refreshes
+            else:
+                await self._refresh()
+        # Copies: callers apply display overrides in place
+        return [dict(state) for state in self._snapshot]
+
+    async def _apply(self, key: str, action: str, value: Any) -> dict[str, Any]:
+        await self._device(key)
+        adapter = self.adapter
+        current = before = self._current(key)
+        # A half-open breaker needs the probe to reach the cloud, so no debouncing
+        if action in adapter.debounced and current is not None and self.breaker.state == "closed":
+            state = adapter.optimistic(current, action, value)
+            if (key, action) not in self._queued:
+                asyncio.ensure_future(self._flush_later(key, action))
+            self._queued[key, action] = value
+        else:
+            # Earlier changes to this device go out first, in order
+            for queued in [q for q in self._queued if q[0] == key]:
+                await self._flush(*queued)
+            state = await self._write(key, action, value)
+            if state is None:
+                current = self._current(key)
+                if current is not None:
+                    state = adapter.optimistic(current, action, value)
+                else:
+                    device = await self._device(key)
+                    state = await self._cloud("refresh", "Refresh", adapter.refresh(device))
+            self._reconcile_soon(key)
+        if adapter.reconcile_delay is not None:
+            # Only what the actions changed; other fields (readings) may move
+            changed = {
+                field: value for field, value in state.items()
+                if before is None or before.get(field) != value
+            }
+            self._promised[key] = {**self._promised.get(key, {}), **changed}
+        self._remember(state)
+        self._boost()
+        return state
+
+    async def _device(self, key: str) -> Any:
+        await self._connect()
+        device = self._devices.get(key)
+        if device is None:
+            raise self._unknown(key)
+        return device
+
+    def _unknown(self, key: str) -> UnknownDeviceError:
+        return self.adapter.unknown_error(f"Unknown {self.adapter.device_noun}: {key}")
+
+    def _current(self, key: str) -> dict[str, Any] | None:
+        """The device's state in the snapshot (promised, if not yet confirmed)."""
+        field = self.adapter.key
+        return next((s for s in self._snapshot or () if s[field] == key), None)
+
+    def _remember(self, state: dict[str, Any]) -> None:
+        """Put one device's fresh state into the snapshot."""
+        key = self.adapter.key
+        if self._snapshot is not None:
+            self._snapshot = [state if s[key] == state[key] else s for s in self._snapshot]
+
+    async def _write(self, key: str, action: str, value: Any) -> dict[str, Any] | None:
+        device = await self._device(key)
+        return await self._cloud("apply", action, self.adapter.apply(device, action, value))
+
+    async def _flush_later(self, key: str, action: str) -> None:
+        await asyncio.sleep(self.adapter.debounce_window)
+        await self._flush(key, action)
+
+    async def _flush(self, key: str, action: str) -> None:
+        """Write the latest debounced value, unless an earlier flush already did."""
+        try:
+            value = self._queued.pop((key, action))
+        except KeyError:
+            return
+        try:
+            await self._write(key, action, value)
+        except Exception as exc:  # noqa: BLE001 - no caller is waiting; reconciling corrects it
+            logger.warning("%s: %s on %s failed: %s", self.adapter.label, action, key, exc)
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._reconcile_soon(key)
+
+    def _reconcile_soon(self, key: str) -> None:
+        """(Re)start the device's reconciliation timer."""
+        if self.adapter.reconcile_delay is None:
+            return
+        task = self._reconciling.get(key)
+        if task is not None:
+            task.cancel()
+        self._reconciling[key] = asyncio.ensure_future(self._reconcile(key))
+
+    async def _reconcile(self, key: str) -> None:
+        """Re-read one device and tell listeners if it isn't in the promised state."""
+        await asyncio.sleep(self.adapter.reconcile_delay)
+        del self._reconciling[key]
+        if any(queued[0] == key for queued in self._queued):
+            return  # a debounced write is still to come; it reconciles after
+        try:
+            state = await self._cloud("refresh", "Refresh", self.adapter.refresh(await self._device(key)))
+        except Exception as exc:  # noqa: BLE001 - the scheduled refreshes take over
+            logger.warning("%s: reconciling %s failed: %s", self.adapter.label, key, exc)
+            self._promised.pop(key, None)
+            return
+        promised = self._promised.pop(key, {})
+        self._remember(state)
+        if any(state.get(field) != value for field, value in promised.items()):
+            logger.info("%s: %s did not end up as requested; correcting", self.adapter.label, key)
+            asyncio.get_running_loop().run_in_executor(None, self._notify, dict(state))
+
+    def _notify(self, state: dict[str, Any]) -> None:
+        for callback in list(self._listeners):
+            try:
+                callback(state)
+            except Exception:  # noqa: BLE001 - one bad listener must not block others
+                logger.exception("%s listener failed", self.adapter.label)
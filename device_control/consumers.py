@@ -0,0 +1,46 @@
+# device_control/consumers.py
+
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .producer import DEVICE_GROUP, current_entity_states, get_producer
+
+
+class DeviceControlConsumer(AsyncWebsocketConsumer):
+    """Sends the page a snapshot on connect, then every change as it happens."""
+
+    async def connect(self):
+        await self.accept()
+
+        # Join the group the shared producer pushes 'device.update' messages to
+        # before reading the snapshot, so no change falls in between
+        await self.channel_layer.group_add(DEVICE_GROUP, self.channel_name)
+
+        # Starting the producer opens the Home Assistant mirror, so keep it
+        # (and the REST fallback for a cold mirror) off the loop
+        producer = await sync_to_async(get_producer, thread_sensitive=False)()
+        producer.bind_loop(asyncio.get_running_loop())
+        producer.client_connected()
+        self.producer = producer
+        entities = await sync_to_async(current_entity_states, thread_sensitive=False)()
+
+        # Clouds not polled yet arrive as their own messages shortly
+        await self.send(text_data=json.dumps({
+            'type': 'snapshot',
+            'entities': entities,
+            **producer.cloud_snapshot(),
+        }))
+
+    async def disconnect(self, close_code):
+        producer = getattr(self, 'producer', None)
+        if producer is not None:
+            producer.client_disconnected()
+        await self.channel_layer.group_discard(DEVICE_GROUP, self.channel_name)
+
+    async def device_update(self, event):
+        """Forward one change from the shared producer to this client."""
+        update = dict(event['update'])
+        await self.send(text_data=json.dumps({'type': update.pop('kind'), **update}))
@@ -9,6 +9,9 @@ floor, and room. Each device entry specifies:
   - icon: Font Awesome icon class (optional)
 """
 
+from types import MappingProxyType
+from typing import NamedTuple
+
 # ──────────────────────────────────────────────
 # Tab: TVs
 # ──────────────────────────────────────────────
@@ -435,11 +438,90 @@ TABS = [
 ]
 
 
+# Home Assistant domain for each device type.
+TYPE_DOMAINS = {
+    "switch": "switch",
+    "light": "light",
+    "cover": "cover",
+    "media_player": "media_player",
+}
+
+
+class DeviceInfo(NamedTuple):
+    """Where a configured entity lives and how to control it."""
+
+    entity_id: str
+    tab: str
+    group: str  # floor / room header it is listed under
+    room: str  # "room" for lights, else the group
+    type: str
+    domain: str | None
+    icon: str | None
+    name: str
+
+
+class DeviceIndex:
+    """Read-only lookups over TABS, compiled once when this module loads.
+
+    Replaces walking every tab, room and device on each request:
+    membership, per-entity info and per-tab entity lists are all O(1).
+    """
+
+    __slots__ = ("_devices", "_tabs", "_rooms", "entity_ids")
+
+    def __init__(self, tabs):
+        devices = {}
+        tab_ids = {}
+        room_ids = {}
+        for tab in tabs:
+            ids = []
+            for group, entries in tab["devices"].items():
+                for dev in entries:
+                    eid = dev["entity_id"]
+                    room = dev.get("room", group)
+                    devices.setdefault(eid, DeviceInfo(
+                        entity_id=eid,
+                        tab=tab["key"],
+                        group=group,
+                        room=room,
+                        type=dev["type"],
+                        domain=TYPE_DOMAINS.get(dev["type"]),
+                        icon=dev.get("icon"),
+                        name=dev["name"],
+                    ))
+                    ids.append(eid)
+                    room_ids.setdefault((tab["key"], room), []).append(eid)
+            tab_ids[tab["key"]] = tuple(dict.fromkeys(ids))
+        self._devices = MappingProxyType(devices)
+        self._tabs = MappingProxyType(tab_ids)
+        self._rooms = MappingProxyType({key: tuple(dict.fromkeys(ids)) for key, ids in room_ids.items()})
+        self.entity_ids = frozenset(devices)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._devices
+
+    def __len__(self):
+        return len(self._devices)
+
+    def get(self, entity_id):
+        """DeviceInfo for a configured entity, or None."""
+        return self._devices.get(entity_id)
+
+    def has_tab(self, tab_key):
+        return tab_key in self._tabs
+
+    def tab_entity_ids(self, tab_key):
+        """Entity ids on one tab, in display order (empty for unknown tabs)."""
+        return self._tabs.get(tab_key, ())
+
+    def room_entity_ids(self, tab_key, room):
+        """Entity ids in one room of a tab (empty if there is no such room)."""
+        return self._rooms.get((tab_key, room), ())
+
+
+DEVICE_INDEX = DeviceIndex(TABS)
+
+
 def get_all_entity_ids():
     """Return a flat set of every entity_id referenced in the config."""
-    ids = set()
-    for tab in TABS:
-        for _group, devices in tab["devices"].items():
-            for dev in devices:
-                ids.add(dev["entity_id"])
-    return ids
+    return set(DEVICE_INDEX.entity_ids)
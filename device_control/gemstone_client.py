@@ -1,101 +1,82 @@
 """
-Async bridge between sync Django and the async ``pygemstone`` cloud client.
+Gemstone Lights, through the shared :mod:`~.cloud_bridge`.
 
 ``pygemstone`` talks to the Gemstone Lights (AWS Amplify / Cognito) cloud over
-aiohttp and is entirely ``async``. Django's request handling here is synchronous
-(WSGI), so we cannot simply ``asyncio.run()`` a fresh coroutine per request: the
-logged-in ``GemstoneClient`` owns an aiohttp ``ClientSession`` bound to the event
-loop it was created on, and re-using it from a different loop raises
-``RuntimeError: ... attached to a different loop``.
-
-The robust pattern (identical to ``napoleon_client``) is a single **dedicated
-background event loop** running in its own daemon thread for the lifetime of the
-process. The cached client + session + device handles live on that loop forever;
-sync callers submit coroutines to it via ``asyncio.run_coroutine_threadsafe`` and
-block on the result.
+aiohttp and is entirely ``async``. :class:`GemstoneAdapter` plugs it into a
+:class:`~.cloud_bridge.CloudBridge`, which runs it on the bridge's background
+loop, serves reads from a refreshed snapshot and retries once after a fresh
+login. The saved-pattern catalogue is discovered at login alongside the devices.
+
+Paging through the catalogue takes several cloud round trips, so it is saved to
+``settings.GEMSTONE_CACHE_FILE`` together with the last device states. After a
+restart the saved states and catalogue are served straight away; at login the
+catalogue's **version** (a hash of the folder listing) is checked in the
+background, and only a changed version (or ``CATALOGUE_MAX_AGE``) triggers a
+re-page, which reuses the entries of patterns whose payload didn't change.
 
 Public sync API:
     * :func:`get_states`  -> dict  {"devices": [...], "patterns": [...]}
+    * :func:`snapshot_age` -> seconds since the states were fetched, or None
+    * :func:`is_stale` -> bool (the cloud is failing; states may be out of date)
+    * :func:`health` -> dict (breaker, snapshot and metrics summary)
     * :func:`apply_action(device_id, action, value)` -> dict (refreshed state)
     * :func:`is_configured` -> bool
 
 All cloud/network errors are surfaced as :class:`GemstoneError` so the views can
-turn them into clean JSON responses.
+turn them into clean JSON responses; an unknown device id raises its subclass
+:class:`UnknownGemstoneError`.
 """
 
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import logging
-import threading
+import os
+import time
 from typing import Any, Callable, Coroutine
 
 from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from .cloud_bridge import CloudAdapter, CloudBridge, CloudError, UnknownDeviceError
 
-# How long a sync caller will block on a coroutine submitted to the loop.
-_CALL_TIMEOUT = 25  # seconds
+logger = logging.getLogger(__name__)
 
 # How many pages of saved patterns to pull when discovering the catalogue.
 _MAX_PATTERN_PAGES = 5
 
+# Re-page the catalogue at least this often even if its version is unchanged:
+# the folder listing is the cheapest change signal the API offers, and this
+# bounds how long a change it misses can go unseen.
+CATALOGUE_MAX_AGE = 6 * 60 * 60  # seconds
 
-class GemstoneError(Exception):
-    """Any failure talking to the Gemstone cloud (auth, network, value)."""
+# Unchanged states still rewrite the cache file this often, so ``states_at``
+# (the age served after a restart) is never further behind than this. Saving
+# on every refresh would rewrite the whole catalogue every few seconds.
+STATES_SAVE_INTERVAL = 60  # seconds
 
+# Layout of the cache file; files with another format are ignored.
+_CACHE_FORMAT = 1
 
-# ---------------------------------------------------------------------------
-# Dedicated background event-loop thread
-# ---------------------------------------------------------------------------
-class _LoopThread:
-    """Owns a single asyncio loop running in a daemon thread."""
-
-    def __init__(self) -> None:
-        self._loop = asyncio.new_event_loop()
-        self._thread = threading.Thread(
-            target=self._run, name="gemstone-loop", daemon=True
-        )
-        self._thread.start()
-
-    def _run(self) -> None:
-        asyncio.set_event_loop(self._loop)
-        self._loop.run_forever()
 
-    def run(self, coro: Coroutine[Any, Any, Any], timeout: int = _CALL_TIMEOUT) -> Any:
-        """Submit ``coro`` to the loop and block until it returns."""
-        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
-        try:
-            return future.result(timeout=timeout)
-        except asyncio.TimeoutError as exc:  # pragma: no cover - network timing
-            future.cancel()
-            raise GemstoneError("Gemstone cloud request timed out") from exc
-
-
-# Lazily created so importing this module (e.g. during `manage.py check`) never
-# spins up a thread.
-_loop_thread: _LoopThread | None = None
-_loop_lock = threading.Lock()
+class GemstoneError(CloudError):
+    """Any failure talking to the Gemstone cloud (auth, network, value)."""
 
 
-def _loop() -> _LoopThread:
-    global _loop_thread
-    if _loop_thread is None:
-        with _loop_lock:
-            if _loop_thread is None:
-                _loop_thread = _LoopThread()
-    return _loop_thread
+class UnknownGemstoneError(GemstoneError, UnknownDeviceError):
+    """No discovered Gemstone device has the requested id."""
 
 
 # ---------------------------------------------------------------------------
-# Cached client + handles (all live on the loop thread)
+# Saved-pattern catalogue (written on the loop thread)
 # ---------------------------------------------------------------------------
-# These are only ever touched from coroutines running on the loop thread, so no
-# additional locking is required around them.
-_client: Any = None  # GemstoneClient
-_devices: dict[str, Any] = {}  # device_id -> Device
+# Replaced wholesale (never mutated), so readers on other threads need no lock.
 _patterns_by_id: dict[str, Any] = {}  # pattern_id -> Pattern (for replay)
 _patterns_ui: list[dict[str, Any]] = []  # JSON-friendly catalogue for the UI
+_patterns_raw: dict[str, dict[str, Any]] = {}  # pattern_id -> folder-pattern payload (cached)
+_catalogue_version: str | None = None
+_catalogue_paged_at = 0.0  # time.time() of the last full page-through
 
 
 def is_configured() -> bool:
@@ -129,48 +110,33 @@ def _color_to_hex(c: Any) -> str:
     return color_to_hex(c)
 
 
-async def _ensure_client() -> None:
-    """Log in and discover devices + saved patterns if we have no live client."""
-    global _client, _devices, _patterns_by_id, _patterns_ui
-    if _client is not None and _devices:
-        return
-
-    # Imported lazily so the app loads even if pygemstone is missing.
-    from pygemstone import GemstoneClient
-    from pygemstone.errors import GemstoneError as LibGemstoneError
-
-    email = getattr(settings, "GEMSTONE_EMAIL", "")
-    password = getattr(settings, "GEMSTONE_PASSWORD", "")
-    if not (email and password):
-        raise GemstoneError("Gemstone credentials are not configured")
-
-    client = GemstoneClient(email, password)
-    try:
-        # __aenter__ creates the aiohttp session on THIS loop; we drive the
-        # context manager manually because the client is cached for the
-        # process lifetime rather than scoped to a single ``async with``.
-        await client.__aenter__()
-        await client.login()
-        devices = await client.devices()
-        patterns = await _discover_patterns(client)
-    except LibGemstoneError as exc:
-        await _safe_close(client)
-        raise GemstoneError(f"Gemstone login/discovery failed: {exc}") from exc
-    except Exception as exc:  # noqa: BLE001 - surface any startup failure cleanly
-        await _safe_close(client)
-        raise GemstoneError(f"Gemstone login/discovery failed: {exc}") from exc
-
-    _client = client
-    _devices = {d.id: d for d in devices}
+def _load_patterns(patterns: list[Any]) -> tuple[int, int, int]:
+    """Rebuild the catalogue from the user's saved (folder) patterns.
 
+    Entries of patterns whose payload is unchanged are reused. Returns the
+    number of patterns added, changed and removed.
+    """
+    global _patterns_by_id, _patterns_ui, _patterns_raw
+    previous_ui = {p["id"]: p for p in _patterns_ui}
     by_id: dict[str, Any] = {}
+    raw: dict[str, dict[str, Any]] = {}
     ui: list[dict[str, Any]] = []
+    added = changed = 0
     for fp in patterns:
         pat = fp.pattern
         pid = getattr(pat, "id", "") or ""
         if not pid or pid in by_id:
             continue
         by_id[pid] = pat
+        raw[pid] = fp.raw
+        previous = _patterns_raw.get(pid)
+        if previous == fp.raw and pid in previous_ui:
+            ui.append(previous_ui[pid])
+            continue
+        if previous is None:
+            added += 1
+        else:
+            changed += 1
         ui.append(
             {
                 "id": pid,
@@ -179,15 +145,20 @@ async def _ensure_client() -> None:
                 "is_favorite": bool(getattr(fp, "is_favorite", False)),
             }
         )
+    removed = len(_patterns_raw.keys() - raw.keys())
     # Favourites first, then alphabetical — stable, friendly ordering.
     ui.sort(key=lambda p: (not p["is_favorite"], p["name"].lower()))
     _patterns_by_id = by_id
     _patterns_ui = ui
-    logger.info(
-        "Gemstone: discovered %d device(s), %d saved pattern(s)",
-        len(_devices),
-        len(_patterns_ui),
-    )
+    _patterns_raw = raw
+    return added, changed, removed
+
+
+async def _fetch_catalogue_version(client: Any) -> str:
+    """A fingerprint of the user's folder listing (one cloud call)."""
+    folders = await client.folders()
+    body = json.dumps([f.raw for f in folders], sort_keys=True)
+    return hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
 
 
 async def _discover_patterns(client: Any) -> list[Any]:
@@ -201,22 +172,36 @@ async def _discover_patterns(client: Any) -> list[Any]:
     return out
 
 
-async def _safe_close(client: Any) -> None:
+def _read_cache() -> dict[str, Any] | None:
+    """The cache file's contents, or None if disabled, missing or unusable."""
+    path = getattr(settings, "GEMSTONE_CACHE_FILE", "")
+    if not path:
+        return None
     try:
-        await client.__aexit__(None, None, None)
-    except Exception:  # pragma: no cover - best-effort cleanup
-        pass
-
-
-async def _reset() -> None:
-    """Drop the cached client (forces a fresh login on the next call)."""
-    global _client, _devices, _patterns_by_id, _patterns_ui
-    client, _client = _client, None
-    _devices = {}
-    _patterns_by_id = {}
-    _patterns_ui = []
-    if client is not None:
-        await _safe_close(client)
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable Gemstone cache %s: %s", path, exc)
+        return None
+    if not isinstance(data, dict) or data.get("format") != _CACHE_FORMAT:
+        return None
+    return data
+
+
+def _write_cache(data: dict[str, Any]) -> None:
+    path = getattr(settings, "GEMSTONE_CACHE_FILE", "")
+    if not path:
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        # Atomic, so another process never reads half a file
+        os.replace(tmp, path)
+    except OSError as exc:
+        logger.warning("Could not save Gemstone cache %s: %s", path, exc)
 
 
 def _state_to_dict(dev: Any) -> dict[str, Any]:
@@ -237,19 +222,8 @@ def _state_to_dict(dev: Any) -> dict[str, Any]:
 
 
 # ---------------------------------------------------------------------------
-# Coroutines (run on the loop thread)
+# Actions (run on the loop thread)
 # ---------------------------------------------------------------------------
-async def _get_states() -> dict[str, Any]:
-    await _ensure_client()
-    devs = list(_devices.values())
-    # Refresh all devices concurrently.
-    await asyncio.gather(*(dev.refresh() for dev in devs))
-    return {
-        "devices": [_state_to_dict(dev) for dev in devs],
-        "patterns": list(_patterns_ui),
-    }
-
-
 async def _set_power(dev: Any, value: Any) -> None:
     if bool(value):
         await dev.turn_on()
@@ -271,33 +245,6 @@ _ACTIONS: dict[str, Callable[[Any, Any], Coroutine[Any, Any, None]]] = {
 }
 
 
-async def _apply_action(device_id: str, action: str, value: Any) -> dict[str, Any]:
-    from pygemstone.errors import GemstoneError as LibGemstoneError
-
-    await _ensure_client()
-    dev = _devices.get(device_id)
-    if dev is None:
-        raise GemstoneError(f"Unknown device: {device_id}")
-
-    handler = _ACTIONS.get(action)
-    if handler is None:
-        raise GemstoneError(f"Unknown action: {action}")
-
-    try:
-        await handler(dev, value)
-    except LibGemstoneError as exc:
-        raise GemstoneError(f"{action} failed: {exc}") from exc
-
-    # Return an OPTIMISTIC state built from the last-known cached state plus the
-    # change we just requested. We deliberately do NOT call ``dev.refresh()``
-    # here: the Gemstone cloud is eventually-consistent, so a refresh issued
-    # immediately after a toggle very often returns the *pre-toggle* state. That
-    # stale value would clobber the UI's optimistic flip and make the button
-    # look like it "did nothing for a bit". The periodic poll (``_get_states``)
-    # reconciles authoritative state a few seconds later.
-    return _optimistic_state(dev, action, value)
-
-
 def _optimistic_state(dev: Any, action: str, value: Any) -> dict[str, Any]:
     """Last-known cached state, overlaid with the change we just requested."""
     base = _state_to_dict(dev)
@@ -319,30 +266,169 @@ def _optimistic_state(dev: Any, action: str, value: Any) -> dict[str, Any]:
     return base
 
 
-# ---------------------------------------------------------------------------
-# Public sync API (called from Django views) — with one auth/connection retry
-# ---------------------------------------------------------------------------
-def _run_with_retry(make_coro: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
-    """Run a coroutine on the loop, retrying once after a fresh login.
+class GemstoneAdapter(CloudAdapter):
+    label = "Gemstone"
+    key = "id"
+    error = GemstoneError
+    unknown_error = UnknownGemstoneError
+    actions = _ACTIONS
+    # A refresh right after a toggle often returns the pre-toggle state (see
+    # apply()), so actions don't speed up the refresh schedule.
+    boost_window = 0
 
-    A cached client whose token/session has gone stale (process idle, cloud-side
-    session reaped, etc.) surfaces as a GemstoneError. We drop the cache,
-    re-login, and retry exactly once before giving up.
-    """
-    loop = _loop()
-    try:
-        return loop.run(make_coro())
-    except GemstoneError:
-        logger.warning("Gemstone call failed; resetting client and retrying once")
-        loop.run(_reset())
-        return loop.run(make_coro())
+    def __init__(self) -> None:
+        self._cache_loaded = False
+        self._states: list[dict[str, Any]] = []  # last states saved to the cache
+        self._states_at = 0.0  # time.time() they were fetched
+        self._saved_at = 0.0  # time.time() the cache file was last written
+        self._revalidating: asyncio.Task | None = None
+
+    def library_errors(self) -> tuple[type[BaseException], ...]:
+        # Imported lazily so the app loads even if pygemstone is missing.
+        from pygemstone.errors import GemstoneError as LibGemstoneError
 
+        return (LibGemstoneError,)
 
+    async def login(self, session: Any) -> Any:
+        from pygemstone import GemstoneClient
+
+        email = getattr(settings, "GEMSTONE_EMAIL", "")
+        password = getattr(settings, "GEMSTONE_PASSWORD", "")
+        if not (email and password):
+            raise GemstoneError("Gemstone credentials are not configured")
+
+        client = GemstoneClient(email, password, session=session)
+        try:
+            # The client is cached for the process lifetime rather than scoped
+            # to a single ``async with``, so drive the context manager by hand.
+            await client.__aenter__()
+            await client.login()
+        except BaseException:
+            await self.close(client)
+            raise
+        return client
+
+    async def discover(self, client: Any) -> dict[str, Any]:
+        await self._load_cache()
+        devices = await client.devices()
+        if _patterns_by_id:
+            # Serve the cached catalogue now and check it in the background.
+            if self._revalidating is None or self._revalidating.done():
+                self._revalidating = asyncio.ensure_future(self._revalidate(client))
+        else:
+            await self._update_catalogue(client, await _fetch_catalogue_version(client))
+        return {d.id: d for d in devices}
+
+    async def refresh(self, dev: Any) -> dict[str, Any]:
+        await dev.refresh()
+        return _state_to_dict(dev)
+
+    async def apply(self, dev: Any, action: str, value: Any) -> dict[str, Any]:
+        await self.actions[action](dev, value)
+        # Return an OPTIMISTIC state built from the last-known cached state plus
+        # the change we just requested. We deliberately do NOT call
+        # ``dev.refresh()`` here: the Gemstone cloud is eventually-consistent, so
+        # a refresh issued immediately after a toggle very often returns the
+        # *pre-toggle* state. That stale value would clobber the UI's optimistic
+        # flip and make the button look like it "did nothing for a bit". The
+        # background refresh reconciles authoritative state a few seconds later.
+        return _optimistic_state(dev, action, value)
+
+    async def close(self, client: Any) -> None:
+        try:
+            await client.__aexit__(None, None, None)
+        except Exception:  # pragma: no cover - best-effort cleanup
+            pass
+
+    async def restore(self) -> tuple[list[dict[str, Any]], float] | None:
+        await self._load_cache()
+        return (list(self._states), self._states_at) if self._states else None
+
+    async def persist(self, states: list[dict[str, Any]]) -> None:
+        self._states_at = time.time()
+        if states != self._states or self._states_at - self._saved_at >= STATES_SAVE_INTERVAL:
+            self._states = states
+            await self._save()
+
+    # -- catalogue cache -------------------------------------------------
+
+    async def _load_cache(self) -> None:
+        """Load the cached catalogue and states (once per process)."""
+        global _catalogue_version, _catalogue_paged_at
+        if self._cache_loaded:
+            return
+        self._cache_loaded = True
+        data = await asyncio.to_thread(_read_cache)
+        if data is None:
+            return
+        from pygemstone.models import FolderPattern
+
+        _load_patterns([FolderPattern.from_api(p) for p in data.get("patterns", [])])
+        _catalogue_version = data.get("version")
+        _catalogue_paged_at = data.get("paged_at", 0.0)
+        self._states = data.get("states", [])
+        self._states_at = self._saved_at = data.get("states_at", 0.0)
+        logger.info("Gemstone: loaded %d cached pattern(s)", len(_patterns_ui))
+
+    async def _revalidate(self, client: Any) -> None:
+        try:
+            version = await _fetch_catalogue_version(client)
+            fresh = time.time() - _catalogue_paged_at < CATALOGUE_MAX_AGE
+            if version != _catalogue_version or not fresh:
+                await self._update_catalogue(client, version)
+        except Exception as exc:  # noqa: BLE001 - keep serving the cached catalogue
+            logger.warning("Gemstone catalogue check failed: %s", exc)
+
+    async def _update_catalogue(self, client: Any, version: str) -> None:
+        global _catalogue_version, _catalogue_paged_at
+        added, changed, removed = _load_patterns(await _discover_patterns(client))
+        _catalogue_version, _catalogue_paged_at = version, time.time()
+        logger.info(
+            "Gemstone: %d saved pattern(s) (%d new, %d changed, %d removed)",
+            len(_patterns_ui), added, changed, removed,
+        )
+        await self._save()
+
+    async def _save(self) -> None:
+        data = {
+            "format": _CACHE_FORMAT,
+            "version": _catalogue_version,
+            "paged_at": _catalogue_paged_at,
+            "patterns": list(_patterns_raw.values()),
+            "states": self._states,
+            "states_at": self._states_at,
+        }
+        self._saved_at = time.time()
+        await asyncio.to_thread(_write_cache, data)
+
+
+_bridge = CloudBridge(GemstoneAdapter())
+
+
+# ---------------------------------------------------------------------------
+# Public sync API (called from Django views)
+# ---------------------------------------------------------------------------
 def get_states() -> dict[str, Any]:
     """Return current device states plus the saved-pattern catalogue."""
-    return _run_with_retry(_get_states)
+    devices = _bridge.get_states()
+    return {"devices": devices, "patterns": list(_patterns_ui)}
+
+
+def snapshot_age() -> float | None:
+    """Seconds since the device states were fetched, or None if never."""
+    return _bridge.snapshot_age()
+
+
+def is_stale() -> bool:
+    """True when get_states() may be returning out-of-date states."""
+    return _bridge.is_stale()
+
+
+def health() -> dict[str, Any]:
+    """Circuit breaker state, snapshot age and call metrics for the health view."""
+    return _bridge.status()
 
 
 def apply_action(device_id: str, action: str, value: Any) -> dict[str, Any]:
-    """Apply a single control action and return the refreshed device state."""
-    return _run_with_retry(lambda: _apply_action(device_id, action, value))
+    """Apply a single control action and return the (optimistic) device state."""
+    return _bridge.apply_action(device_id, action, value)
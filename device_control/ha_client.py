@@ -1,31 +1,185 @@
 """
-Home Assistant REST API client for device_control app.
+Home Assistant REST API client, shared by every app that talks to HA.
 
 Provides functions to fetch entity states and call services
 (switch on/off, cover open/close, light on/off, etc.).
+
+device_control, vacation_mode and scenes used to call ``requests.get`` /
+``requests.post`` directly, so every call opened a new TCP (and often TLS)
+connection to Home Assistant. They now all go through one
+:class:`HomeAssistantClient`, which keeps a pooled keep-alive
+``requests.Session``, retries connection failures (and GETs that hit a
+502/503/504) with backoff, and records per-endpoint latency.
+
+Public API:
+    * :func:`get_client` -> :class:`HomeAssistantClient`
+    * ``client.get(path)`` / ``client.post(path, json=...)`` -> Response
+    * ``client.metrics()`` -> {endpoint: {count, errors, p50, p99, max}}
+    * :func:`get_entity_state` / :func:`get_entity_states` / :func:`call_service`
 """
 
+from __future__ import annotations
+
 import logging
-import requests
+import threading
+import time
+from collections import deque
+from typing import Any
 from urllib.parse import urljoin
+
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
 TIMEOUT = 10  # seconds
 
-
-def _headers():
-    """Authorization headers for Home Assistant API."""
-    return {
-        "Authorization": f"Bearer {settings.HOMEASSISTANT_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-
-def _base_url():
-    """Home Assistant base URL."""
-    return settings.HOMEASSISTANT_URL
+# Keep-alive connections kept open to Home Assistant.
+POOL_SIZE = 10
+
+# Retries for failed connections, and for GETs answered with 502/503/504
+# (service calls are not idempotent, so a POST HA received is never resent).
+RETRIES = 2
+RETRY_BACKOFF = 0.3  # seconds, doubled per retry
+
+# Latency samples kept per endpoint for the percentiles.
+METRIC_SAMPLES = 1000
+
+
+def build_session(pool_size: int = POOL_SIZE, retries: int = RETRIES) -> requests.Session:
+    """A keep-alive session with Home Assistant's retry policy."""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        allowed_methods=frozenset(['GET']),
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def endpoint_name(path: str) -> str:
+    """Group paths for metrics: ``/api/states/light.x`` -> ``/api/states/{entity_id}``."""
+    path = path.split('?', 1)[0]
+    if path.startswith('/api/states/'):
+        return '/api/states/{entity_id}'
+    return path
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LatencyStats:
+    """Call count, error count and recent latency samples for one kind of call."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.samples: deque[float] = deque(maxlen=METRIC_SAMPLES)
+
+    def snapshot(self) -> dict[str, Any]:
+        ordered = sorted(self.samples)
+        stats: dict[str, Any] = {'count': self.count, 'errors': self.errors}
+        if ordered:
+            stats.update(p50=_percentile(ordered, 0.5), p99=_percentile(ordered, 0.99), max=ordered[-1])
+        return stats
+
+
+class HomeAssistantClient:
+    """Pooled HTTP access to the Home Assistant REST API, with latency metrics."""
+
+    def __init__(
+        self,
+        base_url: str,
+        token: str | None,
+        session: requests.Session | None = None,
+        timeout: float = TIMEOUT,
+    ) -> None:
+        self.base_url = base_url
+        self.token = token
+        self.session = session or build_session(
+            getattr(settings, 'HOMEASSISTANT_POOL_SIZE', POOL_SIZE),
+            getattr(settings, 'HOMEASSISTANT_RETRIES', RETRIES),
+        )
+        self._timeout = timeout
+        self._stats: dict[str, LatencyStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def headers(self) -> dict[str, str]:
+        """Authorization headers for Home Assistant API."""
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json",
+        }
+
+    def url(self, path: str) -> str:
+        return urljoin(self.base_url, path)
+
+    def get(self, path: str, timeout: float | None = None, **kwargs: Any) -> requests.Response:
+        return self._send(self.session.get, path, timeout, **kwargs)
+
+    def post(self, path: str, timeout: float | None = None, **kwargs: Any) -> requests.Response:
+        return self._send(self.session.post, path, timeout, **kwargs)
+
+    def _send(self, send: Any, path: str, timeout: float | None, **kwargs: Any) -> requests.Response:
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = send(
+                self.url(path), headers=self.headers(),
+                timeout=self._timeout if timeout is None else timeout, **kwargs,
+            )
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self._record(endpoint_name(path), time.perf_counter() - start, failed)
+
+    # -- metrics -------------------------------------------------------------
+
+    def _record(self, endpoint: str, elapsed: float, failed: bool) -> None:
+        with self._stats_lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = LatencyStats()
+            stats.count += 1
+            stats.errors += failed
+            stats.samples.append(elapsed)
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        """Per-endpoint call counts, error counts and p50/p99/max latency (seconds)."""
+        with self._stats_lock:
+            return {endpoint: stats.snapshot() for endpoint, stats in self._stats.items()}
+
+    def reset_metrics(self) -> None:
+        with self._stats_lock:
+            self._stats = {}
+
+
+_client: HomeAssistantClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HomeAssistantClient:
+    """Return the process-wide client (rebuilt if the HA URL or token setting changes)."""
+    global _client
+    base_url, token = settings.HOMEASSISTANT_URL, settings.HOMEASSISTANT_ACCESS_TOKEN
+    client = _client
+    if client is None or client.base_url != base_url or client.token != token:
+        with _client_lock:
+            client = _client
+            if client is None or client.base_url != base_url or client.token != token:
+                client = _client = HomeAssistantClient(base_url, token)
+    return client
 
 
 def get_entity_state(entity_id):
@@ -35,9 +189,8 @@ def get_entity_state(entity_id):
     Returns dict with 'entity_id', 'state', and 'attributes',
     or None on failure.
     """
-    url = urljoin(_base_url(), f"/api/states/{entity_id}")
     try:
-        resp = requests.get(url, headers=_headers(), timeout=TIMEOUT)
+        resp = get_client().get(f"/api/states/{entity_id}")
         if resp.status_code == 200:
             return resp.json()
         logger.warning("HA returned %s for %s", resp.status_code, entity_id)
@@ -53,9 +206,8 @@ def get_entity_states(entity_ids):
     Returns a dict mapping entity_id -> state dict.
     Fetches all states in a single call and filters.
     """
-    url = urljoin(_base_url(), "/api/states")
     try:
-        resp = requests.get(url, headers=_headers(), timeout=TIMEOUT)
+        resp = get_client().get("/api/states")
         if resp.status_code == 200:
             all_states = resp.json()
             wanted = set(entity_ids)
@@ -77,19 +229,18 @@ def call_service(domain, service, entity_id, extra_data=None):
     Args:
         domain: e.g. 'switch', 'light', 'cover'
         service: e.g. 'turn_on', 'turn_off', 'toggle', 'open_cover', 'close_cover'
-        entity_id: The entity to target
+        entity_id: The entity to target, or a list of entities
         extra_data: Optional dict of additional service data
 
     Returns:
         (success: bool, error: str or None)
     """
-    url = urljoin(_base_url(), f"/api/services/{domain}/{service}")
     payload = {"entity_id": entity_id}
     if extra_data:
         payload.update(extra_data)
 
     try:
-        resp = requests.post(url, headers=_headers(), json=payload, timeout=TIMEOUT)
+        resp = get_client().post(f"/api/services/{domain}/{service}", json=payload)
         if resp.status_code == 200:
             return True, None
         msg = f"HA returned {resp.status_code}: {resp.text[:200]}"
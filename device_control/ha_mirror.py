@@ -0,0 +1,305 @@
+"""
+In-process mirror of Home Assistant entity states over the WebSocket API.
+
+Every poll of ``device_control_states`` used to download the whole
+``/api/states`` list (thousands of entities) and filter it in Python. This
+module instead keeps one long-lived WebSocket to Home Assistant, subscribed
+with ``subscribe_entities`` to just the entities in the device config (and
+any other app adds with :meth:`HAStateMirror.add_entities`), and applies the
+pushed changes to an in-memory dict. Reading states is then a dictionary
+lookup.
+
+Home Assistant's ``subscribe_entities`` stream is compressed:
+
+* ``{"a": {entity_id: {"s": state, "a": attributes, ...}}}`` adds entities
+  (the first event after subscribing contains all of them),
+* ``{"c": {entity_id: {"+": {...}, "-": {"a": [keys]}}}}`` changes some
+  fields / attributes,
+* ``{"r": [entity_id, ...]}`` removes entities.
+
+Mirrored states use the same shape as the REST API (``entity_id``,
+``state``, ``attributes``), so callers don't care where they came from.
+
+The mirror runs on a daemon thread that reconnects with exponential backoff.
+While it is disconnected (or has not received its first snapshot yet)
+:func:`get_states` returns ``None`` and callers fall back to the REST API.
+
+Public API:
+    * :func:`get_states(entity_ids)` -> dict, or None when not in sync
+    * :func:`get_mirror` -> :class:`HAStateMirror` or None if not configured
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import threading
+from typing import Any, Callable, Iterable
+
+from django.conf import settings
+
+from .device_config import DEVICE_INDEX
+
+logger = logging.getLogger(__name__)
+
+# Reconnect backoff bounds.
+RECONNECT_MIN = 1  # seconds
+RECONNECT_MAX = 60  # seconds
+
+# Send a ping after this long without a message; reconnect if the next
+# interval passes without the pong.
+PING_INTERVAL = 30  # seconds
+
+# Opening the socket and authenticating.
+CONNECT_TIMEOUT = 10  # seconds
+
+
+class HAMirrorError(Exception):
+    """The WebSocket handshake or subscription failed."""
+
+
+def websocket_url(base_url: str) -> str:
+    """``http(s)://host:8123`` -> ``ws(s)://host:8123/api/websocket``."""
+    if base_url.startswith('https://'):
+        base_url = 'wss://' + base_url[len('https://'):]
+    elif base_url.startswith('http://'):
+        base_url = 'ws://' + base_url[len('http://'):]
+    return base_url.rstrip('/') + '/api/websocket'
+
+
+def _connect(url: str) -> Any:
+    # Imported lazily so the app loads even if websockets is missing.
+    from websockets.sync.client import connect
+
+    return connect(url, open_timeout=CONNECT_TIMEOUT, max_size=None)
+
+
+def _apply_diff(state: dict[str, Any], diff: dict[str, Any]) -> dict[str, Any]:
+    """A new REST-shaped state with a compressed ``c`` diff applied."""
+    attributes = dict(state.get('attributes', {}))
+    added = diff.get('+', {})
+    if 'a' in added:
+        attributes.update(added['a'])
+    for key in diff.get('-', {}).get('a', []):
+        attributes.pop(key, None)
+    return {
+        'entity_id': state['entity_id'],
+        'state': added.get('s', state.get('state')),
+        'attributes': attributes,
+    }
+
+
+class HAStateMirror:
+    """Keeps ``entity_ids``' states in memory from a ``subscribe_entities`` stream."""
+
+    def __init__(
+        self,
+        entity_ids: Iterable[str],
+        base_url: str,
+        token: str,
+        connect: Callable[[str], Any] = _connect,
+    ) -> None:
+        self._entity_ids = sorted(entity_ids)
+        self._url = websocket_url(base_url)
+        self._token = token
+        self._connect = connect
+        # Replaced wholesale (never mutated) so readers need no lock.
+        self._states: dict[str, dict[str, Any]] = {}
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._resubscribe = threading.Event()
+        self._entities_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._socket: Any = None
+        self._ids = itertools.count(1)
+        self._listeners: list[Callable[[dict[str, Any]], None]] = []
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        """Connect in the background (idempotent); returns immediately."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ha-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        socket = self._socket
+        if socket is not None:
+            try:
+                socket.close()
+            except Exception:  # noqa: BLE001 - best-effort shutdown
+                pass
+
+    def _run(self) -> None:
+        delay = RECONNECT_MIN
+        while not self._stop.is_set():
+            try:
+                self._session()
+            except Exception as exc:  # noqa: BLE001 - keep the thread alive
+                if not self._stop.is_set() and not self._resubscribe.is_set():
+                    logger.warning("Home Assistant WebSocket failed: %s", exc)
+            finally:
+                if self._ready.is_set():
+                    delay = RECONNECT_MIN  # we were in sync; retry promptly
+                self._ready.clear()
+                self._socket = None
+            if self._resubscribe.is_set():
+                # Closed by add_entities; subscribe to the wider set now
+                self._resubscribe.clear()
+                continue
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    # -- reads -------------------------------------------------------------
+
+    @property
+    def ready(self) -> bool:
+        """True while connected and holding a complete snapshot."""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def states(self, entity_ids: Iterable[str]) -> dict[str, dict[str, Any]] | None:
+        """Mirrored states for ``entity_ids``, or None when not in sync."""
+        if not self._ready.is_set():
+            return None
+        states = self._states
+        return {eid: states[eid] for eid in entity_ids if eid in states}
+
+    def add_listener(self, callback: Callable[[dict[str, Any]], None]) -> None:
+        """Call ``callback(changed)`` (mirror thread) with ``{entity_id: state or None}``."""
+        self._listeners.append(callback)
+
+    def add_entities(self, entity_ids: Iterable[str]) -> None:
+        """Mirror ``entity_ids`` too, resubscribing if any are new.
+
+        Lets other apps share this process's one Home Assistant WebSocket.
+        A live connection is reopened, so the mirror is briefly out of sync.
+        """
+        with self._entities_lock:
+            wanted = set(self._entity_ids) | set(entity_ids)
+            if len(wanted) == len(self._entity_ids):
+                return
+            self._entity_ids = sorted(wanted)
+            socket = self._socket
+            if socket is None:
+                return  # the next connection subscribes to them
+            self._resubscribe.set()
+        try:
+            socket.close()
+        except Exception:  # noqa: BLE001 - the session ends either way
+            pass
+
+    # -- connection --------------------------------------------------------
+
+    def _session(self) -> None:
+        socket = self._socket = self._connect(self._url)
+        try:
+            self._authenticate(socket)
+            subscription = next(self._ids)
+            socket.send(json.dumps({
+                'id': subscription,
+                'type': 'subscribe_entities',
+                'entity_ids': self._entity_ids,
+            }))
+            awaiting_pong = False
+            while not self._stop.is_set():
+                try:
+                    message = json.loads(socket.recv(timeout=PING_INTERVAL))
+                except TimeoutError:
+                    if awaiting_pong:
+                        raise HAMirrorError("Home Assistant stopped answering pings") from None
+                    socket.send(json.dumps({'id': next(self._ids), 'type': 'ping'}))
+                    awaiting_pong = True
+                    continue
+                awaiting_pong = False
+                self._handle(message, subscription)
+        finally:
+            socket.close()
+
+    def _authenticate(self, socket: Any) -> None:
+        hello = json.loads(socket.recv(timeout=CONNECT_TIMEOUT))
+        if hello.get('type') != 'auth_required':
+            raise HAMirrorError(f"Unexpected greeting: {hello.get('type')}")
+        socket.send(json.dumps({'type': 'auth', 'access_token': self._token}))
+        reply = json.loads(socket.recv(timeout=CONNECT_TIMEOUT))
+        if reply.get('type') != 'auth_ok':
+            raise HAMirrorError(f"Authentication failed: {reply.get('message', reply.get('type'))}")
+
+    def _handle(self, message: dict[str, Any], subscription: int) -> None:
+        if message.get('id') != subscription:
+            return  # pong or some other reply
+        if message.get('type') == 'result':
+            if not message.get('success'):
+                error = message.get('error', {}).get('message', 'unknown error')
+                raise HAMirrorError(f"subscribe_entities failed: {error}")
+            return
+        if message.get('type') == 'event':
+            self._apply(message.get('event', {}))
+
+    def _apply(self, event: dict[str, Any]) -> None:
+        states = dict(self._states)
+        changed: dict[str, Any] = {}
+        for eid, compressed in event.get('a', {}).items():
+            states[eid] = changed[eid] = {
+                'entity_id': eid,
+                'state': compressed.get('s'),
+                'attributes': compressed.get('a', {}),
+            }
+        for eid, diff in event.get('c', {}).items():
+            if eid in states:
+                states[eid] = changed[eid] = _apply_diff(states[eid], diff)
+        for eid in event.get('r', []):
+            states.pop(eid, None)
+            changed[eid] = None
+        self._states = states
+
+        if 'a' in event and not self._ready.is_set():
+            logger.info("Home Assistant mirror in sync (%d entities)", len(states))
+            self._ready.set()
+        for callback in list(self._listeners):
+            try:
+                callback(changed)
+            except Exception:  # noqa: BLE001 - one bad listener must not block others
+                logger.exception("Home Assistant mirror listener failed")
+
+
+_mirror: HAStateMirror | None = None
+_mirror_lock = threading.Lock()
+
+
+def is_configured() -> bool:
+    """True when an HA token is set and the mirror isn't disabled in settings."""
+    return bool(
+        getattr(settings, 'HOMEASSISTANT_ACCESS_TOKEN', None)
+        and getattr(settings, 'HOMEASSISTANT_WS_MIRROR', True)
+    )
+
+
+def get_mirror() -> HAStateMirror | None:
+    """Return the process-wide mirror, starting it on first use."""
+    global _mirror
+    if _mirror is None and is_configured():
+        with _mirror_lock:
+            if _mirror is None:
+                mirror = HAStateMirror(
+                    DEVICE_INDEX.entity_ids,
+                    settings.HOMEASSISTANT_URL,
+                    settings.HOMEASSISTANT_ACCESS_TOKEN,
+                )
+                mirror.start()
+                _mirror = mirror
+    return _mirror
+
+
+def get_states(entity_ids: Iterable[str]) -> dict[str, dict[str, Any]] | None:
+    """Mirrored states for ``entity_ids``; None means use the REST API instead."""
+    mirror = get_mirror()
+    if mirror is None:
+        return None
+    return mirror.states(entity_ids)
@@ -0,0 +1,121 @@
+"""
+Compare per-call ``requests`` with the shared pooled Home Assistant client.
+
+Starts a local stand-in for Home Assistant's REST API (every response takes
+``--latency`` seconds), fires a burst of ``--calls`` state reads from
+``--concurrency`` threads, and reports how many TCP connections each
+approach opened and the p50/p99 latency of the burst.
+
+    python manage.py ha_client_benchmark --calls 50 --concurrency 8
+"""
+
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from device_control.ha_client import HomeAssistantClient, build_session
+
+STATES = json.dumps([
+    {'entity_id': f'light.room_{i}', 'state': 'on', 'attributes': {'brightness': 200}}
+    for i in range(200)
+]).encode()
+
+
+class _StubHA(ThreadingHTTPServer):
+    """Counts accepted connections; keeps them alive like Home Assistant does."""
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.latency = latency
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        with self._lock:
+            self.connections += 1
+        return super().get_request()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Like aiohttp; otherwise Nagle stalls every keep-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(STATES)))
+        self.end_headers()
+        self.wfile.write(STATES)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark the pooled Home Assistant client against a new connection per call."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--latency', type=float, default=0.005,
+                            help="Simulated Home Assistant processing time per call, in seconds")
+
+    def handle(self, *args, **options):
+        server = _StubHA(options['latency'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            def per_call():
+                return requests.get(f'{base_url}/api/states', timeout=10)
+
+            client = HomeAssistantClient(base_url, 'token', session=build_session(options['concurrency']))
+
+            def pooled():
+                return client.get('/api/states')
+
+            for label, call in (('requests.get per call', per_call), ('shared pooled client', pooled)):
+                before = server.connections
+                wall, latencies = self._burst(call, options['calls'], options['concurrency'])
+                self.stdout.write(
+                    f"{label:<22} {server.connections - before:3d} connections   "
+                    f"p50 {self._percentile(latencies, 0.5) * 1000:6.1f} ms   "
+                    f"p99 {self._percentile(latencies, 0.99) * 1000:6.1f} ms   "
+                    f"total {wall * 1000:7.1f} ms"
+                )
+            stats = client.metrics()['/api/states']
+            self.stdout.write(
+                f"client metrics: {stats['count']} calls, {stats['errors']} errors, "
+                f"p50 {stats['p50'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms"
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @staticmethod
+    def _burst(call, calls, concurrency):
+        def timed(_):
+            start = time.perf_counter()
+            call().raise_for_status()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, range(calls)))
+        return time.perf_counter() - start, latencies
+
+    @staticmethod
+    def _percentile(latencies, fraction):
+        if fraction == 0.5:
+            return statistics.median(latencies)
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
@@ -1,95 +1,46 @@
 """
-Async bridge between sync Django and the async ``pynapoleon`` cloud client.
+Napoleon (Ayla) fireplaces, through the shared :mod:`~.cloud_bridge`.
 
-``pynapoleon`` talks to the Napoleon (Ayla) cloud over aiohttp and is entirely
-``async``. Django's request handling here is synchronous (WSGI), so we cannot
-simply ``asyncio.run()`` a fresh coroutine per request: the logged-in
-``NapoleonClient`` owns an aiohttp ``ClientSession`` that is bound to the event
-loop it was created on, and re-using it from a different loop raises
-``RuntimeError: ... attached to a different loop``.
+``pynapoleon`` talks to the Napoleon cloud over aiohttp and is entirely
+``async``. :class:`NapoleonAdapter` plugs it into a
+:class:`~.cloud_bridge.CloudBridge`, which runs it on the bridge's background
+loop, serves reads from a refreshed snapshot and retries once after a fresh
+login.
 
-The robust pattern is a single **dedicated background event loop** running in
-its own daemon thread for the lifetime of the process. The cached client and
-its session live on that loop forever; sync callers submit coroutines to it via
-``asyncio.run_coroutine_threadsafe`` and block on the result.
+Actions return the state they asked for as soon as the command is accepted;
+the bridge re-reads the fireplace ``RECONCILE_DELAY`` later and reports any
+difference to :func:`add_listener` callbacks. Flame and colour slider changes
+are debounced into one write per fireplace.
 
 Public sync API:
     * :func:`get_states`  -> list[dict]   (one per discovered fireplace)
-    * :func:`apply_action(dsn, action, value)` -> dict (the refreshed state)
+    * :func:`snapshot_age` -> seconds since the states were fetched, or None
+    * :func:`is_stale` -> bool (the cloud is failing; states may be out of date)
+    * :func:`health` -> dict (breaker, snapshot and metrics summary)
+    * :func:`apply_action(dsn, action, value)` -> dict (the expected state)
+    * :func:`add_listener(callback)` -> corrected states after reconciling
     * :func:`is_configured` -> bool
 
 All Ayla/network errors are surfaced as :class:`FireplaceError` so the views can
-turn them into clean JSON responses.
+turn them into clean JSON responses; an unknown DSN raises its subclass
+:class:`UnknownFireplaceError`.
 """
 
 from __future__ import annotations
 
-import asyncio
-import logging
-import threading
 from typing import Any, Callable, Coroutine
 
 from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from .cloud_bridge import RECONCILE_DELAY, CloudAdapter, CloudBridge, CloudError, UnknownDeviceError
 
-# How long a sync caller will block on a coroutine submitted to the loop.
-_CALL_TIMEOUT = 25  # seconds
 
-
-class FireplaceError(Exception):
+class FireplaceError(CloudError):
     """Any failure talking to the Napoleon cloud (auth, network, value)."""
 
 
-# ---------------------------------------------------------------------------
-# Dedicated background event-loop thread
-# ---------------------------------------------------------------------------
-class _LoopThread:
-    """Owns a single asyncio loop running in a daemon thread."""
-
-    def __init__(self) -> None:
-        self._loop = asyncio.new_event_loop()
-        self._thread = threading.Thread(
-            target=self._run, name="napoleon-loop", daemon=True
-        )
-        self._thread.start()
-
-    def _run(self) -> None:
-        asyncio.set_event_loop(self._loop)
-        self._loop.run_forever()
-
-    def run(self, coro: Coroutine[Any, Any, Any], timeout: int = _CALL_TIMEOUT) -> Any:
-        """Submit ``coro`` to the loop and block until it returns."""
-        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
-        try:
-            return future.result(timeout=timeout)
-        except asyncio.TimeoutError as exc:  # pragma: no cover - network timing
-            future.cancel()
-            raise FireplaceError("Napoleon cloud request timed out") from exc
-
-
-# Lazily created so importing this module (e.g. during `manage.py check`) never
-# spins up a thread.
-_loop_thread: _LoopThread | None = None
-_loop_lock = threading.Lock()
-
-
-def _loop() -> _LoopThread:
-    global _loop_thread
-    if _loop_thread is None:
-        with _loop_lock:
-            if _loop_thread is None:
-                _loop_thread = _LoopThread()
-    return _loop_thread
-
-
-# ---------------------------------------------------------------------------
-# Cached client + fireplace handles (all live on the loop thread)
-# ---------------------------------------------------------------------------
-# These are only ever touched from coroutines running on the loop thread, so no
-# additional locking is required around them.
-_client: Any = None  # NapoleonClient
-_fireplaces: dict[str, Any] = {}  # dsn -> Fireplace
+class UnknownFireplaceError(FireplaceError, UnknownDeviceError):
+    """No discovered fireplace has the requested DSN."""
 
 
 def is_configured() -> bool:
@@ -100,51 +51,6 @@ def is_configured() -> bool:
     )
 
 
-async def _ensure_client() -> None:
-    """Log in and discover fireplaces if we don't have a live client yet."""
-    global _client, _fireplaces
-    if _client is not None and _fireplaces:
-        return
-
-    # Imported lazily so the app loads even if pynapoleon is missing.
-    from pynapoleon import NapoleonClient
-    from pynapoleon.errors import NapoleonError
-
-    email = getattr(settings, "NAPOLEON_EMAIL", "")
-    password = getattr(settings, "NAPOLEON_PASSWORD", "")
-    europe = bool(getattr(settings, "NAPOLEON_EUROPE", False))
-    if not (email and password):
-        raise FireplaceError("Napoleon credentials are not configured")
-
-    client = NapoleonClient(email, password, europe=europe)
-    try:
-        await client.login()
-        fireplaces = await client.fireplaces()
-    except NapoleonError as exc:
-        await _safe_close(client)
-        raise FireplaceError(f"Napoleon login/discovery failed: {exc}") from exc
-
-    _client = client
-    _fireplaces = {fp.dsn: fp for fp in fireplaces}
-    logger.info("Napoleon: discovered %d fireplace(s)", len(_fireplaces))
-
-
-async def _safe_close(client: Any) -> None:
-    try:
-        await client.close()
-    except Exception:  # pragma: no cover - best-effort cleanup
-        pass
-
-
-async def _reset() -> None:
-    """Drop the cached client (forces a fresh login on the next call)."""
-    global _client, _fireplaces
-    client, _client = _client, None
-    _fireplaces = {}
-    if client is not None:
-        await _safe_close(client)
-
-
 def _state_to_dict(fp: Any) -> dict[str, Any]:
     """Serialize a Fireplace's cached state into a JSON-friendly dict."""
     s = fp.state
@@ -173,17 +79,6 @@ def _state_to_dict(fp: Any) -> dict[str, Any]:
     }
 
 
-# ---------------------------------------------------------------------------
-# Coroutines (run on the loop thread)
-# ---------------------------------------------------------------------------
-async def _get_states() -> list[dict[str, Any]]:
-    await _ensure_client()
-    fps = list(_fireplaces.values())
-    # Refresh all fireplaces concurrently.
-    await asyncio.gather(*(fp.refresh() for fp in fps))
-    return [_state_to_dict(fp) for fp in fps]
-
-
 # action name -> coroutine factory taking (fireplace, value)
 _ACTIONS: dict[str, Callable[[Any, Any], Coroutine[Any, Any, None]]] = {
     "power": lambda fp, v: fp.set_power(bool(v)),
@@ -202,52 +97,114 @@ _ACTIONS: dict[str, Callable[[Any, Any], Coroutine[Any, Any, None]]] = {
     "favourite": lambda fp, v: fp.apply_favourite(str(v)),
 }
 
+# Continuous controls (sliders, colour pickers): only the last value of a burst
+# is written.
+_DEBOUNCED = frozenset({
+    "flame_speed",
+    "orange_flame",
+    "yellow_flame",
+    "ember_bed_rgb",
+    "ember_bed_brightness",
+    "top_light_rgb",
+})
+
+
+def _optimistic_state(state: dict[str, Any], action: str, value: Any) -> dict[str, Any]:
+    """``state`` overlaid with the change we just requested."""
+    if action == "favourite":
+        return {**state, "current_favourite": str(value)}
+    if action.endswith("_rgb"):
+        value = [int(c) for c in value]
+    elif action in ("power", "eco_mode", "boost_mode") or action.endswith("_cycling"):
+        value = bool(value)
+    else:
+        value = int(value)
+    return {**state, action: value}
+
+
+class NapoleonAdapter(CloudAdapter):
+    label = "Napoleon"
+    key = "dsn"
+    device_noun = "fireplace"
+    error = FireplaceError
+    unknown_error = UnknownFireplaceError
+    actions = _ACTIONS
+    debounced = _DEBOUNCED
+    reconcile_delay = RECONCILE_DELAY
+
+    def library_errors(self) -> tuple[type[BaseException], ...]:
+        # Imported lazily so the app loads even if pynapoleon is missing.
+        from pynapoleon.errors import NapoleonError
+
+        return (NapoleonError,)
+
+    async def login(self, session: Any) -> Any:
+        from pynapoleon import NapoleonClient
+
+        email = getattr(settings, "NAPOLEON_EMAIL", "")
+        password = getattr(settings, "NAPOLEON_PASSWORD", "")
+        europe = bool(getattr(settings, "NAPOLEON_EUROPE", False))
+        if not (email and password):
+            raise FireplaceError("Napoleon credentials are not configured")
+
+        client = NapoleonClient(email, password, europe=europe, websession=session)
+        try:
+            await client.login()
+        except BaseException:
+            await self.close(client)
+            raise
+        return client
+
+    async def discover(self, client: Any) -> dict[str, Any]:
+        return {fp.dsn: fp for fp in await client.fireplaces()}
 
-async def _apply_action(dsn: str, action: str, value: Any) -> dict[str, Any]:
-    from pynapoleon.errors import NapoleonError
+    async def refresh(self, fp: Any) -> dict[str, Any]:
+        await fp.refresh()
+        return _state_to_dict(fp)
 
-    await _ensure_client()
-    fp = _fireplaces.get(dsn)
-    if fp is None:
-        raise FireplaceError(f"Unknown fireplace: {dsn}")
+    async def apply(self, fp: Any, action: str, value: Any) -> None:
+        # No refresh here: the bridge answers with the optimistic state and
+        # reconciles it in the background.
+        await self.actions[action](fp, value)
 
-    handler = _ACTIONS.get(action)
-    if handler is None:
-        raise FireplaceError(f"Unknown action: {action}")
+    def optimistic(self, state: dict[str, Any], action: str, value: Any) -> dict[str, Any]:
+        return _optimistic_state(state, action, value)
+
+    async def close(self, client: Any) -> None:
+        try:
+            await client.close()
+        except Exception:  # pragma: no cover - best-effort cleanup
+            pass
 
-    try:
-        await handler(fp, value)
-        # Reflect the change back to the caller.
-        await fp.refresh()
-    except NapoleonError as exc:
-        raise FireplaceError(f"{action} failed: {exc}") from exc
-    return _state_to_dict(fp)
-
-
-# ---------------------------------------------------------------------------
-# Public sync API (called from Django views) — with one auth/connection retry
-# ---------------------------------------------------------------------------
-def _run_with_retry(make_coro: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
-    """Run a coroutine on the loop, retrying once after a fresh login.
-
-    A cached client whose token/session has gone stale (process idle for a
-    while, cloud-side session reaped, etc.) surfaces as a FireplaceError. We
-    drop the cache, re-login, and retry exactly once before giving up.
-    """
-    loop = _loop()
-    try:
-        return loop.run(make_coro())
-    except FireplaceError:
-        logger.warning("Napoleon call failed; resetting client and retrying once")
-        loop.run(_reset())
-        return loop.run(make_coro())
+
+_bridge = CloudBridge(NapoleonAdapter())
 
 
 def get_states() -> list[dict[str, Any]]:
-    """Return the current state of every discovered fireplace."""
-    return _run_with_retry(_get_states)
+    """Return the state of every discovered fireplace (at most MAX_AGE old)."""
+    return _bridge.get_states()
+
+
+def snapshot_age() -> float | None:
+    """Seconds since the fireplace states were fetched, or None if never."""
+    return _bridge.snapshot_age()
+
+
+def is_stale() -> bool:
+    """True when get_states() may be returning out-of-date states."""
+    return _bridge.is_stale()
+
+
+def health() -> dict[str, Any]:
+    """Circuit breaker state, snapshot age and call metrics for the health view."""
+    return _bridge.status()
 
 
 def apply_action(dsn: str, action: str, value: Any) -> dict[str, Any]:
-    """Apply a single control action and return the refreshed fireplace state."""
-    return _run_with_retry(lambda: _apply_action(dsn, action, value))
+    """Apply a single control action and return the fireplace's expected state."""
+    return _bridge.apply_action(dsn, action, value)
+
+
+def add_listener(callback: Callable[[dict[str, Any]], None]) -> None:
+    """Call ``callback(state)`` when a fireplace didn't end up as an action promised."""
+    _bridge.add_listener(callback)
@@ -0,0 +1,332 @@
+"""
+Shared producer of device_control state for the WebSocket UI.
+
+Tablets used to poll ``api/states/`` every 10 s and the fireplace / Gemstone
+endpoints every 9 s each, so a light switched at the wall took up to a poll
+interval to show up and idle tablets kept Home Assistant and two clouds
+busy. Instead, one producer per process pushes changes to the
+``device_control`` channel group:
+
+* **Home Assistant** entities come from the :mod:`~.ha_mirror` WebSocket
+  subscription; each change is pushed as a per-entity delta as soon as Home
+  Assistant reports it. While the mirror is off, disconnected or not yet in
+  sync, the producer polls the REST states on the cloud interval instead and
+  pushes the entities that changed, since the page stops polling once its
+  socket is open.
+* **Fireplace** and **Gemstone** clouds cannot push, so the producer polls
+  them itself every ``CLOUD_POLL_INTERVAL`` -- once per process, and only
+  while at least one browser is connected -- and pushes the payload when it
+  changed. Action endpoints feed their new state back in via
+  :meth:`DeviceStateProducer.update_fireplace` / ``update_gemstone``, and
+  fireplace states corrected by the cloud bridge's reconciliation are pushed
+  the same way. The
+  payloads' ``age`` (seconds since the cloud was read) changes on every
+  poll, so it doesn't count as a change by itself; ``stale`` is set while the
+  cloud is failing and the states shown are the last known ones.
+
+Payloads have the same shape as the AJAX endpoints, which remain for the
+initial load fallback and for browsers without a socket.
+
+Public API:
+    * :func:`get_producer` -> :class:`DeviceStateProducer`
+    * :func:`entity_entries(raw_states)` / :func:`fireplace_payload` /
+      :func:`gemstone_payload` -> the JSON the endpoints and socket share
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Any, Callable
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from . import gemstone_client, ha_mirror, napoleon_client
+from .device_config import DEVICE_INDEX, FIREPLACE_OVERRIDES, GEMSTONE_OVERRIDES
+from .ha_client import get_entity_states
+
+logger = logging.getLogger(__name__)
+
+# Channels group every device_control WebSocket joins.
+DEVICE_GROUP = 'device_control'
+
+# How often the fireplace and Gemstone clouds are polled while a browser is
+# connected (what each tablet used to do on its own).
+CLOUD_POLL_INTERVAL = 9  # seconds
+
+
+# -- payloads (shared with the AJAX endpoints) ------------------------------
+
+def entity_entry(entity_id: str, data: dict[str, Any]) -> dict[str, Any]:
+    """The fields of a Home Assistant state the page uses."""
+    attrs = data.get("attributes", {})
+    entry = {
+        "state": data.get("state", "unknown"),
+        "friendly_name": attrs.get("friendly_name", entity_id),
+    }
+    # Include position for covers
+    pos = attrs.get("current_position")
+    if pos is not None:
+        entry["current_position"] = pos
+    # Include brightness info for lights
+    brightness = attrs.get("brightness")
+    if brightness is not None:
+        entry["brightness"] = brightness  # 0-255
+    color_modes = attrs.get("supported_color_modes")
+    if color_modes:
+        entry["supported_color_modes"] = color_modes
+    return entry
+
+
+def entity_entries(raw_states: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    return {eid: entity_entry(eid, data) for eid, data in raw_states.items()}
+
+
+def current_entity_states() -> dict[str, dict[str, Any]]:
+    """Every configured entity, from the mirror or (cold start) the REST API."""
+    all_ids = DEVICE_INDEX.entity_ids
+    raw_states = ha_mirror.get_states(all_ids)
+    if raw_states is None:
+        raw_states = get_entity_states(all_ids)
+    return entity_entries(raw_states)
+
+
+def apply_fireplace_overrides(state: dict[str, Any]) -> dict[str, Any]:
+    """Apply optional name/room overrides from device_config to a state dict."""
+    override = FIREPLACE_OVERRIDES.get(state.get("dsn"))
+    if override:
+        if override.get("name"):
+            state["name"] = override["name"]
+        if override.get("room"):
+            state["room"] = override["room"]
+    return state
+
+
+def apply_gemstone_overrides(state: dict[str, Any]) -> dict[str, Any]:
+    """Apply optional name/room overrides from device_config to a state dict."""
+    override = GEMSTONE_OVERRIDES.get(state.get("id"))
+    if override:
+        if override.get("name"):
+            state["name"] = override["name"]
+        if override.get("room"):
+            state["room"] = override["room"]
+    return state
+
+
+def _rounded_age(age: float | None) -> float | None:
+    return None if age is None else round(age, 1)
+
+
+def fireplace_payload() -> dict[str, Any]:
+    """``{configured, fireplaces, age, stale}``; raises FireplaceError on cloud failures."""
+    if not napoleon_client.is_configured():
+        return {"configured": False, "fireplaces": []}
+    states = [apply_fireplace_overrides(s) for s in napoleon_client.get_states()]
+    return {
+        "configured": True,
+        "fireplaces": states,
+        "age": _rounded_age(napoleon_client.snapshot_age()),
+        "stale": napoleon_client.is_stale(),
+    }
+
+
+def gemstone_payload() -> dict[str, Any]:
+    """``{configured, devices, patterns, age, stale}``; raises GemstoneError on cloud failures."""
+    if not gemstone_client.is_configured():
+        return {"configured": False, "devices": [], "patterns": []}
+    data = gemstone_client.get_states()
+    return {
+        "configured": True,
+        "devices": [apply_gemstone_overrides(d) for d in data.get("devices", [])],
+        "patterns": data.get("patterns", []),
+        "age": _rounded_age(gemstone_client.snapshot_age()),
+        "stale": gemstone_client.is_stale(),
+    }
+
+
+def _without_age(payload: dict[str, Any] | None) -> dict[str, Any] | None:
+    if payload is None or "age" not in payload:
+        return payload
+    return {k: v for k, v in payload.items() if k != "age"}
+
+
+# -- producer -----------------------------------------------------------------
+
+class DeviceStateProducer:
+    """Turns HA mirror changes and cloud polls into ``device.update`` messages."""
+
+    def __init__(
+        self,
+        mirror: ha_mirror.HAStateMirror | None = None,
+        publish: Callable[[dict[str, Any]], None] | None = None,
+        poll_interval: float = CLOUD_POLL_INTERVAL,
+    ) -> None:
+        self._mirror = mirror
+        self._publish = publish or self._publish_to_group
+        self._poll_interval = poll_interval
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+        self._clients = 0
+        # Last payload pushed per cloud ('fireplace' / 'gemstone')
+        self._clouds: dict[str, dict[str, Any]] = {}
+        # Last entity entries pushed, to diff REST polls against
+        self._entities: dict[str, dict[str, Any]] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        if self._mirror is not None:
+            self._mirror.add_listener(self._on_entities)
+        self._thread = threading.Thread(target=self._run, name="device-producer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Publish on the event loop the consumers run on (see the Sonos producer)."""
+        self._loop = loop
+
+    def client_connected(self) -> None:
+        with self._lock:
+            self._clients += 1
+            first = self._clients == 1
+        if first:
+            self._wake.set()  # poll the clouds now rather than in up to 9 s
+
+    def client_disconnected(self) -> None:
+        with self._lock:
+            self._clients = max(0, self._clients - 1)
+
+    def cloud_snapshot(self) -> dict[str, dict[str, Any]]:
+        """Last known fireplace / Gemstone payloads (missing until first polled)."""
+        return dict(self._clouds)
+
+    # -- updates -----------------------------------------------------------
+
+    def _on_entities(self, changed: dict[str, Any]) -> None:
+        """HA mirror listener: push configured entities that changed."""
+        entities = {
+            eid: entity_entry(eid, state) if state is not None else None
+            for eid, state in changed.items() if eid in DEVICE_INDEX
+        }
+        if entities:
+            with self._lock:
+                for eid, entry in entities.items():
+                    if entry is None:
+                        self._entities.pop(eid, None)
+                    else:
+                        self._entities[eid] = entry
+            self._publish({'kind': 'entities', 'entities': entities})
+
+    def ha_live(self) -> bool:
+        """True while the HA mirror is in sync and pushing changes itself."""
+        return self._mirror is not None and self._mirror.ready
+
+    def update_fireplace(self, state: dict[str, Any]) -> None:
+        """Fold one fireplace's refreshed state (from an action) into the payload."""
+        self._update_item('fireplace', 'fireplaces', 'dsn', state)
+
+    def _on_fireplace_corrected(self, state: dict[str, Any]) -> None:
+        """napoleon_client listener: a fireplace didn't end up as an action promised."""
+        self.update_fireplace(apply_fireplace_overrides(state))
+
+    def update_gemstone(self, state: dict[str, Any]) -> None:
+        """Fold one Gemstone device's refreshed state (from an action) into the payload."""
+        self._update_item('gemstone', 'devices', 'id', state)
+
+    def _update_item(self, kind: str, field: str, key: str, state: dict[str, Any]) -> None:
+        with self._lock:
+            payload = self._clouds.get(kind)
+            if payload is None:
+                return  # nothing pushed yet; the next poll covers it
+            items = [state if item.get(key) == state.get(key) else item for item in payload.get(field, [])]
+            payload = {**payload, field: items}
+        self._set_cloud(kind, payload)
+
+    def _set_cloud(self, kind: str, payload: dict[str, Any]) -> None:
+        with self._lock:
+            if _without_age(self._clouds.get(kind)) == _without_age(payload):
+                return  # an older or newer snapshot of the same state
+            self._clouds[kind] = payload
+        self._publish({'kind': kind, **payload})
+
+    # -- cloud polling (worker thread) -----------------------------------
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._clients:
+                self.poll_clouds()
+                if not self.ha_live():
+                    self.poll_entities()
+            self._wake.wait(self._poll_interval)
+            self._wake.clear()
+
+    def poll_clouds(self) -> None:
+        """Fetch both cloud payloads and push whichever changed (blocking)."""
+        for kind, load, error in (
+            ('fireplace', fireplace_payload, napoleon_client.FireplaceError),
+            ('gemstone', gemstone_payload, gemstone_client.GemstoneError),
+        ):
+            try:
+                payload = load()
+            except error as exc:
+                logger.warning("%s states fetch failed: %s", kind.capitalize(), exc)
+                payload = {"configured": True, "error": str(exc)}
+            except Exception:  # noqa: BLE001 - keep the poller alive
+                logger.exception("%s poll failed", kind.capitalize())
+                continue
+            self._set_cloud(kind, payload)
+
+    def poll_entities(self) -> None:
+        """Fetch HA states over REST and push those that changed (blocking)."""
+        try:
+            entities = entity_entries(get_entity_states(DEVICE_INDEX.entity_ids))
+        except Exception:  # noqa: BLE001 - keep the poller alive
+            logger.exception("Home Assistant states poll failed")
+            return
+        with self._lock:
+            changed = {eid: entry for eid, entry in entities.items() if self._entities.get(eid) != entry}
+            self._entities.update(changed)
+        if changed:
+            self._publish({'kind': 'entities', 'entities': changed})
+
+    def _publish_to_group(self, update: dict[str, Any]) -> None:
+        channel_layer = get_channel_layer()
+        message = {'type': 'device.update', 'update': update}
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(channel_layer.group_send(DEVICE_GROUP, message), loop)
+        else:
+            async_to_sync(channel_layer.group_send)(DEVICE_GROUP, message)
+
+
+# Lazily created so importing this module never connects or polls.
+_producer: DeviceStateProducer | None = None
+_producer_lock = threading.Lock()
+
+
+def get_producer() -> DeviceStateProducer:
+    """Return the process-wide producer, starting it (and the HA mirror) on first use."""
+    global _producer
+    if _producer is None:
+        with _producer_lock:
+            if _producer is None:
+                producer = DeviceStateProducer(ha_mirror.get_mirror())
+                napoleon_client.add_listener(producer._on_fireplace_corrected)
+                producer.start()
+                _producer = producer
+    return _producer
+
+
+def running_producer() -> DeviceStateProducer | None:
+    """The producer if some browser has started it, else None (never starts it)."""
+    return _producer
@@ -0,0 +1,8 @@
+# device_control/routing.py
+
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/device_control/', consumers.DeviceControlConsumer.as_asgi()),
+]
@@ -109,7 +109,7 @@
             .then(r => r.json().then(d => ({ ok: r.ok, d })))
             .then(({ ok, d }) => {
                 if (ok && d && d.fireplace) {
-                    // reconcile cached record from authoritative response (by dsn)
+                    // take the server's expected state (by dsn); corrections are pushed
                     const idx = STATES.findIndex(s => s.dsn === d.fireplace.dsn);
                     if (idx >= 0) STATES[idx] = d.fireplace;
                     // refresh visuals only — don't rebuild markup / close the popover
@@ -124,21 +124,7 @@
     function fetchStates() {
         return fetch(STATES_URL)
             .then(r => r.json())
-            .then(data => {
-                configured = data.configured !== false;
-                loadError = data.error || null;
-                const list = Array.isArray(data.fireplaces) ? data.fireplaces : [];
-                // keep the user's current selection pinned to its dsn across refreshes
-                const curDsn = STATES[sel] && STATES[sel].dsn;
-                STATES = list;
-                if (curDsn) {
-                    const i = STATES.findIndex(s => s.dsn === curDsn);
-                    sel = i >= 0 ? i : 0;
-                } else {
-                    sel = 0;
-                }
-                renderAll();
-            })
+            .then(applyStates)
             .catch(err => {
                 console.error('fireplace states error', err);
                 loadError = 'Could not reach the fireplace service.';
@@ -146,6 +132,24 @@
             });
     }
 
+    function applyStates(data) {
+        configured = data.configured !== false;
+        loadError = data.error || null;
+        // cloud unreachable: these are the last known states
+        ROOT.classList.toggle('stale', data.stale === true);
+        const list = Array.isArray(data.fireplaces) ? data.fireplaces : [];
+        // keep the user's current selection pinned to its dsn across refreshes
+        const curDsn = STATES[sel] && STATES[sel].dsn;
+        STATES = list;
+        if (curDsn) {
+            const i = STATES.findIndex(s => s.dsn === curDsn);
+            sel = i >= 0 ? i : 0;
+        } else {
+            sel = 0;
+        }
+        renderAll();
+    }
+
     // ── render ───────────────────────────────────────────────
     function showMessage(html) {
         sels.select.innerHTML = '';
@@ -408,10 +412,20 @@
         if (openPop) { openPop = null; renderPreview(); }
     });
 
+    // ── live updates — the page's WebSocket re-dispatches pushed states ─
+    // Held back while a popover is open or a control is being dragged.
+    let pending = null;
+    document.addEventListener('dc:fireplace', (e) => {
+        pending = e.detail;
+        if (!openPop && !editing) { applyStates(pending); pending = null; }
+    });
+
     // ── poll — skip while a popover is open or a control is being dragged ─
+    // Only fetches while the socket is down; otherwise applies held-back pushes.
     function poll() {
         if (openPop || editing) return;
-        fetchStates();
+        if (pending) { applyStates(pending); pending = null; }
+        else if (!window.dcSocketLive) fetchStates();
     }
 
     // initial load + 9s refresh
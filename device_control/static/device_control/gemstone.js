@@ -74,13 +74,7 @@
     function fetchStates() {
         return fetch(STATES_URL)
             .then(r => r.json())
-            .then(data => {
-                configured = data.configured !== false;
-                loadError = data.error || null;
-                DEVICES = Array.isArray(data.devices) ? data.devices : [];
-                PATTERNS = Array.isArray(data.patterns) ? data.patterns : [];
-                render();
-            })
+            .then(applyStates)
             .catch(err => {
                 console.error('gemstone states error', err);
                 loadError = 'Could not reach the Gemstone service.';
@@ -88,6 +82,16 @@
             });
     }
 
+    function applyStates(data) {
+        configured = data.configured !== false;
+        loadError = data.error || null;
+        // cloud unreachable: these are the last known states
+        ROOT.classList.toggle('stale', data.stale === true);
+        DEVICES = Array.isArray(data.devices) ? data.devices : [];
+        PATTERNS = Array.isArray(data.patterns) ? data.patterns : [];
+        render();
+    }
+
     // ── render ───────────────────────────────────────────────
     function showMessage(html) {
         sels.status.innerHTML = '';
@@ -206,11 +210,21 @@
         });
     }
 
+    // ── live updates — the page's WebSocket re-dispatches pushed states ─
+    // Held back while an action is in flight.
+    let pending = null;
+    document.addEventListener('dc:gemstone', (e) => {
+        pending = e.detail;
+        if (!editing) { applyStates(pending); pending = null; }
+    });
+
     // ── poll — skip while an action is in flight ─────────────
+    // Only fetches while the socket is down; otherwise applies held-back pushes.
     function poll() {
         if (editing) return;
+        if (pending) { applyStates(pending); pending = null; return; }
         if (!ROOT.classList.contains('active')) return;
-        fetchStates();
+        if (!window.dcSocketLive) fetchStates();
     }
 
     // initial load + 9s refresh
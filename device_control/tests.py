@@ -2,14 +2,27 @@
 Tests for the device_control app.
 """
 
+import asyncio
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
 from unittest.mock import patch, MagicMock
-from django.test import TestCase, RequestFactory, tag
+
+import requests
+from django.conf import settings
+from django.test import TestCase, RequestFactory, override_settings, tag
 from django.urls import reverse
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
 
-from .device_config import TABS, get_all_entity_ids
+from .device_config import DEVICE_INDEX, TABS, TYPE_DOMAINS, get_all_entity_ids
 from .ha_client import get_entity_state, get_entity_states, call_service
-from . import views
+from . import cloud_bridge, gemstone_client, ha_client, ha_mirror, napoleon_client, producer, views
+from .consumers import DeviceControlConsumer
 
 # The FILTERABLE_TABS set must stay in sync with the JS in the template.
 FILTERABLE_TABS = {"lights", "shades"}
@@ -48,11 +61,35 @@ class DeviceConfigTests(TestCase):
                     self.assertNotIn(eid, seen, f"Duplicate {eid} in tab {tab['key']}")
                     seen.add(eid)
 
+    def test_device_index_matches_config(self):
+        self.assertEqual(DEVICE_INDEX.entity_ids, get_all_entity_ids())
+        device = DEVICE_INDEX.get("light.master_bedroom_chandelier")
+        self.assertEqual(
+            (device.tab, device.group, device.room, device.type, device.domain),
+            ("lights", "Upper Floor", "Master Bedroom", "light", "light"),
+        )
+        self.assertIsNone(DEVICE_INDEX.get("switch.evil_entity"))
+        self.assertNotIn("switch.evil_entity", DEVICE_INDEX)
+
+    def test_device_index_tabs_and_types(self):
+        for tab in TABS:
+            expected = [dev["entity_id"] for devices in tab["devices"].values() for dev in devices]
+            self.assertEqual(list(DEVICE_INDEX.tab_entity_ids(tab["key"])), expected)
+        self.assertEqual(DEVICE_INDEX.tab_entity_ids("nope"), ())
+        for eid in DEVICE_INDEX.entity_ids:
+            self.assertIn(DEVICE_INDEX.get(eid).type, TYPE_DOMAINS)
+
+    def test_device_index_is_read_only(self):
+        get_all_entity_ids().add("switch.evil_entity")
+        self.assertNotIn("switch.evil_entity", DEVICE_INDEX)
+        with self.assertRaises(AttributeError):
+            DEVICE_INDEX.extra = {}
+
 
 class HaClientTests(TestCase):
     """Tests for ha_client.py (mocked HTTP)."""
 
-    @patch("device_control.ha_client.requests.get")
+    @patch("requests.Session.get")
     def test_get_entity_state_success(self, mock_get):
         mock_resp = MagicMock()
         mock_resp.status_code = 200
@@ -67,7 +104,7 @@ class HaClientTests(TestCase):
         self.assertIsNotNone(result)
         self.assertEqual(result["state"], "on")
 
-    @patch("device_control.ha_client.requests.get")
+    @patch("requests.Session.get")
     def test_get_entity_state_failure(self, mock_get):
         mock_resp = MagicMock()
         mock_resp.status_code = 404
@@ -76,7 +113,7 @@ class HaClientTests(TestCase):
         result = get_entity_state("switch.nonexistent")
         self.assertIsNone(result)
 
-    @patch("device_control.ha_client.requests.get")
+    @patch("requests.Session.get")
     def test_get_entity_states_filters(self, mock_get):
         mock_resp = MagicMock()
         mock_resp.status_code = 200
@@ -93,7 +130,7 @@ class HaClientTests(TestCase):
         self.assertIn("switch.c", result)
         self.assertNotIn("switch.b", result)
 
-    @patch("device_control.ha_client.requests.post")
+    @patch("requests.Session.post")
     def test_call_service_success(self, mock_post):
         mock_resp = MagicMock()
         mock_resp.status_code = 200
@@ -103,7 +140,7 @@ class HaClientTests(TestCase):
         self.assertTrue(success)
         self.assertIsNone(error)
 
-    @patch("device_control.ha_client.requests.post")
+    @patch("requests.Session.post")
     def test_call_service_failure(self, mock_post):
         mock_resp = MagicMock()
         mock_resp.status_code = 500
@@ -115,6 +152,360 @@ class HaClientTests(TestCase):
         self.assertIn("500", error)
 
 
+class HomeAssistantClientTests(TestCase):
+    """All HA callers share one pooled session and its latency metrics."""
+
+    def test_client_is_shared_and_follows_settings(self):
+        client = ha_client.get_client()
+        self.assertIs(ha_client.get_client(), client)
+        with self.settings(HOMEASSISTANT_URL="http://other.local:8123"):
+            self.assertIsNot(ha_client.get_client(), client)
+            self.assertEqual(ha_client.get_client().url("/api/states"), "http://other.local:8123/api/states")
+
+    def test_session_pools_and_retries_only_safe_requests(self):
+        adapter = ha_client.build_session(pool_size=4, retries=3).get_adapter("http://ha.local")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertEqual(adapter.max_retries.allowed_methods, frozenset(["GET"]))
+
+    def test_metrics_per_endpoint(self):
+        session = MagicMock(spec=requests.Session)
+        session.get.return_value = MagicMock(status_code=200)
+        session.post.return_value = MagicMock(status_code=500)
+        client = ha_client.HomeAssistantClient("http://ha.local:8123", "token", session=session)
+
+        client.get("/api/states/light.kitchen")
+        client.get("/api/states/switch.tv")
+        client.post("/api/services/light/turn_on", json={"entity_id": "light.kitchen"})
+
+        session.get.assert_called_with(
+            "http://ha.local:8123/api/states/switch.tv",
+            headers={"Authorization": "Bearer token", "Content-Type": "application/json"},
+            timeout=ha_client.TIMEOUT,
+        )
+        metrics = client.metrics()
+        self.assertEqual(metrics["/api/states/{entity_id}"]["count"], 2)
+        self.assertEqual(metrics["/api/states/{entity_id}"]["errors"], 0)
+        self.assertEqual(metrics["/api/services/light/turn_on"]["errors"], 1)
+        self.assertIn("p99", metrics["/api/services/light/turn_on"])
+
+    def test_failed_connections_are_counted(self):
+        session = MagicMock(spec=requests.Session)
+        session.get.side_effect = requests.ConnectionError("refused")
+        client = ha_client.HomeAssistantClient("http://ha.local:8123", "token", session=session)
+        with self.assertRaises(requests.ConnectionError):
+            client.get("/api/states")
+        self.assertEqual(client.metrics()["/api/states"]["errors"], 1)
+
+
+class FakeHASocket:
+    """Scripted stand-in for a Home Assistant WebSocket connection."""
+
+    def __init__(self, messages=()):
+        self.incoming = queue.Queue()
+        self.sent = []
+        self.closed = threading.Event()
+        for message in messages:
+            self.push(message)
+
+    def push(self, message):
+        self.incoming.put(json.dumps(message))
+
+    def send(self, text):
+        self.sent.append(json.loads(text))
+
+    def recv(self, timeout=None):
+        if self.closed.is_set():
+            raise ConnectionError("closed")
+        try:
+            text = self.incoming.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError from None
+        if text is None:
+            raise ConnectionError("closed")
+        return text
+
+    def close(self):
+        self.closed.set()
+        self.incoming.put(None)
+
+
+HANDSHAKE = [{"type": "auth_required"}, {"type": "auth_ok"}, {"id": 1, "type": "result", "success": True}]
+
+
+class HAMirrorTests(TestCase):
+    """The WebSocket mirror answers state reads from memory."""
+
+    def setUp(self):
+        self.socket = FakeHASocket(HANDSHAKE)
+        self.mirror = ha_mirror.HAStateMirror(
+            ["light.kitchen", "switch.tv"], "https://ha.local:8123", "token",
+            connect=lambda url: self.socket,
+        )
+        self.addCleanup(self.mirror.stop)
+
+    def _event(self, event):
+        self.socket.push({"id": 1, "type": "event", "event": event})
+
+    def test_websocket_url(self):
+        self.assertEqual(ha_mirror.websocket_url("http://ha.local:8123/"), "ws://ha.local:8123/api/websocket")
+        self.assertEqual(ha_mirror.websocket_url("https://ha.local"), "wss://ha.local/api/websocket")
+
+    def test_not_ready_until_first_snapshot(self):
+        self.assertIsNone(self.mirror.states(["light.kitchen"]))
+        self.mirror.start()
+        self._event({"a": {"light.kitchen": {"s": "on", "a": {"brightness": 200}}}})
+        self.assertTrue(self.mirror.wait_ready(2))
+
+        self.assertEqual(self.socket.sent[0], {"type": "auth", "access_token": "token"})
+        self.assertEqual(self.socket.sent[1]["type"], "subscribe_entities")
+        self.assertEqual(self.socket.sent[1]["entity_ids"], ["light.kitchen", "switch.tv"])
+        self.assertEqual(self.mirror.states(["light.kitchen", "switch.tv"]), {
+            "light.kitchen": {"entity_id": "light.kitchen", "state": "on", "attributes": {"brightness": 200}},
+        })
+
+    def test_changes_and_removals_are_applied(self):
+        changes = []
+        self.mirror.add_listener(changes.append)
+        self.mirror.start()
+        self._event({"a": {
+            "light.kitchen": {"s": "on", "a": {"brightness": 200, "friendly_name": "Kitchen"}},
+            "switch.tv": {"s": "off", "a": {}},
+        }})
+        self._event({"c": {"light.kitchen": {"+": {"s": "off"}, "-": {"a": ["brightness"]}}}})
+        self._event({"r": ["switch.tv"]})
+        self.mirror.wait_ready(2)
+        for _ in range(100):
+            if len(changes) == 3:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.mirror.states(["light.kitchen", "switch.tv"]), {
+            "light.kitchen": {
+                "entity_id": "light.kitchen", "state": "off", "attributes": {"friendly_name": "Kitchen"},
+            },
+        })
+        self.assertEqual(changes[2], {"switch.tv": None})
+
+    def test_added_entities_are_subscribed_on_a_new_connection(self):
+        first, second = self.socket, FakeHASocket(HANDSHAKE)
+        sockets = iter([first, second])
+        self.mirror._connect = lambda url: next(sockets)
+        self.mirror.start()
+        self._event({"a": {"light.kitchen": {"s": "on", "a": {}}}})
+        self.assertTrue(self.mirror.wait_ready(2))
+
+        self.mirror.add_entities(["switch.tv", "input_boolean.away"])
+        self.assertTrue(first.closed.wait(2))
+        for _ in range(200):
+            if len(second.sent) >= 2:
+                break
+            time.sleep(0.01)
+        subscribe = second.sent[1]
+        self.assertEqual(subscribe["entity_ids"], ["input_boolean.away", "light.kitchen", "switch.tv"])
+        second.push({"id": subscribe["id"], "type": "event", "event": {"a": {"input_boolean.away": {"s": "on", "a": {}}}}})
+        self.assertTrue(self.mirror.wait_ready(2))
+        self.assertEqual(self.mirror.states(["input_boolean.away"])["input_boolean.away"]["state"], "on")
+
+    def test_known_entities_do_not_resubscribe(self):
+        self.mirror.start()
+        self._event({"a": {"light.kitchen": {"s": "on", "a": {}}}})
+        self.assertTrue(self.mirror.wait_ready(2))
+        self.mirror.add_entities(["switch.tv"])
+        self.assertFalse(self.socket.closed.is_set())
+
+    def test_rejected_auth_keeps_mirror_out_of_sync(self):
+        self.socket = FakeHASocket([{"type": "auth_required"}, {"type": "auth_invalid", "message": "bad token"}])
+        self.mirror.start()
+        self.assertFalse(self.mirror.wait_ready(0.2))
+        self.assertIsNone(self.mirror.states(["light.kitchen"]))
+
+    @patch("device_control.views.get_entity_states")
+    @patch("device_control.views.ha_mirror.get_states")
+    def test_states_endpoint_uses_mirror(self, mock_mirror, mock_rest):
+        mock_mirror.return_value = {
+            "switch.living_room_tv_socket_1": {"state": "off", "attributes": {"friendly_name": "TV"}},
+        }
+        resp = self.client.get(reverse("device_control_states"))
+        self.assertEqual(resp.json()["switch.living_room_tv_socket_1"]["state"], "off")
+        mock_rest.assert_not_called()
+
+    @patch("device_control.views.get_entity_states", return_value={})
+    @patch("device_control.views.ha_mirror.get_states", return_value=None)
+    def test_states_endpoint_falls_back_to_rest(self, _mirror, mock_rest):
+        self.client.get(reverse("device_control_states"))
+        mock_rest.assert_called_once()
+
+    @patch("device_control.views.ha_mirror.get_states", return_value={})
+    def test_states_endpoint_limits_to_tab(self, mock_mirror):
+        self.client.get(reverse("device_control_states"), {"tab": "garage"})
+        self.assertEqual(mock_mirror.call_args[0][0], DEVICE_INDEX.tab_entity_ids("garage"))
+        resp = self.client.get(reverse("device_control_states"), {"tab": "nope"})
+        self.assertEqual(resp.status_code, 404)
+
+    @patch("device_control.views.ha_mirror.get_states")
+    def test_states_endpoint_limits_to_room(self, mock_mirror):
+        mock_mirror.return_value = {}
+        self.client.get(reverse("device_control_states"), {"tab": "lights", "room": "Kitchen"})
+        room_ids = mock_mirror.call_args[0][0]
+        self.assertTrue(room_ids)
+        self.assertTrue(all(DEVICE_INDEX.get(eid).room == "Kitchen" for eid in room_ids))
+        resp = self.client.get(reverse("device_control_states"), {"tab": "lights", "room": "Attic"})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get(reverse("device_control_states"), {"room": "Kitchen"})
+        self.assertEqual(resp.status_code, 400)
+
+    @patch("device_control.views.ha_mirror.get_states")
+    def test_unchanged_slice_returns_304(self, mock_mirror):
+        mock_mirror.return_value = {
+            "switch.living_room_tv_socket_1": {"state": "off", "attributes": {"friendly_name": "TV"}},
+        }
+        url = reverse("device_control_states")
+        first = self.client.get(url, {"tab": "tvs"})
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+
+        again = self.client.get(url, {"tab": "tvs"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b"")
+
+        mock_mirror.return_value = {
+            "switch.living_room_tv_socket_1": {"state": "on", "attributes": {"friendly_name": "TV"}},
+        }
+        changed = self.client.get(url, {"tab": "tvs"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+        self.assertEqual(changed.json()["switch.living_room_tv_socket_1"]["state"], "on")
+
+
+class DeviceStateProducerTests(TestCase):
+    """Mirror changes and cloud polls become pushes; unchanged polls don't."""
+
+    def setUp(self):
+        self.mirror = MagicMock()
+        self.published = []
+        self.producer = producer.DeviceStateProducer(self.mirror, publish=self.published.append)
+
+    def test_mirror_changes_are_pushed_as_entity_deltas(self):
+        self.producer.start()
+        self.addCleanup(self.producer.stop)
+        listener = self.mirror.add_listener.call_args[0][0]
+
+        listener({
+            "switch.living_room_tv_socket_1": {"state": "on", "attributes": {"friendly_name": "TV"}},
+            "sensor.not_configured": {"state": "1", "attributes": {}},
+        })
+        listener({"switch.living_room_tv_socket_1": None})
+
+        self.assertEqual(self.published, [
+            {"kind": "entities", "entities": {
+                "switch.living_room_tv_socket_1": {"state": "on", "friendly_name": "TV"},
+            }},
+            {"kind": "entities", "entities": {"switch.living_room_tv_socket_1": None}},
+        ])
+
+    @patch("device_control.producer.gemstone_client.is_configured", return_value=False)
+    @patch("device_control.producer.napoleon_client.get_states")
+    @patch("device_control.producer.napoleon_client.is_configured", return_value=True)
+    def test_cloud_polls_push_only_changes(self, _cfg, mock_states, _gem):
+        mock_states.return_value = [{"dsn": "AC000W1", "power": False}]
+        self.producer.poll_clouds()
+        self.producer.poll_clouds()
+        self.assertEqual([u["kind"] for u in self.published], ["fireplace", "gemstone"])
+        self.assertEqual(self.published[0]["fireplaces"], [{"dsn": "AC000W1", "power": False}])
+
+        # An action elsewhere updates one fireplace in place
+        self.producer.update_fireplace({"dsn": "AC000W1", "power": True})
+        self.assertEqual(self.published[-1]["fireplaces"], [{"dsn": "AC000W1", "power": True}])
+        self.assertEqual(self.producer.cloud_snapshot()["fireplace"]["fireplaces"][0]["power"], True)
+
+    @patch("device_control.producer.get_entity_states", return_value={})
+    @patch("device_control.producer.gemstone_client.is_configured", return_value=False)
+    @patch("device_control.producer.napoleon_client.is_configured", return_value=False)
+    def test_clouds_are_polled_only_while_clients_are_connected(self, mock_cfg, _gem, _states):
+        self.producer = producer.DeviceStateProducer(publish=self.published.append, poll_interval=0.01)
+        self.producer.start()
+        self.addCleanup(self.producer.stop)
+        time.sleep(0.05)
+        mock_cfg.assert_not_called()
+
+        self.producer.client_connected()
+        for _ in range(100):
+            if self.published:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.published[0], {"kind": "fireplace", "configured": False, "fireplaces": []})
+
+
+    @patch("device_control.producer.get_entity_states")
+    @patch("device_control.producer.gemstone_client.is_configured", return_value=False)
+    @patch("device_control.producer.napoleon_client.is_configured", return_value=False)
+    def test_entities_are_polled_while_the_mirror_is_down(self, _cfg, _gem, mock_states):
+        tv = "switch.living_room_tv_socket_1"
+        mock_states.return_value = {tv: {"state": "off", "attributes": {"friendly_name": "TV"}}}
+        self.mirror.ready = False
+        self.producer = producer.DeviceStateProducer(self.mirror, publish=self.published.append, poll_interval=0.01)
+        self.producer.start()
+        self.addCleanup(self.producer.stop)
+        self.producer.client_connected()
+
+        def entity_updates():
+            return [u["entities"] for u in self.published if u["kind"] == "entities"]
+
+        for _ in range(100):
+            if entity_updates():
+                break
+            time.sleep(0.01)
+        self.assertEqual(entity_updates()[0], {tv: {"state": "off", "friendly_name": "TV"}})
+
+        # Unchanged polls push nothing; a change is pushed on its own
+        time.sleep(0.05)
+        self.assertEqual(len(entity_updates()), 1)
+        mock_states.return_value = {tv: {"state": "on", "attributes": {"friendly_name": "TV"}}}
+        for _ in range(100):
+            if len(entity_updates()) > 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(entity_updates()[1], {tv: {"state": "on", "friendly_name": "TV"}})
+
+        # Once the mirror is in sync it pushes changes itself
+        self.mirror.ready = True
+        time.sleep(0.05)
+        calls = mock_states.call_count
+        time.sleep(0.05)
+        self.assertEqual(mock_states.call_count, calls)
+
+
+class DeviceControlConsumerTests(TestCase):
+    """New sockets get a snapshot, then whatever the producer pushes."""
+
+    async def test_connect_sends_snapshot_then_pushes(self):
+        mock_producer = MagicMock()
+        mock_producer.cloud_snapshot.return_value = {"fireplace": {"configured": False, "fireplaces": []}}
+        entities = {"switch.living_room_tv_socket_1": {"state": "off", "friendly_name": "TV"}}
+        with patch("device_control.consumers.get_producer", return_value=mock_producer), \
+                patch("device_control.consumers.current_entity_states", return_value=entities):
+            communicator = WebsocketCommunicator(DeviceControlConsumer.as_asgi(), "/ws/device_control/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            message = await communicator.receive_json_from()
+            self.assertEqual(message["type"], "snapshot")
+            self.assertEqual(message["entities"], entities)
+            self.assertEqual(message["fireplace"], {"configured": False, "fireplaces": []})
+            mock_producer.client_connected.assert_called_once()
+
+            await get_channel_layer().group_send(producer.DEVICE_GROUP, {
+                "type": "device.update",
+                "update": {"kind": "entities", "entities": {"switch.living_room_tv_socket_1": None}},
+            })
+            message = await communicator.receive_json_from()
+            self.assertEqual(message, {"type": "entities", "entities": {"switch.living_room_tv_socket_1": None}})
+
+            await communicator.disconnect()
+            mock_producer.client_disconnected.assert_called_once()
+
+
 class ViewTests(TestCase):
     """Tests for device_control views."""
 
@@ -194,6 +585,24 @@ class ViewTests(TestCase):
         )
         self.assertEqual(resp.status_code, 400)
 
+    @patch("device_control.views.call_service", return_value=(True, None))
+    def test_action_requires_type(self, mock_call):
+        resp = self.client.post(
+            reverse("device_control_action"),
+            data='{"entity_id": "cover.kitchen_left_window", "action": "open"}',
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+        mock_call.assert_not_called()
+
+    def test_action_rejects_type_not_matching_config(self):
+        resp = self.client.post(
+            reverse("device_control_action"),
+            data='{"entity_id": "switch.living_room_tv_socket_1", "action": "open", "type": "cover"}',
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+
     def test_action_rejects_unknown_type(self):
         resp = self.client.post(
             reverse("device_control_action"),
@@ -226,6 +635,535 @@ class ViewTests(TestCase):
         self.assertFalse(data["ok"])
 
 
+class BulkActionViewTests(TestCase):
+    """Bulk actions become one HA service call per (domain, service, data)."""
+
+    def _post(self, actions):
+        return self.client.post(
+            reverse("device_control_bulk_action"),
+            data=json.dumps({"actions": actions}),
+            content_type="application/json",
+        )
+
+    @patch("device_control.views.call_service", return_value=(True, None))
+    def test_items_are_grouped_per_service_call(self, mock_call):
+        resp = self._post([
+            {"entity_id": "light.master_bedroom_main_lights", "action": "off", "type": "light"},
+            {"entity_id": "switch.living_room_tv_socket_1", "action": "off", "type": "switch"},
+            {"entity_id": "light.master_bedroom_chandelier", "action": "off", "type": "light"},
+            {"entity_id": "light.master_bedroom_chandelier", "action": "on", "type": "light", "brightness": 128},
+        ])
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertTrue(data["ok"])
+        self.assertEqual([r["entity_id"] for r in data["results"]], [
+            "light.master_bedroom_main_lights", "switch.living_room_tv_socket_1",
+            "light.master_bedroom_chandelier", "light.master_bedroom_chandelier",
+        ])
+        self.assertEqual(mock_call.call_count, 3)
+        mock_call.assert_any_call(
+            "light", "turn_off", ["light.master_bedroom_main_lights", "light.master_bedroom_chandelier"],
+            extra_data=None,
+        )
+        mock_call.assert_any_call("switch", "turn_off", ["switch.living_room_tv_socket_1"], extra_data=None)
+        mock_call.assert_any_call(
+            "light", "turn_on", ["light.master_bedroom_chandelier"], extra_data={"brightness": 128},
+        )
+
+    @patch("device_control.views.call_service")
+    def test_results_are_per_entity(self, mock_call):
+        mock_call.side_effect = lambda domain, *args, **kwargs: (
+            (True, None) if domain == "light" else (False, "HA timeout")
+        )
+        resp = self._post([
+            {"entity_id": "light.master_bedroom_main_lights", "action": "off", "type": "light"},
+            {"entity_id": "switch.living_room_tv_socket_1", "action": "off", "type": "switch"},
+            {"entity_id": "switch.not_configured", "action": "off", "type": "switch"},
+            {"entity_id": "light.master_bedroom_chandelier", "action": "explode", "type": "light"},
+        ])
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()["results"]
+        self.assertFalse(resp.json()["ok"])
+        self.assertTrue(results[0]["ok"])
+        self.assertEqual(results[1]["error"], "HA timeout")
+        self.assertEqual(results[2]["error"], "Entity not allowed")
+        self.assertEqual(results[3]["error"], "Unknown action: explode")
+        self.assertEqual(mock_call.call_count, 2)
+
+    @patch("device_control.views.call_service", return_value=(False, "HA down"))
+    def test_all_calls_failing_returns_502(self, _call):
+        resp = self._post([{"entity_id": "switch.living_room_tv_socket_1", "action": "on", "type": "switch"}])
+        self.assertEqual(resp.status_code, 502)
+
+    @patch("device_control.views.call_service")
+    def test_only_invalid_items_make_no_calls(self, mock_call):
+        resp = self._post([{"entity_id": "switch.not_configured", "action": "off", "type": "switch"}])
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.json()["ok"])
+        self.assertEqual(resp.json()["results"][0]["error"], "Entity not allowed")
+        mock_call.assert_not_called()
+
+    def test_rejects_missing_or_oversized_lists(self):
+        self.assertEqual(self._post([]).status_code, 400)
+        item = {"entity_id": "switch.living_room_tv_socket_1", "action": "on", "type": "switch"}
+        self.assertEqual(self._post([item] * (views.MAX_BULK_ACTIONS + 1)).status_code, 400)
+
+
+class FakeCloudAdapter(cloud_bridge.CloudAdapter):
+    """Two lamps whose state the test controls; every cloud call is counted."""
+
+    label = "Fake"
+    actions = {"power": None}
+
+    def __init__(self):
+        self.power = False
+        self.refreshes = 0
+        self.logins = 0
+        self.fail = False
+        self.saved = None
+        self.persisted = []
+
+    async def login(self, session):
+        self.logins += 1
+        return object()
+
+    async def discover(self, client):
+        return {"lamp-1": "lamp-1", "lamp-2": "lamp-2"}
+
+    async def refresh(self, device):
+        if device == "lamp-1":
+            self.refreshes += 1
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise self.error("cloud down")
+        return {"id": device, "power": self.power}
+
+    async def apply(self, device, action, value):
+        return {"id": device, "power": bool(value)}
+
+    async def restore(self):
+        return self.saved
+
+    async def persist(self, states):
+        self.persisted.append(states)
+
+
+class OptimisticFakeAdapter(FakeCloudAdapter):
+    """Sends commands without reading back; the cloud obeys power only if ``obey``."""
+
+    actions = {"power": None, "level": None}
+    debounced = frozenset({"level"})
+    debounce_window = 0.05
+    reconcile_delay = 0.2
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+        self.obey = True
+
+    async def apply(self, device, action, value):
+        self.writes.append((device, action, value))
+        if action == "power" and self.obey:
+            self.power = value
+
+
+class CloudBridgeTests(TestCase):
+    """Cloud reads come from a background-refreshed, coalesced snapshot."""
+
+    def setUp(self):
+        self.adapter = FakeCloudAdapter()
+        self.bridge = cloud_bridge.CloudBridge(self.adapter)
+        self.addCleanup(self._stop_scheduler)
+
+        async def no_session():
+            return None
+
+        patcher = patch.object(cloud_bridge, "_shared_session", no_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _stop_scheduler(self):
+        async def stop():
+            if self.bridge._scheduler is not None:
+                self.bridge._scheduler.cancel()
+
+        cloud_bridge.get_loop().run(stop())
+
+    def test_concurrent_reads_share_one_refresh(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.bridge.get_states())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        lamps = [{"id": "lamp-1", "power": False}, {"id": "lamp-2", "power": False}]
+        self.assertEqual(results, [lamps] * 5)
+        self.assertEqual(self.adapter.refreshes, 1)
+        self.assertEqual(self.adapter.logins, 1)
+
+    def test_reads_are_served_from_the_snapshot(self):
+        self.assertIsNone(self.bridge.snapshot_age())
+        self.bridge.get_states()[0]["name"] = "mutated by a caller"
+        self.adapter.power = True
+        self.assertEqual(self.bridge.get_states()[0], {"id": "lamp-1", "power": False})
+        self.assertEqual(self.adapter.refreshes, 1)
+        self.assertLess(self.bridge.snapshot_age(), cloud_bridge.MAX_AGE)
+
+    def test_stale_snapshot_is_refreshed_before_reading(self):
+        self.bridge.get_states()
+        self.adapter.power = True
+        self.adapter.max_age = 0
+        self.assertEqual(self.bridge.get_states()[0], {"id": "lamp-1", "power": True})
+
+    def test_interval_follows_actions_and_readers(self):
+        self.assertEqual(self.bridge._interval(), cloud_bridge.IDLE_INTERVAL)
+        self.bridge.get_states()
+        self.assertEqual(self.bridge._interval(), cloud_bridge.ACTIVE_INTERVAL)
+        self.bridge.apply_action("lamp-1", "power", True)
+        self.assertEqual(self.bridge._interval(), cloud_bridge.FAST_INTERVAL)
+
+    def test_action_updates_snapshot(self):
+        self.bridge.get_states()
+        self.assertEqual(self.bridge.apply_action("lamp-2", "power", True), {"id": "lamp-2", "power": True})
+        self.assertEqual(self.bridge.get_states()[1], {"id": "lamp-2", "power": True})
+        self.assertEqual(self.adapter.refreshes, 1)
+
+    def test_saved_states_are_served_until_the_first_refresh(self):
+        self.adapter.saved = ([{"id": "lamp-1", "power": True}], time.time() - 120)
+        self.assertEqual(self.bridge.get_states(), [{"id": "lamp-1", "power": True}])
+        self.assertGreaterEqual(self.bridge.snapshot_age(), 120)
+
+        for _ in range(100):
+            if self.adapter.persisted:
+                break
+            time.sleep(0.01)
+        live = [{"id": "lamp-1", "power": False}, {"id": "lamp-2", "power": False}]
+        self.assertEqual(self.adapter.persisted, [live])
+        self.assertEqual(self.bridge.get_states(), live)
+
+    def test_unknown_action_or_device_is_rejected(self):
+        with self.assertRaisesMessage(cloud_bridge.CloudError, "Unknown action: dim"):
+            self.bridge.apply_action("lamp-1", "dim", 3)
+        with self.assertRaisesMessage(cloud_bridge.CloudError, "Unknown device: lamp-9"):
+            self.bridge.apply_action("lamp-9", "power", True)
+
+    def test_unknown_devices_do_not_trip_the_breaker(self):
+        bridge = cloud_bridge.CloudBridge(self.adapter, cloud_bridge.CircuitBreaker(name="Fake", threshold=2))
+        self.bridge = bridge
+        # Before the first read the key is checked after logging in, once
+        with self.assertRaises(cloud_bridge.UnknownDeviceError):
+            bridge.apply_action("lamp-9", "power", True)
+        bridge.get_states()
+        for _ in range(3):
+            with self.assertRaises(cloud_bridge.UnknownDeviceError):
+                bridge.apply_action("lamp-9", "power", True)
+        self.assertEqual(self.adapter.logins, 1)
+        self.assertEqual(bridge.breaker.state, "closed")
+        self.assertEqual(bridge.apply_action("lamp-1", "power", True), {"id": "lamp-1", "power": True})
+
+    def test_failed_call_retries_once_after_fresh_login(self):
+        self.adapter.fail = True
+        with self.assertRaises(cloud_bridge.CloudError):
+            self.bridge.get_states()
+        self.assertEqual(self.adapter.logins, 2)
+        self.assertEqual(self.bridge.metrics()["refresh"]["errors"], 2)
+
+    def _failing_bridge(self, **breaker):
+        self.bridge = cloud_bridge.CloudBridge(self.adapter, cloud_bridge.CircuitBreaker(name="Fake", **breaker))
+        self.adapter.fail = True
+        return self.bridge
+
+    def test_breaker_fails_fast_then_probes(self):
+        bridge = self._failing_bridge(threshold=2, cooldown=0.05)
+        for _ in range(2):
+            with self.assertRaises(cloud_bridge.CloudError):
+                bridge.get_states()
+        self.assertEqual(bridge.breaker.state, "open")
+        logins = self.adapter.logins
+        with self.assertRaisesMessage(cloud_bridge.CloudError, "Fake cloud unavailable"):
+            bridge.get_states()
+        self.assertEqual(self.adapter.logins, logins)
+
+        time.sleep(0.06)
+        self.assertEqual(bridge.breaker.state, "half-open")
+        self.adapter.fail = False
+        bridge.get_states()
+        self.assertEqual(bridge.breaker.state, "closed")
+
+    def test_open_breaker_serves_last_known_states_as_stale(self):
+        bridge = self._failing_bridge(threshold=1, cooldown=60)
+        self.adapter.fail = False
+        lamps = bridge.get_states()
+        self.assertFalse(bridge.is_stale())
+
+        self.adapter.fail = True
+        self.adapter.max_age = 0
+        self.assertEqual(bridge.get_states(), lamps)
+        self.assertEqual(bridge.breaker.state, "open")
+        self.assertTrue(bridge.is_stale())
+        refreshes = self.adapter.refreshes
+        self.assertEqual(bridge.get_states(), lamps)
+        self.assertEqual(self.adapter.refreshes, refreshes)
+        self.assertEqual(bridge.status()["breaker"]["state"], "open")
+
+    def _wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("timed out")
+
+    def _optimistic_bridge(self):
+        self.adapter = OptimisticFakeAdapter()
+        self.bridge = cloud_bridge.CloudBridge(self.adapter)
+        self.bridge.get_states()
+        return self.bridge
+
+    def test_optimistic_action_answers_without_reading_back(self):
+        bridge = self._optimistic_bridge()
+        self.assertEqual(bridge.apply_action("lamp-1", "power", True), {"id": "lamp-1", "power": True})
+        self.assertEqual(self.adapter.writes, [("lamp-1", "power", True)])
+        self.assertEqual(self.adapter.refreshes, 1)
+
+    def test_rapid_changes_are_debounced_into_one_write(self):
+        bridge = self._optimistic_bridge()
+        for level in (1, 2, 3):
+            state = bridge.apply_action("lamp-1", "level", level)
+        self.assertEqual(state, {"id": "lamp-1", "power": False, "level": 3})
+        self.assertEqual(self.adapter.writes, [])
+        self._wait_for(lambda: self.adapter.writes)
+        self.assertEqual(self.adapter.writes, [("lamp-1", "level", 3)])
+
+    def test_queued_change_is_written_before_the_next_action(self):
+        bridge = self._optimistic_bridge()
+        bridge.apply_action("lamp-1", "level", 5)
+        bridge.apply_action("lamp-1", "power", True)
+        self.assertEqual(self.adapter.writes, [("lamp-1", "level", 5), ("lamp-1", "power", True)])
+
+    def test_reconciling_pushes_corrections(self):
+        bridge = self._optimistic_bridge()
+        corrected = []
+        bridge.add_listener(corrected.append)
+        self.adapter.obey = False
+        bridge.apply_action("lamp-1", "power", True)
+        # Refreshes keep the promised state until the device is re-read
+        self.adapter.max_age = 0
+        self.assertTrue(bridge.get_states()[0]["power"])
+
+        self._wait_for(lambda: corrected)
+        self.assertEqual(corrected, [{"id": "lamp-1", "power": False}])
+        self.assertFalse(bridge.get_states()[0]["power"])
+
+    def test_confirmed_action_pushes_nothing(self):
+        bridge = self._optimistic_bridge()
+        corrected = []
+        bridge.add_listener(corrected.append)
+        bridge.apply_action("lamp-2", "power", True)
+        refreshes = self.adapter.refreshes
+        self._wait_for(lambda: not bridge._promised)
+        self.assertEqual(corrected, [])
+        self.assertEqual(self.adapter.refreshes, refreshes)  # lamp-2 re-read only
+
+    def test_untouched_fields_changing_push_nothing(self):
+        bridge = self._optimistic_bridge()
+        corrected = []
+        bridge.add_listener(corrected.append)
+        refresh = self.adapter.refresh
+
+        async def refresh_with_reading(device):
+            # A sensor reading that moves on every read
+            return {**await refresh(device), "reading": self.adapter.refreshes}
+        self.adapter.refresh = refresh_with_reading
+        bridge.apply_action("lamp-1", "power", True)
+        self._wait_for(lambda: not bridge._promised and not bridge._reconciling)
+        self.assertEqual(corrected, [])
+
+    def test_fireplace_optimistic_state(self):
+        state = {"dsn": "AC1", "power": False, "ember_bed_rgb": [0, 0, 0], "current_favourite": None}
+        self.assertEqual(
+            napoleon_client._optimistic_state(state, "ember_bed_rgb", [255, 120, 0])["ember_bed_rgb"],
+            [255, 120, 0],
+        )
+        self.assertIs(napoleon_client._optimistic_state(state, "power", 1)["power"], True)
+        self.assertEqual(
+            napoleon_client._optimistic_state(state, "favourite", "summerday")["current_favourite"], "summerday"
+        )
+
+    def test_vendor_bridges_share_one_loop_thread(self):
+        self.assertIs(napoleon_client._bridge.adapter.error, napoleon_client.FireplaceError)
+        self.assertTrue(issubclass(gemstone_client.GemstoneError, cloud_bridge.CloudError))
+        cloud_bridge.get_loop()
+        names = [t.name for t in threading.enumerate()]
+        self.assertEqual(names.count("cloud-bridge"), 1)
+        self.assertNotIn("napoleon-loop", names)
+        self.assertNotIn("gemstone-loop", names)
+
+
+class CircuitBreakerTests(TestCase):
+    def _open(self, **kwargs):
+        breaker = cloud_bridge.CircuitBreaker(threshold=1, name="Fake", **kwargs)
+        breaker.record_failure()
+        return breaker
+
+    def test_failed_probe_doubles_the_cooldown_up_to_the_max(self):
+        breaker = self._open(cooldown=0.01, max_cooldown=0.03)
+        self.assertFalse(breaker.allow())
+        for cooldown in (0.02, 0.03):
+            time.sleep(breaker.status()["cooldown"] + 0.005)
+            self.assertTrue(breaker.allow())  # half-open: this call is the probe
+            self.assertFalse(breaker.allow())  # one probe at a time
+            breaker.record_failure()
+            self.assertEqual(breaker.status()["cooldown"], cooldown)
+            self.assertEqual(breaker.state, "open")
+
+    def test_needs_all_probes_to_close(self):
+        breaker = self._open(cooldown=0, probes=2)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_success_outside_a_probe_does_not_close(self):
+        breaker = self._open(cooldown=60)
+        breaker.record_success()  # a call that started before the breaker opened
+        self.assertEqual(breaker.state, "open")
+
+    @override_settings(CLOUD_BREAKER_THRESHOLD=7, CLOUD_BREAKER_PROBES=2)
+    def test_configured_from_settings(self):
+        breaker = cloud_bridge.CircuitBreaker.from_settings("Fake")
+        self.assertEqual((breaker.threshold, breaker.probes), (7, 2))
+
+
+def folder_payload(updated_at=1):
+    return {"folderId": "folder-1", "name": "Holidays", "lastUpdatedAt": updated_at}
+
+
+def folder_pattern_payload(pattern_id, name, favourite=False):
+    return {
+        "id": f"fp-{pattern_id}",
+        "isFavorite": favourite,
+        "patternData": {"id": pattern_id, "name": name, "colors": [0x0000FF]},
+    }
+
+
+class FakeGemstoneClient:
+    """The catalogue calls of pygemstone's client; folder pages are counted."""
+
+    def __init__(self, patterns, folder_updated_at=1):
+        self.patterns = patterns
+        self.folder_updated_at = folder_updated_at
+        self.pages = 0
+
+    async def folders(self):
+        from pygemstone.models import Folder
+
+        return [Folder.from_api(folder_payload(self.folder_updated_at))]
+
+    async def folder_patterns(self, page=1):
+        from pygemstone.models import FolderPattern
+
+        self.pages += 1
+        return [FolderPattern.from_api(p) for p in self.patterns] if page == 1 else []
+
+    async def devices(self):
+        return []
+
+
+class GemstoneCatalogueTests(TestCase):
+    """The pattern catalogue is cached on disk and re-paged only when it changed."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_patcher = override_settings(GEMSTONE_CACHE_FILE=os.path.join(tmp.name, "gemstone.json"))
+        settings_patcher.enable()
+        self.addCleanup(settings_patcher.disable)
+        self._forget_catalogue()
+        self.patterns = [
+            folder_pattern_payload("pat-1", "Christmas", favourite=True),
+            folder_pattern_payload("pat-2", "Halloween"),
+        ]
+
+    def _forget_catalogue(self):
+        """What a process restart forgets."""
+        patcher = patch.multiple(
+            gemstone_client, _patterns_by_id={}, _patterns_ui=[], _patterns_raw={},
+            _catalogue_version=None, _catalogue_paged_at=0.0,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _login(self, client):
+        adapter = gemstone_client.GemstoneAdapter()
+
+        async def discover():
+            await adapter.discover(client)
+            if adapter._revalidating is not None:
+                await adapter._revalidating
+
+        asyncio.run(discover())
+        return adapter
+
+    def _names(self):
+        return [p["name"] for p in gemstone_client._patterns_ui]
+
+    def test_first_login_pages_catalogue_and_saves_it(self):
+        client = FakeGemstoneClient(self.patterns)
+        self._login(client)
+        self.assertEqual(client.pages, 2)
+        self.assertEqual(self._names(), ["Christmas", "Halloween"])
+        with open(settings.GEMSTONE_CACHE_FILE) as f:
+            self.assertEqual(len(json.load(f)["patterns"]), 2)
+
+    def test_restart_serves_cache_and_skips_unchanged_catalogue(self):
+        self._login(FakeGemstoneClient(self.patterns))
+        self._forget_catalogue()
+
+        client = FakeGemstoneClient(self.patterns)
+        self._login(client)
+        self.assertEqual(client.pages, 0)
+        self.assertEqual(self._names(), ["Christmas", "Halloween"])
+
+    def test_changed_catalogue_is_reloaded_incrementally(self):
+        self._login(FakeGemstoneClient(self.patterns))
+        christmas = gemstone_client._patterns_ui[0]
+        self._forget_catalogue()
+
+        self.patterns[1] = folder_pattern_payload("pat-3", "Easter")
+        client = FakeGemstoneClient(self.patterns, folder_updated_at=2)
+        with self.assertLogs("device_control.gemstone_client", "INFO") as logs:
+            self._login(client)
+        self.assertEqual(client.pages, 2)
+        self.assertEqual(self._names(), ["Christmas", "Easter"])
+        self.assertEqual(gemstone_client._patterns_ui[0], christmas)
+        self.assertIn("(1 new, 0 changed, 1 removed)", logs.output[-1])
+
+    def test_saved_states_are_restored(self):
+        adapter = gemstone_client.GemstoneAdapter()
+        states = [{"id": "dev-1", "power": True}]
+        asyncio.run(adapter.persist(states))
+
+        restored = asyncio.run(gemstone_client.GemstoneAdapter().restore())
+        self.assertEqual(restored[0], states)
+        self.assertAlmostEqual(restored[1], time.time(), delta=5)
+
+    def test_unchanged_states_refresh_saved_timestamp(self):
+        adapter = gemstone_client.GemstoneAdapter()
+        states = [{"id": "dev-1", "power": True}]
+        with patch("device_control.gemstone_client.time.time", return_value=1000.0):
+            asyncio.run(adapter.persist(states))
+        with patch("device_control.gemstone_client.time.time", return_value=1010.0):
+            asyncio.run(adapter.persist(list(states)))  # within the interval: not written
+        self.assertEqual(asyncio.run(gemstone_client.GemstoneAdapter().restore())[1], 1000.0)
+
+        later = 1000.0 + gemstone_client.STATES_SAVE_INTERVAL
+        with patch("device_control.gemstone_client.time.time", return_value=later):
+            asyncio.run(adapter.persist(list(states)))
+        self.assertEqual(asyncio.run(gemstone_client.GemstoneAdapter().restore())[1], later)
+
+
 class FireplaceViewTests(TestCase):
     """Tests for the Napoleon fireplace endpoints (mocked napoleon_client)."""
 
@@ -386,6 +1324,45 @@ class FireplaceViewTests(TestCase):
         self.assertEqual(resp.status_code, 502)
         self.assertFalse(resp.json()["ok"])
 
+    @patch("device_control.views.napoleon_client.apply_action")
+    @patch("device_control.views.napoleon_client.is_configured", return_value=True)
+    def test_action_unknown_dsn_returns_404(self, _cfg, mock_apply):
+        mock_apply.side_effect = views.napoleon_client.UnknownFireplaceError("Unknown fireplace: XX")
+        resp = self.client.post(
+            reverse("device_control_fireplace_action"),
+            data='{"dsn": "XX", "action": "power", "value": true}',
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 404)
+
+
+class HealthViewTests(TestCase):
+    def _health(self, state):
+        return {"breaker": {"state": state}, "snapshot_age": 4.0, "stale": state != "closed", "metrics": {}}
+
+    @patch("device_control.views.ha_mirror.get_mirror", return_value=None)
+    @patch("device_control.views.gemstone_client.is_configured", return_value=False)
+    @patch("device_control.views.napoleon_client.is_configured", return_value=True)
+    def test_reports_each_backend(self, _napoleon, _gemstone, _mirror):
+        with patch.object(napoleon_client, "health", return_value=self._health("closed")):
+            resp = self.client.get(reverse("device_control_health"))
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertTrue(data["ok"])
+        self.assertEqual(data["home_assistant"]["mirror"], "disabled")
+        self.assertEqual(data["fireplace"]["breaker"]["state"], "closed")
+        self.assertEqual(data["gemstone"], {"configured": False})
+
+    @patch("device_control.views.ha_mirror.get_mirror", return_value=None)
+    @patch("device_control.views.gemstone_client.is_configured", return_value=False)
+    @patch("device_control.views.napoleon_client.is_configured", return_value=True)
+    def test_open_breaker_is_unhealthy(self, _napoleon, _gemstone, _mirror):
+        with patch.object(napoleon_client, "health", return_value=self._health("open")):
+            resp = self.client.get(reverse("device_control_health"))
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(resp.json()["ok"])
+        self.assertTrue(resp.json()["fireplace"]["stale"])
+
 
 class FireplaceTabTests(TestCase):
     """The fireplace tab must render its dedicated panel structure."""
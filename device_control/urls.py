@@ -5,8 +5,10 @@ urlpatterns = [
     path('', views.device_control_view, name='device_control'),
     path('api/states/', views.device_control_states, name='device_control_states'),
     path('api/action/', views.device_control_action, name='device_control_action'),
+    path('api/bulk-action/', views.device_control_bulk_action, name='device_control_bulk_action'),
     path('api/fireplace/states/', views.device_control_fireplace_states, name='device_control_fireplace_states'),
     path('api/fireplace/action/', views.device_control_fireplace_action, name='device_control_fireplace_action'),
     path('api/gemstone/states/', views.device_control_gemstone_states, name='device_control_gemstone_states'),
     path('api/gemstone/action/', views.device_control_gemstone_action, name='device_control_gemstone_action'),
+    path('api/health/', views.device_control_health, name='device_control_health'),
 ]
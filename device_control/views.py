@@ -5,44 +5,60 @@ Provides:
   - device_control_view: renders the main page shell with tabs
   - device_control_states: AJAX endpoint returning current entity states as JSON
   - device_control_action: AJAX endpoint to toggle/control a device
+  - device_control_bulk_action: AJAX endpoint to control many devices at once
+  - device_control_health: JSON health of Home Assistant and the cloud backends
 """
 
+import hashlib
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.decorators.http import require_POST
 
-from .device_config import TABS, get_all_entity_ids, FIREPLACE_OVERRIDES, GEMSTONE_OVERRIDES
-from .ha_client import call_service, get_entity_states
+from .device_config import DEVICE_INDEX, TABS
+from .ha_client import call_service, get_client, get_entity_states
+from .producer import (
+    apply_fireplace_overrides,
+    apply_gemstone_overrides,
+    entity_entries,
+    fireplace_payload,
+    gemstone_payload,
+    running_producer,
+)
+from . import ha_mirror
 from . import napoleon_client
 from . import gemstone_client
 
 logger = logging.getLogger(__name__)
 
-# Maps device type to the HA domain / service names
+# Maps device type to the HA service names; the domain comes from
+# device_config.TYPE_DOMAINS (via the device index)
 SERVICE_MAP = {
     "switch": {
-        "on": ("switch", "turn_on"),
-        "off": ("switch", "turn_off"),
-        "toggle": ("switch", "toggle"),
+        "on": "turn_on",
+        "off": "turn_off",
+        "toggle": "toggle",
     },
     "light": {
-        "on": ("light", "turn_on"),
-        "off": ("light", "turn_off"),
-        "toggle": ("light", "toggle"),
+        "on": "turn_on",
+        "off": "turn_off",
+        "toggle": "toggle",
     },
     "cover": {
-        "open": ("cover", "open_cover"),
-        "close": ("cover", "close_cover"),
-        "stop": ("cover", "stop_cover"),
-        "set_position": ("cover", "set_cover_position"),
+        "open": "open_cover",
+        "close": "close_cover",
+        "stop": "stop_cover",
+        "set_position": "set_cover_position",
     },
     "media_player": {
-        "on": ("media_player", "turn_on"),
-        "off": ("media_player", "turn_off"),
-        "toggle": ("media_player", "toggle"),
+        "on": "turn_on",
+        "off": "turn_off",
+        "toggle": "toggle",
     },
 }
 
@@ -56,80 +72,115 @@ def device_control_states(request):
     """
     AJAX endpoint: fetch current states for all configured entities.
 
+    Optional query params limit the result to one slice of the page:
+      - tab: a tab key, e.g. "lights"
+      - room: a room (or floor group) within that tab, e.g. "Kitchen"
+
+    The response carries an ETag of its content, so a poll with a matching
+    If-None-Match gets an empty 304 while nothing in the slice changed.
+
     Returns JSON: { entity_id: { state, friendly_name, current_position? } }
     """
-    all_ids = get_all_entity_ids()
-    raw_states = get_entity_states(all_ids)
-
-    result = {}
-    for eid, data in raw_states.items():
-        attrs = data.get("attributes", {})
-        entry = {
-            "state": data.get("state", "unknown"),
-            "friendly_name": attrs.get("friendly_name", eid),
-        }
-        # Include position for covers
-        pos = attrs.get("current_position")
-        if pos is not None:
-            entry["current_position"] = pos
-        # Include brightness info for lights
-        brightness = attrs.get("brightness")
-        if brightness is not None:
-            entry["brightness"] = brightness  # 0-255
-        color_modes = attrs.get("supported_color_modes")
-        if color_modes:
-            entry["supported_color_modes"] = color_modes
-        result[eid] = entry
+    tab = request.GET.get("tab")
+    room = request.GET.get("room")
+    if tab is None:
+        if room is not None:
+            return JsonResponse({"error": "room needs a tab"}, status=400)
+        entity_ids = DEVICE_INDEX.entity_ids
+    elif not DEVICE_INDEX.has_tab(tab):
+        return JsonResponse({"error": f"Unknown tab: {tab}"}, status=404)
+    elif room is None:
+        entity_ids = DEVICE_INDEX.tab_entity_ids(tab)
+    else:
+        entity_ids = DEVICE_INDEX.room_entity_ids(tab, room)
+        if not entity_ids:
+            return JsonResponse({"error": f"Unknown room: {room}"}, status=404)
 
-    return JsonResponse(result)
+    # Answer from the WebSocket mirror; the REST call covers cold starts
+    raw_states = ha_mirror.get_states(entity_ids)
+    if raw_states is None:
+        raw_states = get_entity_states(entity_ids)
 
+    body = json.dumps(entity_entries(raw_states), sort_keys=True)
+    etag = quote_etag(hashlib.blake2b(body.encode(), digest_size=12).hexdigest())
+    response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    # Let the browser keep the slice, but always revalidate it
+    response["Cache-Control"] = "no-cache"
+    return get_conditional_response(request, etag=etag, response=response)
 
-@require_POST
-def device_control_action(request):
-    """
-    AJAX endpoint: perform an action on a device.
 
-    Expects JSON body: { entity_id, action, type }
-      - entity_id: e.g. "switch.living_room_tv_socket_1"
-      - action: e.g. "on", "off", "toggle", "open", "close", "stop"
-      - type: e.g. "switch", "light", "cover", "media_player"
-    """
-    try:
-        body = json.loads(request.body)
-    except (json.JSONDecodeError, ValueError):
-        return JsonResponse({"error": "Invalid JSON"}, status=400)
+class _ActionError(ValueError):
+    """An action item that can't be turned into a service call."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
 
-    entity_id = body.get("entity_id", "")
-    action = body.get("action", "")
-    device_type = body.get("type", "")
+
+def _service_call(item):
+    """Map one { entity_id, action, type, ... } item to (domain, service, extra_data)."""
+    entity_id = item.get("entity_id", "")
+    action = item.get("action", "")
 
     # Validate entity is in our config
-    allowed = get_all_entity_ids()
-    if entity_id not in allowed:
-        return JsonResponse({"error": "Entity not allowed"}, status=403)
+    device = DEVICE_INDEX.get(entity_id)
+    if device is None:
+        raise _ActionError("Entity not allowed", status=403)
 
-    # Look up the service call
+    # The page must send the type, and it must agree with the config
+    device_type = item.get("type", "")
     type_map = SERVICE_MAP.get(device_type)
     if not type_map:
-        return JsonResponse({"error": f"Unknown device type: {device_type}"}, status=400)
+        raise _ActionError(f"Unknown device type: {device_type}")
+    if device_type != device.type:
+        raise _ActionError(f"{entity_id} is a {device.type}, not a {device_type}")
 
-    service_info = type_map.get(action)
-    if not service_info:
-        return JsonResponse({"error": f"Unknown action: {action}"}, status=400)
+    # Look up the service call
+    service = type_map.get(action)
+    if not service:
+        raise _ActionError(f"Unknown action: {action}")
 
-    domain, service = service_info
+    domain = device.domain
 
     # Pass brightness for light dimming
     extra_data = None
     if device_type == "light" and action == "on":
-        brightness = body.get("brightness")
+        brightness = item.get("brightness")
         if brightness is not None:
             extra_data = {"brightness": int(brightness)}
     elif device_type == "cover" and action == "set_position":
-        position = body.get("position")
+        position = item.get("position")
         if position is not None:
             extra_data = {"position": int(position)}
 
+    return domain, service, extra_data
+
+
+@require_POST
+def device_control_action(request):
+    """
+    AJAX endpoint: perform an action on a device.
+
+    Expects JSON body: { entity_id, action, type }
+      - entity_id: e.g. "switch.living_room_tv_socket_1"
+      - action: e.g. "on", "off", "toggle", "open", "close", "stop"
+      - type: e.g. "switch", "light", "cover", "media_player" (must match
+        the device config)
+    """
+    try:
+        body = json.loads(request.body)
+    except (json.JSONDecodeError, ValueError):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    entity_id = body.get("entity_id", "")
+    action = body.get("action", "")
+
+    try:
+        domain, service, extra_data = _service_call(body)
+    except _ActionError as exc:
+        return JsonResponse({"error": str(exc)}, status=exc.status)
+
     success, error = call_service(domain, service, entity_id, extra_data=extra_data)
 
     if success:
@@ -138,6 +189,75 @@ def device_control_action(request):
         return JsonResponse({"ok": False, "error": error}, status=502)
 
 
+# Upper bound on the number of items in one bulk request.
+MAX_BULK_ACTIONS = 200
+
+# Service calls sent to Home Assistant at once by a bulk request.
+BULK_WORKERS = 4
+
+
+@require_POST
+def device_control_bulk_action(request):
+    """
+    AJAX endpoint: perform many device actions at once.
+
+    Expects JSON body: { actions: [ { entity_id, action, type, ... }, ... ] }
+    with the same items device_control_action takes. Items that map to the
+    same service call (domain, service and extra data) are sent to Home
+    Assistant as one call with a list of entity_ids, so "all lights off"
+    is a single request rather than one per light.
+
+    Returns JSON: { ok, results: [ { entity_id, action, ok, error? }, ... ] }
+    with one result per item, in order. 502 if every service call failed.
+    """
+    try:
+        body = json.loads(request.body)
+    except (json.JSONDecodeError, ValueError):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    items = body.get("actions") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({"error": "Missing actions"}, status=400)
+    if len(items) > MAX_BULK_ACTIONS:
+        return JsonResponse({"error": f"At most {MAX_BULK_ACTIONS} actions per request"}, status=400)
+
+    results = []
+    # (domain, service, extra_data as JSON) -> indexes of the items it covers
+    groups = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"entity_id": None, "action": None, "ok": False, "error": "Invalid action"})
+            continue
+        results.append({"entity_id": item.get("entity_id", ""), "action": item.get("action", "")})
+        try:
+            domain, service, extra_data = _service_call(item)
+        except (_ActionError, TypeError, ValueError) as exc:
+            results[index].update(ok=False, error=str(exc))
+            continue
+        key = (domain, service, json.dumps(extra_data, sort_keys=True))
+        groups.setdefault(key, []).append(index)
+
+    def send(key):
+        domain, service, extra_json = key
+        # HA accepts a list of entity_ids; repeats of one entity are sent once
+        entity_ids = list(dict.fromkeys(results[i]["entity_id"] for i in groups[key]))
+        return call_service(domain, service, entity_ids, extra_data=json.loads(extra_json))
+
+    outcomes = {}
+    if groups:
+        with ThreadPoolExecutor(max_workers=min(len(groups), BULK_WORKERS)) as pool:
+            outcomes = dict(zip(groups, pool.map(send, groups)))
+        for key, (success, error) in outcomes.items():
+            for index in groups[key]:
+                results[index]["ok"] = success
+                if not success:
+                    results[index]["error"] = error
+
+    ok = all(r["ok"] for r in results)
+    all_failed = bool(outcomes) and not any(success for success, _ in outcomes.values())
+    return JsonResponse({"ok": ok, "results": results}, status=502 if all_failed else 200)
+
+
 # ──────────────────────────────────────────────
 # Fireplace (Napoleon cloud) endpoints
 # ──────────────────────────────────────────────
@@ -177,41 +297,25 @@ def _is_rgb(v):
     )
 
 
-def _apply_overrides(state):
-    """Apply optional name/room overrides from device_config to a state dict."""
-    override = FIREPLACE_OVERRIDES.get(state.get("dsn"))
-    if override:
-        if override.get("name"):
-            state["name"] = override["name"]
-        if override.get("room"):
-            state["room"] = override["room"]
-    return state
-
-
 def device_control_fireplace_states(request):
     """AJAX endpoint: current state of every discovered fireplace.
 
     Returns JSON: { "configured": bool, "fireplaces": [ {...}, ... ] }
     """
-    if not napoleon_client.is_configured():
-        return JsonResponse({"configured": False, "fireplaces": []})
-
     try:
-        states = napoleon_client.get_states()
+        return JsonResponse(fireplace_payload())
     except napoleon_client.FireplaceError as exc:
         logger.warning("Fireplace states fetch failed: %s", exc)
         return JsonResponse({"configured": True, "error": str(exc)}, status=502)
 
-    states = [_apply_overrides(s) for s in states]
-    return JsonResponse({"configured": True, "fireplaces": states})
-
 
 @require_POST
 def device_control_fireplace_action(request):
     """AJAX endpoint: apply a control action to a fireplace.
 
     Expects JSON body: { dsn, action, value }
-    Returns the refreshed fireplace state on success.
+    Returns the fireplace's expected state on success; if the fireplace ends up
+    otherwise, the correction is pushed over the WebSocket.
     """
     try:
         body = json.loads(request.body)
@@ -238,11 +342,18 @@ def device_control_fireplace_action(request):
 
     try:
         state = napoleon_client.apply_action(dsn, action, value)
+    except napoleon_client.UnknownFireplaceError as exc:
+        return JsonResponse({"ok": False, "error": str(exc)}, status=404)
     except napoleon_client.FireplaceError as exc:
         logger.warning("Fireplace action %s failed: %s", action, exc)
         return JsonResponse({"ok": False, "error": str(exc)}, status=502)
 
-    return JsonResponse({"ok": True, "fireplace": _apply_overrides(state)})
+    state = apply_fireplace_overrides(state)
+    # Push the new state to other open tablets
+    producer = running_producer()
+    if producer is not None:
+        producer.update_fireplace(state)
+    return JsonResponse({"ok": True, "fireplace": state})
 
 
 # ──────────────────────────────────────────────
@@ -259,40 +370,17 @@ _GEMSTONE_ACTION_VALIDATORS = {
 }
 
 
-def _apply_gemstone_overrides(state):
-    """Apply optional name/room overrides from device_config to a state dict."""
-    override = GEMSTONE_OVERRIDES.get(state.get("id"))
-    if override:
-        if override.get("name"):
-            state["name"] = override["name"]
-        if override.get("room"):
-            state["room"] = override["room"]
-    return state
-
-
 def device_control_gemstone_states(request):
     """AJAX endpoint: current state of every Gemstone device + saved patterns.
 
     Returns JSON: { "configured": bool, "devices": [...], "patterns": [...] }
     """
-    if not gemstone_client.is_configured():
-        return JsonResponse({"configured": False, "devices": [], "patterns": []})
-
     try:
-        data = gemstone_client.get_states()
+        return JsonResponse(gemstone_payload())
     except gemstone_client.GemstoneError as exc:
         logger.warning("Gemstone states fetch failed: %s", exc)
         return JsonResponse({"configured": True, "error": str(exc)}, status=502)
 
-    devices = [_apply_gemstone_overrides(d) for d in data.get("devices", [])]
-    return JsonResponse(
-        {
-            "configured": True,
-            "devices": devices,
-            "patterns": data.get("patterns", []),
-        }
-    )
-
 
 @require_POST
 def device_control_gemstone_action(request):
@@ -326,8 +414,47 @@ def device_control_gemstone_action(request):
 
     try:
         state = gemstone_client.apply_action(device_id, action, value)
+    except gemstone_client.UnknownGemstoneError as exc:
+        return JsonResponse({"ok": False, "error": str(exc)}, status=404)
     except gemstone_client.GemstoneError as exc:
         logger.warning("Gemstone action %s failed: %s", action, exc)
         return JsonResponse({"ok": False, "error": str(exc)}, status=502)
 
-    return JsonResponse({"ok": True, "device": _apply_gemstone_overrides(state)})
+    state = apply_gemstone_overrides(state)
+    # Push the new state to other open tablets
+    producer = running_producer()
+    if producer is not None:
+        producer.update_gemstone(state)
+    return JsonResponse({"ok": True, "device": state})
+
+
+def device_control_health(request):
+    """Health endpoint: circuit breaker and snapshot state of every backend.
+
+    Returns JSON::
+
+        { "ok": bool,
+          "home_assistant": { "mirror": "ready" | "syncing" | "disabled", "metrics": {...} },
+          "fireplace": { "configured": bool, "breaker": {...}, "stale": bool, ... },
+          "gemstone": { ... } }
+
+    ``ok`` is false (and the status 503) while a configured cloud's breaker
+    is not closed.
+    """
+    mirror = ha_mirror.get_mirror()
+    body = {
+        "home_assistant": {
+            "mirror": "disabled" if mirror is None else ("ready" if mirror.ready else "syncing"),
+            "metrics": get_client().metrics(),
+        },
+    }
+    ok = True
+    for kind, client in (("fireplace", napoleon_client), ("gemstone", gemstone_client)):
+        if not client.is_configured():
+            body[kind] = {"configured": False}
+            continue
+        health = client.health()
+        body[kind] = {"configured": True, **health}
+        ok = ok and health["breaker"]["state"] == "closed"
+    body["ok"] = ok
+    return JsonResponse(body, status=200 if ok else 503)
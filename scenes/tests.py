@@ -1,6 +1,7 @@
 from django.test import TestCase, Client
 from django.conf import settings
 from unittest.mock import patch, MagicMock
+from device_control.ha_client import TIMEOUT
 from .views import get_scenes, activate_scene, homeassistant_icon_mapping
 
 class SceneControlTests(TestCase):
@@ -17,7 +18,7 @@ class SceneControlTests(TestCase):
             },
         ]
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_get_scenes_success(self, mock_get):
         """Test fetching scenes from Home Assistant API"""
         mock_get.return_value = MagicMock(status_code=200, json=lambda: self.mock_scenes_response)
@@ -29,7 +30,7 @@ class SceneControlTests(TestCase):
         self.assertEqual(scenes[0]["name"], "Movie Night")
         self.assertEqual(scenes[0]["icon"], "fa-solid fa-film")  # Mapped correctly
         
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_get_scenes_with_filter(self, mock_get):
         """Test filtering scenes based on SCENE_FILTER"""
         mock_get.return_value = MagicMock(status_code=200, json=lambda: self.mock_scenes_response)
@@ -40,7 +41,7 @@ class SceneControlTests(TestCase):
         self.assertEqual(len(scenes), 1)
         self.assertEqual(scenes[0]["name"], "Dinner Time")
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_activate_scene(self, mock_post):
         """Test activating a scene by sending request to Home Assistant"""
         mock_post.return_value = MagicMock(status_code=200)
@@ -55,6 +56,7 @@ class SceneControlTests(TestCase):
                 "Content-Type": "application/json",
             },
             json={"entity_id": scene_id},
+            timeout=TIMEOUT,
         )
 
     def test_homeassistant_icon_mapping(self):
@@ -1,22 +1,12 @@
 from django.shortcuts import render, redirect
 from django.conf import settings
-import requests
-from urllib.parse import urljoin
 
-# Home Assistant Configuration
-HEADERS = {
-    "Authorization": f"Bearer {settings.HOMEASSISTANT_ACCESS_TOKEN}",
-    "Content-Type": "application/json",
-}
+from device_control.ha_client import get_client
 
 def get_scenes():
     """Fetch the list of scenes from Home Assistant."""
     
-    base_url = settings.HOMEASSISTANT_URL
-    api_endpoint = "/api/states"
-    url = urljoin(base_url, api_endpoint)
-
-    response = requests.get(url, headers=HEADERS)
+    response = get_client().get("/api/states")
     scenes = []
     if response.status_code == 200:
         entities = response.json()
@@ -37,9 +27,8 @@ def get_scenes():
 
 def activate_scene(scene_id):
     """Activate a scene using Home Assistant API."""
-    url = f"{settings.HOMEASSISTANT_URL}/api/services/scene/turn_on"
     data = {"entity_id": scene_id}
-    requests.post(url, headers=HEADERS, json=data)
+    get_client().post("/api/services/scene/turn_on", json=data)
 
 def scenes(request):
     """View to display and activate scenes."""
@@ -0,0 +1,243 @@
+"""
+Album art proxy with resizing and an on-disk cache.
+
+Album art URLs point straight at the speakers (``http://<ip>:1400/getaa?...``)
+or at Spotify's CDN, so every wall tablet fetched full-size art from the
+speakers again and again. Instead, payloads now carry
+``/sonos_control/art/<digest>/?src=<url>&size=thumb|full`` URLs (see
+:func:`art_url`), and the server:
+
+* fetches each source image **once** (concurrent requests for the same image
+  share one fetch),
+* stores a ``thumb`` and a ``full`` rendition in a content-addressed disk
+  cache (files are named after the SHA-256 of their bytes, so identical art
+  from different URLs is stored once),
+* evicts the least recently served files once the cache grows past
+  ``ALBUM_ART_CACHE_MAX_BYTES``, and
+* serves them with the content digest as a strong ETag and a long
+  ``Cache-Control``.
+
+``<digest>`` is an HMAC of the source URL keyed on ``SECRET_KEY``, so the
+endpoint only fetches URLs this server handed out -- it is not an open proxy.
+
+Public API:
+    * :func:`art_url(source_url, size)` -> proxy URL (or the input if not http)
+    * :func:`verify_digest(digest, source_url)` -> bool
+    * :func:`get_art_cache` -> :class:`AlbumArtCache` (``get(source_url, size)``)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Longest edge of each rendition, in pixels.
+ART_SIZES = {'thumb': 160, 'full': 640}
+
+# How long browsers may keep a rendition; the URL changes with the source.
+ART_MAX_AGE = 30 * 24 * 3600  # seconds
+
+# Upstream fetch timeout (speakers can be slow to render art).
+FETCH_TIMEOUT = 5  # seconds
+
+# Refuse to decode anything bigger than this from upstream.
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+_HMAC_SALT = 'sonos_control.album_art'
+
+
+class AlbumArtError(Exception):
+    """The source image could not be fetched or decoded."""
+
+
+def source_digest(source_url: str) -> str:
+    return salted_hmac(_HMAC_SALT, source_url).hexdigest()[:32]
+
+
+def verify_digest(digest: str, source_url: str) -> bool:
+    """True if ``digest`` was issued by :func:`art_url` for ``source_url``."""
+    return constant_time_compare(digest, source_digest(source_url))
+
+
+def art_url(source_url: str | None, size: str = 'thumb') -> str | None:
+    """Proxy URL for ``source_url``; anything that isn't http(s) is returned as-is."""
+    if not source_url or not source_url.startswith(('http://', 'https://')):
+        return source_url
+    path = reverse('album_art', args=[source_digest(source_url)])
+    return f"{path}?{urlencode({'src': source_url, 'size': size})}"
+
+
+def _fetch(source_url: str) -> bytes:
+    response = requests.get(source_url, timeout=FETCH_TIMEOUT, stream=True)
+    response.raise_for_status()
+    body = response.raw.read(MAX_SOURCE_BYTES + 1, decode_content=True)
+    if len(body) > MAX_SOURCE_BYTES:
+        raise AlbumArtError(f'{source_url} is larger than {MAX_SOURCE_BYTES} bytes')
+    return body
+
+
+def _render(source: bytes, edge: int) -> bytes:
+    """Downscale (never upscale) to ``edge`` pixels and encode as JPEG."""
+    with Image.open(io.BytesIO(source)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=85, optimize=True)
+        return out.getvalue()
+
+
+class AlbumArtCache:
+    """Content-addressed, LRU-evicted disk cache of resized album art.
+
+    Layout: ``blobs/<sha256>.jpg`` holds image bytes; ``index/<digest>``
+    maps a source URL digest to the blob of each rendition.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        fetch: Callable[[str], bytes] = _fetch,
+    ) -> None:
+        self._blobs = Path(directory) / 'blobs'
+        self._index = Path(directory) / 'index'
+        self._blobs.mkdir(parents=True, exist_ok=True)
+        self._index.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._inflight: dict[str, threading.Lock] = {}
+
+    def get(self, source_url: str, size: str) -> tuple[Path, str]:
+        """Return ``(path, etag)`` for a rendition, fetching it if needed (blocking)."""
+        if size not in ART_SIZES:
+            raise ValueError(f'Unknown album art size {size!r}')
+        key = source_digest(source_url)
+        hit = self._lookup(key, size)
+        if hit is not None:
+            return hit
+
+        # Single flight: one fetch per source, however many tablets ask
+        with self._lock:
+            fetch_lock = self._inflight.setdefault(key, threading.Lock())
+        with fetch_lock:
+            try:
+                hit = self._lookup(key, size)
+                if hit is None:
+                    self._store(key, source_url)
+                    hit = self._lookup(key, size)
+            finally:
+                # A later caller may already have installed a fresh lock
+                with self._lock:
+                    if self._inflight.get(key) is fetch_lock:
+                        del self._inflight[key]
+        if hit is None:  # evicted straight away by a tiny cache limit
+            raise AlbumArtError(f'Could not cache {source_url}')
+        return hit
+
+    def _lookup(self, key: str, size: str) -> tuple[Path, str] | None:
+        try:
+            blob = json.loads((self._index / key).read_text())[size]
+        except (OSError, ValueError, KeyError):
+            return None
+        path = self._blobs / f'{blob}.jpg'
+        try:
+            os.utime(path)  # mark as recently used for LRU eviction
+        except OSError:
+            return None
+        return path, blob
+
+    def _store(self, key: str, source_url: str) -> None:
+        try:
+            source = self._fetch(source_url)
+            renditions = {size: _render(source, edge) for size, edge in ART_SIZES.items()}
+        except AlbumArtError:
+            raise
+        except Exception as exc:  # noqa: BLE001 - any fetch/decode failure
+            raise AlbumArtError(f'Failed to load {source_url}: {exc}') from exc
+
+        index = {}
+        for size, data in renditions.items():
+            blob = hashlib.sha256(data).hexdigest()
+            path = self._blobs / f'{blob}.jpg'
+            if not path.exists():
+                self._write_atomic(path, data)
+            index[size] = blob
+        self._write_atomic(self._index / key, json.dumps(index).encode())
+        self._evict()
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _evict(self) -> None:
+        """Delete least recently served blobs until under the size limit."""
+        entries = []
+        total = 0
+        for path in self._blobs.glob('*.jpg'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self._max_bytes:
+            return
+        # Trim to 90% so we don't evict again on the very next miss
+        target = self._max_bytes * 0.9
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+        # Index entries pointing at evicted blobs simply miss and refetch
+
+
+_cache: AlbumArtCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_art_cache() -> AlbumArtCache:
+    """Return the process-wide album art cache (settings-configurable)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                directory = getattr(
+                    settings, 'ALBUM_ART_CACHE_DIR',
+                    os.path.join(settings.MEDIA_ROOT, 'album_art_cache'),
+                )
+                max_bytes = getattr(settings, 'ALBUM_ART_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+                _cache = AlbumArtCache(directory, max_bytes)
+    return _cache
@@ -0,0 +1,296 @@
+"""
+Run a list of Sonos operations in one request.
+
+A scene such as "party mode" used to POST ``toggle_group`` once per target,
+then ``adjust-volume`` once per speaker, then ``play-uri``, each waiting for
+the previous one. :func:`run_batch` takes the whole ordered list at once::
+
+    [{"op": "join", "speaker": "RINCON_B", "coordinator": "RINCON_A"},
+     {"op": "volume", "speaker": "RINCON_B", "volume": 30},
+     {"op": "play_uri", "speaker": "RINCON_A", "uri": "spotify:playlist:..."}]
+
+and returns one result per operation, in the same order.
+
+Operations only wait for earlier ones they actually depend on. Each
+operation reads or writes a few per-speaker resources (``group``,
+``volume``, ``playback``); an operation waits for the last earlier writer of
+anything it touches, and a write also waits for earlier readers. So joining
+eight speakers to one coordinator, setting eight volumes and starting
+playback all go out at once, while e.g. ``unjoin`` followed by ``play_uri``
+on the same speaker still happens in that order. Playback operations are
+sent to the group coordinator the speaker will have at that point in the
+list.
+
+An operation that reads what a failed operation wrote (e.g. ``play_uri`` on
+a speaker whose ``join`` failed, which would go to the wrong coordinator) is
+not run and reports the failure instead. Operations that only wait for an
+earlier one to keep the order still run.
+
+Ready operations run on the shared :class:`~.commands.KeyedCommandExecutor`
+keyed by the speaker they talk to, so they are also ordered with WebSocket
+commands for that speaker.
+
+Public API:
+    * :data:`OPERATIONS` -> supported ``op`` names
+    * :func:`plan_batch(registry, operations)` -> list of steps
+    * :func:`run_batch(operations, ...)` -> list of result dicts (awaitable)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from asgiref.sync import sync_to_async
+from soco.plugins.sharelink import ShareLinkPlugin
+
+from .commands import KeyedCommandExecutor, get_executor
+from .registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ('join', 'unjoin', 'volume', 'play_uri', 'clear_queue')
+
+# Upper bound on the number of operations in one batch.
+MAX_OPERATIONS = 100
+
+# How long a whole batch may take before unfinished operations are reported
+# as timed out (and those not yet started are dropped).
+BATCH_TIMEOUT = 30  # seconds
+
+
+class BatchError(ValueError):
+    """An operation is malformed or refers to an unknown speaker."""
+
+
+@dataclass
+class _Step:
+    index: int
+    op: dict[str, Any]
+    key: str = ''
+    run: Callable[[], dict[str, Any]] | None = None
+    error: str | None = None
+    depends_on: set[int] = field(default_factory=set)
+    # The subset of depends_on whose writes this step reads: skip it if they fail
+    needs: set[int] = field(default_factory=set)
+
+
+def _coordinator_uid(speaker: Any) -> str:
+    group = getattr(speaker, 'group', None)
+    coordinator = getattr(group, 'coordinator', None)
+    return coordinator.uid if coordinator is not None else speaker.uid
+
+
+def _play_uri(speaker: Any, uri: str) -> dict[str, Any]:
+    speaker.stop()
+    insert_index = ShareLinkPlugin(speaker).add_share_link_to_queue(uri=uri, position=1)
+    speaker.play_from_queue(index=insert_index - 1)
+    return {'message': f'Playing {uri} on {speaker.player_name}'}
+
+
+def _join(speaker: Any, coordinator: Any) -> dict[str, Any]:
+    speaker.join(coordinator)
+    return {'message': f'{speaker.player_name} joined {coordinator.player_name}'}
+
+
+def _unjoin(speaker: Any) -> dict[str, Any]:
+    speaker.unjoin()
+    return {'message': f'{speaker.player_name} left its group'}
+
+
+def _set_volume(speaker: Any, volume: int) -> dict[str, Any]:
+    speaker.volume = volume
+    return {'volume': volume}
+
+
+def _clear_queue(speaker: Any) -> dict[str, Any]:
+    speaker.clear_queue()
+    return {'message': 'Queue cleared'}
+
+
+class _Planner:
+    """Resolves speakers and dependencies while walking the list in order."""
+
+    def __init__(self, registry: Any) -> None:
+        self._registry = registry
+        # uid -> coordinator uid, updated as joins/unjoins are planned
+        self._coordinator = {s.uid: _coordinator_uid(s) for s in registry.speakers()}
+        self._last_writer: dict[tuple[str, str], int] = {}
+        self._readers: dict[tuple[str, str], list[int]] = defaultdict(list)
+
+    def speaker(self, op: dict[str, Any], field_name: str = 'speaker') -> Any:
+        uid = op.get(field_name)
+        speaker = self._registry.get(uid)
+        if speaker is None:
+            raise BatchError(f'Speaker {uid} not found')
+        return speaker
+
+    def coordinator_of(self, speaker: Any) -> Any:
+        return self._registry.get(self._coordinator.get(speaker.uid, speaker.uid)) or speaker
+
+    def plan(self, step: _Step) -> None:
+        op = step.op
+        action = op.get('op')
+        speaker = self.speaker(op)
+        reads: list[tuple[str, str]] = []
+        writes: list[tuple[str, str]] = []
+
+        if action == 'join':
+            target = self.coordinator_of(self.speaker(op, 'coordinator'))
+            if target is speaker:
+                raise BatchError('A speaker cannot join itself')
+            reads.append((op['coordinator'], 'group'))
+            writes.append((speaker.uid, 'group'))
+            step.key, step.run = speaker.uid, lambda: _join(speaker, target)
+            self._coordinator[speaker.uid] = target.uid
+        elif action == 'unjoin':
+            writes.append((speaker.uid, 'group'))
+            step.key, step.run = speaker.uid, lambda: _unjoin(speaker)
+            self._coordinator[speaker.uid] = speaker.uid
+        elif action == 'volume':
+            try:
+                volume = max(0, min(100, int(op.get('volume'))))
+            except (TypeError, ValueError):
+                raise BatchError('Volume must be a number') from None
+            writes.append((speaker.uid, 'volume'))
+            step.key, step.run = speaker.uid, lambda: _set_volume(speaker, volume)
+        elif action in ('play_uri', 'clear_queue'):
+            coordinator = self.coordinator_of(speaker)
+            reads.append((speaker.uid, 'group'))
+            writes.append((coordinator.uid, 'playback'))
+            if action == 'play_uri':
+                uri = op.get('uri')
+                if not uri:
+                    raise BatchError('play_uri needs a uri')
+                step.run = lambda: _play_uri(coordinator, uri)
+            else:
+                step.run = lambda: _clear_queue(coordinator)
+            step.key = coordinator.uid
+        else:
+            raise BatchError(f'Unknown operation {action!r}')
+
+        for resource in reads:
+            if resource in self._last_writer:
+                step.depends_on.add(self._last_writer[resource])
+                step.needs.add(self._last_writer[resource])
+            self._readers[resource].append(step.index)
+        for resource in writes:
+            if resource in self._last_writer:
+                step.depends_on.add(self._last_writer[resource])
+            step.depends_on.update(self._readers.pop(resource, []))
+            self._last_writer[resource] = step.index
+        step.depends_on.discard(step.index)
+        step.needs.discard(step.index)
+
+
+def plan_batch(registry: Any, operations: list[dict[str, Any]]) -> list[_Step]:
+    """Validate ``operations`` and work out which earlier ones each waits for.
+
+    May touch the network (``speaker.group``) if topology events are not
+    subscribed, so call it off the event loop.
+    """
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError(f'At most {MAX_OPERATIONS} operations per batch')
+    planner = _Planner(registry)
+    steps = []
+    for index, op in enumerate(operations):
+        step = _Step(index, op if isinstance(op, dict) else {})
+        try:
+            if not isinstance(op, dict):
+                raise BatchError('Each operation must be an object')
+            planner.plan(step)
+        except BatchError as exc:
+            step.error, step.run, step.depends_on, step.needs = str(exc), None, set(), set()
+        steps.append(step)
+    return steps
+
+
+def _start(steps: list[_Step], executor: KeyedCommandExecutor,
+           abandoned: threading.Event) -> list[Future]:
+    """Submit each step once the steps it depends on have finished."""
+    results = [Future() for _ in steps]
+    waiting = {step.index: len(step.depends_on) for step in steps}
+    dependents: dict[int, list[int]] = defaultdict(list)
+    for step in steps:
+        for dependency in step.depends_on:
+            dependents[dependency].append(step.index)
+    failed: dict[int, str] = {}  # index -> error message
+    lock = threading.Lock()
+
+    def finish(step: _Step, result: dict[str, Any]) -> None:
+        if result['status'] == 'error':
+            with lock:
+                failed[step.index] = result['message']
+        results[step.index].set_result(result)
+        for index in dependents[step.index]:
+            with lock:
+                waiting[index] -= 1
+                ready = waiting[index] == 0
+            if ready:
+                launch(steps[index])
+
+    def launch(step: _Step) -> None:
+        if step.error is not None:
+            finish(step, {'status': 'error', 'message': step.error})
+            return
+        with lock:
+            broken = sorted(index for index in step.needs if index in failed)
+        if broken:
+            index = broken[0]
+            message = f"Skipped: operation {index} ({steps[index].op.get('op')}) failed: {failed[index]}"
+            finish(step, {'status': 'error', 'message': message})
+            return
+        if abandoned.is_set():
+            finish(step, {'status': 'error', 'message': 'Batch timed out before this operation started'})
+            return
+        future = executor.submit(step.key, step.run)
+        future.add_done_callback(lambda f: finish(step, _outcome(step, f)))
+
+    for step in steps:
+        if not step.depends_on:
+            launch(step)
+    return results
+
+
+def _outcome(step: _Step, future: Future) -> dict[str, Any]:
+    if future.cancelled():
+        return {'status': 'error', 'message': 'Cancelled'}
+    exc = future.exception()
+    if exc is not None:
+        logger.warning("Sonos batch operation %s failed: %s", step.op.get('op'), exc)
+        return {'status': 'error', 'message': str(exc)}
+    return {'status': 'success', **future.result()}
+
+
+async def run_batch(
+    operations: list[dict[str, Any]],
+    registry: Any = None,
+    executor: KeyedCommandExecutor | None = None,
+    timeout: float | None = None,
+) -> list[dict[str, Any]]:
+    """Run ``operations`` and return one result dict per operation, in order."""
+    if registry is None:
+        registry = await sync_to_async(get_registry, thread_sensitive=False)()
+    steps = await sync_to_async(plan_batch, thread_sensitive=False)(registry, operations)
+    abandoned = threading.Event()
+    futures = _start(steps, executor or get_executor(), abandoned)
+
+    pending = [asyncio.wrap_future(f) for f in futures]
+    if pending:
+        await asyncio.wait(pending, timeout=BATCH_TIMEOUT if timeout is None else timeout)
+    abandoned.set()
+
+    results = []
+    for step, future in zip(steps, futures):
+        result = {'index': step.index, 'op': step.op.get('op'), 'speaker': step.op.get('speaker')}
+        if future.done():
+            result.update(future.result())
+        else:
+            result.update({'status': 'error', 'message': 'Speaker did not respond in time'})
+        results.append(result)
+    return results
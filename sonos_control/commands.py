@@ -0,0 +1,126 @@
+"""
+Off-loop execution of blocking Sonos commands.
+
+Every soco call is a synchronous SOAP request, and an unreachable speaker can
+hold one for many seconds. Running them inside ``SonosConsumer.receive``
+froze every WebSocket on the same Daphne worker, so commands now go through a
+:class:`KeyedCommandExecutor`:
+
+* a bounded thread pool (``COMMAND_WORKERS``) runs the blocking calls,
+* commands for the same key (speaker UID) run one at a time, in arrival
+  order, so e.g. "pause" can never overtake an earlier "play" on the same
+  speaker -- and a hung speaker ties up at most one worker,
+* jobs for different speakers run in parallel.
+
+:func:`run_command` awaits a job from async code with a timeout. A command
+that times out while still queued is cancelled and never sent; one that is
+already on the wire is left to finish (soco cannot abort a SOAP call).
+
+Public API:
+    * :func:`get_executor` -> the lazily created process-wide executor
+    * :meth:`KeyedCommandExecutor.submit(key, fn, *args)` -> concurrent Future
+    * :func:`run_command(key, fn, *args, timeout=...)` -> awaitable result
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on concurrent blocking soco calls per process.
+COMMAND_WORKERS = 8
+
+# How long a WebSocket client waits for a command before getting an error.
+COMMAND_TIMEOUT = 10  # seconds
+
+
+class KeyedCommandExecutor:
+    """Thread pool that serializes jobs sharing a key and parallelizes the rest."""
+
+    def __init__(self, max_workers: int = COMMAND_WORKERS) -> None:
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="sonos-cmd")
+        self._lock = threading.Lock()
+        # key -> jobs waiting behind the one currently running for that key.
+        # A key is present exactly while one of its jobs is running.
+        self._pending: dict[str, deque] = {}
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Queue ``fn(*args, **kwargs)`` behind earlier jobs for ``key``."""
+        future: Future = Future()
+        job = (future, fn, args, kwargs)
+        with self._lock:
+            queue = self._pending.get(key)
+            if queue is not None:
+                queue.append(job)
+                return future
+            self._pending[key] = deque()
+        self._pool.submit(self._run, key, job)
+        return future
+
+    def pending(self, key: str) -> int:
+        """Number of jobs queued (not yet running) for ``key``."""
+        with self._lock:
+            return len(self._pending.get(key, ()))
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, key: str, job: tuple) -> None:
+        future, fn, args, kwargs = job
+        # False if the caller already gave up on this job
+        if future.set_running_or_notify_cancel():
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as exc:  # noqa: BLE001 - delivered via the future
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+        with self._lock:
+            queue = self._pending[key]
+            if not queue:
+                del self._pending[key]
+                return
+            next_job = queue.popleft()
+        # Resubmit rather than loop so one busy speaker cannot starve others
+        self._pool.submit(self._run, key, next_job)
+
+
+async def run_command(
+    key: str,
+    fn: Callable[..., Any],
+    *args: Any,
+    timeout: float | None = None,
+    executor: KeyedCommandExecutor | None = None,
+) -> Any:
+    """Run a blocking command for ``key`` without blocking the event loop.
+
+    Raises ``asyncio.TimeoutError`` if it does not finish within ``timeout``
+    (default ``COMMAND_TIMEOUT``).
+    """
+    if timeout is None:
+        timeout = COMMAND_TIMEOUT
+    executor = executor or get_executor()
+    future = executor.submit(key, fn, *args)
+    # wrap_future propagates cancellation on timeout back to the queued job
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+
+_executor: KeyedCommandExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> KeyedCommandExecutor:
+    """Return the process-wide command executor."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = KeyedCommandExecutor()
+    return _executor
@@ -1,174 +1,124 @@
 # sonos_control/consumers.py
 
 import json
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .views import sonos_get_speaker_info, adjust_speaker_volume, speaker_play_pause, sonos_clear_queue
+from .views import speaker_play_pause, sonos_clear_queue
+from .producer import SPEAKER_GROUP, get_producer
+from .commands import run_command
+from .queue_cache import QUEUE_PAGE_SIZE
+from .volume import get_volume_coalescer
 import asyncio
 
 class SonosConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        self.command_tasks = set()
         await self.accept()
-        self.speaker_group_name = 'sonos_speakers'
+        self.speaker_group_name = SPEAKER_GROUP
 
-        # Add the WebSocket to the group
+        # Add the WebSocket to the group; the shared producer pushes
+        # 'speaker.update' messages to it whenever a speaker changes.
         await self.channel_layer.group_add(
             self.speaker_group_name,
             self.channel_name
         )
 
-        # Initialize the previous state to None
-        self.previous_speaker_data = None
+        # Starting the producer discovers speakers, so keep it off the loop
+        producer = await sync_to_async(get_producer, thread_sensitive=False)()
+        producer.bind_loop(asyncio.get_running_loop())
+        self.producer = producer
 
-        # Start the task to send updates periodically, only if not already running
-        if not hasattr(self, 'send_task') or self.send_task.done():
-            self.send_task = asyncio.create_task(self.send_speaker_updates())
+        # Send the full current state once; only changes follow
+        await self.send(text_data=json.dumps({
+            'type': 'speaker_update',
+            'snapshot': True,
+            'speaker_data': producer.snapshot(),
+            'removed': [],
+        }))
 
     async def disconnect(self, close_code):
+        # Drop commands this client is still waiting on
+        for task in list(self.command_tasks):
+            task.cancel()
+
         # Leave the group
         await self.channel_layer.group_discard(
             self.speaker_group_name,
             self.channel_name
         )
 
-        # Cancel the periodic task if it exists
-        if hasattr(self, 'send_task') and not self.send_task.done():
-            try:
-                self.send_task.cancel()
-            except asyncio.CancelledError:
-                pass
+    async def speaker_update(self, event):
+        """Forward changed speakers from the shared producer to this client."""
+        # Queue edits first, so the update's queue_version already matches
+        for speaker_uid, delta in event.get('queue_deltas', {}).items():
+            await self.send(text_data=json.dumps({
+                'type': 'queue_delta',
+                'speaker_uid': speaker_uid,
+                **delta,
+            }))
+        await self.send(text_data=json.dumps({
+            'type': 'speaker_update',
+            'speaker_data': event['speaker_data'],
+            'removed': event['removed'],
+        }))
 
     async def receive(self, text_data):
         # Parse the incoming WebSocket message (which is a JSON string)
         data = json.loads(text_data)
-        
-        # Extract the relevant fields from the data
-        action = data.get('action')
-        
-        if action == 'volume':
-            speaker_uid = data.get('speaker_uid')
-            volume = data.get('volume')            
-            # Call the shared function to adjust the volume
-            result = adjust_speaker_volume(speaker_uid, volume)
 
-            # Send the result back to the WebSocket client
-            await self.send(text_data=json.dumps({
-                'status': result['status'],
-                'message': result.get('message'),
-                'action': 'volume',
-                'type': 'response'
-            }))
-        elif action == 'play_track':
-            speaker_uid = data.get('speaker_uid')
-            track_index = data.get('track_index')            
-            # play the track on the speaker
-            result = speaker_play_pause(speaker_uid, "play_track", track_index)
+        # Run the command in its own task so a slow speaker never holds up
+        # this handler (or any other client's updates)
+        task = asyncio.create_task(self.handle_command(data))
+        self.command_tasks.add(task)
+        task.add_done_callback(self.command_tasks.discard)
 
-            # Send back a response to the client
-            await self.send(text_data=json.dumps({
-                'status': result['status'],
-                'message': result['message'],
-                'speaker_uid': speaker_uid,
-                'action': 'play_track',
-                'type': 'response'
-            }))
-        elif action == 'pause':
-            print("Pause action received")
-            speaker_uid = data.get('speaker_uid')
-            # pause the speaker
-            result = speaker_play_pause(speaker_uid, "pause")
+    async def handle_command(self, data):
+        action = data.get('action')
+        speaker_uid = data.get('speaker_uid')
+        response = {
+            'action': action,
+            'speaker_uid': speaker_uid,
+            'request_id': data.get('request_id'),
+            'type': 'response'
+        }
 
-            # Send back a response to the client
-            await self.send(text_data=json.dumps({
-                'status': result['status'],
-                'message': result['message'],
-                'speaker_uid': speaker_uid,
-                'action': 'pause',
-                'type': 'response'
-            }))
-        elif action == 'play':
-            print("Play action received")
-            speaker_uid = data.get('speaker_uid')
-            # Call your logic to play the speaker
-            result = speaker_play_pause(speaker_uid, "play")
-            
-            if result['status'] != 'success':
-                print(f"Error: {result['message']}")
-                # Send back a response to the client
-            
-            await self.send(text_data=json.dumps({
-                'status': result['status'],
-                'message': result['message'],
-                'speaker_uid': speaker_uid,
-                'action': 'play',
-                'type': 'response'
-            }))
+        if action == 'volume':
+            # Coalesced and rate limited; acknowledge the target straight away
+            # and let the RenderingControl event push the real volume. Creating
+            # the coalescer and reading the speaker's group may block, so keep
+            # both off the loop
+            coalescer = await sync_to_async(get_volume_coalescer, thread_sensitive=False)()
+            set_volume = coalescer.set_group_volume if data.get('group') else coalescer.set_volume
+            try:
+                volume = await sync_to_async(set_volume, thread_sensitive=False)(speaker_uid, data.get('volume'))
+                response.update({'status': 'success', 'volume': volume, 'optimistic': True})
+            except (TypeError, ValueError) as e:
+                response.update({'status': 'error', 'message': str(e)})
+            await self.send(text_data=json.dumps(response))
+            return
+        elif action == 'play_track':
+            command = (speaker_play_pause, speaker_uid, 'play_track', data.get('track_index'))
+        elif action in ('play', 'pause'):
+            command = (speaker_play_pause, speaker_uid, action)
         elif action == 'clear_queue':
-            print("Clear queue action received")
-            speaker_uid = data.get('speaker_uid')
-            # Call your logic to clear the queue
-            result = sonos_clear_queue(speaker_uid)
-
-            # Send back a response to the client
-            await self.send(text_data=json.dumps({
-                'status': result['status'],
-                'message': result['message'],
-                'speaker_uid': speaker_uid,
-                'action': 'clear_queue',
-                'type': 'response'
-            }))
+            command = (sonos_clear_queue, speaker_uid)
+        elif action == 'queue_page':
+            command = (self.producer.queue_page, speaker_uid,
+                       data.get('start', 0), data.get('count', QUEUE_PAGE_SIZE))
         else:
-            await self.send(text_data=json.dumps({
-                'status': 'error',
-                'message': 'Unknown action',
-                'type': 'response'
-            }))
-
-    async def send_speaker_updates(self):
-        while True:
-            # Fetch the latest speaker info
-            speakers_info = sonos_get_speaker_info()
-
-            # Prepare the new data to send
-            speaker_data = {}
-            for info in speakers_info:
-                if info['is_coordinator']:
-                    speaker_data[info['uid']] = {
-                        'group_label': info['group_label'],
-                        'track': info['track'],
-                        'artist': info['artist'],
-                        'album': info['album'],
-                        'volume': info['volume'],
-                        'play_state': info['play_state'],
-                        'album_art': info['album_art'],
-                        'queue': info['queue']
-                    }
-
-            # Check if the data has changed
-            if speaker_data != self.previous_speaker_data:
-                # Data has changed, send it to the WebSocket
-                
-                #print play_state for each speaker
-                for speaker in speaker_data:
-                    print(f"{speaker}: {speaker_data[speaker]['play_state']}")
-                
-                await self.send(text_data=json.dumps({
-                    'type': 'speaker_update',
-                    'speaker_data': speaker_data
-                }))
-                # Update the previous state
-                self.previous_speaker_data = speaker_data
-
-            # Wait for 1 seconds before checking again
-            await asyncio.sleep(1)
-            
-    async def adjust_speaker_volume(self, speaker_name, volume):
-        # This function should contain the logic to adjust the speaker's volume
-        # using your existing Sonos integration or other systems.
-        
-        # Placeholder logic: Just print for now
-        print(f"Adjusting {speaker_name}'s volume to {volume}")
-        
-        # Here you'd add the actual volume adjustment logic, for example:
-        # speaker = get_speaker_by_name(speaker_name)
-        # speaker.set_volume(volume)
-        # Adjust this according to your Sonos control logic            
+            response.update({'status': 'error', 'message': 'Unknown action'})
+            await self.send(text_data=json.dumps(response))
+            return
+
+        try:
+            # Commands for one speaker run in order; other speakers in parallel
+            result = await run_command(speaker_uid or '', *command)
+        except asyncio.TimeoutError:
+            result = {'status': 'error', 'message': f'Speaker {speaker_uid} did not respond in time'}
+        except Exception as e:
+            result = {'status': 'error', 'message': f'Command failed: {str(e)}'}
+
+        response.update({key: value for key, value in result.items() if key != 'status_code'})
+
+        # Send the result back to the WebSocket client
+        await self.send(text_data=json.dumps(response))
@@ -0,0 +1,194 @@
+"""
+In-memory stand-ins for a household of SoCo speakers, used by the Sonos
+benchmark commands. Every UPnP round trip sleeps for ``latency`` seconds so
+the benchmarks can model a real LAN without any speakers attached.
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+
+class StubSubscription:
+    def __init__(self, service):
+        self.service = service
+        self.callback = None
+        self.auto_renew_fail = None
+        self.is_subscribed = True
+        self.time_left = 600
+
+    def unsubscribe(self):
+        self.is_subscribed = False
+
+
+class StubService:
+    def __init__(self, speaker):
+        self.soco = speaker
+        self.subscriptions = []
+
+    def subscribe(self, requested_timeout=None, auto_renew=False):
+        sub = StubSubscription(self)
+        self.subscriptions.append(sub)
+        return sub
+
+    def fire(self, **variables):
+        """Deliver an event to every live subscription (like soco's event thread)."""
+        for sub in self.subscriptions:
+            if sub.is_subscribed and sub.callback:
+                sub.callback(SimpleNamespace(service=self, variables=variables))
+
+
+class StubQueue(list):
+    """A page of queue items with the metadata soco's ``Queue`` carries."""
+
+    def __init__(self, items, total_matches, update_id):
+        super().__init__(items)
+        self.number_returned = len(items)
+        self.total_matches = total_matches
+        self.update_id = update_id
+
+
+class StubGroup:
+    def __init__(self, coordinator, members):
+        self.coordinator = coordinator
+        self.members = set(members)
+        self.label = " + ".join(sorted(m.player_name for m in members))
+
+    def __contains__(self, speaker):
+        return speaker in self.members
+
+
+# Speakers regroup concurrently in the batch benchmark
+_topology_lock = threading.Lock()
+
+
+class StubSpeaker:
+    def __init__(self, uid, name, latency=0.0, queue_length=20):
+        self.uid = uid
+        self.player_name = name
+        self.latency = latency
+        self.group = None
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+        self._volume = 20
+        self.play_state = 'PLAYING'
+        self.track = 'Track 0'
+        self.queue_items = [make_queue_item(f'{name} song {i}') for i in range(queue_length)]
+        self.queue_update_id = 1
+        self.avTransport = StubService(self)
+        self.renderingControl = StubService(self)
+        self.queue = StubService(self)
+        self.zoneGroupTopology = StubService(self)
+
+    def _round_trip(self):
+        with self._calls_lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def is_coordinator(self):
+        return self.group.coordinator is self
+
+    @property
+    def volume(self):
+        self._round_trip()
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._round_trip()
+        self._volume = int(value)
+
+    def get_current_track_info(self):
+        self._round_trip()
+        return {
+            'title': self.track, 'artist': 'Artist', 'album': 'Album',
+            'album_art': f'http://{self.uid}:1400/getaa?s=1&u=now',
+        }
+
+    def get_current_transport_info(self):
+        self._round_trip()
+        return {'current_transport_state': self.play_state}
+
+    def get_queue(self, start=0, max_items=100, full_album_art_uri=False):
+        self._round_trip()
+        return StubQueue(
+            self.queue_items[start:start + max_items],
+            total_matches=len(self.queue_items),
+            update_id=self.queue_update_id,
+        )
+
+    def join(self, coordinator):
+        self._round_trip()
+        with _topology_lock:
+            self._leave_group()
+            group = coordinator.group
+            group.members.add(self)
+            group.label = " + ".join(sorted(m.player_name for m in group.members))
+            self.group = group
+
+    def unjoin(self):
+        self._round_trip()
+        with _topology_lock:
+            self._leave_group()
+            self.group = StubGroup(self, [self])
+
+    def _leave_group(self):
+        old = self.group
+        old.members.discard(self)
+        if old.members and old.coordinator is self:
+            old.coordinator = min(old.members, key=lambda m: m.player_name)
+        old.label = " + ".join(sorted(m.player_name for m in old.members))
+
+    def clear_queue(self):
+        self._round_trip()
+        self.edit_queue([])
+
+    def edit_queue(self, items):
+        """Replace the queue and send the Queue event a real speaker would."""
+        self.queue_items = list(items)
+        self.queue_update_id += 1
+        self.queue.fire(update_id=str(self.queue_update_id))
+
+
+def make_queue_item(title):
+    return SimpleNamespace(
+        title=title, creator='Artist',
+        album_art_uri=f'http://stub:1400/getaa?s=1&u={title}',
+        resources=[SimpleNamespace(uri=f'x-sonos-spotify:{title}')],
+    )
+
+
+class StubRegistry:
+    """Same lookup surface as :class:`sonos_control.registry.SpeakerRegistry`."""
+
+    def __init__(self, speakers):
+        self._by_uid = {s.uid: s for s in speakers}
+        self._listeners = []
+
+    def speakers(self):
+        return sorted(self._by_uid.values(), key=lambda s: s.player_name)
+
+    def get(self, uid):
+        return self._by_uid.get(uid)
+
+    def __len__(self):
+        return len(self._by_uid)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+
+def build_fleet(n_speakers, group_size=3, latency=0.0):
+    """Build ``n_speakers`` stub speakers, grouped ``group_size`` at a time."""
+    speakers = [
+        StubSpeaker(f'RINCON_{i:04d}', f'Room {i:02d}', latency=latency)
+        for i in range(n_speakers)
+    ]
+    for start in range(0, n_speakers, group_size):
+        members = speakers[start:start + group_size]
+        group = StubGroup(members[0], members)
+        for speaker in members:
+            speaker.group = group
+    return StubRegistry(speakers)
@@ -0,0 +1,74 @@
+"""
+Compare a "party mode" scene sent as one batch with the old request-per-step flow.
+
+The scene joins every speaker to the first one and sets every speaker's
+volume. Runs against a stub fleet where every UPnP call sleeps for
+``--latency`` seconds, and reports wall time for each approach.
+
+    python manage.py sonos_batch_benchmark --sizes 10 20 --latency 0.05
+"""
+
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from sonos_control.batch import run_batch
+from sonos_control.commands import KeyedCommandExecutor
+
+from ._stub_fleet import build_fleet
+
+
+def party_mode(registry, volume=35):
+    speakers = registry.speakers()
+    coordinator = speakers[0]
+    operations = [
+        {'op': 'join', 'speaker': s.uid, 'coordinator': coordinator.uid}
+        for s in speakers[1:]
+    ]
+    operations += [{'op': 'volume', 'speaker': s.uid, 'volume': volume} for s in speakers]
+    operations.append({'op': 'clear_queue', 'speaker': coordinator.uid})
+    return operations
+
+
+def sequential(registry, operations):
+    """The previous flow: one request, and so one blocking call, per step."""
+    for op in operations:
+        speaker = registry.get(op['speaker'])
+        if op['op'] == 'join':
+            speaker.join(registry.get(op['coordinator']))
+        elif op['op'] == 'volume':
+            speaker.volume = op['volume']
+        elif op['op'] == 'clear_queue':
+            speaker.clear_queue()
+
+
+class Command(BaseCommand):
+    help = "Benchmark batched Sonos scenes against one request per operation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20])
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Simulated UPnP round trip per call, in seconds")
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            registry = build_fleet(size, group_size=1, latency=options['latency'])
+            operations = party_mode(registry)
+            start = time.perf_counter()
+            sequential(registry, operations)
+            serial = time.perf_counter() - start
+
+            registry = build_fleet(size, group_size=1, latency=options['latency'])
+            executor = KeyedCommandExecutor(max_workers=size)
+            start = time.perf_counter()
+            results = asyncio.run(run_batch(party_mode(registry), registry=registry, executor=executor))
+            batched = time.perf_counter() - start
+            executor.shutdown()
+
+            failed = sum(r['status'] != 'success' for r in results)
+            self.stdout.write(
+                f"{size:>3} speakers, {len(operations)} operations: "
+                f"sequential {serial * 1000:8.1f} ms   batch {batched * 1000:7.1f} ms "
+                f"({serial / batched:.1f}x faster, {failed} failed)"
+            )
@@ -0,0 +1,109 @@
+"""
+Measure event-to-browser latency and CPU cost of the Sonos state push.
+
+Runs entirely against a stub speaker fleet (no Sonos hardware needed):
+connects 1, 5 and 20 WebSocket clients to ``SonosConsumer``, fires UPnP
+events on the stub subscriptions, and times how long each change takes to
+reach every client. CPU is sampled over an idle window too, which is where
+the old per-client 1-second polling loop used to cost the most.
+
+    python manage.py sonos_push_benchmark --speakers 12 --events 50
+"""
+
+import asyncio
+import json
+import statistics
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from sonos_control import producer as producer_module
+from sonos_control.consumers import SonosConsumer
+from sonos_control.producer import SpeakerStateProducer
+
+from ._stub_fleet import build_fleet
+
+
+class Command(BaseCommand):
+    help = "Benchmark the event-driven Sonos WebSocket push against a stub fleet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--speakers', type=int, default=12)
+        parser.add_argument('--clients', type=int, nargs='+', default=[1, 5, 20])
+        parser.add_argument('--events', type=int, default=50)
+        parser.add_argument('--latency', type=float, default=0.005,
+                            help="Simulated UPnP round trip per call, in seconds")
+        parser.add_argument('--idle', type=float, default=3.0,
+                            help="Idle window used to sample background CPU, in seconds")
+
+    def handle(self, *args, **options):
+        registry = build_fleet(options['speakers'], latency=options['latency'])
+        producer = SpeakerStateProducer(registry, resync_interval=3600)
+        producer.start()
+        # Consumers pick the producer up through get_producer()
+        previous, producer_module._producer = producer_module._producer, producer
+        try:
+            for n_clients in options['clients']:
+                result = asyncio.run(self._run(registry, n_clients, options))
+                self.stdout.write(
+                    f"{n_clients:>3} client(s): "
+                    f"p50 {result['p50'] * 1000:7.1f} ms  "
+                    f"p95 {result['p95'] * 1000:7.1f} ms  "
+                    f"max {result['max'] * 1000:7.1f} ms  "
+                    f"CPU active {result['cpu_active']:5.1f}%  "
+                    f"CPU idle {result['cpu_idle']:5.1f}%  "
+                    f"UPnP calls/event {result['calls_per_event']:.1f}"
+                )
+        finally:
+            producer.stop()
+            producer_module._producer = previous
+
+    async def _run(self, registry, n_clients, options):
+        clients = []
+        for _ in range(n_clients):
+            communicator = WebsocketCommunicator(SonosConsumer.as_asgi(), "/ws/sonos/")
+            connected, _ = await communicator.connect()
+            assert connected
+            await communicator.receive_json_from(timeout=10)  # initial snapshot
+            clients.append(communicator)
+
+        coordinators = [s for s in registry.speakers() if s.is_coordinator]
+        latencies = []
+        calls_before = sum(s.calls for s in registry.speakers())
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+        for i in range(options['events']):
+            speaker = coordinators[i % len(coordinators)]
+            speaker.track = f'Track {time.perf_counter_ns()}'
+            sent = time.perf_counter()
+            speaker.avTransport.fire()
+            for communicator in clients:
+                message = await communicator.receive_json_from(timeout=10)
+                assert speaker.uid in message['speaker_data'], message
+            latencies.append(time.perf_counter() - sent)
+
+        cpu_active = _cpu_percent(wall_start, cpu_start)
+        calls = sum(s.calls for s in registry.speakers()) - calls_before
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        await asyncio.sleep(options['idle'])
+        cpu_idle = _cpu_percent(wall_start, cpu_start)
+
+        for communicator in clients:
+            await communicator.disconnect()
+
+        latencies.sort()
+        return {
+            'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95) - 1],
+            'max': latencies[-1],
+            'cpu_active': cpu_active,
+            'cpu_idle': cpu_idle,
+            'calls_per_event': calls / options['events'],
+        }
+
+
+def _cpu_percent(wall_start, cpu_start):
+    wall = time.perf_counter() - wall_start
+    return 100.0 * (time.process_time() - cpu_start) / wall if wall else 0.0
@@ -0,0 +1,74 @@
+"""
+Compare the old per-speaker snapshot with the topology-aware builder.
+
+Runs against stub fleets of 10 to 30 speakers (grouped three at a time by
+default) where every UPnP call sleeps for ``--latency`` seconds, and reports
+wall time and the number of UPnP calls for each approach.
+
+    python manage.py sonos_snapshot_benchmark --sizes 10 20 30 --latency 0.02
+"""
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from sonos_control.snapshot import build_speaker_info, get_ungrouped_speakers, queue_item_data
+
+from ._stub_fleet import build_fleet
+
+
+def legacy_speaker_info(speakers):
+    """The previous implementation: four serial round trips per speaker."""
+    speakers_info = []
+    all_ungrouped = get_ungrouped_speakers(speakers)
+    for speaker in speakers:
+        current_track = speaker.get_current_track_info()
+        queue = [queue_item_data(t) for t in speaker.get_queue(full_album_art_uri=True)]
+        speakers_info.append({
+            'name': speaker.player_name,
+            'uid': speaker.uid,
+            'track': current_track['title'],
+            'volume': speaker.volume,
+            'play_state': speaker.get_current_transport_info()['current_transport_state'],
+            'queue': queue,
+            'is_coordinator': speaker.is_coordinator,
+            'ungrouped': [s for s in all_ungrouped if s is not speaker],
+        })
+    return sorted(speakers_info, key=lambda x: x['name'])
+
+
+class Command(BaseCommand):
+    help = "Benchmark topology-aware Sonos snapshots against the old per-speaker loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 30])
+        parser.add_argument('--group-size', type=int, default=3)
+        parser.add_argument('--latency', type=float, default=0.02,
+                            help="Simulated UPnP round trip per call, in seconds")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            registry = build_fleet(size, group_size=options['group_size'],
+                                   latency=options['latency'])
+            speakers = registry.speakers()
+            legacy = self._measure(speakers, legacy_speaker_info, options['repeat'])
+            aware = self._measure(speakers, build_speaker_info, options['repeat'])
+            self.stdout.write(
+                f"{size:>3} speakers: "
+                f"legacy {legacy[0] * 1000:8.1f} ms / {legacy[1]:4d} calls   "
+                f"topology-aware {aware[0] * 1000:7.1f} ms / {aware[1]:4d} calls   "
+                f"({legacy[0] / aware[0]:.1f}x faster)"
+            )
+
+    @staticmethod
+    def _measure(speakers, build, repeat):
+        timings = []
+        calls_before = sum(s.calls for s in speakers)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            build(speakers)
+            timings.append(time.perf_counter() - start)
+        calls = (sum(s.calls for s in speakers) - calls_before) // repeat
+        return statistics.median(timings), calls
@@ -0,0 +1,314 @@
+"""
+Shared, event-driven producer of Sonos speaker state for the WebSocket UI.
+
+Previously every connected browser ran its own 1-second loop calling the
+blocking ``sonos_get_speaker_info()``, so N tablets caused N times the UPnP
+traffic and the consumer's event loop stalled while soco did SOAP calls.
+
+Now a single producer per process:
+
+* subscribes to ``AVTransport``, ``RenderingControl`` and ``Queue`` events on
+  every speaker (the subscriptions follow topology changes reported by the
+  :mod:`~sonos_control.registry`),
+* marks the affected group coordinator "dirty" when an event arrives,
+* rebuilds only the dirty coordinators on its own worker thread (never on the
+  event loop), and
+* fans out just the coordinators whose state actually changed to the
+  ``sonos_speakers`` channel group.
+
+Queues are not part of that state: each coordinator's queue is cached by its
+UpdateID (see :mod:`~sonos_control.queue_cache`), only its length and version
+are pushed, and edits travel as ``queue_deltas``. Browsers page the tracks in
+with :meth:`SpeakerStateProducer.queue_page`.
+
+A slow full resync (``RESYNC_INTERVAL``) covers missed or expired
+subscriptions.
+
+Consumers call :func:`get_producer` and :meth:`SpeakerStateProducer.snapshot`
+for the initial state, then receive ``speaker.update`` group messages.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .queue_cache import QueueCache
+from .registry import SpeakerRegistry, get_registry
+from .snapshot import build_speaker_info, speaker_update_data
+
+logger = logging.getLogger(__name__)
+
+# Channels group every Sonos WebSocket joins.
+SPEAKER_GROUP = 'sonos_speakers'
+
+# UPnP services whose events can change what the UI shows.
+EVENT_SERVICES = ('avTransport', 'renderingControl', 'queue')
+
+# Requested lifetime of each event subscription (auto-renewed).
+SUBSCRIPTION_TIMEOUT = 600  # seconds
+
+# Events tend to arrive in bursts (track change = transport + queue +
+# metadata); wait this long so one rebuild covers the whole burst.
+EVENT_DEBOUNCE = 0.05  # seconds
+
+# Safety-net full refresh in case an event was missed.
+RESYNC_INTERVAL = 30  # seconds
+
+
+class SpeakerStateProducer:
+    """Turns soco UPnP events into ``speaker.update`` channel-group messages."""
+
+    def __init__(
+        self,
+        registry: SpeakerRegistry,
+        publish: Callable[[dict[str, Any], list[str], dict[str, Any]], None] | None = None,
+        debounce: float = EVENT_DEBOUNCE,
+        resync_interval: float = RESYNC_INTERVAL,
+    ) -> None:
+        self._registry = registry
+        self._publish = publish or self._publish_to_group
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._debounce = debounce
+        self._resync_interval = resync_interval
+        # coordinator uid -> last published speaker_update_data() dict
+        self._state: dict[str, dict[str, Any]] = {}
+        self._queues = QueueCache()
+        self._subscriptions: dict[tuple[str, str], Any] = {}
+        self._subscriptions_lock = threading.Lock()
+        self._dirty: set[str] = set()
+        self._resync_pending = False
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        """Build the initial state, subscribe, and start the worker thread."""
+        if self._thread is not None:
+            return
+        self._registry.add_listener(self._on_topology_change)
+        self._sync_subscriptions()
+        self._rebuild(resync=True)
+        self._thread = threading.Thread(
+            target=self._run, name="sonos-producer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._wake:
+            self._wake.notify()
+        for sub in list(self._subscriptions.values()):
+            try:
+                sub.unsubscribe()
+            except Exception:  # pragma: no cover - best-effort cleanup
+                pass
+        self._subscriptions.clear()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Publish on the event loop the consumers run on.
+
+        The in-memory channel layer's queues belong to that loop, so group
+        sends from the worker thread must be scheduled onto it rather than
+        run on a throwaway loop via ``async_to_sync``.
+        """
+        self._loop = loop
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """Current state of every coordinator (what a new client should see)."""
+        return dict(self._state)
+
+    def queue_page(self, speaker_uid: str, start: int, count: int) -> dict[str, Any]:
+        """One window of a coordinator's cached queue (blocking on a cache miss)."""
+        speaker = self._registry.get(speaker_uid)
+        if speaker is None:
+            return {'status': 'error', 'message': f'Speaker {speaker_uid} not found'}
+        try:
+            page = self._queues.page(speaker, start, count)
+        except Exception as e:  # noqa: BLE001 - reported to the client
+            return {'status': 'error', 'message': f'Failed to load queue: {str(e)}'}
+        return {'status': 'success', 'queue': page}
+
+    def _publish_to_group(
+        self,
+        speaker_data: dict[str, Any],
+        removed: list[str],
+        queue_deltas: dict[str, Any],
+    ) -> None:
+        """Send changed coordinators to every connected Sonos WebSocket."""
+        channel_layer = get_channel_layer()
+        message = {
+            'type': 'speaker.update',
+            'speaker_data': speaker_data,
+            'removed': removed,
+            'queue_deltas': queue_deltas,
+        }
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(
+                channel_layer.group_send(SPEAKER_GROUP, message), loop
+            )
+        else:
+            async_to_sync(channel_layer.group_send)(SPEAKER_GROUP, message)
+
+    # -- event intake (soco event thread) ---------------------------------
+
+    def _on_event(self, speaker_uid: str, event: Any) -> None:
+        speaker = self._registry.get(speaker_uid)
+        if speaker is None:
+            return
+        group = speaker.group  # served from the topology event cache
+        coordinator = group.coordinator if group is not None else speaker
+        if coordinator is speaker and getattr(event, 'service', None) is speaker.queue:
+            # Lets the next rebuild skip the Browse if the queue is unchanged
+            self._queues.note_update_id(speaker_uid, event.variables.get('update_id'))
+        self.mark_dirty(coordinator.uid)
+
+    def _on_topology_change(self) -> None:
+        self._sync_subscriptions()
+        with self._wake:
+            self._resync_pending = True
+            self._wake.notify()
+
+    def mark_dirty(self, coordinator_uid: str) -> None:
+        """Schedule a rebuild of one coordinator's state."""
+        with self._wake:
+            self._dirty.add(coordinator_uid)
+            self._wake.notify()
+
+    # -- subscriptions -----------------------------------------------------
+
+    def _sync_subscriptions(self) -> None:
+        """Subscribe new speakers and drop subscriptions for vanished ones."""
+        with self._subscriptions_lock:
+            self._sync_subscriptions_locked()
+
+    def _sync_subscriptions_locked(self) -> None:
+        speakers = {s.uid: s for s in self._registry.speakers()}
+        for key in list(self._subscriptions):
+            sub = self._subscriptions[key]
+            if key[0] not in speakers or not sub.is_subscribed:
+                self._subscriptions.pop(key, None)
+                try:
+                    sub.unsubscribe()
+                except Exception:  # pragma: no cover - best-effort cleanup
+                    pass
+        for uid, speaker in speakers.items():
+            for service_name in EVENT_SERVICES:
+                if (uid, service_name) in self._subscriptions:
+                    continue
+                try:
+                    sub = getattr(speaker, service_name).subscribe(
+                        requested_timeout=SUBSCRIPTION_TIMEOUT, auto_renew=True
+                    )
+                except Exception as exc:  # noqa: BLE001 - resync covers it
+                    logger.warning(
+                        "Sonos %s subscription on %s failed: %s",
+                        service_name, speaker.player_name, exc,
+                    )
+                    continue
+                sub.callback = functools.partial(self._on_event, uid)
+                self._subscriptions[(uid, service_name)] = sub
+
+    # -- worker thread -----------------------------------------------------
+
+    def _run(self) -> None:
+        next_resync = time.monotonic() + self._resync_interval
+        while not self._stop.is_set():
+            with self._wake:
+                timeout = max(0.0, next_resync - time.monotonic())
+                if not (self._dirty or self._resync_pending):
+                    self._wake.wait(timeout)
+            if self._stop.is_set():
+                return
+
+            resync = time.monotonic() >= next_resync
+            if resync:
+                self._sync_subscriptions()
+                next_resync = time.monotonic() + self._resync_interval
+            elif self._debounce:
+                time.sleep(self._debounce)
+
+            try:
+                self._rebuild(resync=resync)
+            except Exception:  # noqa: BLE001 - keep the producer alive
+                logger.exception("Sonos state rebuild failed")
+
+    def _rebuild(self, resync: bool = False) -> None:
+        """Rebuild dirty coordinators and publish whatever changed."""
+        with self._wake:
+            dirty, self._dirty = self._dirty, set()
+            resync = resync or self._resync_pending
+            self._resync_pending = False
+
+        speakers = self._registry.speakers()
+        coordinators = {s.uid: s for s in speakers if s.is_coordinator}
+        if resync:
+            dirty = set(coordinators)
+
+        # Dirty coordinators only, queried concurrently; members not at all
+        infos = build_speaker_info(
+            speakers, coordinators=dirty & set(coordinators),
+            include_queue=False, include_members=False,
+        )
+        changed: dict[str, dict[str, Any]] = {}
+        queue_deltas: dict[str, Any] = {}
+        for info in infos:
+            uid = info['uid']
+            try:
+                # Only re-fetched when the UpdateID moved (probed on resync)
+                queue = self._queues.refresh(coordinators[uid], probe=resync)
+            except Exception as exc:  # noqa: BLE001 - one offline speaker
+                logger.warning("Failed to read Sonos queue for %s: %s", uid, exc)
+                continue
+            data = speaker_update_data(info)
+            data['queue_length'] = queue.length
+            data['queue_version'] = queue.version
+            if queue.changed:
+                queue_deltas[uid] = {
+                    'from_version': queue.from_version,
+                    'version': queue.version,
+                    'length': queue.length,
+                    'ops': queue.ops,
+                }
+            if self._state.get(uid) != data:
+                changed[uid] = data
+
+        removed = [uid for uid in self._state if uid not in coordinators]
+        for uid in removed:
+            self._queues.forget(uid)
+        if not (changed or removed):
+            return
+
+        state = dict(self._state)
+        state.update(changed)
+        for uid in removed:
+            state.pop(uid, None)
+        self._state = state
+        self._publish(changed, removed, queue_deltas)
+
+
+# Lazily created so importing this module never discovers or subscribes.
+_producer: SpeakerStateProducer | None = None
+_producer_lock = threading.Lock()
+
+
+def get_producer() -> SpeakerStateProducer:
+    """Return the process-wide producer, starting it on first use (blocking)."""
+    global _producer
+    if _producer is None:
+        with _producer_lock:
+            if _producer is None:
+                producer = SpeakerStateProducer(get_registry())
+                producer.start()
+                _producer = producer
+    return _producer
@@ -0,0 +1,225 @@
+"""
+Per-coordinator cache of Sonos queues, keyed by the queue's UpdateID.
+
+Shipping the whole queue inside every ``speaker_update`` message cost
+hundreds of KB per second per client for a long Spotify queue, and every poll
+re-fetched it with a ``Browse`` call even when nothing had changed. Instead:
+
+* Every ``Browse`` response and every ``Queue`` UPnP event carries the queue's
+  ``UpdateID``, which the speaker bumps on each edit. A queue is re-fetched
+  only when an event reports a new UpdateID, or when a periodic resync probe
+  (a one-item ``Browse``) shows that it moved. Speakers whose queue did not
+  change are not touched.
+* When a queue does change, the old and new track lists are diffed and the
+  browser receives compact ``insert`` / ``remove`` / ``move`` operations
+  rather than the full list.
+* Browsers load the queue window by window (:meth:`QueueCache.page`) and only
+  when it is shown.
+
+Each cached queue has a ``version``, a counter that moves whenever its
+contents change. Every delta says which version it applies to, so a client
+that missed one can notice and reload.
+
+Public API:
+    * :class:`QueueCache` -> ``refresh(speaker)``, ``page(speaker, start, count)``
+    * :func:`diff_queue(old, new)` -> list of delta operations
+"""
+
+from __future__ import annotations
+
+import difflib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+
+from .snapshot import queue_item_data
+
+logger = logging.getLogger(__name__)
+
+# Tracks per Browse call when (re)fetching a queue; also the default window
+# a browser asks for.
+QUEUE_PAGE_SIZE = 100
+
+# Inserts larger than this are sent as a bare count; the browser drops what
+# it had loaded past that point and pages the rest in on demand.
+DELTA_MAX_TRACKS = 50
+
+
+@dataclass
+class QueueChange:
+    """Result of :meth:`QueueCache.refresh` for one coordinator."""
+
+    version: int
+    length: int
+    from_version: int | None = None  # None when nothing changed
+    ops: list[dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return self.from_version is not None
+
+
+@dataclass
+class _Entry:
+    update_id: int | None
+    version: int
+    tracks: list[dict[str, Any]]
+
+
+def _track_key(track: dict[str, Any]) -> tuple:
+    return (track.get('uri'), track.get('title'), track.get('artist'))
+
+
+def diff_queue(old: list[dict[str, Any]], new: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Operations that turn ``old`` into ``new`` when applied in order.
+
+    Indices refer to the list as it stands after the preceding operations.
+    """
+    old_keys = [_track_key(t) for t in old]
+    new_keys = [_track_key(t) for t in new]
+
+    # A single dragged track shows up as delete + insert of the same item
+    if len(old) == len(new) and old_keys != new_keys:
+        move = _single_move(old_keys, new_keys)
+        if move is not None:
+            return [{'op': 'move', 'from': move[0], 'to': move[1]}]
+
+    ops: list[dict[str, Any]] = []
+    matcher = difflib.SequenceMatcher(a=old_keys, b=new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ('delete', 'replace'):
+            ops.append({'op': 'remove', 'index': j1, 'count': i2 - i1})
+        if tag in ('insert', 'replace'):
+            op = {'op': 'insert', 'index': j1, 'count': j2 - j1}
+            if j2 - j1 <= DELTA_MAX_TRACKS:
+                op['tracks'] = new[j1:j2]
+            ops.append(op)
+    return ops
+
+
+def _single_move(old_keys: list, new_keys: list) -> tuple[int, int] | None:
+    """(from, to) if ``new_keys`` is ``old_keys`` with one item relocated."""
+    start = 0
+    while old_keys[start] == new_keys[start]:
+        start += 1
+    end = len(old_keys)
+    while old_keys[end - 1] == new_keys[end - 1]:
+        end -= 1
+    # Moved down: old[start] now sits at end - 1
+    if old_keys[start + 1:end] == new_keys[start:end - 1] and old_keys[start] == new_keys[end - 1]:
+        return start, end - 1
+    # Moved up: old[end - 1] now sits at start
+    if old_keys[start:end - 1] == new_keys[start + 1:end] and old_keys[end - 1] == new_keys[start]:
+        return end - 1, start
+    return None
+
+
+class QueueCache:
+    """Caches each coordinator's queue and reports changes as deltas."""
+
+    def __init__(self, page_size: int = QUEUE_PAGE_SIZE) -> None:
+        self._page_size = page_size
+        self._lock = threading.Lock()
+        self._entries: dict[str, _Entry] = {}
+        # uid -> UpdateID reported by the latest Queue event
+        self._hints: dict[str, int] = {}
+        # uids whose Queue event had no usable UpdateID; probed on next refresh
+        self._unknown: set[str] = set()
+
+    def note_update_id(self, uid: str, update_id: Any) -> None:
+        """Record the UpdateID from a ``Queue`` event (soco event thread).
+
+        An event without a usable UpdateID still means the queue may have
+        changed, so the next :meth:`refresh` probes it.
+        """
+        try:
+            update_id = int(update_id)
+        except (TypeError, ValueError):
+            logger.debug("Queue event for %s without a usable UpdateID: %r", uid, update_id)
+            with self._lock:
+                self._hints.pop(uid, None)
+                self._unknown.add(uid)
+            return
+        with self._lock:
+            self._hints[uid] = update_id
+            self._unknown.discard(uid)
+
+    def forget(self, uid: str) -> None:
+        with self._lock:
+            self._entries.pop(uid, None)
+            self._hints.pop(uid, None)
+            self._unknown.discard(uid)
+
+    def refresh(self, speaker: Any, probe: bool = False) -> QueueChange:
+        """Bring ``speaker``'s cached queue up to date (blocking).
+
+        Without an event hint the cached queue is trusted as-is unless
+        ``probe`` is set, in which case a one-item ``Browse`` checks the
+        UpdateID first. A ``Queue`` event without an UpdateID forces the
+        probe.
+        """
+        uid = speaker.uid
+        with self._lock:
+            entry = self._entries.get(uid)
+            hint = self._hints.pop(uid, None)
+            if uid in self._unknown:
+                self._unknown.discard(uid)
+                probe = True
+
+        if entry is not None:
+            if hint is None and probe:
+                hint = getattr(speaker.get_queue(0, 1), 'update_id', None)
+            unchanged = hint == entry.update_id if hint is not None else not probe
+            if unchanged:
+                return QueueChange(version=entry.version, length=len(entry.tracks))
+
+        update_id, tracks = self._fetch(speaker)
+        if entry is None:
+            # Nothing to diff against; clients page it in from scratch
+            with self._lock:
+                self._entries[uid] = _Entry(update_id=update_id, version=1, tracks=tracks)
+            return QueueChange(version=1, length=len(tracks))
+
+        ops = diff_queue(entry.tracks, tracks)
+        new_entry = _Entry(update_id=update_id, version=entry.version + (1 if ops else 0),
+                           tracks=tracks)
+        with self._lock:
+            self._entries[uid] = new_entry
+        if not ops:
+            return QueueChange(version=new_entry.version, length=len(tracks))
+        return QueueChange(
+            version=new_entry.version, length=len(tracks),
+            from_version=entry.version, ops=ops,
+        )
+
+    def page(self, speaker: Any, start: int = 0, count: int = QUEUE_PAGE_SIZE) -> dict[str, Any]:
+        """One window of the cached queue (fetches it first if not cached)."""
+        with self._lock:
+            entry = self._entries.get(speaker.uid)
+        if entry is None:
+            self.refresh(speaker)
+            with self._lock:
+                entry = self._entries[speaker.uid]
+        start = max(0, int(start))
+        count = max(0, min(int(count), self._page_size))
+        return {
+            'version': entry.version,
+            'length': len(entry.tracks),
+            'start': start,
+            'tracks': entry.tracks[start:start + count],
+        }
+
+    def _fetch(self, speaker: Any) -> tuple[int | None, list[dict[str, Any]]]:
+        """Read the whole queue, ``page_size`` items per Browse call."""
+        tracks: list[dict[str, Any]] = []
+        update_id = None
+        while True:
+            page = speaker.get_queue(
+                start=len(tracks), max_items=self._page_size, full_album_art_uri=True
+            )
+            update_id = getattr(page, 'update_id', update_id)
+            tracks.extend(queue_item_data(item) for item in page)
+            total = getattr(page, 'total_matches', len(tracks))
+            if not len(page) or len(tracks) >= total:
+                return update_id, tracks
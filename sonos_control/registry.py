@@ -0,0 +1,212 @@
+"""
+Process-wide registry of Sonos speakers.
+
+``soco.discover()`` sends an SSDP multicast and then blocks for replies, which
+costs seconds per call. Doing that on every volume tap (and once a second per
+WebSocket client) made the whole Sonos page sluggish, so discovery now happens
+**once per process** and the result is kept current by:
+
+* a UPnP ``ZoneGroupTopology`` event subscription on one "anchor" speaker.
+  Topology events are identical on every player in a household, so one
+  subscription is enough. While it is active soco also serves ``speaker.group``
+  / ``visible_zones`` from its cached zone-group state instead of issuing a
+  ``GetZoneGroupState`` SOAP call.
+* a slow background rediscovery (``REDISCOVERY_INTERVAL``) as a fallback for
+  missed events, expired subscriptions or an anchor speaker being unplugged.
+
+Speakers are indexed by UID, so :meth:`SpeakerRegistry.get` is a dict lookup
+and never touches the network.
+
+Public API:
+    * :func:`get_registry` -> the lazily started process-wide registry
+    * :meth:`SpeakerRegistry.speakers` -> list of visible SoCo instances
+    * :meth:`SpeakerRegistry.get(uid)` -> SoCo or None
+    * :meth:`SpeakerRegistry.add_listener(callback)` -> topology change hook
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Any, Callable
+
+import soco
+
+logger = logging.getLogger(__name__)
+
+# Fallback rediscovery period; topology events normally keep us current.
+REDISCOVERY_INTERVAL = 300  # seconds
+
+# Requested lifetime of the ZoneGroupTopology subscription (auto-renewed).
+SUBSCRIPTION_TIMEOUT = 600  # seconds
+
+
+def _discover_sonos(**kwargs):
+    """Discover Sonos speakers, optionally binding to a specific network interface.
+
+    Set the SONOS_INTERFACE env var to the IP of the network interface
+    where Sonos speakers live (needed when running inside Docker with
+    host networking, since soco may pick the wrong interface).
+    """
+    interface = os.getenv('SONOS_INTERFACE')
+    if interface:
+        kwargs.setdefault('interface_addr', interface)
+    return soco.discover(**kwargs)
+
+
+class SpeakerRegistry:
+    """Keeps a UID -> SoCo index of the household, updated from UPnP events."""
+
+    def __init__(
+        self,
+        discover: Callable[[], Any] = _discover_sonos,
+        rediscovery_interval: float = REDISCOVERY_INTERVAL,
+    ) -> None:
+        self._discover = discover
+        self._rediscovery_interval = rediscovery_interval
+        # Replaced wholesale (never mutated) so readers need no lock.
+        self._by_uid: dict[str, Any] = {}
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._subscription: Any = None
+        self._listeners: list[Callable[[], None]] = []
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        """Run the initial discovery and start the fallback rediscovery thread."""
+        if self._thread is not None:
+            return
+        self.refresh()
+        self._thread = threading.Thread(
+            target=self._rediscovery_loop, name="sonos-registry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop rediscovery and drop the topology subscription."""
+        self._stop.set()
+        self._unsubscribe()
+
+    def _rediscovery_loop(self) -> None:
+        while not self._stop.wait(self._rediscovery_interval):
+            try:
+                self.refresh()
+            except Exception:  # noqa: BLE001 - keep the thread alive
+                logger.exception("Sonos rediscovery failed")
+
+    # -- lookups (no network) ---------------------------------------------
+
+    def speakers(self) -> list[Any]:
+        """All visible speakers, in a stable (name) order."""
+        return sorted(self._by_uid.values(), key=lambda s: s.player_name)
+
+    def get(self, uid: str | None) -> Any:
+        """Return the SoCo instance for ``uid``, or None if unknown."""
+        if not uid:
+            return None
+        return self._by_uid.get(uid)
+
+    def __len__(self) -> int:
+        return len(self._by_uid)
+
+    # -- change notification ----------------------------------------------
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Call ``callback()`` (from a background thread) after topology changes."""
+        self._listeners.append(callback)
+
+    def _notify(self) -> None:
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception:  # noqa: BLE001 - one bad listener must not block others
+                logger.exception("Sonos topology listener failed")
+
+    # -- discovery / events -----------------------------------------------
+
+    def refresh(self) -> None:
+        """Re-run SSDP discovery, rebuild the index and (re)subscribe."""
+        with self._refresh_lock:
+            found = self._discover() or set()
+            if not found and self._by_uid:
+                # SSDP replies are lossy; keep the last good index.
+                logger.warning("Sonos rediscovery found no speakers; keeping cache")
+                return
+            self._set_speakers(found)
+            if found and not self._subscription_alive():
+                self._subscribe()
+        self._notify()
+
+    def _set_speakers(self, speakers: Any) -> None:
+        by_uid = {s.uid: s for s in speakers}
+        if set(by_uid) != set(self._by_uid):
+            logger.info("Sonos registry: %d speaker(s)", len(by_uid))
+        self._by_uid = by_uid
+
+    def _subscription_alive(self) -> bool:
+        sub = self._subscription
+        return bool(sub is not None and sub.is_subscribed and sub.time_left)
+
+    def _subscribe(self) -> None:
+        """Subscribe to ZoneGroupTopology events on one anchor speaker."""
+        self._unsubscribe()
+        anchor = min(self._by_uid.values(), key=lambda s: s.uid)
+        try:
+            sub = anchor.zoneGroupTopology.subscribe(
+                requested_timeout=SUBSCRIPTION_TIMEOUT, auto_renew=True
+            )
+        except Exception as exc:  # noqa: BLE001 - fall back to rediscovery
+            logger.warning(
+                "Sonos topology subscription on %s failed: %s", anchor.player_name, exc
+            )
+            return
+        sub.callback = self._on_topology_event
+        sub.auto_renew_fail = self._on_renew_failed
+        self._subscription = sub
+
+    def _unsubscribe(self) -> None:
+        sub, self._subscription = self._subscription, None
+        if sub is not None:
+            try:
+                sub.unsubscribe()
+            except Exception:  # pragma: no cover - best-effort cleanup
+                pass
+
+    def _on_topology_event(self, event: Any) -> None:
+        """soco has already folded the event into its zone-group cache."""
+        sub = self._subscription
+        if sub is None:
+            return
+        try:
+            # Served from the event-updated cache while subscribed.
+            self._set_speakers(sub.service.soco.visible_zones)
+        except Exception:  # noqa: BLE001 - wait for the next event/rediscovery
+            logger.exception("Failed to apply Sonos topology event")
+            return
+        self._notify()
+
+    def _on_renew_failed(self, exc: Exception) -> None:
+        """Anchor went away; rediscover now rather than at the next interval."""
+        logger.warning("Sonos topology subscription renewal failed: %s", exc)
+        threading.Thread(target=self.refresh, name="sonos-registry-renew", daemon=True).start()
+
+
+# Lazily created so importing this module (e.g. during `manage.py check`) never
+# sends a discovery multicast.
+_registry: SpeakerRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> SpeakerRegistry:
+    """Return the process-wide registry, discovering speakers on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = SpeakerRegistry()
+                registry.start()
+                _registry = registry
+    return _registry
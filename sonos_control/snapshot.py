@@ -0,0 +1,178 @@
+"""
+Topology-aware snapshot of what every Sonos speaker is doing.
+
+The old builder made four round trips (track info, queue, volume, transport
+state) to *every* speaker, one after another. Group members just mirror
+their coordinator's transport and queue, and the UI only renders
+coordinators, so most of those calls were wasted. :func:`build_speaker_info`
+instead:
+
+* asks **coordinators** for track info, transport state and (optionally) the
+  queue,
+* asks **every** speaker only for its volume (the one per-member setting),
+* copies the coordinator's playback fields onto its members, and
+* runs all of those calls concurrently on a small thread pool, so a snapshot
+  takes roughly one round trip instead of 4 x N.
+
+Group membership comes from ``speaker.group``, which soco serves from its
+topology-event cache while the registry's subscription is active.
+
+Public API:
+    * :func:`build_speaker_info(speakers, ...)` -> list of info dicts
+    * :func:`speaker_update_data(info)` -> the subset pushed over WebSockets
+    * :func:`queue_item_data(track)` / :func:`get_ungrouped_speakers(speakers)`
+
+Album art URLs are rewritten to the local art proxy (:mod:`.album_art`):
+thumbnails for queue items, full size for the now-playing track.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable
+
+from .album_art import art_url
+
+logger = logging.getLogger(__name__)
+
+# Concurrent UPnP calls while building one snapshot.
+SNAPSHOT_WORKERS = 16
+
+# Playback fields a group member shares with its coordinator.
+_COORDINATOR_FIELDS = ('track', 'artist', 'album', 'album_art', 'play_state', 'queue')
+
+
+def get_ungrouped_speakers(speakers):
+    """Return the speakers that are not part of any group."""
+    return [speaker for speaker in speakers if len(speaker.group.members) == 1]
+
+
+def queue_item_data(track):
+    """The fields of a queue item the UI needs."""
+    return {
+        'title': track.title,
+        'artist': track.creator,  # Use 'creator' for the artist
+        'album_art': art_url(track.album_art_uri, 'thumb') if track.album_art_uri else None,
+        'uri': track.resources[0].uri if track.resources else None
+    }
+
+
+def speaker_update_data(info):
+    """The subset of a coordinator's info that is pushed over the WebSocket.
+
+    The queue is not included; it is sent as deltas and loaded page by page.
+    """
+    return {
+        'group_label': info['group_label'],
+        'track': info['track'],
+        'artist': info['artist'],
+        'album': info['album'],
+        'volume': info['volume'],
+        'play_state': info['play_state'],
+        'album_art': info['album_art'],
+        'is_grouped': info['is_grouped']
+    }
+
+
+def _submit_playback(pool, speaker, include_queue):
+    """Start the calls a coordinator answers for its whole group."""
+    return (
+        pool.submit(speaker.get_current_track_info),
+        pool.submit(speaker.get_current_transport_info),
+        pool.submit(speaker.get_queue, full_album_art_uri=True) if include_queue else None,
+    )
+
+
+def _playback_state(futures):
+    track_future, transport_future, queue_future = futures
+    current_track = track_future.result()
+    return {
+        'track': current_track['title'],
+        'artist': current_track['artist'],
+        'album': current_track['album'],
+        'album_art': art_url(current_track['album_art'], 'full'),
+        'play_state': transport_future.result()['current_transport_state'],
+        'queue': [queue_item_data(t) for t in queue_future.result()] if queue_future else [],
+    }
+
+
+def build_speaker_info(
+    speakers: Iterable[Any],
+    coordinators: Iterable[str] | None = None,
+    include_queue: bool = True,
+    include_members: bool = True,
+) -> list[dict[str, Any]]:
+    """Build info dicts for ``speakers`` with as few, and as parallel, calls as possible.
+
+    ``coordinators`` limits the snapshot to those groups (by coordinator
+    UID). With ``include_members=False`` only coordinators are returned and
+    members are not contacted at all. A group whose coordinator cannot be
+    reached is left out (and logged) rather than failing the whole snapshot.
+    """
+    speakers = list(speakers)
+    wanted = set(coordinators) if coordinators is not None else None
+    all_ungrouped = get_ungrouped_speakers(speakers)
+
+    groups = []
+    for speaker in speakers:
+        if not speaker.is_coordinator:
+            continue
+        if wanted is not None and speaker.uid not in wanted:
+            continue
+        members = [speaker]
+        if include_members:
+            members += sorted(
+                (m for m in speaker.group.members if m is not speaker and m in speakers),
+                key=lambda m: m.player_name,
+            )
+        groups.append((speaker, members))
+
+    pool = _get_pool()
+    # Submit every call up front so all speakers are queried concurrently.
+    # Only this thread waits on them; pool jobs never wait on each other.
+    playback = {c.uid: _submit_playback(pool, c, include_queue) for c, _ in groups}
+    volumes = {m.uid: pool.submit(lambda s: s.volume, m) for _, members in groups for m in members}
+
+    speakers_info = []
+    for coordinator, members in groups:
+        try:
+            shared = _playback_state(playback[coordinator.uid])
+        except Exception as exc:  # noqa: BLE001 - one offline group
+            logger.warning("Failed to read Sonos state for %s: %s", coordinator.player_name, exc)
+            continue
+        group = coordinator.group
+        for member in members:
+            try:
+                volume = volumes[member.uid].result()
+            except Exception as exc:  # noqa: BLE001 - keep the rest of the group
+                logger.warning("Failed to read volume of %s: %s", member.player_name, exc)
+                volume = None
+            speakers_info.append({
+                'name': member.player_name,
+                'uid': member.uid,
+                **{key: shared[key] for key in _COORDINATOR_FIELDS},
+                'volume': volume,
+                'is_coordinator': member is coordinator,
+                'is_grouped': len(group.members) > 1,
+                'group_label': group.label,
+                'group': group.members,  # Get group members
+                'ungrouped': [s for s in all_ungrouped if s is not member],
+            })
+
+    return sorted(speakers_info, key=lambda x: x['name'])
+
+
+# Created on first use so importing this module starts no threads.
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(SNAPSHOT_WORKERS, thread_name_prefix="sonos-snapshot")
+    return _pool
@@ -0,0 +1,275 @@
+"""
+Per-user cache for Spotify Web API responses.
+
+``fetch_spotify_data`` used to make three sequential Spotify calls on every
+visit, and ``spotify_search`` called ``sp.search`` for every query. Both now
+go through a :class:`StaleWhileRevalidateCache`:
+
+* a **fresh** entry (younger than ``ttl``) is served with no API call, so
+  switching back to the Spotify tab is free,
+* a **stale** entry (up to ``stale_ttl`` past that) is served immediately
+  while one background refresh runs,
+* a **missing** entry is fetched on a small thread pool; concurrent callers
+  for the same key share that one fetch, and different keys (e.g. the three
+  library shelves) are fetched in parallel.
+
+Entries are keyed per user by a ``user_key`` stamped into the token info the
+first time it is used (a hash of the refresh token at that point), so the key
+stays the same when Spotify refreshes the access token or rotates the refresh
+token.
+
+Search adds two things on top (:class:`SpotifySearchCache`):
+
+* **prefix reuse** -- if an earlier, shorter query returned *every* match
+  (fewer hits than the result limit), results for a longer query that
+  extends it are filtered from those instead of asking Spotify again;
+* **server-side debounce** -- a query waits ``SEARCH_DEBOUNCE`` before going
+  to Spotify and is dropped (``superseded``) if the same user has sent a
+  newer one in the meantime.
+
+Public API:
+    * :func:`get_library_cache` / :func:`get_search_cache`
+    * :func:`spotify_user_key(token_info)` / :func:`with_user_key(token_info)`
+    * :func:`normalize_query(query)`
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+# Library shelves (recently played, saved tracks, top tracks).
+LIBRARY_TTL = 60  # seconds
+LIBRARY_STALE_TTL = 15 * 60  # seconds
+
+# Search results.
+SEARCH_TTL = 5 * 60  # seconds
+SEARCH_STALE_TTL = 0  # seconds; a stale search is simply re-run
+
+# How long a search waits for a newer query from the same user.
+SEARCH_DEBOUNCE = 0.25  # seconds
+
+# Concurrent Spotify API calls per process.
+SPOTIFY_WORKERS = 6
+
+# Upper bound on cached responses (all users), least recently used dropped.
+MAX_ENTRIES = 512
+
+
+def spotify_user_key(token_info: dict[str, Any] | None) -> str | None:
+    """Stable, non-reversible cache key for the user behind ``token_info``.
+
+    Tokens stamped by :func:`with_user_key` keep their key; others are keyed
+    by a hash of their current secret.
+    """
+    if not token_info:
+        return None
+    if token_info.get('user_key'):
+        return token_info['user_key']
+    secret = token_info.get('refresh_token') or token_info.get('access_token')
+    if not secret:
+        return None
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def with_user_key(token_info: dict[str, Any]) -> dict[str, Any]:
+    """``token_info`` carrying its :func:`spotify_user_key` from now on."""
+    user = spotify_user_key(token_info)
+    if user is None or token_info.get('user_key') == user:
+        return token_info
+    return {**token_info, 'user_key': user}
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a search query."""
+    return ' '.join(query.casefold().split())
+
+
+def _completed(value: Any) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
+
+
+class StaleWhileRevalidateCache:
+    """TTL cache whose fetches run on a pool, single-flight per key."""
+
+    def __init__(
+        self,
+        ttl: float,
+        stale_ttl: float = 0,
+        max_entries: int = MAX_ENTRIES,
+        executor: ThreadPoolExecutor | None = None,
+    ) -> None:
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._max_entries = max_entries
+        self._executor = executor or _get_executor()
+        self._lock = threading.Lock()
+        # key -> (value, fetched_at monotonic)
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._inflight: dict[Hashable, Future] = {}
+
+    def get(self, key: Hashable, fetch: Callable[[], Any]) -> Future:
+        """Future for ``key``'s value; already resolved when cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = time.monotonic() - fetched_at
+                if age < self._ttl + self._stale_ttl:
+                    self._entries.move_to_end(key)
+                    if age >= self._ttl and key not in self._inflight:
+                        self._start(key, fetch)  # revalidate in the background
+                    return _completed(value)
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._start(key, fetch)
+            return future
+
+    def peek(self, key: Hashable) -> Any:
+        """The fresh cached value for ``key``, or None (never fetches)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self._ttl:
+            return entry[0]
+        return None
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        """Snapshot of fresh entries."""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, t) in self._entries.items() if now - t < self._ttl]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Drop every entry whose key matches ``predicate``."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def _start(self, key: Hashable, fetch: Callable[[], Any]) -> Future:
+        # Caller holds self._lock
+        future = self._executor.submit(self._run, key, fetch)
+        self._inflight[key] = future
+        return future
+
+    def _run(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        try:
+            value = fetch()
+        except Exception as exc:
+            logger.warning("Spotify fetch for %s failed: %s", key, exc)
+            raise
+        else:
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+class SpotifySearchCache:
+    """Search results per (user, normalized query), with prefix reuse and debounce."""
+
+    def __init__(self, cache: StaleWhileRevalidateCache | None = None,
+                 debounce: float = SEARCH_DEBOUNCE) -> None:
+        self._cache = cache or StaleWhileRevalidateCache(SEARCH_TTL, SEARCH_STALE_TTL)
+        self.debounce = debounce
+        self._tickets = itertools.count(1)
+        self._latest: dict[str, int] = {}
+
+    def lookup(self, user: str, query: str) -> list[dict[str, Any]] | None:
+        """Cached results for ``query``, or ones derived from a complete prefix."""
+        hit = self._cache.peek((user, query))
+        if hit is not None:
+            return hit['results']
+
+        best = None
+        for (key_user, cached_query), value in self._cache.items():
+            if key_user != user or not value['complete'] or not query.startswith(cached_query):
+                continue
+            if best is None or len(cached_query) > len(best[0]):
+                best = (cached_query, value)
+        if best is None:
+            return None
+
+        # The prefix returned every match, so the longer query's are among them
+        terms = query.split()
+        results = [r for r in best[1]['results'] if _matches(r, terms)]
+        self._cache.put((user, query), {'results': results, 'complete': True})
+        return results
+
+    def begin(self, user: str) -> int:
+        """Register a new query from ``user``; returns its ticket."""
+        ticket = next(self._tickets)
+        self._latest[user] = ticket
+        return ticket
+
+    def is_latest(self, user: str, ticket: int) -> bool:
+        return self._latest.get(user) == ticket
+
+    def fetch(self, user: str, query: str, search: Callable[[], dict[str, Any]]) -> Future:
+        """Run ``search`` (returning ``{'results', 'complete'}``) through the cache."""
+        return self._cache.get((user, query), search)
+
+    def forget_user(self, user: str) -> None:
+        self._cache.discard(lambda key: key[0] == user)
+        self._latest.pop(user, None)
+
+
+def _matches(result: dict[str, Any], terms: list[str]) -> bool:
+    text = ' '.join(str(result.get(field) or '') for field in ('name', 'artist', 'album')).casefold()
+    return all(term in text for term in terms)
+
+
+_executor: ThreadPoolExecutor | None = None
+_library: StaleWhileRevalidateCache | None = None
+_search: SpotifySearchCache | None = None
+_singletons_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _singletons_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(SPOTIFY_WORKERS, thread_name_prefix="spotify")
+    return _executor
+
+
+def get_library_cache() -> StaleWhileRevalidateCache:
+    """Process-wide cache of the library shelves, keyed ``(user, shelf)``."""
+    global _library
+    if _library is None:
+        executor = _get_executor()
+        with _singletons_lock:
+            if _library is None:
+                _library = StaleWhileRevalidateCache(LIBRARY_TTL, LIBRARY_STALE_TTL, executor=executor)
+    return _library
+
+
+def get_search_cache() -> SpotifySearchCache:
+    """Process-wide search cache."""
+    global _search
+    if _search is None:
+        executor = _get_executor()
+        with _singletons_lock:
+            if _search is None:
+                _search = SpotifySearchCache(
+                    StaleWhileRevalidateCache(SEARCH_TTL, SEARCH_STALE_TTL, executor=executor)
+                )
+    return _search
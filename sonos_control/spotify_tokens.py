@@ -0,0 +1,264 @@
+"""
+Shared Spotify clients with proactive token refresh.
+
+``get_spotify_instance`` used to build a new ``SpotifyOAuth`` (and with it a
+new HTTP session) on every request, and tokens were only refreshed lazily
+once spotipy noticed they had expired -- adding a token round trip to
+whichever request happened to hit it. :class:`SpotifyTokenManager` instead:
+
+* keeps **one spotipy client per user** (keyed by
+  :func:`~.spotify_cache.spotify_user_key`), all sharing **one pooled**
+  ``requests.Session``,
+* refreshes each token on a background thread ``REFRESH_MARGIN`` before it
+  expires, so requests normally find a valid token, and
+* makes refreshes **single-flight** per user: whoever gets the lock first
+  refreshes, everyone waiting behind it reuses the new token. spotipy's own
+  lazy refresh (e.g. right after a restart) goes through the same lock.
+
+Users who have not made a request for ``IDLE_TIMEOUT`` are dropped and no
+longer refreshed. The session copy of the token is updated by
+``get_spotify_instance`` whenever the manager holds a newer one.
+
+Public API:
+    * :func:`get_token_manager` -> :class:`SpotifyTokenManager`
+    * ``client(token_info)`` -> ``(spotipy.Spotify, current_token_info)``
+    * ``refresh(user)`` / ``forget(user)``
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any
+
+import requests
+import spotipy
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
+
+from .spotify_cache import SPOTIFY_WORKERS, spotify_user_key, with_user_key
+
+logger = logging.getLogger(__name__)
+
+# Refresh a token this long before it expires.
+REFRESH_MARGIN = 5 * 60  # seconds
+
+# How often the refresh thread looks for tokens that are due.
+CHECK_INTERVAL = 30  # seconds
+
+# Stop refreshing for users who have not made a request in this long.
+IDLE_TIMEOUT = 12 * 3600  # seconds
+
+# Seconds Spotify API calls may take (matches spotipy's default).
+REQUESTS_TIMEOUT = 5
+
+
+def build_session(pool_size: int = SPOTIFY_WORKERS) -> requests.Session:
+    """A pooled session with spotipy's retry policy."""
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _expires_in(token_info: dict[str, Any]) -> float | None:
+    expires_at = token_info.get('expires_at')
+    return None if expires_at is None else expires_at - time.time()
+
+
+class _UserToken(CacheHandler):
+    """In-memory token store for one user; the client's cache handler."""
+
+    def __init__(self, user: str, token_info: dict[str, Any]) -> None:
+        self.user = user
+        self._token_info = token_info
+        self.refresh_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.client: spotipy.Spotify | None = None
+
+    def get_cached_token(self) -> dict[str, Any]:
+        return self._token_info
+
+    def save_token_to_cache(self, token_info: dict[str, Any]) -> None:
+        # spotipy's refreshed tokens don't carry the key; keep it across rotation
+        self._token_info = {**token_info, 'user_key': self.user}
+
+
+class _ManagedOAuth(SpotifyOAuth):
+    """SpotifyOAuth whose refreshes are single-flight per user."""
+
+    def __init__(self, store: _UserToken, refresh_margin: float, **kwargs: Any) -> None:
+        super().__init__(cache_handler=store, **kwargs)
+        self._store = store
+        self._refresh_margin = refresh_margin
+
+    def refresh_access_token(self, refresh_token: str) -> dict[str, Any]:
+        with self._store.refresh_lock:
+            current = self._store.get_cached_token()
+            remaining = _expires_in(current)
+            if remaining is not None and remaining > self._refresh_margin:
+                return current  # refreshed while we waited for the lock
+            return super().refresh_access_token(current.get('refresh_token') or refresh_token)
+
+
+class SpotifyTokenManager:
+    """One spotipy client per user, with tokens refreshed ahead of expiry."""
+
+    def __init__(
+        self,
+        client_id: str | None,
+        client_secret: str | None,
+        redirect_uri: str | None,
+        session: requests.Session | None = None,
+        refresh_margin: float = REFRESH_MARGIN,
+        check_interval: float = CHECK_INTERVAL,
+        idle_timeout: float = IDLE_TIMEOUT,
+    ) -> None:
+        self._oauth_settings = {
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'redirect_uri': redirect_uri,
+        }
+        self.session = session or build_session()
+        self._refresh_margin = refresh_margin
+        self._check_interval = check_interval
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._users: dict[str, _UserToken] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the background refresh thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._refresh_loop, name="spotify-tokens", daemon=True
+            )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._check_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.refresh_due()
+            except Exception:  # noqa: BLE001 - keep the thread alive
+                logger.exception("Spotify token refresh pass failed")
+
+    # -- clients -------------------------------------------------------------
+
+    def client(self, token_info: dict[str, Any]) -> tuple[spotipy.Spotify, dict[str, Any]]:
+        """The shared client for ``token_info``'s user and their newest token.
+
+        The returned token carries the user's ``user_key``; callers should
+        store it so the user keeps the same key after the refresh token
+        rotates.
+        """
+        token_info = with_user_key(token_info)
+        user = spotify_user_key(token_info)
+        if user is None:
+            raise ValueError("Spotify token info has no token")
+        with self._lock:
+            store = self._users.get(user)
+            if store is None:
+                store = self._users[user] = _UserToken(user, token_info)
+            elif token_info.get('expires_at', 0) > store.get_cached_token().get('expires_at', 0):
+                store.save_token_to_cache(token_info)  # e.g. signed in again
+            store.last_used = time.monotonic()
+            if store.client is None:
+                auth_manager = _ManagedOAuth(
+                    store, self._refresh_margin,
+                    requests_session=self.session, requests_timeout=REQUESTS_TIMEOUT,
+                    **self._oauth_settings,
+                )
+                store.client = spotipy.Spotify(
+                    auth_manager=auth_manager, requests_session=self.session,
+                    requests_timeout=REQUESTS_TIMEOUT,
+                )
+            current = store.get_cached_token()
+
+        if self._is_due(store):
+            self._wake.set()  # due now; let the refresh thread pick it up
+        return store.client, current
+
+    def token(self, user: str) -> dict[str, Any] | None:
+        with self._lock:
+            store = self._users.get(user)
+        return store.get_cached_token() if store is not None else None
+
+    def refresh(self, user: str) -> dict[str, Any] | None:
+        """Refresh ``user``'s token now unless someone already did (blocking)."""
+        with self._lock:
+            store = self._users.get(user)
+        if store is None or store.client is None:
+            return None
+        token_info = store.get_cached_token()
+        if not token_info.get('refresh_token'):
+            return token_info
+        return store.client.auth_manager.refresh_access_token(token_info['refresh_token'])
+
+    def refresh_due(self) -> None:
+        """Refresh every token close to expiry and drop idle users."""
+        now = time.monotonic()
+        with self._lock:
+            for user in [u for u, s in self._users.items() if now - s.last_used > self._idle_timeout]:
+                del self._users[user]
+            due = [user for user, store in self._users.items() if self._is_due(store)]
+        for user in due:
+            try:
+                self.refresh(user)
+            except Exception as exc:  # noqa: BLE001 - retried on the next pass
+                logger.warning("Failed to refresh Spotify token: %s", exc)
+
+    def _is_due(self, store: _UserToken) -> bool:
+        remaining = _expires_in(store.get_cached_token())
+        return remaining is not None and remaining <= self._refresh_margin
+
+    def forget(self, user: str) -> None:
+        with self._lock:
+            self._users.pop(user, None)
+
+
+_manager: SpotifyTokenManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_token_manager() -> SpotifyTokenManager:
+    """Return the process-wide token manager, starting its refresh thread."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                manager = SpotifyTokenManager(
+                    settings.SPOTIFY_CLIENT_ID,
+                    settings.SPOTIFY_CLIENT_SECRET,
+                    settings.SPOTIFY_REDIRECT_URI,
+                )
+                manager.start()
+                _manager = manager
+    return _manager
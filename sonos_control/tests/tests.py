@@ -1,5 +1,40 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
 from django.test import TestCase
-from unittest.mock import patch
+from django.urls import reverse
+from PIL import Image
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from sonos_control.album_art import AlbumArtCache, art_url, source_digest
+from sonos_control.batch import run_batch
+from sonos_control.commands import KeyedCommandExecutor, run_command
+from sonos_control.consumers import SonosConsumer
+from sonos_control.management.commands._stub_fleet import build_fleet, make_queue_item
+from sonos_control.producer import SPEAKER_GROUP, SpeakerStateProducer
+from sonos_control.queue_cache import DELTA_MAX_TRACKS, QueueCache, diff_queue
+from sonos_control.registry import SpeakerRegistry
+from sonos_control.snapshot import build_speaker_info
+from sonos_control.spotify_cache import (
+    SpotifySearchCache, StaleWhileRevalidateCache, normalize_query, spotify_user_key,
+    with_user_key,
+)
+from sonos_control.spotify_tokens import SpotifyTokenManager
+from sonos_control.volume import VolumeCoalescer
 
 
 class SpotifySearchInputTest(TestCase):
@@ -47,3 +82,1069 @@ class SpotifySearchInputTest(TestCase):
 
         self.assertIn('id="virtual-keyboard"', content)
         self.assertIn('vk-container', content)
+
+
+def _fake_speaker(uid, name):
+    speaker = MagicMock()
+    speaker.uid = uid
+    speaker.player_name = name
+    return speaker
+
+
+class SpeakerRegistryTest(TestCase):
+    """The registry discovers once and serves UID lookups from memory."""
+
+    def setUp(self):
+        self.kitchen = _fake_speaker('RINCON_A', 'Kitchen')
+        self.deck = _fake_speaker('RINCON_B', 'Deck')
+        self.discover = MagicMock(return_value={self.kitchen, self.deck})
+        self.registry = SpeakerRegistry(discover=self.discover)
+
+    def test_lookup_by_uid_does_not_rediscover(self):
+        self.registry.refresh()
+        self.assertIs(self.registry.get('RINCON_A'), self.kitchen)
+        self.assertIs(self.registry.get('RINCON_B'), self.deck)
+        self.assertIsNone(self.registry.get('RINCON_missing'))
+        self.assertEqual(self.discover.call_count, 1)
+
+    def test_speakers_sorted_by_name(self):
+        self.registry.refresh()
+        self.assertEqual(self.registry.speakers(), [self.deck, self.kitchen])
+
+    def test_subscribes_to_topology_on_one_anchor(self):
+        self.registry.refresh()
+        self.kitchen.zoneGroupTopology.subscribe.assert_called_once()
+        self.deck.zoneGroupTopology.subscribe.assert_not_called()
+
+    def test_topology_event_updates_index(self):
+        self.registry.refresh()
+        sub = self.kitchen.zoneGroupTopology.subscribe.return_value
+        office = _fake_speaker('RINCON_C', 'Office')
+        sub.service.soco.visible_zones = {self.kitchen, office}
+        listener = MagicMock()
+        self.registry.add_listener(listener)
+
+        sub.callback(MagicMock())
+
+        self.assertIs(self.registry.get('RINCON_C'), office)
+        self.assertIsNone(self.registry.get('RINCON_B'))
+        listener.assert_called_once_with()
+        self.assertEqual(self.discover.call_count, 1)
+
+    def test_empty_rediscovery_keeps_cache(self):
+        self.registry.refresh()
+        self.discover.return_value = None
+        self.registry.refresh()
+        self.assertEqual(len(self.registry), 2)
+
+    def test_subscription_failure_is_not_fatal(self):
+        self.kitchen.zoneGroupTopology.subscribe.side_effect = OSError('port in use')
+        self.registry.refresh()
+        self.assertIs(self.registry.get('RINCON_B'), self.deck)
+
+
+class SpeakerStateProducerTest(TestCase):
+    """The producer rebuilds only coordinators touched by UPnP events."""
+
+    def setUp(self):
+        # Six speakers in two groups of three
+        self.registry = build_fleet(6)
+        self.published = []
+        self.producer = SpeakerStateProducer(
+            self.registry,
+            publish=lambda *message: self.published.append(message),
+        )
+        self.producer._sync_subscriptions()
+        self.producer._rebuild(resync=True)
+        self.coordinators = [s for s in self.registry.speakers() if s.is_coordinator]
+
+    def test_initial_snapshot_has_every_coordinator(self):
+        self.assertEqual(
+            set(self.producer.snapshot()), {s.uid for s in self.coordinators}
+        )
+        self.assertEqual(len(self.published), 1)
+
+    def test_subscribes_each_speaker_once_per_service(self):
+        for speaker in self.registry.speakers():
+            self.assertEqual(len(speaker.avTransport.subscriptions), 1)
+            self.assertEqual(len(speaker.renderingControl.subscriptions), 1)
+            self.assertEqual(len(speaker.queue.subscriptions), 1)
+        self.producer._sync_subscriptions()
+        self.assertEqual(len(self.coordinators[0].queue.subscriptions), 1)
+
+    def test_event_on_member_publishes_only_its_coordinator(self):
+        coordinator = self.coordinators[1]
+        member = next(m for m in coordinator.group.members if m is not coordinator)
+        coordinator.track = 'New song'
+        calls_before = self.coordinators[0].calls
+
+        member.renderingControl.fire()
+        self.producer._rebuild()
+
+        data, removed, _ = self.published[-1]
+        self.assertEqual(list(data), [coordinator.uid])
+        self.assertEqual(data[coordinator.uid]['track'], 'New song')
+        self.assertEqual(removed, [])
+        # The other group was not queried at all
+        self.assertEqual(self.coordinators[0].calls, calls_before)
+
+    def test_unchanged_state_is_not_published(self):
+        self.coordinators[0].avTransport.fire()
+        self.producer._rebuild()
+        self.assertEqual(len(self.published), 1)
+
+    def test_vanished_coordinator_is_reported_removed(self):
+        gone = self.coordinators[1]
+        for member in gone.group.members:
+            del self.registry._by_uid[member.uid]
+
+        self.producer._on_topology_change()
+        self.producer._rebuild()
+
+        data, removed, _ = self.published[-1]
+        self.assertEqual(removed, [gone.uid])
+        self.assertNotIn(gone.uid, self.producer.snapshot())
+        self.assertFalse(gone.avTransport.subscriptions[0].is_subscribed)
+
+
+class SonosConsumerTest(TestCase):
+    """New WebSocket clients get one snapshot, then only group pushes."""
+
+    async def test_connect_sends_snapshot(self):
+        producer = MagicMock()
+        producer.snapshot.return_value = {'RINCON_A': {'track': 'Song'}}
+        with patch('sonos_control.consumers.get_producer', return_value=producer):
+            communicator = WebsocketCommunicator(SonosConsumer.as_asgi(), '/ws/sonos/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            message = await communicator.receive_json_from()
+            self.assertTrue(message['snapshot'])
+            self.assertEqual(message['speaker_data'], {'RINCON_A': {'track': 'Song'}})
+
+            await get_channel_layer().group_send(SPEAKER_GROUP, {
+                'type': 'speaker.update',
+                'speaker_data': {'RINCON_A': {'volume': 30}},
+                'removed': ['RINCON_B'],
+                'queue_deltas': {'RINCON_A': {
+                    'from_version': 1, 'version': 2, 'length': 0,
+                    'ops': [{'op': 'remove', 'index': 0, 'count': 1}],
+                }},
+            })
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['type'], 'queue_delta')
+            self.assertEqual(message['speaker_uid'], 'RINCON_A')
+            self.assertEqual(message['version'], 2)
+            message = await communicator.receive_json_from()
+            self.assertNotIn('snapshot', message)
+            self.assertEqual(message['speaker_data'], {'RINCON_A': {'volume': 30}})
+            self.assertEqual(message['removed'], ['RINCON_B'])
+            await communicator.disconnect()
+        producer.bind_loop.assert_called_once()
+
+
+class KeyedCommandExecutorTest(TestCase):
+    """Commands for one speaker run in order; other speakers are not held up."""
+
+    def setUp(self):
+        self.executor = KeyedCommandExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_same_key_runs_in_submission_order(self):
+        order = []
+
+        def job(n):
+            time.sleep(0.01 if n == 0 else 0)
+            order.append(n)
+
+        futures = [self.executor.submit('RINCON_A', job, n) for n in range(5)]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+    def test_slow_key_does_not_block_other_keys(self):
+        release = threading.Event()
+        slow = self.executor.submit('RINCON_SLOW', release.wait, 5)
+        fast = self.executor.submit('RINCON_FAST', lambda: 'done')
+        self.assertEqual(fast.result(timeout=1), 'done')
+        self.assertFalse(slow.done())
+        release.set()
+        slow.result(timeout=5)
+
+    def test_timed_out_queued_command_is_never_run(self):
+        release = threading.Event()
+        queued = MagicMock()
+        self.executor.submit('RINCON_A', release.wait, 5)
+
+        async def call():
+            await run_command('RINCON_A', queued, timeout=0.05, executor=self.executor)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(call())
+        release.set()
+        self.executor.submit('RINCON_A', lambda: None).result(timeout=5)
+        queued.assert_not_called()
+
+
+class SonosConsumerCommandTest(TestCase):
+    """receive() dispatches commands without waiting for the speaker."""
+
+    async def test_slow_speaker_does_not_block_other_commands(self):
+        release = threading.Event()
+
+        def fake_play_pause(speaker_uid, action, track_index=None):
+            if speaker_uid == 'RINCON_SLOW':
+                release.wait(5)
+            return {'status': 'success', 'message': 'ok'}
+
+        producer = MagicMock()
+        producer.snapshot.return_value = {}
+        with patch('sonos_control.consumers.get_producer', return_value=producer), \
+                patch('sonos_control.consumers.speaker_play_pause', side_effect=fake_play_pause):
+            communicator = WebsocketCommunicator(SonosConsumer.as_asgi(), '/ws/sonos/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # snapshot
+
+            await communicator.send_json_to(
+                {'action': 'play', 'speaker_uid': 'RINCON_SLOW', 'request_id': 1})
+            await communicator.send_json_to(
+                {'action': 'pause', 'speaker_uid': 'RINCON_FAST', 'request_id': 2})
+
+            message = await communicator.receive_json_from(timeout=2)
+            self.assertEqual(message['request_id'], 2)
+            self.assertEqual(message['status'], 'success')
+
+            release.set()
+            message = await communicator.receive_json_from(timeout=5)
+            self.assertEqual(message['request_id'], 1)
+            self.assertEqual(message['action'], 'play')
+            await communicator.disconnect()
+
+    async def test_volume_is_acknowledged_optimistically(self):
+        producer = MagicMock()
+        producer.snapshot.return_value = {}
+        coalescer = MagicMock()
+        threads = []
+
+        def set_group_volume(uid, volume):
+            threads.append(threading.current_thread())
+            return volume
+        coalescer.set_group_volume.side_effect = set_group_volume
+        with patch('sonos_control.consumers.get_producer', return_value=producer), \
+                patch('sonos_control.consumers.get_volume_coalescer', return_value=coalescer):
+            communicator = WebsocketCommunicator(SonosConsumer.as_asgi(), '/ws/sonos/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # snapshot
+
+            await communicator.send_json_to({
+                'action': 'volume', 'speaker_uid': 'RINCON_A', 'volume': 35,
+                'group': True, 'request_id': 7,
+            })
+            message = await communicator.receive_json_from(timeout=2)
+            self.assertEqual(message['request_id'], 7)
+            self.assertEqual(message['volume'], 35)
+            self.assertTrue(message['optimistic'])
+            coalescer.set_group_volume.assert_called_once_with('RINCON_A', 35)
+            coalescer.set_volume.assert_not_called()
+            # Reading the group may hit the network; not on the event loop
+            self.assertIsNot(threads[0], threading.current_thread())
+            await communicator.disconnect()
+
+    async def test_command_timeout_is_reported(self):
+        release = threading.Event()
+        producer = MagicMock()
+        producer.snapshot.return_value = {}
+        with patch('sonos_control.consumers.get_producer', return_value=producer), \
+                patch('sonos_control.consumers.sonos_clear_queue', side_effect=lambda uid: release.wait(5)), \
+                patch('sonos_control.commands.COMMAND_TIMEOUT', 0.05):
+            communicator = WebsocketCommunicator(SonosConsumer.as_asgi(), '/ws/sonos/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # snapshot
+
+            await communicator.send_json_to(
+                {'action': 'clear_queue', 'speaker_uid': 'RINCON_GONE', 'request_id': 'abc'})
+            message = await communicator.receive_json_from(timeout=2)
+            release.set()
+            self.assertEqual(message['request_id'], 'abc')
+            self.assertEqual(message['status'], 'error')
+            self.assertIn('did not respond', message['message'])
+            await communicator.disconnect()
+
+
+class VolumeCoalescerTest(TestCase):
+    """Slider bursts collapse into a few rate-limited SetVolume calls."""
+
+    def setUp(self):
+        # Two groups of three; each SetVolume takes 50ms
+        self.registry = build_fleet(6, latency=0.05)
+        self.executor = KeyedCommandExecutor(max_workers=8)
+        self.addCleanup(self.executor.shutdown)
+        self.failed = []
+        self.coalescer = VolumeCoalescer(
+            self.registry, self.executor, rate=10, on_failure=self.failed.append
+        )
+        self.speaker = self.registry.speakers()[0]
+
+    def _wait_idle(self):
+        deadline = time.monotonic() + 5
+        while self.coalescer._scheduled and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_burst_sends_latest_target_only(self):
+        for volume in range(10, 60):
+            self.coalescer.set_volume(self.speaker.uid, volume)
+        self._wait_idle()
+        self.assertEqual(self.speaker._volume, 59)
+        # First value goes straight out, the rest collapse into the latest
+        self.assertLessEqual(self.speaker.calls, 3)
+
+    def test_rate_limited_per_speaker(self):
+        start = time.monotonic()
+        for volume in (10, 20, 30):
+            self.coalescer.set_volume(self.speaker.uid, volume)
+            time.sleep(0.12)
+        self._wait_idle()
+        self.assertEqual(self.speaker.calls, 3)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(self.speaker._volume, 30)
+
+    def test_rate_limit_wait_does_not_hold_a_worker(self):
+        executor = KeyedCommandExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        coalescer = VolumeCoalescer(self.registry, executor, rate=2)
+        coalescer.set_volume(self.speaker.uid, 10)
+        time.sleep(0.1)  # sent; the next one waits out the 0.5s limit
+        coalescer.set_volume(self.speaker.uid, 20)
+        other = self.registry.speakers()[3]
+        start = time.monotonic()
+        executor.submit(other.uid, lambda: None).result(timeout=1)
+        # The only worker was free for other speakers meanwhile
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(self.speaker._volume, 10)
+        deadline = time.monotonic() + 2
+        while coalescer._scheduled and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.speaker._volume, 20)
+
+    def test_target_is_clamped_and_validated(self):
+        self.assertEqual(self.coalescer.set_volume(self.speaker.uid, '150'), 100)
+        self.assertEqual(self.coalescer.set_volume(self.speaker.uid, -3), 0)
+        with self.assertRaises(ValueError):
+            self.coalescer.set_volume(self.speaker.uid, 'loud')
+        with self.assertRaises(ValueError):
+            self.coalescer.set_volume('RINCON_missing', 10)
+        self._wait_idle()
+
+    def test_group_volume_sets_members_in_parallel(self):
+        coordinator = self.speaker.group.coordinator
+        start = time.monotonic()
+        self.coalescer.set_group_volume(coordinator.uid, 42)
+        self._wait_idle()
+        for member in coordinator.group.members:
+            self.assertEqual(member._volume, 42)
+        # Three 50ms calls in parallel, not one after another
+        self.assertLess(time.monotonic() - start, 0.15)
+        others = [s for s in self.registry.speakers() if s not in coordinator.group]
+        self.assertTrue(all(s._volume == 20 for s in others))
+
+    def test_failure_is_reported(self):
+        with patch.object(type(self.speaker), 'volume', new_callable=PropertyMock) as volume:
+            volume.side_effect = OSError('unreachable')
+            self.coalescer.set_volume(self.speaker.uid, 30)
+            self._wait_idle()
+        self.assertEqual(self.failed, [self.speaker])
+
+
+def _track(title):
+    return {'title': title, 'artist': 'Artist', 'album_art': None, 'uri': f'x-sonos-spotify:{title}'}
+
+
+def _apply_ops(tracks, ops, new):
+    """Apply queue delta ops the way the browser does (full list loaded)."""
+    tracks = list(tracks)
+    for op in ops:
+        if op['op'] == 'remove':
+            del tracks[op['index']:op['index'] + op['count']]
+        elif op['op'] == 'insert':
+            tracks[op['index']:op['index']] = op.get('tracks', new[op['index']:op['index'] + op['count']])
+        elif op['op'] == 'move':
+            tracks.insert(op['to'], tracks.pop(op['from']))
+    return tracks
+
+
+class QueueDiffTest(TestCase):
+    """Queue edits become small insert/remove/move operations."""
+
+    def setUp(self):
+        self.old = [_track(f'song {i}') for i in range(10)]
+
+    def assertDiffApplies(self, new):
+        ops = diff_queue(self.old, new)
+        self.assertEqual(_apply_ops(self.old, ops, new), new)
+        return ops
+
+    def test_append(self):
+        ops = self.assertDiffApplies(self.old + [_track('new')])
+        self.assertEqual(ops, [{'op': 'insert', 'index': 10, 'count': 1, 'tracks': [_track('new')]}])
+
+    def test_remove(self):
+        ops = self.assertDiffApplies(self.old[:3] + self.old[5:])
+        self.assertEqual(ops, [{'op': 'remove', 'index': 3, 'count': 2}])
+
+    def test_move_down_and_up(self):
+        new = self.old[:2] + self.old[3:8] + [self.old[2]] + self.old[8:]
+        self.assertEqual(self.assertDiffApplies(new), [{'op': 'move', 'from': 2, 'to': 7}])
+        new = self.old[:1] + [self.old[6]] + self.old[1:6] + self.old[7:]
+        self.assertEqual(self.assertDiffApplies(new), [{'op': 'move', 'from': 6, 'to': 1}])
+
+    def test_mixed_edits(self):
+        new = [_track('a')] + self.old[1:4] + [_track('b'), _track('c')] + self.old[7:]
+        self.assertDiffApplies(new)
+
+    def test_large_insert_omits_tracks(self):
+        extra = [_track(f'extra {i}') for i in range(DELTA_MAX_TRACKS + 1)]
+        ops = self.assertDiffApplies(self.old + extra)
+        self.assertNotIn('tracks', ops[0])
+        self.assertEqual(ops[0]['count'], DELTA_MAX_TRACKS + 1)
+
+
+class QueueCacheTest(TestCase):
+    """Queues are only re-read when their UpdateID moves."""
+
+    def setUp(self):
+        self.speaker = build_fleet(1).speakers()[0]
+        self.speaker.queue_items = [make_queue_item(f'song {i}') for i in range(250)]
+        self.cache = QueueCache()
+        self.first = self.cache.refresh(self.speaker)
+
+    def test_initial_fetch_pages_through_whole_queue(self):
+        self.assertEqual(self.first.length, 250)
+        self.assertFalse(self.first.changed)
+        self.assertEqual(self.speaker.calls, 3)
+
+    def test_unchanged_queue_is_not_refetched(self):
+        self.cache.note_update_id(self.speaker.uid, str(self.speaker.queue_update_id))
+        change = self.cache.refresh(self.speaker)
+        self.assertFalse(change.changed)
+        self.cache.refresh(self.speaker)
+        self.assertEqual(self.speaker.calls, 3)
+
+    def test_resync_probes_with_one_item(self):
+        self.cache.refresh(self.speaker, probe=True)
+        self.assertEqual(self.speaker.calls, 4)
+
+    def test_event_without_update_id_forces_probe(self):
+        self.speaker.queue_items.append(make_queue_item('new'))
+        self.speaker.queue_update_id += 1
+        self.cache.note_update_id(self.speaker.uid, None)
+
+        change = self.cache.refresh(self.speaker)
+
+        self.assertTrue(change.changed)
+        self.assertEqual(change.length, 251)
+        # The flag is consumed: the next plain refresh trusts the cache again
+        calls = self.speaker.calls
+        self.assertFalse(self.cache.refresh(self.speaker).changed)
+        self.assertEqual(self.speaker.calls, calls)
+
+    def test_edit_produces_delta(self):
+        self.speaker.queue_items.append(make_queue_item('new'))
+        self.speaker.queue_update_id += 1
+        self.cache.note_update_id(self.speaker.uid, self.speaker.queue_update_id)
+
+        change = self.cache.refresh(self.speaker)
+
+        self.assertEqual(change.from_version, self.first.version)
+        self.assertEqual(change.version, self.first.version + 1)
+        self.assertEqual(change.length, 251)
+        self.assertEqual([op['op'] for op in change.ops], ['insert'])
+
+    def test_page(self):
+        page = self.cache.page(self.speaker, start=240, count=50)
+        self.assertEqual(page['start'], 240)
+        self.assertEqual(page['length'], 250)
+        self.assertEqual([t['title'] for t in page['tracks']], [f'song {i}' for i in range(240, 250)])
+        self.assertEqual(self.speaker.calls, 3)
+
+
+class ProducerQueueTest(TestCase):
+    """Queue changes reach clients as deltas, never as the whole queue."""
+
+    def setUp(self):
+        self.registry = build_fleet(3)
+        self.published = []
+        self.producer = SpeakerStateProducer(
+            self.registry, publish=lambda *message: self.published.append(message),
+        )
+        self.producer._sync_subscriptions()
+        self.producer._rebuild(resync=True)
+        self.coordinator = next(s for s in self.registry.speakers() if s.is_coordinator)
+
+    def test_update_carries_queue_version_not_tracks(self):
+        data = self.producer.snapshot()[self.coordinator.uid]
+        self.assertNotIn('queue', data)
+        self.assertEqual(data['queue_length'], 20)
+        self.assertEqual(data['queue_version'], 1)
+
+    def test_queue_event_publishes_delta(self):
+        self.coordinator.edit_queue(self.coordinator.queue_items[1:])
+        self.producer._rebuild()
+
+        data, removed, deltas = self.published[-1]
+        self.assertEqual(data[self.coordinator.uid]['queue_version'], 2)
+        self.assertEqual(deltas[self.coordinator.uid]['ops'], [{'op': 'remove', 'index': 0, 'count': 1}])
+        self.assertEqual(deltas[self.coordinator.uid]['from_version'], 1)
+
+    def test_transport_event_does_not_touch_queue(self):
+        self.coordinator.track = 'Next song'
+        self.coordinator.avTransport.fire()
+        calls_before = self.coordinator.calls
+        self.producer._rebuild()
+        # Track info, volume and transport state only -- no Browse
+        self.assertEqual(self.coordinator.calls - calls_before, 3)
+        self.assertEqual(self.published[-1][2], {})
+
+    def test_queue_page(self):
+        result = self.producer.queue_page(self.coordinator.uid, 5, 2)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(len(result['queue']['tracks']), 2)
+        self.assertEqual(self.producer.queue_page('RINCON_missing', 0, 10)['status'], 'error')
+
+
+class BuildSpeakerInfoTest(TestCase):
+    """Coordinators answer for their group; members are asked for volume only."""
+
+    def setUp(self):
+        # Ten speakers: groups of three plus a lone speaker; 20ms per call
+        self.registry = build_fleet(10, latency=0.02)
+        self.speakers = self.registry.speakers()
+        self.coordinators = [s for s in self.speakers if s.is_coordinator]
+        self.members = [s for s in self.speakers if not s.is_coordinator]
+
+    def test_members_only_queried_for_volume(self):
+        infos = build_speaker_info(self.speakers)
+        self.assertEqual(len(infos), 10)
+        for coordinator in self.coordinators:
+            self.assertEqual(coordinator.calls, 4)
+        for member in self.members:
+            self.assertEqual(member.calls, 1)
+
+    def test_members_share_coordinator_playback(self):
+        coordinator = self.coordinators[0]
+        coordinator.track = 'Group song'
+        by_uid = {info['uid']: info for info in build_speaker_info(self.speakers)}
+        for member in coordinator.group.members:
+            info = by_uid[member.uid]
+            self.assertEqual(info['track'], 'Group song')
+            self.assertEqual(len(info['queue']), 20)
+            self.assertEqual(info['is_coordinator'], member is coordinator)
+
+    def test_calls_run_concurrently(self):
+        start = time.monotonic()
+        build_speaker_info(self.speakers)
+        # 22 calls of 20ms each; serially that would be 440ms
+        self.assertLess(time.monotonic() - start, 0.2)
+
+    def test_coordinators_only_subset(self):
+        target = self.coordinators[1]
+        infos = build_speaker_info(
+            self.speakers, coordinators=[target.uid], include_queue=False, include_members=False,
+        )
+        self.assertEqual([info['uid'] for info in infos], [target.uid])
+        self.assertEqual(target.calls, 3)
+        self.assertEqual(sum(s.calls for s in self.speakers), 3)
+
+    def test_unreachable_group_is_skipped(self):
+        offline = self.coordinators[0]
+        offline.get_current_transport_info = MagicMock(side_effect=OSError('timed out'))
+        infos = build_speaker_info(self.speakers)
+        uids = {info['uid'] for info in infos}
+        self.assertFalse(uids & {m.uid for m in offline.group.members})
+        self.assertEqual(len(infos), 10 - len(offline.group.members))
+
+
+def _png(width, height, colour=(200, 30, 30)):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), colour).save(out, format='PNG')
+    return out.getvalue()
+
+
+class AlbumArtCacheTest(TestCase):
+    """Art is fetched once, resized, and evicted least-recently-used first."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.fetch = MagicMock(return_value=_png(1000, 800))
+        self.cache = AlbumArtCache(self.directory, fetch=self.fetch)
+        self.url = 'http://192.168.1.20:1400/getaa?s=1&u=x-sonos-spotify%3Atrack'
+
+    def test_fetches_once_and_resizes(self):
+        thumb, thumb_etag = self.cache.get(self.url, 'thumb')
+        full, full_etag = self.cache.get(self.url, 'full')
+        self.assertEqual(self.cache.get(self.url, 'thumb'), (thumb, thumb_etag))
+        self.fetch.assert_called_once_with(self.url)
+        self.assertNotEqual(thumb_etag, full_etag)
+        with Image.open(thumb) as image:
+            self.assertEqual(image.size, (160, 128))
+        with Image.open(full) as image:
+            self.assertEqual(image.size, (640, 512))
+
+    def test_small_source_is_not_upscaled(self):
+        self.fetch.return_value = _png(64, 64)
+        path, _ = self.cache.get(self.url, 'full')
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (64, 64))
+
+    def test_identical_art_is_stored_once(self):
+        _, first = self.cache.get(self.url, 'thumb')
+        _, second = self.cache.get('https://i.scdn.co/image/abc', 'thumb')
+        self.assertEqual(first, second)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_concurrent_requests_share_one_fetch(self):
+        def slow_fetch(url):
+            time.sleep(0.05)
+            return _png(300, 300)
+        self.fetch.side_effect = slow_fetch
+        threads = [threading.Thread(target=self.cache.get, args=(self.url, 'thumb')) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_finishing_fetch_leaves_a_newer_inflight_lock(self):
+        key = source_digest(self.url)
+        newer = threading.Lock()
+
+        def fetch(url):
+            # A later caller replaced the entry while this fetch was running
+            self.cache._inflight[key] = newer
+            return _png(300, 300)
+        self.fetch.side_effect = fetch
+        self.cache.get(self.url, 'thumb')
+        self.assertIs(self.cache._inflight.get(key), newer)
+
+    def test_lru_eviction(self):
+        self.fetch.side_effect = lambda url: _png(400, 400, colour=(ord(url[-1]) * 40 % 255, 90, 0))
+        blobs = Path(self.directory, 'blobs')
+        self.cache.get('http://a/1', 'thumb')
+        self.cache.get('http://a/2', 'thumb')
+        one_entry = sum(p.stat().st_size for p in blobs.glob('*.jpg')) / 2
+        # Age both entries, then touch 1 so 2 is least recently used
+        for path in blobs.glob('*.jpg'):
+            os.utime(path, (time.time() - 100, time.time() - 100))
+        self.cache.get('http://a/1', 'full')
+        self.cache.get('http://a/1', 'thumb')
+
+        self.cache._max_bytes = one_entry * 2.5
+        self.cache.get('http://a/3', 'thumb')
+
+        self.assertEqual(self.fetch.call_count, 3)
+        self.cache.get('http://a/1', 'thumb')
+        self.assertEqual(self.fetch.call_count, 3)  # still cached
+        self.cache.get('http://a/2', 'thumb')
+        self.assertEqual(self.fetch.call_count, 4)  # was evicted
+
+    def test_bad_image_raises(self):
+        self.fetch.return_value = b'not an image'
+        with self.assertRaises(Exception):
+            self.cache.get(self.url, 'thumb')
+
+
+class AlbumArtViewTest(TestCase):
+    """The art endpoint only serves signed URLs, with strong ETags."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = AlbumArtCache(directory, fetch=MagicMock(return_value=_png(500, 500)))
+        patcher = patch('sonos_control.views.get_art_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.source = 'http://192.168.1.20:1400/getaa?s=1&u=track'
+
+    def test_art_url(self):
+        url = art_url(self.source, 'thumb')
+        self.assertTrue(url.startswith(f'/sonos_control/art/{source_digest(self.source)}/?'))
+        self.assertIsNone(art_url(None))
+        self.assertEqual(art_url('/static/default_album_art.webp'), '/static/default_album_art.webp')
+
+    def test_serves_with_etag_and_long_cache(self):
+        response = self.client.get(art_url(self.source, 'thumb'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        again = self.client.get(art_url(self.source, 'thumb'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    def test_unsigned_source_is_rejected(self):
+        digest = source_digest(self.source)
+        response = self.client.get(f'/sonos_control/art/{digest}/', {'src': 'http://evil.example/x.png'})
+        self.assertEqual(response.status_code, 404)
+        self.cache._fetch.assert_not_called()
+
+    def test_bad_size_and_upstream_failure(self):
+        response = self.client.get(art_url(self.source, 'huge'))
+        self.assertEqual(response.status_code, 400)
+        self.cache._fetch.side_effect = OSError('speaker offline')
+        response = self.client.get(art_url('http://192.168.1.21:1400/getaa', 'thumb'))
+        self.assertEqual(response.status_code, 502)
+
+
+
+class StaleWhileRevalidateCacheTest(TestCase):
+    """Fresh hits are free, stale ones revalidate once in the background."""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_fresh_entry_is_served_without_fetching(self):
+        cache = StaleWhileRevalidateCache(ttl=60, executor=self.executor)
+        fetch = MagicMock(return_value=['a'])
+        self.assertEqual(cache.get('k', fetch).result(timeout=2), ['a'])
+        self.assertEqual(cache.get('k', fetch).result(timeout=2), ['a'])
+        fetch.assert_called_once()
+
+    def test_stale_entry_is_served_then_refreshed(self):
+        cache = StaleWhileRevalidateCache(ttl=0.05, stale_ttl=60, executor=self.executor)
+        cache.get('k', lambda: 'old').result(timeout=2)
+        time.sleep(0.06)
+        self.assertEqual(cache.get('k', lambda: 'new').result(timeout=2), 'old')
+        deadline = time.monotonic() + 2
+        while cache.peek('k') != 'new' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.peek('k'), 'new')
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = StaleWhileRevalidateCache(ttl=60, executor=self.executor)
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(2)
+            return 'v'
+
+        futures = [cache.get('k', fetch) for _ in range(5)]
+        release.set()
+        self.assertEqual([f.result(timeout=2) for f in futures], ['v'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_fetch_is_not_cached(self):
+        cache = StaleWhileRevalidateCache(ttl=60, executor=self.executor)
+        with self.assertRaises(RuntimeError):
+            cache.get('k', MagicMock(side_effect=RuntimeError('boom'))).result(timeout=2)
+        self.assertEqual(cache.get('k', lambda: 'ok').result(timeout=2), 'ok')
+
+
+class SpotifySearchCacheTest(TestCase):
+    """Search results are reused for longer queries when the prefix was complete."""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(2)
+        self.addCleanup(self.executor.shutdown)
+        self.searches = SpotifySearchCache(
+            StaleWhileRevalidateCache(ttl=60, executor=self.executor), debounce=0
+        )
+        self.results = [
+            {'name': 'Yellow Submarine', 'artist': 'The Beatles', 'album': 'Revolver'},
+            {'name': 'Yellow', 'artist': 'Coldplay', 'album': 'Parachutes'},
+        ]
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query('  Yellow   SUBMARINE '), 'yellow submarine')
+
+    def test_complete_prefix_is_filtered_locally(self):
+        self.searches.fetch('u1', 'yellow', lambda: {'results': self.results, 'complete': True}).result(timeout=2)
+        hit = self.searches.lookup('u1', 'yellow beatles')
+        self.assertEqual([r['name'] for r in hit], ['Yellow Submarine'])
+        self.assertIsNone(self.searches.lookup('u2', 'yellow beatles'))
+
+    def test_incomplete_prefix_is_not_reused(self):
+        self.searches.fetch('u1', 'yellow', lambda: {'results': self.results, 'complete': False}).result(timeout=2)
+        self.assertIsNone(self.searches.lookup('u1', 'yellow beatles'))
+        self.assertEqual(self.searches.lookup('u1', 'yellow'), self.results)
+
+    def test_newer_query_supersedes_older(self):
+        first = self.searches.begin('u1')
+        second = self.searches.begin('u1')
+        self.assertFalse(self.searches.is_latest('u1', first))
+        self.assertTrue(self.searches.is_latest('u1', second))
+
+    def test_forget_user(self):
+        self.searches.fetch('u1', 'yellow', lambda: {'results': self.results, 'complete': True}).result(timeout=2)
+        self.searches.forget_user('u1')
+        self.assertIsNone(self.searches.lookup('u1', 'yellow'))
+
+
+def _spotify_track(name):
+    return {
+        'name': name,
+        'artists': [{'name': 'Artist'}],
+        'album': {'name': 'Album', 'images': []},
+        'uri': f'spotify:track:{name}',
+    }
+
+
+class SpotifyViewCacheTest(TestCase):
+    """fetch_spotify_data and spotify_search go through the per-user caches."""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.sp = MagicMock()
+        self.sp.current_user_recently_played.return_value = {'items': [{'track': _spotify_track('a')}]}
+        self.sp.current_user_saved_tracks.return_value = {'items': [{'track': _spotify_track('b')}]}
+        self.sp.current_user_top_tracks.return_value = {'items': [_spotify_track('c')]}
+        self.sp.search.return_value = {'tracks': {'items': [_spotify_track('Yellow')], 'total': 1}}
+
+        library = StaleWhileRevalidateCache(ttl=60, executor=self.executor)
+        searches = SpotifySearchCache(StaleWhileRevalidateCache(ttl=60, executor=self.executor), debounce=0)
+        for target, value in (
+            ('sonos_control.views._spotify_client_and_user', MagicMock(return_value=(self.sp, 'user1'))),
+            ('sonos_control.views.get_library_cache', MagicMock(return_value=library)),
+            ('sonos_control.views.get_search_cache', MagicMock(return_value=searches)),
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_library_is_served_from_cache_when_fresh(self):
+        first = self.client.get(reverse('fetch_spotify_data')).json()
+        self.assertEqual(first['recently_played'][0]['name'], 'a')
+        self.assertEqual(first['favorite_tracks'][0]['name'], 'b')
+        self.assertEqual(first['top_tracks'][0]['name'], 'c')
+
+        second = self.client.get(reverse('fetch_spotify_data')).json()
+        self.assertEqual(second, first)
+        self.sp.current_user_recently_played.assert_called_once()
+        self.sp.current_user_saved_tracks.assert_called_once()
+        self.sp.current_user_top_tracks.assert_called_once()
+
+    def test_search_reuses_results(self):
+        response = self.client.get(reverse('spotify_search'), {'query': 'Yellow'})
+        self.assertEqual(response.json()['search_results'][0]['name'], 'Yellow')
+        self.client.get(reverse('spotify_search'), {'query': ' yellow '})
+        self.client.get(reverse('spotify_search'), {'query': 'yellow album'})
+        self.sp.search.assert_called_once()
+
+
+class SpotifyTokenManagerTest(TestCase):
+    """Clients are shared per user and tokens refreshed once, ahead of expiry."""
+
+    def setUp(self):
+        self.session = MagicMock(spec=requests.Session)
+        self.refreshes = 0
+
+        def post(*args, **kwargs):
+            self.refreshes += 1
+            time.sleep(0.05)
+            response = MagicMock()
+            response.json.return_value = {'access_token': f'access-{self.refreshes}', 'expires_in': 3600}
+            return response
+
+        self.session.post.side_effect = post
+        self.manager = SpotifyTokenManager('id', 'secret', 'http://localhost/cb', session=self.session)
+
+    def _token(self, expires_in):
+        return {'access_token': 'access-0', 'refresh_token': 'refresh', 'expires_at': int(time.time() + expires_in)}
+
+    def test_one_client_per_user(self):
+        first, _ = self.manager.client(self._token(3600))
+        second, _ = self.manager.client(self._token(3600))
+        self.assertIs(first, second)
+        self.assertIs(first._session, self.session)
+
+    def test_due_token_is_refreshed_in_background_pass(self):
+        token = self._token(60)
+        self.manager.client(token)
+        self.manager.refresh_due()
+        _, current = self.manager.client(token)
+        self.assertEqual(current['access_token'], 'access-1')
+        self.assertEqual(current['refresh_token'], 'refresh')
+        self.manager.refresh_due()  # now fresh, nothing to do
+        self.assertEqual(self.refreshes, 1)
+
+    def test_concurrent_refreshes_are_single_flight(self):
+        token = self._token(60)
+        self.manager.client(token)
+        user = spotify_user_key(token)
+        threads = [threading.Thread(target=self.manager.refresh, args=(user,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.refreshes, 1)
+
+    def test_user_key_survives_refresh_token_rotation(self):
+        def rotate(*args, **kwargs):
+            self.refreshes += 1
+            response = MagicMock()
+            response.json.return_value = {
+                'access_token': 'access-1', 'refresh_token': 'rotated', 'expires_in': 3600,
+            }
+            return response
+        self.session.post.side_effect = rotate
+        first, signed_in = self.manager.client(self._token(60))
+        self.manager.refresh_due()
+
+        second, current = self.manager.client(signed_in)
+        self.assertIs(second, first)
+        self.assertEqual(current['refresh_token'], 'rotated')
+        self.assertEqual(spotify_user_key(current), spotify_user_key(signed_in))
+        self.assertEqual(len(self.manager._users), 1)
+
+    def test_signing_in_again_forgets_previous_user(self):
+        old = with_user_key(self._token(3600))
+        session = self.client.session
+        session['spotify_token_info'] = old
+        session.save()
+        self.manager.client(old)
+        new = {'access_token': 'access-9', 'refresh_token': 'other', 'expires_at': int(time.time() + 3600)}
+        with patch('sonos_control.views.ServerCacheHandler') as server_cache, \
+                patch('sonos_control.views.get_token_manager', return_value=self.manager):
+            server_cache.return_value.get_cached_token.return_value = new
+            self.client.get(reverse('spotify_auth_status'))
+        self.assertIsNone(self.manager.token(spotify_user_key(old)))
+        self.assertEqual(self.client.session['spotify_token_info']['user_key'], spotify_user_key(new))
+
+    def test_idle_users_are_dropped(self):
+        token = self._token(60)
+        self.manager.client(token)
+        self.manager._idle_timeout = 0
+        self.manager.refresh_due()
+        self.assertIsNone(self.manager.token(spotify_user_key(token)))
+        self.assertEqual(self.refreshes, 0)
+
+    def test_view_stores_refreshed_token_in_session(self):
+        token = self._token(60)
+        session = self.client.session
+        session['spotify_token_info'] = token
+        session.save()
+        self.manager.client(token)
+        self.manager.refresh_due()
+
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        library = StaleWhileRevalidateCache(ttl=60, executor=executor)
+        with patch('sonos_control.views.get_token_manager', return_value=self.manager), \
+                patch('sonos_control.views.get_library_cache', return_value=library):
+            self.client.get(reverse('fetch_spotify_data'))
+        self.assertEqual(self.client.session['spotify_token_info']['access_token'], 'access-1')
+
+
+class SonosBatchTest(TestCase):
+    """Batched operations run in parallel unless one depends on another."""
+
+    def setUp(self):
+        self.executor = KeyedCommandExecutor(max_workers=16)
+        self.addCleanup(self.executor.shutdown)
+
+    def _run(self, registry, operations, **kwargs):
+        return asyncio.run(run_batch(operations, registry=registry, executor=self.executor, **kwargs))
+
+    def test_party_mode_takes_about_one_round_trip_per_speaker(self):
+        registry = build_fleet(9, group_size=1, latency=0.05)
+        speakers = registry.speakers()
+        operations = [{'op': 'join', 'speaker': s.uid, 'coordinator': speakers[0].uid} for s in speakers[1:]]
+        operations.append({'op': 'clear_queue', 'speaker': speakers[0].uid})
+
+        start = time.perf_counter()
+        results = self._run(registry, operations)
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(r['status'] == 'success' for r in results))
+        self.assertEqual(len(speakers[0].group.members), 9)
+        self.assertLess(elapsed, 0.05 * len(operations) / 2)
+
+    def test_dependent_operations_keep_their_order(self):
+        registry = build_fleet(3, group_size=3)
+        member = registry.speakers()[1]
+        order = []
+        member.unjoin = MagicMock(side_effect=lambda: (time.sleep(0.05), order.append('unjoin')))
+        member.clear_queue = MagicMock(side_effect=lambda: order.append('clear'))
+
+        results = self._run(registry, [
+            {'op': 'unjoin', 'speaker': member.uid},
+            {'op': 'clear_queue', 'speaker': member.uid},
+        ])
+        self.assertEqual([r['status'] for r in results], ['success', 'success'])
+        self.assertEqual(order, ['unjoin', 'clear'])
+
+    def test_playback_goes_to_the_coordinator_after_joins(self):
+        registry = build_fleet(4, group_size=1)
+        a, b = registry.speakers()[:2]
+        a.clear_queue = MagicMock()
+        b.clear_queue = MagicMock()
+        self._run(registry, [
+            {'op': 'join', 'speaker': b.uid, 'coordinator': a.uid},
+            {'op': 'clear_queue', 'speaker': b.uid},
+        ])
+        a.clear_queue.assert_called_once()
+        b.clear_queue.assert_not_called()
+
+    def test_invalid_and_failing_operations_are_reported_per_operation(self):
+        registry = build_fleet(2, group_size=1)
+        a, b = registry.speakers()
+        b.unjoin = MagicMock(side_effect=OSError('unreachable'))
+        results = self._run(registry, [
+            {'op': 'volume', 'speaker': a.uid, 'volume': 150},
+            {'op': 'dance', 'speaker': a.uid},
+            {'op': 'volume', 'speaker': 'RINCON_GONE', 'volume': 10},
+            {'op': 'unjoin', 'speaker': b.uid},
+        ])
+        self.assertEqual([r['status'] for r in results], ['success', 'error', 'error', 'error'])
+        self.assertEqual(results[0]['volume'], 100)
+        self.assertEqual(results[3]['message'], 'unreachable')
+        self.assertEqual([r['index'] for r in results], [0, 1, 2, 3])
+
+    def test_operations_reading_a_failed_write_are_skipped(self):
+        registry = build_fleet(3, group_size=1)
+        a, b, c = registry.speakers()
+        b.join = MagicMock(side_effect=OSError('unreachable'))
+        a.clear_queue = MagicMock()
+        b.clear_queue = MagicMock()
+        c.join = MagicMock()
+        results = self._run(registry, [
+            {'op': 'join', 'speaker': b.uid, 'coordinator': a.uid},
+            {'op': 'clear_queue', 'speaker': b.uid},  # reads b's group
+            {'op': 'join', 'speaker': c.uid, 'coordinator': b.uid},  # reads b's group
+            {'op': 'volume', 'speaker': b.uid, 'volume': 20},  # independent of the join
+        ])
+        self.assertEqual([r['status'] for r in results], ['error', 'error', 'error', 'success'])
+        self.assertEqual(results[1]['message'], 'Skipped: operation 0 (join) failed: unreachable')
+        a.clear_queue.assert_not_called()
+        b.clear_queue.assert_not_called()
+        c.join.assert_not_called()
+
+    def test_timeout_reports_unfinished_operations(self):
+        registry = build_fleet(1, group_size=1)
+        speaker = registry.speakers()[0]
+        release = threading.Event()
+        self.addCleanup(release.set)
+        speaker.clear_queue = MagicMock(side_effect=lambda: release.wait(5))
+        results = self._run(registry, [{'op': 'clear_queue', 'speaker': speaker.uid}], timeout=0.05)
+        self.assertEqual(results[0]['status'], 'error')
+
+    def test_view(self):
+        registry = build_fleet(2, group_size=1)
+        a, b = registry.speakers()
+        with patch('sonos_control.batch.get_registry', return_value=registry), \
+                patch('sonos_control.batch.get_executor', return_value=self.executor):
+            response = self.client.post(
+                reverse('sonos_batch'),
+                data=json.dumps({'operations': [{'op': 'join', 'speaker': b.uid, 'coordinator': a.uid}]}),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['status'], 'success')
+            self.assertIn(b, a.group.members)
+
+            bad = self.client.post(reverse('sonos_batch'), data='{"operations": 3}',
+                                   content_type='application/json')
+            self.assertEqual(bad.status_code, 400)
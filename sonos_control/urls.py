@@ -9,6 +9,8 @@ urlpatterns = [
     path('play-track/', views.play_track, name='play_track'),
     path('play-uri/', views.play_uri, name='play_uri'),
     path('queue-track/', views.queue_track, name='queue_track'),
+    path('batch/', views.sonos_batch, name='sonos_batch'),
+    path('art/<str:digest>/', views.album_art, name='album_art'),
     path('search/', views.spotify_search, name='spotify_search'),
     #path('spotify/login/', views.spotify_login, name='spotify_login'),
     path('spotify/auth/qrcode/', views.spotify_auth_qrcode, name='spotify_auth_qrcode'),
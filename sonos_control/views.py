@@ -20,19 +20,19 @@ from django.core.cache import cache
 import os
 from .utils import generate_auth_url, generate_qr_code
 from .cache_handler import ServerCacheHandler, SessionCacheHandler
-
-
-def _discover_sonos(**kwargs):
-    """Discover Sonos speakers, optionally binding to a specific network interface.
-
-    Set the SONOS_INTERFACE env var to the IP of the network interface
-    where Sonos speakers live (needed when running inside Docker with
-    host networking, since soco may pick the wrong interface).
-    """
-    interface = os.getenv('SONOS_INTERFACE')
-    if interface:
-        kwargs.setdefault('interface_addr', interface)
-    return soco.discover(**kwargs)
+from .registry import get_registry
+from .batch import BatchError, run_batch
+from .snapshot import build_speaker_info
+from .album_art import ART_MAX_AGE, AlbumArtError, art_url, get_art_cache, verify_digest
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from .spotify_cache import (
+    get_library_cache, get_search_cache, normalize_query, spotify_user_key, with_user_key,
+)
+from .spotify_tokens import get_token_manager
+import asyncio
+import functools
 
 
 def sonos_control_view(request):
@@ -66,13 +66,13 @@ def toggle_group(request):
         if action != 'toggle_group':
             return JsonResponse({'status': 'error', 'message': 'Invalid action'}, status=400)
 
-        # Discover the Sonos speakers
-        speakers = _discover_sonos()
-        if not speakers:
+        # Look up the Sonos speakers in the registry (no network round trip)
+        registry = get_registry()
+        if not len(registry):
             return JsonResponse({'status': 'error', 'message': 'No speakers found'}, status=404)
 
         # Find the main speaker (coordinator) by UUID
-        speaker = next((s for s in speakers if s.uid == speaker_uuid), None)
+        speaker = registry.get(speaker_uuid)
         if not speaker:
             return JsonResponse({'status': 'error', 'message': f'Speaker with UUID {speaker_uuid} not found'}, status=404)
 
@@ -80,7 +80,7 @@ def toggle_group(request):
         
         # Find the target speaker by UUID
         for target_uid in target_speakers_uuid:
-            target_speaker = next((s for s in speakers if s.uid == target_uid), None)
+            target_speaker = registry.get(target_uid)
             if not target_speaker:
                 return JsonResponse({'status': 'error', 'message': f'Target speaker with UID {target_uid} not found'}, status=404)
 
@@ -127,13 +127,12 @@ def adjust_speaker_volume(speaker_uid, volume):
     if not speaker_uid or not volume:
         return {'status': 'error', 'message': 'Invalid parameters', 'status_code': 400}
 
-    # Discover Sonos speakers
-    speakers = _discover_sonos()
-    if not speakers:
+    # Look up the speaker by its UID in the registry
+    registry = get_registry()
+    if not len(registry):
         return {'status': 'error', 'message': 'No Sonos speakers found', 'status_code': 404}
 
-    # Find the speaker by its UID
-    speaker = next((s for s in speakers if s.uid == speaker_uid), None)
+    speaker = registry.get(speaker_uid)
     if not speaker:
         return {'status': 'error', 'message': f'Speaker {speaker_uid} not found', 'status_code': 404}
 
@@ -153,13 +152,12 @@ def speaker_play_pause(speaker_uid, action, track_index=None):
     if not speaker_uid or not action:
         return {'status': 'error', 'message': 'Invalid parameters', 'status_code': 400}
 
-    # Discover Sonos speakers
-    speakers = _discover_sonos()
-    if not speakers:
+    # Look up the speaker by its UID in the registry
+    registry = get_registry()
+    if not len(registry):
         return {'status': 'error', 'message': 'No Sonos speakers found', 'status_code': 404}
 
-    # Find the speaker by its UID
-    speaker = next((s for s in speakers if s.uid == speaker_uid), None)
+    speaker = registry.get(speaker_uid)
     if not speaker:
         return {'status': 'error', 'message': f'Speaker {speaker_uid} not found', 'status_code': 404}
 
@@ -205,10 +203,10 @@ def queue_track(request):
         
         print(f'Looking for speaker: {speakerUid} - adding track: {track_uri} at position: {position}')
         
-        # Find the Sonos speaker by name
-        speakers = _discover_sonos()
-        if speakers:
-            speaker = next((s for s in speakers if s.uid == speakerUid), None)
+        # Find the Sonos speaker by UID
+        registry = get_registry()
+        if len(registry):
+            speaker = registry.get(speakerUid)
             if speaker:
                 try:
                     share_link_plugin = ShareLinkPlugin(speaker)
@@ -237,10 +235,10 @@ def play_uri(request):
         
         print(f'Looking for speaker: {speakerUid}')
         
-        # Find the Sonos speaker by name
-        speakers = _discover_sonos()
-        if speakers:
-            speaker = next((s for s in speakers if s.uid == speakerUid), None)
+        # Find the Sonos speaker by UID
+        registry = get_registry()
+        if len(registry):
+            speaker = registry.get(speakerUid)
             if speaker:
                 try:
                     share_link_plugin = ShareLinkPlugin(speaker)
@@ -276,13 +274,12 @@ def play_track(request):
         if not speaker_uid or track_index is None:
             return JsonResponse({'status': 'error', 'message': 'Invalid parameters'}, status=400)
 
-        # Discover Sonos speakers
-        speakers = _discover_sonos()
-        if not speakers:
+        # Look up the speaker by its UID in the registry
+        registry = get_registry()
+        if not len(registry):
             return JsonResponse({'status': 'error', 'message': 'No Sonos speakers found'}, status=404)
 
-        # Find the speaker by its UID
-        speaker = next((s for s in speakers if s.uid == speaker_uid), None)
+        speaker = registry.get(speaker_uid)
         if not speaker:
             return JsonResponse({'status': 'error', 'message': f'Speaker {speaker_uid} not found'}, status=404)
 
@@ -295,14 +292,38 @@ def play_track(request):
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
 
+async def sonos_batch(request):
+    """Run an ordered list of Sonos operations; one result per operation.
+
+    Expects a JSON body ``{"operations": [{"op": ..., "speaker": ...}, ...]}``;
+    see :mod:`sonos_control.batch` for the operations and their ordering.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    if not isinstance(operations, list):
+        return JsonResponse({'status': 'error', 'message': 'operations must be a list'}, status=400)
+
+    try:
+        results = await run_batch(operations)
+    except BatchError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    ok = all(result['status'] == 'success' for result in results)
+    return JsonResponse({'status': 'success' if ok else 'error', 'results': results})
+
+
 def sonos_clear_queue(speaker_uid):
     
     if not speaker_uid:
         return {'status': 'error', 'message': 'Invalid parameters', 'status_code': 400}    
         
-    # Discover and find the speaker by UID
-    speakers = _discover_sonos()
-    speaker = next((s for s in speakers if s.uid == speaker_uid), None)
+    # Find the speaker by UID
+    speaker = get_registry().get(speaker_uid)
 
     if speaker:
         try:
@@ -322,13 +343,12 @@ def speaker_play_pause(speaker_uid, action, track_index=None):
     if not speaker_uid or not action:
         return {'status': 'error', 'message': 'Invalid parameters', 'status_code': 400}
 
-    # Discover Sonos speakers
-    speakers = _discover_sonos()
-    if not speakers:
+    # Look up the speaker by its UID in the registry
+    registry = get_registry()
+    if not len(registry):
         return {'status': 'error', 'message': 'No Sonos speakers found', 'status_code': 404}
 
-    # Find the speaker by its UID
-    speaker = next((s for s in speakers if s.uid == speaker_uid), None)
+    speaker = registry.get(speaker_uid)
     if not speaker:
         return {'status': 'error', 'message': f'Speaker {speaker_uid} not found', 'status_code': 404}
 
@@ -348,63 +368,45 @@ def speaker_play_pause(speaker_uid, action, track_index=None):
         return {'status': 'error', 'message': f'Failed to toggle play/pause: {str(e)}', 'status_code': 500}
 
 def sonos_get_speaker_info():
-    speakers_info = []
-    speakers = _discover_sonos()
-    all_ungrouped_speakers = []
-
-    if speakers:
-        for speaker in speakers:
-            # Get list of speakers that are not part of any group
-            if len(speaker.group.members) == 1:
-                all_ungrouped_speakers.append(speaker)
-
-        for speaker in speakers:
-            # Get speaker info like current track, artist, album, volume, etc.
-            current_track = speaker.get_current_track_info()
-            queue = speaker.get_queue(full_album_art_uri=True)  # Fetch the speaker's queue
-            
-            #print(f'Speaker - {speaker.player_name} - is coordinator: {speaker.is_coordinator}: group label: {speaker.group.label}, this speaker {speaker} - group: {speaker.group}')
-            
-            # Prepare the queue list with album art
-            queue_with_album_art = []
-            for track in queue:
-                album_art_uri = track.album_art_uri if track.album_art_uri else None
-                queue_with_album_art.append({
-                    'title': track.title,
-                    'artist': track.creator,  # Use 'creator' for the artist
-                    'album_art': album_art_uri
-                })
-            
-            # Copy list of ungrouped speakers but remove the current speaker
-            ungrouped_speakers = all_ungrouped_speakers.copy()
-            try:
-                ungrouped_speakers.remove(speaker)
-            except ValueError:
-                pass
-
-            # Prepare the speaker info
-            speaker_info = {
-                'name': speaker.player_name,
-                'uid': speaker.uid,
-                'track': current_track['title'],
-                'artist': current_track['artist'],
-                'album': current_track['album'],
-                'album_art': current_track['album_art'],
-                'volume': speaker.volume,
-                'play_state': speaker.get_current_transport_info()['current_transport_state'],
-                'queue': queue_with_album_art,  # Include the queue with album art
-                'is_coordinator': speaker.is_coordinator,
-                'is_grouped': len(speaker.group.members) > 1,
-                'group_label': speaker.group.label,
-                'group': speaker.group.members,  # Get group members
-                'ungrouped': ungrouped_speakers
-            }
-
-            speakers_info.append(speaker_info)
-            
-        speakers_info = sorted(speakers_info, key=lambda x: x['name'])
-    
-    return speakers_info
+    """Info for every visible speaker, for the initial page render.
+
+    Only coordinators are asked about playback and queue; members are asked
+    for their volume alone, and all calls run concurrently.
+    """
+    return build_speaker_info(get_registry().speakers())
+
+async def album_art(request, digest):
+    """Serve a cached, resized rendition of the album art at ?src= (see album_art.py)."""
+    source_url = request.GET.get('src', '')
+    size = request.GET.get('size', 'thumb')
+    if not verify_digest(digest, source_url):
+        return HttpResponse(status=404)
+
+    try:
+        # Fetching and resizing block, so keep them off the shared sync thread
+        path, etag = await sync_to_async(get_art_cache().get, thread_sensitive=False)(source_url, size)
+    except ValueError:
+        return HttpResponse(status=400)
+    except AlbumArtError as e:
+        print(f'Album art unavailable: {e}')
+        return HttpResponse(status=502)
+
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={ART_MAX_AGE}, immutable',
+    }
+    if headers['ETag'] in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            content = await sync_to_async(path.read_bytes, thread_sensitive=False)()
+        except OSError:
+            return HttpResponse(status=502)  # evicted between lookup and read
+        response = HttpResponse(content, content_type='image/jpeg')
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
 
 ####################################################
 # Spotify Integration
@@ -458,9 +460,18 @@ def spotify_auth_qrcode(request):
 
     return JsonResponse(response_data)    
 
+def _forget_spotify_user(user):
+    """Drop a Spotify user's cached data and client."""
+    get_search_cache().forget_user(user)
+    get_library_cache().discard(lambda key: key[0] == user)
+    get_token_manager().forget(user)
+
 def spotify_logout(request):
     
-    # Clear the Spotify token info from the session
+    # Drop the user's cached data and client, then clear the Spotify token info from the session
+    user = spotify_user_key(SessionCacheHandler(request.session).get_cached_token())
+    if user:
+        _forget_spotify_user(user)
     SessionCacheHandler(request.session).delete_cached_token()
     
     return redirect('sonos_control')
@@ -473,14 +484,12 @@ def get_spotify_instance(request):
         # Redirect the user to Spotify authorization page
         return redirect('spotify_auth')
     
-    sp_oauth = SpotifyOAuth(
-        client_id=settings.SPOTIFY_CLIENT_ID,
-        client_secret=settings.SPOTIFY_CLIENT_SECRET,
-        redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-        cache_handler=SessionCacheHandler(request.session)
-    )
-    
-    return spotipy.Spotify(auth_manager=sp_oauth)
+    # One shared client per user; its token is refreshed in the background
+    sp, current_token_info = get_token_manager().client(token_info)
+    if current_token_info != token_info:
+        SessionCacheHandler(request.session).save_token_to_cache(current_token_info)
+
+    return sp
     
 def spotify_auth_status(request):
     session_id = request.GET.get('session_id')
@@ -489,6 +498,11 @@ def spotify_auth_status(request):
     token_info = server_cache.get_cached_token()
 
     if token_info:
+        # Signing in again replaces the session's user; drop the old one's entries
+        token_info = with_user_key(token_info)
+        previous = spotify_user_key(SessionCacheHandler(request.session).get_cached_token())
+        if previous and previous != spotify_user_key(token_info):
+            _forget_spotify_user(previous)
         #add the token info to the session
         #request.session['spotify_token_info'] = token_info
         SessionCacheHandler(request.session).save_token_to_cache(token_info)
@@ -510,7 +524,8 @@ def spotify_callback(request):
         client_secret=settings.SPOTIFY_CLIENT_SECRET,
         redirect_uri=settings.SPOTIFY_REDIRECT_URI,
         state=state,
-        cache_handler=server_cache
+        cache_handler=server_cache,
+        requests_session=get_token_manager().session,
     )
 
     try:
@@ -535,80 +550,143 @@ def spotify_home(request):
         # Redirect to login if not authenticated
         return sp    
 
+def spotify_album_art(images):
+    """Proxied URL of the smallest Spotify image that still fills a grid card."""
+    if not images:
+        return None
+    large_enough = [image for image in images if (image.get('width') or 0) >= 300]
+    image = min(large_enough, key=lambda image: image['width']) if large_enough else images[0]
+    return art_url(image['url'], 'full')
+
+
+def _recently_played(sp):
+    # Fetch recently played tracks
+    recently_played_results = sp.current_user_recently_played(limit=20)
+    return [{
+        'name': track['track']['name'],
+        'artist': track['track']['artists'][0]['name'],
+        'album': track['track']['album']['name'],
+        'uri': track['track']['uri'],
+        'album_art': spotify_album_art(track['track']['album']['images'])  # Fetch album art (proxied)
+    } for track in recently_played_results['items']]
+
+
+def _favorite_tracks(sp):
+    # Fetch favorite tracks
+    favorite_tracks_results = sp.current_user_saved_tracks(limit=20)
+    return [{
+        'name': track['track']['name'],
+        'artist': track['track']['artists'][0]['name'],
+        'album': track['track']['album']['name'],
+        'uri': track['track']['uri'],
+        'album_art': spotify_album_art(track['track']['album']['images'])  # Fetch album art (proxied)
+    } for track in favorite_tracks_results['items']]
+
+
+def _top_tracks(sp):
+    #fetch top tracks
+    top_tracks_results = sp.current_user_top_tracks(limit=20)
+    return [{
+        'name': track['name'],
+        'artist': track['artists'][0]['name'],
+        'album': track['album']['name'],
+        'uri': track['uri'],
+        'album_art': spotify_album_art(track['album']['images'])  # Fetch album art (proxied)
+    } for track in top_tracks_results['items']]
+
+
+# Library shelves shown on the Spotify tab, each cached per user
+SPOTIFY_LIBRARY = {
+    'recently_played': _recently_played,
+    'favorite_tracks': _favorite_tracks,
+    'top_tracks': _top_tracks,
+}
+
+SPOTIFY_SEARCH_LIMIT = 18
+
+
+def _spotify_client_and_user(request):
+    """The user's Spotify client and cache key, or (None, None) if not signed in."""
+    sp = get_spotify_instance(request)
+    if not isinstance(sp, spotipy.Spotify):
+        return None, None
+    user = spotify_user_key(SessionCacheHandler(request.session).get_cached_token())
+    return sp, user
+
+
+def _spotify_error_response(e):
+    if 'http_status' in dir(e) and e.http_status == 401:
+        return JsonResponse({'error': 'Spotify token expired'}, status=401)
+    print(f"Error: {e}")
+    return JsonResponse({'error': str(e)}, status=500)
+
+
 def fetch_spotify_data(request):
     try:
-        sp = get_spotify_instance(request)
-        
-        # Fetch recently played tracks
-        recently_played_results = sp.current_user_recently_played(limit=20)
-        recently_played = [{
-            'name': track['track']['name'],
-            'artist': track['track']['artists'][0]['name'],
-            'album': track['track']['album']['name'],
-            'uri': track['track']['uri'],
-            'album_art': track['track']['album']['images'][0]['url'] if track['track']['album']['images'] else None  # Fetch album art
-        } for track in recently_played_results['items']]
-        
-        # Fetch favorite tracks
-        favorite_tracks_results = sp.current_user_saved_tracks(limit=20)
-        favorite_tracks = [{
-            'name': track['track']['name'],
-            'artist': track['track']['artists'][0]['name'],
-            'album': track['track']['album']['name'],
-            'uri': track['track']['uri'],
-            'album_art': track['track']['album']['images'][0]['url'] if track['track']['album']['images'] else None  # Fetch album art
-        } for track in favorite_tracks_results['items']]
-        
-        #fetch top tracks
-        top_tracks_results = sp.current_user_top_tracks(limit=20)
-        top_tracks = [{
-            'name': track['name'],
-            'artist': track['artists'][0]['name'],
-            'album': track['album']['name'],
-            'uri': track['uri'],
-            'album_art': track['album']['images'][0]['url'] if track['album']['images'] else None  # Fetch album art
-        } for track in top_tracks_results['items']]
-
-        return JsonResponse({
-            'recently_played': recently_played,
-            'favorite_tracks': favorite_tracks,
-            'top_tracks': top_tracks
-        })
+        sp, user = _spotify_client_and_user(request)
+        if sp is None:
+            return JsonResponse({'error': 'Spotify is not connected'}, status=401)
+
+        # The shelves are fetched concurrently; fresh ones cost no API call
+        library = get_library_cache()
+        futures = {
+            name: library.get((user, name), functools.partial(load, sp))
+            for name, load in SPOTIFY_LIBRARY.items()
+        }
+        return JsonResponse({name: future.result() for name, future in futures.items()})
     except Exception as e:
-        if 'http_status' in dir(e) and e.http_status == 401:
-            return JsonResponse({'error': 'Spotify token expired'}, status=401)
-        else:
-            print(f"Error: {e}")
-            return JsonResponse({'error': str(e)}, status=500)
+        return _spotify_error_response(e)
+
 
-def spotify_search(request):
-    query = request.GET.get('query', '')
-    search_results = []
+def _search_tracks(sp, query):
+    # Search on Spotify for tracks, albums, and artists
+    results = sp.search(q=query, type='track,album,artist', limit=SPOTIFY_SEARCH_LIMIT)
+    tracks = results.get('tracks', {})
+
+    # Structure the search results to return relevant information as JSON
+    search_results = [{
+        'name': item['name'],
+        'artist': item['artists'][0]['name'],
+        'album': item['album']['name'],
+        'album_art': spotify_album_art(item['album']['images']),
+        'uri': item['uri'],
+    } for item in tracks.get('items', [])]
+
+    # Fewer hits than the limit means these are all of them
+    return {'results': search_results, 'complete': tracks.get('total', 0) <= SPOTIFY_SEARCH_LIMIT}
+
+
+async def spotify_search(request):
+    query = normalize_query(request.GET.get('query', ''))
+    if not query:
+        return JsonResponse({'search_results': []})
 
     try:
         # Get the Spotify instance for the authenticated user
-        sp = get_spotify_instance(request)
-
-        if query:
-            # Search on Spotify for tracks, albums, and artists
-            results = sp.search(q=query, type='track,album,artist', limit=18)
-            
-            # Structure the search results to return relevant information as JSON
-            for item in results.get('tracks', {}).get('items', []):
-                search_results.append({
-                    'name': item['name'],
-                    'artist': item['artists'][0]['name'],
-                    'album': item['album']['name'],
-                    'album_art': item['album']['images'][0]['url'] if item['album']['images'] else None,
-                    'uri': item['uri'],
-                })
-
+        sp, user = await sync_to_async(_spotify_client_and_user)(request)
+        if sp is None:
+            return JsonResponse({'error': 'Spotify is not connected'}, status=401)
+
+        searches = get_search_cache()
+        cached = searches.lookup(user, query)
+        if cached is not None:
+            return JsonResponse({'search_results': cached})
+
+        # Give the user a moment to send a newer query before calling Spotify
+        ticket = searches.begin(user)
+        await asyncio.sleep(searches.debounce)
+        if not searches.is_latest(user, ticket):
+            return JsonResponse({'search_results': [], 'superseded': True})
+
+        result = await asyncio.wrap_future(
+            searches.fetch(user, query, functools.partial(_search_tracks, sp, query))
+        )
     except Exception as e:
         # Catch any errors, return the error message in the JSON response
-        return JsonResponse({'error': str(e)}, status=500)
+        return _spotify_error_response(e)
 
     # Return the search results as JSON
-    return JsonResponse({'search_results': search_results})
+    return JsonResponse({'search_results': result['results']})
 
 
 
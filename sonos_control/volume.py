@@ -0,0 +1,155 @@
+"""
+Coalescing, rate-limited volume changes for Sonos speakers.
+
+Dragging a volume slider emits a burst of ``volume`` actions. Sending each one
+as its own ``SetVolume`` SOAP call queued them up behind each other and the
+speaker lagged well behind the finger. The :class:`VolumeCoalescer` instead:
+
+* keeps only the **latest** requested target per speaker UID -- intermediate
+  values that arrive while a call is in flight are simply overwritten,
+* sends at most ``VOLUME_RATE`` ``SetVolume`` calls per second per speaker,
+* runs the calls on the keyed command executor (see :mod:`.commands`) under
+  the speaker's UID, so they stay ordered with that speaker's other commands
+  and different speakers are adjusted in parallel. A call held back by the
+  rate limit waits on a timer, not on one of the executor's workers.
+
+Callers acknowledge the requested value straight away (optimistically); the
+real volume arrives later through the ``RenderingControl`` event that the
+state producer pushes to every client. If a call fails the coordinator is
+marked dirty so the next push corrects the optimistic value.
+
+Public API:
+    * :func:`get_volume_coalescer` -> the process-wide coalescer
+    * :meth:`VolumeCoalescer.set_volume(uid, volume)` -> one speaker
+    * :meth:`VolumeCoalescer.set_group_volume(uid, volume)` -> every member
+      of ``uid``'s group
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from .commands import KeyedCommandExecutor, get_executor
+from .producer import get_producer
+from .registry import SpeakerRegistry, get_registry
+
+logger = logging.getLogger(__name__)
+
+# Maximum SetVolume calls per second, per speaker.
+VOLUME_RATE = 5
+
+
+class VolumeCoalescer:
+    """Collapses bursts of volume targets into at most ``rate`` calls/second."""
+
+    def __init__(
+        self,
+        registry: SpeakerRegistry,
+        executor: KeyedCommandExecutor,
+        rate: float = VOLUME_RATE,
+        on_failure: Callable[[Any], None] | None = None,
+    ) -> None:
+        self._registry = registry
+        self._executor = executor
+        self._interval = 1.0 / rate
+        self._on_failure = on_failure
+        self._lock = threading.Lock()
+        # uid -> latest target not yet sent; a uid is present in _scheduled
+        # while a drain job for it is waiting, queued or running
+        self._targets: dict[str, int] = {}
+        self._scheduled: set[str] = set()
+        self._last_sent: dict[str, float] = {}
+
+    def set_volume(self, speaker_uid: str, volume: Any) -> int:
+        """Request ``volume`` for one speaker; returns the clamped target.
+
+        Raises ``ValueError`` for an unknown speaker or a non-numeric volume.
+        """
+        target = max(0, min(100, int(volume)))
+        if self._registry.get(speaker_uid) is None:
+            raise ValueError(f'Speaker {speaker_uid} not found')
+
+        with self._lock:
+            self._targets[speaker_uid] = target
+            if speaker_uid in self._scheduled:
+                return target  # the pending drain will pick up the new value
+            self._scheduled.add(speaker_uid)
+        self._schedule(speaker_uid)
+        return target
+
+    def set_group_volume(self, speaker_uid: str, volume: Any) -> int:
+        """Set every member of ``speaker_uid``'s group to ``volume`` in parallel."""
+        speaker = self._registry.get(speaker_uid)
+        if speaker is None:
+            raise ValueError(f'Speaker {speaker_uid} not found')
+        group = speaker.group  # served from the topology event cache
+        members = group.members if group is not None else [speaker]
+        target = None
+        # Each member is its own executor key, so the calls run concurrently
+        for member in members:
+            target = self.set_volume(member.uid, volume)
+        return target
+
+    def _schedule(self, speaker_uid: str) -> None:
+        """Queue a drain for ``speaker_uid`` once its rate limit allows one."""
+        wait = self._last_sent.get(speaker_uid, 0.0) + self._interval - time.monotonic()
+        if wait <= 0:
+            self._executor.submit(speaker_uid, self._drain, speaker_uid)
+            return
+        # Wait out the rate limit off the pool (so the newest target is the
+        # one sent) instead of holding a worker every speaker shares
+        timer = threading.Timer(wait, self._executor.submit, (speaker_uid, self._drain, speaker_uid))
+        timer.daemon = True
+        timer.start()
+
+    def _drain(self, speaker_uid: str) -> None:
+        with self._lock:
+            target = self._targets.pop(speaker_uid, None)
+            if target is None:
+                self._scheduled.discard(speaker_uid)
+                return
+
+        speaker = self._registry.get(speaker_uid)
+        try:
+            if speaker is None:
+                raise ValueError(f'Speaker {speaker_uid} not found')
+            speaker.volume = target
+        except Exception as exc:  # noqa: BLE001 - reported via on_failure
+            logger.warning("Failed to set volume on %s: %s", speaker_uid, exc)
+            if self._on_failure is not None and speaker is not None:
+                self._on_failure(speaker)
+        finally:
+            self._last_sent[speaker_uid] = time.monotonic()
+
+        with self._lock:
+            if speaker_uid not in self._targets:
+                self._scheduled.discard(speaker_uid)
+                return
+        # A newer target arrived meanwhile; queue behind other commands
+        self._schedule(speaker_uid)
+
+
+def _resync_after_failure(speaker: Any) -> None:
+    """Re-push the real state so clients drop the optimistic volume."""
+    group = speaker.group
+    coordinator = group.coordinator if group is not None else speaker
+    get_producer().mark_dirty(coordinator.uid)
+
+
+_coalescer: VolumeCoalescer | None = None
+_coalescer_lock = threading.Lock()
+
+
+def get_volume_coalescer() -> VolumeCoalescer:
+    """Return the process-wide volume coalescer."""
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = VolumeCoalescer(
+                    get_registry(), get_executor(), on_failure=_resync_after_failure
+                )
+    return _coalescer
@@ -1 +1,4 @@
 from django.contrib import admin
+from .models import VacationRun
+
+admin.site.register(VacationRun)
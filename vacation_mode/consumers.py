@@ -0,0 +1,32 @@
+# vacation_mode/consumers.py
+
+import json
+
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from . import events
+from .executor import get_active_run
+
+
+class VacationRunConsumer(AsyncWebsocketConsumer):
+    """Sends the page the active run on connect, then its changes as they happen."""
+
+    async def connect(self):
+        await self.accept()
+
+        # Join the group before reading the snapshot, so no change falls in
+        # between (a change the snapshot already has is harmless to repeat)
+        await self.channel_layer.group_add(events.RUN_GROUP, self.channel_name)
+        events.get_watcher().add_socket()
+
+        run = await sync_to_async(get_active_run)()
+        await self.send(text_data=json.dumps({"type": "snapshot", "run": run}))
+
+    async def disconnect(self, close_code):
+        events.get_watcher().remove_socket()
+        await self.channel_layer.group_discard(events.RUN_GROUP, self.channel_name)
+
+    async def run_update(self, event):
+        """Forward one run or step change read by the RunWatcher to this client."""
+        await self.send(text_data=json.dumps(event["update"]))
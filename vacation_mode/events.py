@@ -0,0 +1,120 @@
+"""
+Pushes vacation/home run progress to the page over Channels.
+
+The page used to poll status_view once a second for the whole run dict.
+The process executing a run writes it to the run store every
+RUN_SAVE_INTERVAL while it changes, and the store is shared by every worker
+process. So while a process has vacation_mode sockets open, its RunWatcher
+reads the run in progress from the store every RUN_WATCH_INTERVAL and sends
+the ``vacation_mode`` group only the step fields that changed:
+
+    {"type": "steps", "run_id": "...", "steps": {"3": {"status": "retrying", "attempt": 2}}}
+
+The whole run goes out as {"type": "run", "run": {...}} when the watcher
+first sees it and when it completes. Every worker reads the same rows, so
+sockets on a worker that isn't running the steps get the same updates as
+the one that is, whatever the channel layer. VacationRunConsumer sends each
+new socket the active run as a snapshot first; the watcher's next read is
+at least as new, so a delta read before the snapshot is corrected by the
+one after it.
+"""
+
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from . import run_store
+
+logger = logging.getLogger(__name__)
+
+# Channels group every vacation_mode WebSocket joins.
+RUN_GROUP = "vacation_mode"
+
+RUN_WATCH_INTERVAL = 0.25  # seconds between reads while a run is in progress
+RUN_IDLE_WATCH_INTERVAL = 2  # seconds between reads while no run is
+
+
+def step_deltas(previous, current):
+    """
+    The fields of each step that changed between two lists of step dicts.
+
+    Returns:
+        Dict of step index (as a string, like JSON keys) -> changed fields.
+    """
+    deltas = {}
+    for idx, (old, new) in enumerate(zip(previous, current)):
+        changed = {key: value for key, value in new.items() if key not in old or old[key] != value}
+        if changed:
+            deltas[str(idx)] = changed
+    return deltas
+
+
+def _read_run(run_id):
+    """The run being followed, or the active run when none is."""
+    return run_store.get_run(run_id) if run_id else run_store.get_active_run()
+
+
+class RunWatcher:
+    """
+    Follows the run in progress in the run store while this process has
+    vacation_mode sockets open, and sends the group what changed.
+    """
+
+    def __init__(self):
+        self.sockets = 0
+        self._task = None
+        self._run = None  # the followed run as last read
+
+    def add_socket(self):
+        """Count a new socket, starting the watch on its event loop."""
+        self.sockets += 1
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._run = None
+            self._task = loop.create_task(self._watch())
+
+    def remove_socket(self):
+        """Forget a closed socket; the watch stops with the last one."""
+        self.sockets = max(0, self.sockets - 1)
+        if not self.sockets and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Keep watching; the next read catches up
+                logger.exception("Reading the vacation run failed")
+            await asyncio.sleep(RUN_WATCH_INTERVAL if self._run else RUN_IDLE_WATCH_INTERVAL)
+
+    async def check(self):
+        """Read the followed run once and send the group any change."""
+        previous = self._run
+        current = await sync_to_async(_read_run)(previous["run_id"] if previous else None)
+        finished = current is None or current["status"] == "complete"
+        self._run = None if finished else current
+        if current is None or current == previous:
+            return
+        if previous is None or finished:
+            await self._send({"type": "run", "run": current})
+        else:
+            deltas = step_deltas(previous["steps"], current["steps"])
+            if deltas:
+                await self._send({"type": "steps", "run_id": current["run_id"], "steps": deltas})
+
+    async def _send(self, update):
+        await get_channel_layer().group_send(RUN_GROUP, {"type": "run.update", "update": update})
+
+
+_watcher = RunWatcher()
+
+
+def get_watcher():
+    """The process-wide RunWatcher."""
+    return _watcher
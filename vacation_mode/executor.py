@@ -1,31 +1,48 @@
 """
 Execution engine for vacation/home mode steps.
 
-Runs steps sequentially in a background thread, calling the Home Assistant
-REST API for each action. Supports retries and stores per-step status
-in an in-memory store keyed by run_id.
+Runs steps in a background thread, calling the Home Assistant REST API for
+each action. Steps form a dependency graph (see steps.py): independent steps
+run side by side on a small worker pool, while steps that depend on each
+other, or that touch the same device or resource group, run one after the
+other. Supports retries and records per-step status and timing in the
+run store (see run_store.py), so any worker process can show a run and
+push its changes to the page over a WebSocket (see events.py).
+
+After each action the target entities are verified by a shared
+StateVerifier. It is woken by state changes from device_control's Home
+Assistant WebSocket mirror, which also subscribes to the step entities.
+While that mirror is not in sync it polls instead, with one states fetch
+per tick for every verification in flight.
 """
 
 import threading
 import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import requests
 import logging
-from urllib.parse import urljoin
-from django.conf import settings
+
+from django.db import IntegrityError, connections
+
+from device_control import ha_mirror
+from device_control.ha_client import get_client
+
+from . import run_store
 
 logger = logging.getLogger(__name__)
 
-# In-memory store for run statuses: { run_id: { ... } }
+# Runs this process is executing: { run_id: { ... } }. Removed once written
+# to the run store as complete.
 _runs = {}
 
-# Lock to prevent concurrent executions
-_execution_lock = threading.Lock()
-
 MAX_RETRIES = 2
+MAX_PARALLEL_STEPS = 4  # steps running at the same time
 RETRY_DELAY = 3  # seconds
-STATE_VERIFY_DELAY = 2  # max seconds to poll for expected state
-STATE_VERIFY_POLL_INTERVAL = 1  # seconds between poll attempts
+STATE_VERIFY_DELAY = 2  # max seconds to wait for expected state
+STATE_VERIFY_POLL_INTERVAL = 1  # seconds between polls while the mirror is not in sync
+RUN_SAVE_INTERVAL = 0.25  # seconds between writes of a changing run
+RUN_ID_ATTEMPTS = 3  # new ids to try if one clashes with a kept run
 STATE_NUMERIC_TOLERANCE = 0.5  # tolerance for C/F rounding (e.g. 38°C → F → C = 37.8°C)
 
 STATUS_PENDING = "pending"
@@ -36,27 +53,13 @@ STATUS_FAILED = "failed"
 STATUS_SKIPPED = "skipped"
 
 
-def get_ha_headers():
-    """Get authorization headers for Home Assistant API."""
-    return {
-        "Authorization": f"Bearer {settings.HOMEASSISTANT_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-
-def get_ha_base_url():
-    """Get the Home Assistant base URL."""
-    return settings.HOMEASSISTANT_URL
-
-
 def get_away_mode_state():
     """
     Query Home Assistant for the current state of input_boolean.home_away_mode_enabled.
     Returns True if away mode is on, False otherwise.
     """
-    url = urljoin(get_ha_base_url(), "/api/states/input_boolean.home_away_mode_enabled")
     try:
-        response = requests.get(url, headers=get_ha_headers(), timeout=10)
+        response = get_client().get("/api/states/input_boolean.home_away_mode_enabled", timeout=10)
         if response.status_code == 200:
             state = response.json().get("state", "off")
             return state == "on"
@@ -92,7 +95,7 @@ def call_ha_service(action, data, device_id=None, area_id=None, entity_id_overri
         (success: bool, error_message: str or None)
     """
     domain, service = action.split("/")
-    url = urljoin(get_ha_base_url(), f"/api/services/{domain}/{service}")
+    path = f"/api/services/{domain}/{service}"
 
     payload = dict(data)
 
@@ -124,13 +127,13 @@ def call_ha_service(action, data, device_id=None, area_id=None, entity_id_overri
     payload = {k: v for k, v in payload.items() if v is not None}
 
     if dry_run:
-        logger.info(f"[DRY RUN] Would call HA service: {url} with payload: {payload}")
+        logger.info(f"[DRY RUN] Would call HA service: {path} with payload: {payload}")
         time.sleep(0.5)  # Simulate a short delay
         return True, None
 
     try:
-        logger.info(f"Calling HA service: {url} with payload: {payload}")
-        response = requests.post(url, headers=get_ha_headers(), json=payload, timeout=30)
+        logger.info(f"Calling HA service: {path} with payload: {payload}")
+        response = get_client().post(path, json=payload, timeout=30)
         if response.status_code in (200, 201):
             return True, None
         else:
@@ -204,8 +207,8 @@ def verify_entity_state(action_def, dry_run=False):
     """
     After a service call, verify that the target entity reached the expected state.
 
-    Polls the HA states API at regular intervals until the expected state is
-    reached or the timeout expires.
+    Waits (see StateVerifier) until the expected state is reported or the
+    action's verify_delay expires.
 
     Args:
         action_def: The action dict from step definitions
@@ -232,98 +235,263 @@ def verify_entity_state(action_def, dry_run=False):
 
     max_wait = action_def.get("verify_delay", STATE_VERIFY_DELAY)
     start_time = time.time()
-    errors = []
-
-    while True:
-        time.sleep(STATE_VERIFY_POLL_INTERVAL)
-        errors = _check_entities(entity_ids, check_type, expected)
-
-        if not errors:
-            elapsed = time.time() - start_time
-            entity_desc = ", ".join(entity_ids)
-            logger.warning(
-                f"State verified OK for {entity_desc} "
-                f"({action}) in {elapsed:.1f}s (max_wait={max_wait}s)"
-            )
-            return True, None
+    errors = get_verifier().wait_for(entity_ids, check_type, expected, max_wait)
+    elapsed = time.time() - start_time
 
-        if time.time() - start_time >= max_wait:
-            break
+    if not errors:
+        entity_desc = ", ".join(entity_ids)
+        logger.warning(
+            f"State verified OK for {entity_desc} "
+            f"({action}) in {elapsed:.1f}s (max_wait={max_wait}s)"
+        )
+        return True, None
 
-    elapsed = time.time() - start_time
     error_msg = "State verification failed: " + "; ".join(errors)
     logger.warning(f"{error_msg} (after {elapsed:.1f}s, max_wait={max_wait}s)")
     return False, error_msg
 
 
-def _check_entities(entity_ids, check_type, expected):
+def _fetch_states(entity_ids):
+    """
+    Fetch entity states from the REST API in one request: the entity's own
+    endpoint for a single entity, otherwise the full state list.
+
+    Returns:
+        Dict of entity_id -> state dict, or an error string for entities
+        whose state could not be fetched.
+    """
+    if len(entity_ids) == 1:
+        path = f"/api/states/{entity_ids[0]}"
+    else:
+        path = "/api/states"
+    try:
+        response = get_client().get(path, timeout=10)
+    except requests.RequestException as e:
+        return {entity_id: f"{entity_id}: state query failed: {e}" for entity_id in entity_ids}
+    if response.status_code != 200:
+        return {
+            entity_id: f"{entity_id}: failed to query state (HTTP {response.status_code})"
+            for entity_id in entity_ids
+        }
+
+    if len(entity_ids) == 1:
+        return {entity_ids[0]: response.json()}
+    by_id = {state["entity_id"]: state for state in response.json()}
+    return {
+        entity_id: by_id.get(entity_id, f"{entity_id}: not found in Home Assistant")
+        for entity_id in entity_ids
+    }
+
+
+def _check_entities(entity_ids, states, check_type, expected):
     """
     Check whether all entities have reached the expected state.
 
+    Args:
+        states: entity_id -> state dict or error string (see _fetch_states)
+
     Returns:
         List of error strings (empty if all entities match).
     """
     errors = []
     for entity_id in entity_ids:
-        url = urljoin(get_ha_base_url(), f"/api/states/{entity_id}")
-        try:
-            response = requests.get(url, headers=get_ha_headers(), timeout=10)
-            if response.status_code != 200:
-                errors.append(f"{entity_id}: failed to query state (HTTP {response.status_code})")
-                continue
+        state_data = states.get(entity_id)
+        if state_data is None:
+            errors.append(f"{entity_id}: no state reported")
+            continue
+        if isinstance(state_data, str):
+            errors.append(state_data)
+            continue
 
-            state_data = response.json()
-            actual_state = state_data.get("state")
+        actual_state = state_data.get("state")
 
-            # Any entity in unavailable/unknown state is a failure
-            if actual_state in ("unavailable", "unknown"):
-                errors.append(f"{entity_id} is {actual_state}")
-                continue
+        # Any entity in unavailable/unknown state is a failure
+        if actual_state in ("unavailable", "unknown"):
+            errors.append(f"{entity_id} is {actual_state}")
+            continue
 
-            if check_type == "state":
-                if str(actual_state) != str(expected):
+        if check_type == "state":
+            if str(actual_state) != str(expected):
+                errors.append(
+                    f"{entity_id}: expected state '{expected}', got '{actual_state}'"
+                )
+        elif check_type == "state_numeric":
+            try:
+                if abs(float(actual_state) - expected) > STATE_NUMERIC_TOLERANCE:
                     errors.append(
-                        f"{entity_id}: expected state '{expected}', got '{actual_state}'"
+                        f"{entity_id}: expected state ~{expected}, got {actual_state}"
                     )
-            elif check_type == "state_numeric":
+            except (ValueError, TypeError):
+                errors.append(
+                    f"{entity_id}: state '{actual_state}' is not numeric"
+                )
+        elif check_type.startswith("attr:"):
+            attr_name = check_type.split(":", 1)[1]
+            attrs = state_data.get("attributes", {})
+            actual_value = attrs.get(attr_name)
+            if actual_value is None:
+                errors.append(
+                    f"{entity_id}: attribute '{attr_name}' not found"
+                )
+            elif type(expected) is float:
                 try:
-                    if abs(float(actual_state) - expected) > STATE_NUMERIC_TOLERANCE:
+                    if abs(float(actual_value) - expected) > STATE_NUMERIC_TOLERANCE:
                         errors.append(
-                            f"{entity_id}: expected state ~{expected}, got {actual_state}"
+                            f"{entity_id}: expected {attr_name}~={expected}, got {actual_value}"
                         )
                 except (ValueError, TypeError):
                     errors.append(
-                        f"{entity_id}: state '{actual_state}' is not numeric"
-                    )
-            elif check_type.startswith("attr:"):
-                attr_name = check_type.split(":", 1)[1]
-                attrs = state_data.get("attributes", {})
-                actual_value = attrs.get(attr_name)
-                if actual_value is None:
-                    errors.append(
-                        f"{entity_id}: attribute '{attr_name}' not found"
-                    )
-                elif type(expected) is float:
-                    try:
-                        if abs(float(actual_value) - expected) > STATE_NUMERIC_TOLERANCE:
-                            errors.append(
-                                f"{entity_id}: expected {attr_name}~={expected}, got {actual_value}"
-                            )
-                    except (ValueError, TypeError):
-                        errors.append(
-                            f"{entity_id}: {attr_name}='{actual_value}' is not numeric"
-                        )
-                elif str(actual_value) != str(expected):
-                    errors.append(
-                        f"{entity_id}: expected {attr_name}='{expected}', got '{actual_value}'"
+                        f"{entity_id}: {attr_name}='{actual_value}' is not numeric"
                     )
-
-        except requests.RequestException as e:
-            errors.append(f"{entity_id}: state query failed: {e}")
+            elif str(actual_value) != str(expected):
+                errors.append(
+                    f"{entity_id}: expected {attr_name}='{expected}', got '{actual_value}'"
+                )
 
     return errors
 
 
+class _StateWatch:
+    """One verification in flight: entities that must all pass one check."""
+
+    def __init__(self, entity_ids, check_type, expected):
+        self.entity_ids = list(entity_ids)
+        self.check_type = check_type
+        self.expected = expected
+        self.errors = [f"{entity_id}: no state reported" for entity_id in self.entity_ids]
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def evaluate(self, states):
+        """Re-check against fresh states; sets done once they all pass."""
+        errors = _check_entities(self.entity_ids, states, self.check_type, self.expected)
+        with self._lock:
+            if self.done.is_set():
+                return
+            self.errors = errors
+            if not errors:
+                self.done.set()
+
+
+class StateVerifier:
+    """
+    Resolves verifications the moment Home Assistant reports the expected state.
+
+    With a WebSocket mirror of the step entities, every state change re-checks
+    the verifications watching that entity. When there is no mirror or it is
+    not in sync, one poller thread makes a single states fetch every
+    STATE_VERIFY_POLL_INTERVAL for all verifications in flight, instead of
+    one fetch per entity per verification.
+    """
+
+    def __init__(self, mirror=None):
+        self._mirror = mirror
+        self._lock = threading.Lock()
+        self._watches = set()
+        self._poller = None
+        if mirror is not None:
+            mirror.add_listener(self._on_changes)
+
+    def wait_for(self, entity_ids, check_type, expected, max_wait):
+        """
+        Block until every entity passes the check or max_wait seconds pass.
+
+        Returns:
+            List of error strings from the last check (empty when verified).
+        """
+        watch = _StateWatch(entity_ids, check_type, expected)
+        with self._lock:
+            self._watches.add(watch)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name="vacation-verify", daemon=True)
+                self._poller.start()
+        try:
+            watch.evaluate(self._states(watch.entity_ids))
+            if not watch.done.wait(max_wait) and max_wait > 0:
+                # One last check at the deadline, as the final poll used to be
+                watch.evaluate(self._states(watch.entity_ids))
+        finally:
+            with self._lock:
+                self._watches.discard(watch)
+        return watch.errors
+
+    def _states(self, entity_ids):
+        """Mirrored states where the mirror is in sync; the REST API for the rest."""
+        states = {}
+        if self._mirror is not None:
+            states = self._mirror.states(entity_ids) or {}
+        missing = [entity_id for entity_id in entity_ids if entity_id not in states]
+        if missing:
+            states.update(_fetch_states(missing))
+        return states
+
+    def _poll(self):
+        """Re-check every verification in flight each tick (mirror lookups are free)."""
+        while True:
+            time.sleep(STATE_VERIFY_POLL_INTERVAL)
+            with self._lock:
+                if not self._watches:
+                    self._poller = None
+                    return
+                watches = [watch for watch in self._watches if not watch.done.is_set()]
+            entity_ids = sorted({entity_id for watch in watches for entity_id in watch.entity_ids})
+            if not entity_ids:
+                continue
+            try:
+                states = self._states(entity_ids)
+            except Exception:
+                logger.exception("Polling entity states for verification failed")
+                continue
+            for watch in watches:
+                watch.evaluate(states)
+
+    def _on_changes(self, changed):
+        """Mirror listener: re-check the verifications watching a changed entity."""
+        with self._lock:
+            watches = [
+                watch for watch in self._watches
+                if not watch.done.is_set() and any(entity_id in changed for entity_id in watch.entity_ids)
+            ]
+        for watch in watches:
+            states = self._mirror.states(watch.entity_ids)
+            if states is not None:
+                watch.evaluate(states)
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def _step_entity_ids():
+    """Every entity the vacation and home steps act on."""
+    from .steps import VACATION_STEPS, HOME_STEPS
+
+    return {
+        entity_id
+        for step in VACATION_STEPS + HOME_STEPS
+        for action in step.get("actions", [])
+        for entity_id in _get_entity_ids_for_action(action)
+    }
+
+
+def get_verifier():
+    """
+    Return the process-wide StateVerifier.
+
+    It shares device_control's mirror (one Home Assistant WebSocket per
+    process), which is extended with the step entities on first use.
+    """
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                mirror = ha_mirror.get_mirror()
+                if mirror is not None:
+                    mirror.add_entities(_step_entity_ids())
+                _verifier = StateVerifier(mirror)
+    return _verifier
+
+
 def execute_step(step, step_status, dry_run=False, action_indices=None):
     """
     Execute a single step (which may contain multiple actions).
@@ -390,23 +558,77 @@ def execute_step(step, step_status, dry_run=False, action_indices=None):
     return True, failed_indices
 
 
-def run_steps(run_id, steps, dry_run=False):
+def _step_resources(step):
     """
-    Execute all steps sequentially in a background thread.
-    Updates _runs[run_id] with per-step status.
+    Resources a step holds while it runs: its declared "resources" groups plus
+    every entity, device and area its actions target.
     """
-    run_data = _runs[run_id]
+    resources = set(step.get("resources", []))
+    for action in step.get("actions", []):
+        resources.update(_get_entity_ids_for_action(action))
+        for target in ("device_id", "area_id"):
+            value = action.get(target)
+            if value:
+                values = value if isinstance(value, list) else [value]
+                resources.update(f"{target}:{v}" for v in values)
+    return resources
+
+
+def plan_steps(steps):
+    """
+    Resolve each step's "depends_on" keys to step indices.
 
-    for idx, step in enumerate(steps):
-        step_status = run_data["steps"][idx]
+    A step without "depends_on" waits for the step before it, as steps
+    always used to run one after another.
 
-        # Skip steps that were marked as skipped before execution
-        if step_status["status"] == STATUS_SKIPPED:
-            continue
+    Returns:
+        List with, for each step, the set of step indices it waits for.
 
-        step_status["status"] = STATUS_RUNNING
-        step_status["attempt"] = 1
+    Raises:
+        ValueError: on a duplicate or unknown key, or a dependency cycle.
+    """
+    index = {}
+    for i, step in enumerate(steps):
+        key = step.get("key")
+        if key is None:
+            continue
+        if key in index:
+            raise ValueError(f"Duplicate step key '{key}'")
+        index[key] = i
+
+    deps = []
+    for i, step in enumerate(steps):
+        if "depends_on" not in step:
+            deps.append({i - 1} if i else set())
+            continue
+        unknown = [key for key in step["depends_on"] if key not in index]
+        if unknown:
+            raise ValueError(f"Step '{step['alias']}' depends on unknown step(s): {', '.join(unknown)}")
+        deps.append({index[key] for key in step["depends_on"]})
+
+    # Peel off steps with no unfinished dependencies; anything left is a cycle
+    remaining = dict(enumerate(deps))
+    while remaining:
+        ready = [i for i, d in remaining.items() if not remaining.keys() & d]
+        if not ready:
+            aliases = ", ".join(steps[i]["alias"] for i in sorted(remaining))
+            raise ValueError(f"Dependency cycle between steps: {aliases}")
+        for i in ready:
+            del remaining[i]
+    return deps
+
+
+def run_step(step, step_status, dry_run=False):
+    """
+    Execute one step with retries, recording its status and timing in
+    step_status ("started_at", "finished_at", "duration" in seconds).
+    """
+    step_status["status"] = STATUS_RUNNING
+    step_status["attempt"] = 1
+    step_status["started_at"] = time.time()
+    started = time.monotonic()
 
+    try:
         success, failed_indices = execute_step(step, step_status, dry_run=dry_run)
 
         if not success:
@@ -423,21 +645,125 @@ def run_steps(run_id, steps, dry_run=False):
                 )
                 if success:
                     break
+    except Exception as e:
+        # Keep one broken step from taking down the whole run
+        logger.exception(f"Step '{step['alias']}' crashed")
+        step_status["error"] = str(e)
+        step_status["progress"] = None
+        success = False
 
-        if success:
-            step_status["status"] = STATUS_SUCCESS
-            step_status["error"] = None
-        else:
-            step_status["status"] = STATUS_FAILED
-            # error is already set by execute_step
+    if success:
+        step_status["status"] = STATUS_SUCCESS
+        step_status["error"] = None
+    else:
+        step_status["status"] = STATUS_FAILED
+        # error is already set by execute_step
 
-    # Mark run as complete
-    run_data["status"] = "complete"
-    run_data["completed_at"] = time.time()
+    step_status["finished_at"] = time.time()
+    step_status["duration"] = round(time.monotonic() - started, 2)
 
-    # Release lock
-    if _execution_lock.locked():
-        _execution_lock.release()
+
+def _run_timing(step_statuses, deps, elapsed):
+    """
+    Wall-clock time of a run next to what the steps add up to one after
+    another, and the longest dependency chain (the best parallelism can do).
+    """
+    durations = [status.get("duration") or 0 for status in step_statuses]
+    chains = {}
+
+    def chain(i):
+        if i not in chains:
+            chains[i] = durations[i] + max((chain(d) for d in deps[i]), default=0)
+        return chains[i]
+
+    return {
+        "elapsed": round(elapsed, 1),
+        "serial": round(sum(durations), 1),
+        "critical_path": round(max((chain(i) for i in range(len(deps))), default=0), 1),
+    }
+
+
+def _snapshot(run_data):
+    """
+    A copy of run_data that steps running on the pool can't change under
+    a JSON encoder (copying a dict is atomic).
+    """
+    return {**run_data, "steps": [dict(step) for step in run_data["steps"]]}
+
+
+def run_steps(run_id, steps, dry_run=False):
+    """
+    Execute the steps' dependency graph in a background thread.
+
+    A step starts once every step it depends on has finished (whatever the
+    outcome) and no running step holds any of its resources; up to
+    MAX_PARALLEL_STEPS run at once, earlier steps first.
+    Updates _runs[run_id] with per-step status and the run's "timing".
+    Every RUN_SAVE_INTERVAL while it changes, the run is written to the run
+    store, where every worker's RunWatcher picks it up.
+    """
+    run_data = _runs[run_id]
+    step_statuses = run_data["steps"]
+    started = time.monotonic()
+    # As start_execution stored it
+    saved = {"data": _snapshot(run_data), "at": time.monotonic()}
+
+    def save():
+        snapshot = _snapshot(run_data)
+        previous = saved["data"]
+        if snapshot != previous or time.monotonic() - saved["at"] >= run_store.RUN_HEARTBEAT:
+            run_store.save_run(snapshot)
+            saved.update(data=snapshot, at=time.monotonic())
+
+    try:
+        deps = plan_steps(steps)
+        resources = [_step_resources(step) for step in steps]
+
+        # Skipped steps count as finished for their dependents
+        waiting = {idx for idx, status in enumerate(step_statuses) if status["status"] != STATUS_SKIPPED}
+        finished = set(range(len(steps))) - waiting
+        held = set()
+        running = {}  # future -> step index
+
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_STEPS, thread_name_prefix="vacation-step") as pool:
+            while waiting or running:
+                for idx in sorted(waiting):
+                    if len(running) >= MAX_PARALLEL_STEPS:
+                        break
+                    if deps[idx] <= finished and not resources[idx] & held:
+                        waiting.discard(idx)
+                        held |= resources[idx]
+                        future = pool.submit(run_step, steps[idx], step_statuses[idx], dry_run)
+                        running[future] = idx
+
+                done, _ = wait(running, timeout=RUN_SAVE_INTERVAL, return_when=FIRST_COMPLETED)
+                save()
+                for future in done:
+                    idx = running.pop(future)
+                    held -= resources[idx]
+                    finished.add(idx)
+
+        run_data["timing"] = timing = _run_timing(step_statuses, deps, time.monotonic() - started)
+        logger.info(
+            f"Run {run_id} took {timing['elapsed']}s "
+            f"(steps one after another: {timing['serial']}s, critical path: {timing['critical_path']}s)"
+        )
+    finally:
+        # Mark run as complete, which also lets the next run start
+        run_data["status"] = "complete"
+        run_data["completed_at"] = time.time()
+        try:
+            run_store.save_run(_snapshot(run_data))
+        finally:
+            _runs.pop(run_id, None)
+
+
+def _run_in_thread(run_id, steps, dry_run):
+    try:
+        run_steps(run_id, steps, dry_run)
+    finally:
+        # Connections are per thread; don't leave this one open
+        connections.close_all()
 
 
 def start_execution(mode, dry_run=False, skip_steps=None):
@@ -454,20 +780,18 @@ def start_execution(mode, dry_run=False, skip_steps=None):
     """
     from .steps import VACATION_STEPS, HOME_STEPS
 
-    if not _execution_lock.acquire(blocking=False):
-        return None, "An execution is already in progress"
-
     steps = VACATION_STEPS if mode == "vacation" else HOME_STEPS
     skip_set = set(skip_steps) if skip_steps else set()
     run_id = str(uuid.uuid4())[:8]
 
-    _runs[run_id] = {
+    run_data = {
         "run_id": run_id,
         "mode": mode,
         "dry_run": dry_run,
         "status": "running",
         "started_at": time.time(),
         "completed_at": None,
+        "timing": None,
         "steps": [
             {
                 "alias": step["alias"],
@@ -476,25 +800,42 @@ def start_execution(mode, dry_run=False, skip_steps=None):
                 "attempt": 0,
                 "error": None,
                 "progress": None,
+                "duration": None,
             }
             for i, step in enumerate(steps)
         ],
     }
 
-    thread = threading.Thread(target=run_steps, args=(run_id, steps, dry_run), daemon=True)
+    # Only one run at a time, across every worker process
+    for attempt in range(RUN_ID_ATTEMPTS):
+        try:
+            created = run_store.create_run(run_data)
+            break
+        except IntegrityError:
+            # The short id clashed with a finished run that is still kept
+            if attempt == RUN_ID_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Run id {run_id} is taken; retrying with a new one")
+            run_id = run_data["run_id"] = str(uuid.uuid4())[:8]
+    if not created:
+        return None, "An execution is already in progress"
+
+    if not dry_run:
+        # Connect the verification mirror while the first actions are sent
+        get_verifier()
+
+    _runs[run_id] = run_data
+    thread = threading.Thread(target=_run_in_thread, args=(run_id, steps, dry_run), daemon=True)
     thread.start()
 
     return run_id, None
 
 
 def get_run_status(run_id):
-    """Get the current status of a run."""
-    return _runs.get(run_id)
+    """Get the current status of a run (from any process)."""
+    return run_store.get_run(run_id)
 
 
 def get_active_run():
-    """Get the currently active (running) run, if any."""
-    for run_id, run_data in _runs.items():
-        if run_data["status"] == "running":
-            return run_data
-    return None
+    """Get the currently active (running) run, if any, from any process."""
+    return run_store.get_active_run()
@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-18 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VacationRun',
+            fields=[
+                ('run_id', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('mode', models.CharField(max_length=16)),
+                ('dry_run', models.BooleanField(default=False)),
+                ('active', models.BooleanField(default=True)),
+                ('data', models.JSONField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField()),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['completed_at'], name='vacation_mo_complet_5761de_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('active', True)), fields=('active',), name='vacation_run_one_active')],
+            },
+        ),
+    ]
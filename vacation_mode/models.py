@@ -1 +1,25 @@
 from django.db import models
+from django.db.models import Q
+
+
+class VacationRun(models.Model):
+    """One vacation/home run; ``data`` is the status dict the page polls."""
+
+    run_id = models.CharField(max_length=16, primary_key=True)
+    mode = models.CharField(max_length=16)
+    dry_run = models.BooleanField(default=False)
+    active = models.BooleanField(default=True)
+    data = models.JSONField()
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # At most one run in progress, whichever process started it
+            models.UniqueConstraint(fields=["active"], condition=Q(active=True), name="vacation_run_one_active"),
+        ]
+        indexes = [models.Index(fields=["completed_at"])]
+
+    def __str__(self):
+        return f"{self.mode} run {self.run_id}"
@@ -0,0 +1,8 @@
+# vacation_mode/routing.py
+
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/vacation_mode/', consumers.VacationRunConsumer.as_asgi()),
+]
@@ -0,0 +1,107 @@
+"""
+Database-backed store for vacation/home runs.
+
+Runs used to live in a module-level dict behind a threading.Lock: they were
+lost on restart, invisible to other worker processes and never evicted.
+Each run is now a VacationRun row holding the status dict the page polls:
+
+* At most one row is active (a partial unique constraint). Inserting the
+  active run is the execution lock across processes, and the constraint's
+  index makes finding the active run a single lookup.
+* The process executing a run writes its status through with save_run and
+  touches the row at least every RUN_HEARTBEAT seconds. An active run whose
+  row hasn't been written for RUN_STALE_AFTER (its process died) is retired
+  so it can't block new runs.
+* Finished runs are deleted RUN_TTL after they complete.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import VacationRun
+
+logger = logging.getLogger(__name__)
+
+RUN_TTL = timedelta(days=7)  # how long finished runs are kept
+RUN_HEARTBEAT = 30  # seconds between writes while nothing changes
+RUN_STALE_AFTER = timedelta(minutes=5)  # active run without a write this long is abandoned
+
+
+def create_run(run_data):
+    """
+    Store run_data as the active run.
+
+    Returns:
+        True, or False if another run is already active.
+
+    Raises:
+        IntegrityError: run_data's run_id is already taken by a kept run.
+    """
+    _retire_stale()
+    evict_finished()
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            VacationRun.objects.create(
+                run_id=run_data["run_id"],
+                mode=run_data["mode"],
+                dry_run=run_data.get("dry_run", False),
+                data=run_data,
+                updated_at=now,
+            )
+    except IntegrityError:
+        # A taken run_id fails the insert too; only an active run is a conflict
+        if VacationRun.objects.filter(active=True).exists():
+            return False
+        raise
+    return True
+
+
+def save_run(run_data):
+    """
+    Write a run's current status; a "complete" run stops being active.
+
+    Only the process executing the run calls this. Runs retired as abandoned
+    are left alone.
+    """
+    now = timezone.now()
+    fields = {"data": run_data, "updated_at": now}
+    if run_data["status"] == "complete":
+        fields.update(active=False, completed_at=now)
+    VacationRun.objects.filter(run_id=run_data["run_id"], active=True).update(**fields)
+
+
+def get_run(run_id):
+    """The status dict of a run, or None if unknown or evicted."""
+    return VacationRun.objects.filter(run_id=run_id).values_list("data", flat=True).first()
+
+
+def get_active_run():
+    """The status dict of the run in progress, or None."""
+    _retire_stale()
+    return VacationRun.objects.filter(active=True).values_list("data", flat=True).first()
+
+
+def evict_finished():
+    """Delete runs that completed more than RUN_TTL ago."""
+    VacationRun.objects.filter(active=False, completed_at__lt=timezone.now() - RUN_TTL).delete()
+
+
+def _retire_stale():
+    """Complete active runs whose process stopped writing them."""
+    cutoff = timezone.now() - RUN_STALE_AFTER
+    for run in VacationRun.objects.filter(active=True, updated_at__lt=cutoff):
+        logger.warning(f"Run {run.run_id} stopped updating at {run.updated_at}; marking it abandoned")
+        steps = [
+            step if step["status"] in ("success", "failed", "skipped")
+            else {**step, "status": "failed", "error": "Interrupted: the server running it stopped", "progress": None}
+            for step in run.data.get("steps", [])
+        ]
+        run.data = {**run.data, "status": "complete", "completed_at": time.time(), "abandoned": True, "steps": steps}
+        run.active = False
+        run.completed_at = timezone.now()
+        run.save(update_fields=["data", "active", "completed_at"])
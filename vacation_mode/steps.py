@@ -4,6 +4,12 @@ Step definitions for Vacation Mode and Home Mode.
 Each step is a dict with:
 - alias: Human-readable name
 - icon: Font Awesome icon class
+- key: Short name other steps use to depend on this one
+- depends_on: Keys of the steps that must finish before this one starts.
+  Steps whose dependencies are done run in parallel; a step without
+  depends_on waits for the step listed before it.
+- resources: Optional resource groups; steps sharing one never run at the
+  same time. Steps targeting the same entity never overlap either.
 - actions: List of HA API calls to execute sequentially
   Each action has:
     - action: HA service to call (e.g. "climate/set_temperature")
@@ -11,6 +17,10 @@ Each step is a dict with:
     - delay_after: Optional delay in seconds after this action
 """
 
+# The thermostat calls are paced with delay_after; keep the steps that set
+# thermostats from overlapping so the pacing still holds.
+THERMOSTATS = "thermostats"
+
 # ============================================================
 # VACATION MODE STEPS (Leaving)
 # ============================================================
@@ -18,6 +28,8 @@ VACATION_STEPS = [
     {
         "alias": "Turn Off Water Heater",
         "icon": "fas fa-fire",
+        "key": "water_heater",
+        "depends_on": [],
         "actions": [
             {
                 "action": "climate/set_preset_mode",
@@ -32,6 +44,8 @@ VACATION_STEPS = [
     {
         "alias": "Set Hot Tub to Vacation Mode",
         "icon": "fas fa-hot-tub-person",
+        "key": "hot_tub",
+        "depends_on": [],
         "actions": [
             {
                 "action": "climate/set_preset_mode",
@@ -46,6 +60,8 @@ VACATION_STEPS = [
     {
         "alias": "Heat Pump Vacation Setup",
         "icon": "fas fa-temperature-arrow-down",
+        "key": "heat_pump",
+        "depends_on": [],
         "actions": [
             {
                 "action": "switch/turn_off",
@@ -78,6 +94,9 @@ VACATION_STEPS = [
     {
         "alias": "Set Thermostats to 13.5°C",
         "icon": "fas fa-snowflake",
+        "key": "thermostats",
+        "depends_on": [],
+        "resources": [THERMOSTATS],
         "actions": [
             {
                 "action": "climate/set_temperature",
@@ -133,6 +152,9 @@ VACATION_STEPS = [
     {
         "alias": "Set Garage Heaters to 5°C",
         "icon": "fas fa-warehouse",
+        "key": "garage_heaters",
+        "depends_on": [],
+        "resources": [THERMOSTATS],
         "actions": [
             {
                 "action": "climate/set_temperature",
@@ -156,6 +178,8 @@ VACATION_STEPS = [
     {
         "alias": "Set Fridge & Freezer to Vacation Mode",
         "icon": "fas fa-icicles",
+        "key": "fridge_freezer",
+        "depends_on": [],
         "actions": [
             {
                 "action": "switch/turn_on",
@@ -183,6 +207,8 @@ VACATION_STEPS = [
     {
         "alias": "Turn Off Televisions & Sonos",
         "icon": "fas fa-tv",
+        "key": "tvs",
+        "depends_on": [],
         "actions": [
             {
                 "action": "switch/turn_off",
@@ -255,6 +281,8 @@ VACATION_STEPS = [
     {
         "alias": "Turn Off Patio Heaters",
         "icon": "fas fa-fire-flame-curved",
+        "key": "patio_heaters",
+        "depends_on": [],
         "actions": [
             {
                 "action": "switch/turn_off",
@@ -268,6 +296,8 @@ VACATION_STEPS = [
     {
         "alias": "Turn Off Fireplaces",
         "icon": "fas fa-fire",
+        "key": "fireplaces",
+        "depends_on": [],
         "actions": [
             {
                 "action": "climate/set_hvac_mode",
@@ -307,6 +337,19 @@ VACATION_STEPS = [
     {
         "alias": "Enable Home Away Mode",
         "icon": "fas fa-plane-departure",
+        "key": "away_mode",
+        # The away flag only flips once everything else is done
+        "depends_on": [
+            "water_heater",
+            "hot_tub",
+            "heat_pump",
+            "thermostats",
+            "garage_heaters",
+            "fridge_freezer",
+            "tvs",
+            "patio_heaters",
+            "fireplaces",
+        ],
         "actions": [
             {
                 "action": "input_boolean/turn_on",
@@ -326,6 +369,8 @@ HOME_STEPS = [
     {
         "alias": "Start Water Heater",
         "icon": "fas fa-fire",
+        "key": "water_heater",
+        "depends_on": [],
         "actions": [
             {
                 "action": "climate/set_preset_mode",
@@ -340,6 +385,8 @@ HOME_STEPS = [
     {
         "alias": "Start Hot Tub",
         "icon": "fas fa-hot-tub-person",
+        "key": "hot_tub",
+        "depends_on": [],
         "actions": [
             {
                 "action": "climate/set_preset_mode",
@@ -354,6 +401,8 @@ HOME_STEPS = [
     {
         "alias": "Heat Pump Home Setup",
         "icon": "fas fa-temperature-arrow-up",
+        "key": "heat_pump",
+        "depends_on": [],
         "actions": [
             {
                 "action": "number/set_value",
@@ -395,6 +444,9 @@ HOME_STEPS = [
     {
         "alias": "Set Thermostats to Home Temperatures",
         "icon": "fas fa-house-chimney",
+        "key": "thermostats",
+        "depends_on": [],
+        "resources": [THERMOSTATS],
         "actions": [
             {
                 "action": "climate/set_preset_mode",
@@ -483,6 +535,8 @@ HOME_STEPS = [
     {
         "alias": "Setup Fridge/Freezer for Arrival",
         "icon": "fas fa-icicles",
+        "key": "fridge_freezer",
+        "depends_on": [],
         "actions": [
             {
                 "action": "switch/turn_off",
@@ -510,6 +564,8 @@ HOME_STEPS = [
     {
         "alias": "Turn On Televisions & Sonos",
         "icon": "fas fa-tv",
+        "key": "tvs",
+        "depends_on": [],
         "actions": [
             {
                 "action": "switch/turn_on",
@@ -582,6 +638,16 @@ HOME_STEPS = [
     {
         "alias": "Disable Home Away Mode",
         "icon": "fas fa-house-flag",
+        "key": "away_mode",
+        # The away flag only flips once everything else is done
+        "depends_on": [
+            "water_heater",
+            "hot_tub",
+            "heat_pump",
+            "thermostats",
+            "fridge_freezer",
+            "tvs",
+        ],
         "actions": [
             {
                 "action": "input_boolean/turn_off",
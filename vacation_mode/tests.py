@@ -1,8 +1,15 @@
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
 from django.test import TestCase, Client, tag
+from django.utils import timezone
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 from unittest.mock import patch, MagicMock
 import json
+import threading
 import time
+from datetime import timedelta
 import unittest
 import requests as requests_lib
 
@@ -33,12 +40,15 @@ from .executor import (
     start_execution,
     get_run_status,
     get_active_run,
+    plan_steps,
     run_steps,
     verify_entity_state,
     _get_expected_state,
     _get_entity_ids_for_action,
+    StateVerifier,
+    get_verifier,
+    _step_entity_ids,
     _runs,
-    _execution_lock,
     STATUS_PENDING,
     STATUS_RUNNING,
     STATUS_RETRYING,
@@ -47,13 +57,16 @@ from .executor import (
     MAX_RETRIES,
     RETRY_DELAY,
 )
+from . import events, run_store
+from .consumers import VacationRunConsumer
+from .models import VacationRun
 from .steps import VACATION_STEPS, HOME_STEPS
 
 
 class GetAwayModeStateTests(TestCase):
     """Tests for querying the away mode state from Home Assistant."""
 
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_returns_true_when_on(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -61,7 +74,7 @@ class GetAwayModeStateTests(TestCase):
         )
         self.assertTrue(get_away_mode_state())
 
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_returns_false_when_off(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -69,7 +82,7 @@ class GetAwayModeStateTests(TestCase):
         )
         self.assertFalse(get_away_mode_state())
 
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_returns_false_on_error(self, mock_get):
         mock_get.side_effect = requests_lib.RequestException("Connection refused")
         self.assertFalse(get_away_mode_state())
@@ -78,7 +91,7 @@ class GetAwayModeStateTests(TestCase):
 class CallHaServiceTests(TestCase):
     """Tests for calling Home Assistant services."""
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_successful_call(self, mock_post):
         mock_post.return_value = MagicMock(status_code=200)
         success, error = call_ha_service(
@@ -88,7 +101,7 @@ class CallHaServiceTests(TestCase):
         self.assertTrue(success)
         self.assertIsNone(error)
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_failed_call_returns_error(self, mock_post):
         mock_post.return_value = MagicMock(status_code=500, text="Internal Server Error")
         success, error = call_ha_service(
@@ -99,7 +112,7 @@ class CallHaServiceTests(TestCase):
         self.assertFalse(success)
         self.assertIn("500", error)
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_network_exception(self, mock_post):
         mock_post.side_effect = requests_lib.ConnectionError("Connection timeout")
         success, error = call_ha_service(
@@ -109,7 +122,7 @@ class CallHaServiceTests(TestCase):
         self.assertFalse(success)
         self.assertIn("Connection timeout", error)
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_device_id_targeting(self, mock_post):
         mock_post.return_value = MagicMock(status_code=200)
         call_ha_service(
@@ -122,7 +135,7 @@ class CallHaServiceTests(TestCase):
         self.assertEqual(payload["device_id"], "test_device")
         self.assertNotIn("entity_id", payload)
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_area_id_targeting(self, mock_post):
         mock_post.return_value = MagicMock(status_code=200)
         call_ha_service(
@@ -134,7 +147,7 @@ class CallHaServiceTests(TestCase):
         payload = call_args[1]["json"]
         self.assertEqual(payload["area_id"], ["garage", "garage_storage_room"])
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_entity_id_override(self, mock_post):
         mock_post.return_value = MagicMock(status_code=200)
         call_ha_service(
@@ -309,7 +322,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIsNone(error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_switch_on_verified(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -321,7 +334,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIsNone(error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_switch_still_off_after_turn_on(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -333,7 +346,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIn("expected state 'on', got 'off'", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_entity_unavailable(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -345,7 +358,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIn("is unavailable", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_entity_unknown(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -357,7 +370,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIn("is unknown", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_climate_temperature_verified(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -368,7 +381,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertTrue(success)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_climate_temperature_wrong(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -380,7 +393,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIn("expected temperature~=13.5, got 20.0", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_climate_preset_mode_verified(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -391,7 +404,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertTrue(success)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_climate_preset_mode_wrong(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -403,7 +416,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIn("expected preset_mode='Off', got 'Eco Mode'", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_number_set_value_verified(self, mock_get):
         mock_get.return_value = MagicMock(
             status_code=200,
@@ -414,7 +427,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertTrue(success)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_number_set_value_within_tolerance(self, mock_get):
         """Values within C/F rounding tolerance (0.5) should pass verification."""
         mock_get.return_value = MagicMock(
@@ -426,23 +439,21 @@ class VerifyEntityStateTests(TestCase):
         self.assertTrue(success)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_multiple_entities_one_fails(self, mock_get):
         """When multiple entity_ids given, failure of one should fail the verification."""
-        def mock_responses(*args, **kwargs):
-            url = args[0]
-            if "climate.ok" in url:
-                return MagicMock(status_code=200, json=lambda: {"state": "heat", "attributes": {"preset_mode": "none"}})
-            else:
-                return MagicMock(status_code=200, json=lambda: {"state": "unavailable", "attributes": {}})
-        mock_get.side_effect = mock_responses
+        # Several entities are read with one /api/states request
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: [
+            {"entity_id": "climate.ok", "state": "heat", "attributes": {"preset_mode": "none"}},
+            {"entity_id": "climate.dead", "state": "unavailable", "attributes": {}},
+        ])
         action = {"action": "climate/set_preset_mode", "data": {"entity_id": ["climate.ok", "climate.dead"], "preset_mode": "none"}}
         success, error = verify_entity_state(action)
         self.assertFalse(success)
         self.assertIn("climate.dead is unavailable", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_http_error_on_state_query(self, mock_get):
         mock_get.return_value = MagicMock(status_code=500)
         action = {"action": "switch/turn_on", "data": {"entity_id": "switch.test"}}
@@ -451,7 +462,7 @@ class VerifyEntityStateTests(TestCase):
         self.assertIn("HTTP 500", error)
 
     @patch("vacation_mode.executor.STATE_VERIFY_DELAY", 0)
-    @patch("vacation_mode.executor.requests.get")
+    @patch("requests.Session.get")
     def test_network_error_on_state_query(self, mock_get):
         mock_get.side_effect = requests_lib.ConnectionError("timeout")
         action = {"action": "switch/turn_on", "data": {"entity_id": "switch.test"}}
@@ -466,6 +477,94 @@ class VerifyEntityStateTests(TestCase):
         self.assertTrue(success)
 
 
+class FakeMirror:
+    """Stands in for device_control's HAStateMirror."""
+
+    def __init__(self, states):
+        self._states = dict(states)
+        self._listeners = []
+        self.ready = True
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def states(self, entity_ids):
+        return {eid: self._states[eid] for eid in entity_ids if eid in self._states}
+
+    def push(self, entity_id, state):
+        self._states[entity_id] = {"entity_id": entity_id, "state": state, "attributes": {}}
+        for callback in self._listeners:
+            callback({entity_id: self._states[entity_id]})
+
+
+class StateVerifierTests(TestCase):
+    """Tests for StateVerifier (mirror events and the shared poller)."""
+
+    def _wait_in_thread(self, verifier, entity_ids, expected, max_wait=5):
+        result = {}
+
+        def wait():
+            started = time.time()
+            result["errors"] = verifier.wait_for(entity_ids, "state", expected, max_wait)
+            result["elapsed"] = time.time() - started
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        return thread, result
+
+    @patch("vacation_mode.executor.STATE_VERIFY_POLL_INTERVAL", 60)
+    def test_mirror_event_resolves_immediately(self):
+        mirror = FakeMirror({"switch.a": {"entity_id": "switch.a", "state": "off", "attributes": {}}})
+        verifier = StateVerifier(mirror)
+        thread, result = self._wait_in_thread(verifier, ["switch.a"], "on")
+        time.sleep(0.1)
+        mirror.push("switch.a", "on")
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result["errors"], [])
+        self.assertLess(result["elapsed"], 1)
+
+    def test_timeout_reports_last_errors(self):
+        mirror = FakeMirror({"switch.a": {"entity_id": "switch.a", "state": "off", "attributes": {}}})
+        errors = StateVerifier(mirror).wait_for(["switch.a"], "state", "on", 0.2)
+        self.assertEqual(errors, ["switch.a: expected state 'on', got 'off'"])
+
+    @patch("vacation_mode.executor.STATE_VERIFY_POLL_INTERVAL", 0.05)
+    def test_poller_fetches_once_per_tick_for_all_waiters(self):
+        fetches = []
+        states = {"switch.a": "off", "switch.b": "off"}
+
+        def fake_fetch(entity_ids):
+            fetches.append(list(entity_ids))
+            if len(fetches) >= 4:
+                states.update({"switch.a": "on", "switch.b": "on"})
+            return {eid: {"entity_id": eid, "state": states[eid], "attributes": {}} for eid in entity_ids}
+
+        verifier = StateVerifier()
+        with patch("vacation_mode.executor._fetch_states", side_effect=fake_fetch):
+            thread_a, result_a = self._wait_in_thread(verifier, ["switch.a"], "on")
+            thread_b, result_b = self._wait_in_thread(verifier, ["switch.b"], "on")
+            thread_a.join(3)
+            thread_b.join(3)
+
+        self.assertEqual(result_a["errors"], [])
+        self.assertEqual(result_b["errors"], [])
+        # Past the two initial checks, each tick is one fetch covering both waiters
+        self.assertIn(["switch.a", "switch.b"], fetches)
+        self.assertLess(result_a["elapsed"], 2)
+
+
+    def test_verifier_shares_the_device_control_mirror(self):
+        mirror = MagicMock()
+        with patch("vacation_mode.executor._verifier", None), \
+                patch("vacation_mode.executor.ha_mirror.get_mirror", return_value=mirror), \
+                patch("vacation_mode.executor.ha_mirror.HAStateMirror") as mock_new_mirror:
+            verifier = get_verifier()
+        self.assertIs(verifier._mirror, mirror)
+        mirror.add_entities.assert_called_once_with(_step_entity_ids())
+        mock_new_mirror.assert_not_called()
+
+
 class ViewTests(TestCase):
     """Tests for the vacation mode views."""
 
@@ -530,7 +629,7 @@ class ViewTests(TestCase):
 class DryRunTests(TestCase):
     """Tests for dry run mode."""
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_dry_run_skips_api_call(self, mock_post):
         """Dry run should not make any HTTP requests."""
         success, error = call_ha_service(
@@ -542,7 +641,7 @@ class DryRunTests(TestCase):
         self.assertIsNone(error)
         mock_post.assert_not_called()
 
-    @patch("vacation_mode.executor.requests.post")
+    @patch("requests.Session.post")
     def test_dry_run_execute_step(self, mock_post):
         """Dry run step should succeed without HTTP calls."""
         step = {
@@ -643,19 +742,48 @@ class StepDefinitionTests(TestCase):
                 )
 
 
-class RunStepsTests(TestCase):
-    """Tests for the full run_steps execution flow."""
+class PlanStepsTests(TestCase):
+    """Tests for resolving step dependencies."""
 
-    def setUp(self):
-        # Ensure lock is released before each test
-        if _execution_lock.locked():
-            _execution_lock.release()
+    def _step(self, key, **extra):
+        return {"alias": key.title(), "icon": "fas fa-test", "key": key, "actions": [], **extra}
 
-    def tearDown(self):
-        # Clean up
-        if _execution_lock.locked():
-            _execution_lock.release()
-        _runs.clear()
+    def test_steps_without_dependencies_run_in_order(self):
+        steps = [self._step("a"), self._step("b"), self._step("c")]
+        self.assertEqual(plan_steps(steps), [set(), {0}, {1}])
+
+    def test_declared_dependencies(self):
+        steps = [self._step("a", depends_on=[]), self._step("b", depends_on=[]), self._step("c", depends_on=["a", "b"])]
+        self.assertEqual(plan_steps(steps), [set(), set(), {0, 1}])
+
+    def test_unknown_dependency_rejected(self):
+        with self.assertRaisesMessage(ValueError, "unknown step(s): nope"):
+            plan_steps([self._step("a", depends_on=["nope"])])
+
+    def test_duplicate_key_rejected(self):
+        with self.assertRaisesMessage(ValueError, "Duplicate step key 'a'"):
+            plan_steps([self._step("a"), self._step("a")])
+
+    def test_cycle_rejected(self):
+        steps = [self._step("a", depends_on=["b"]), self._step("b", depends_on=["a"]), self._step("c", depends_on=[])]
+        with self.assertRaisesMessage(ValueError, "Dependency cycle between steps: A, B"):
+            plan_steps(steps)
+
+    def test_defined_steps_form_valid_graphs(self):
+        for steps in (VACATION_STEPS, HOME_STEPS):
+            deps = plan_steps(steps)
+            # The away flag flips last
+            self.assertEqual(deps[-1], set(range(len(steps) - 1)))
+
+
+def _begin_run(run_data):
+    """Make run_data the active run, as start_execution does."""
+    run_store.create_run(run_data)
+    _runs[run_data["run_id"]] = run_data
+
+
+class RunStepsTests(TestCase):
+    """Tests for the full run_steps execution flow."""
 
     @patch("vacation_mode.executor.verify_entity_state", return_value=(True, None))
     @patch("vacation_mode.executor.call_ha_service")
@@ -668,15 +796,14 @@ class RunStepsTests(TestCase):
         ]
 
         run_id = "test-run-1"
-        _execution_lock.acquire()
-        _runs[run_id] = {
+        _begin_run({
             "run_id": run_id, "mode": "vacation", "status": "running",
             "steps": [{"alias": s["alias"], "icon": s["icon"], "status": STATUS_PENDING, "attempt": 0, "error": None} for s in steps],
-        }
+        })
 
         run_steps(run_id, steps)
 
-        run_data = _runs[run_id]
+        run_data = get_run_status(run_id)
         self.assertEqual(run_data["status"], "complete")
         for step in run_data["steps"]:
             self.assertEqual(step["status"], STATUS_SUCCESS)
@@ -693,15 +820,14 @@ class RunStepsTests(TestCase):
         ]
 
         run_id = "test-run-2"
-        _execution_lock.acquire()
-        _runs[run_id] = {
+        _begin_run({
             "run_id": run_id, "mode": "vacation", "status": "running",
             "steps": [{"alias": "Flaky Step", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None}],
-        }
+        })
 
         run_steps(run_id, steps)
 
-        run_data = _runs[run_id]
+        run_data = get_run_status(run_id)
         self.assertEqual(run_data["steps"][0]["status"], STATUS_SUCCESS)
         self.assertEqual(run_data["status"], "complete")
 
@@ -721,18 +847,17 @@ class RunStepsTests(TestCase):
         ]
 
         run_id = "test-run-3"
-        _execution_lock.acquire()
-        _runs[run_id] = {
+        _begin_run({
             "run_id": run_id, "mode": "vacation", "status": "running",
             "steps": [
                 {"alias": "Bad Step", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None},
                 {"alias": "Good Step", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None},
             ],
-        }
+        })
 
         run_steps(run_id, steps)
 
-        run_data = _runs[run_id]
+        run_data = get_run_status(run_id)
         self.assertEqual(run_data["status"], "complete")
         self.assertEqual(run_data["steps"][0]["status"], STATUS_FAILED)
         self.assertEqual(run_data["steps"][1]["status"], STATUS_SUCCESS)
@@ -763,15 +888,14 @@ class RunStepsTests(TestCase):
         ]
 
         run_id = "test-run-retry-partial"
-        _execution_lock.acquire()
-        _runs[run_id] = {
+        _begin_run({
             "run_id": run_id, "mode": "home", "status": "running",
             "steps": [{"alias": "Multi Step", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None, "progress": None}],
-        }
+        })
 
         run_steps(run_id, steps)
 
-        run_data = _runs[run_id]
+        run_data = get_run_status(run_id)
         self.assertEqual(run_data["steps"][0]["status"], STATUS_SUCCESS)
         # Total calls: 3 initial + 1 retry = 4 (NOT 3 initial + 3 retry = 6)
         self.assertEqual(mock_call.call_count, 4)
@@ -780,63 +904,190 @@ class RunStepsTests(TestCase):
 
     @patch("vacation_mode.executor.verify_entity_state", return_value=(True, None))
     @patch("vacation_mode.executor.call_ha_service")
-    def test_run_releases_lock_on_completion(self, mock_call, mock_verify):
+    def test_run_is_inactive_on_completion(self, mock_call, mock_verify):
         mock_call.return_value = (True, None)
         steps = [{"alias": "S", "icon": "fas fa-test", "actions": [{"action": "switch/turn_on", "data": {"entity_id": "s1"}}]}]
 
         run_id = "test-run-4"
-        _execution_lock.acquire()
-        _runs[run_id] = {
+        _begin_run({
             "run_id": run_id, "mode": "vacation", "status": "running",
             "steps": [{"alias": "S", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None}],
-        }
+        })
 
         run_steps(run_id, steps)
-        # Lock should be released — we can acquire it again
-        acquired = _execution_lock.acquire(blocking=False)
-        self.assertTrue(acquired)
-        if acquired:
-            _execution_lock.release()
+        # No longer active — another run can start
+        self.assertIsNone(get_active_run())
+        self.assertNotIn(run_id, _runs)
+        self.assertTrue(run_store.create_run({"run_id": "test-run-5", "mode": "home", "status": "running", "steps": []}))
 
 
-class StartExecutionTests(TestCase):
-    """Tests for the start_execution function."""
+class ParallelRunStepsTests(TestCase):
+    """Tests for running the step graph on the worker pool."""
 
     def setUp(self):
-        if _execution_lock.locked():
-            _execution_lock.release()
-        _runs.clear()
+        self.active = set()
+        self.overlaps = []
 
-    def tearDown(self):
-        # Wait for any background threads to finish
+    def _slow_call(self, action, data, **kwargs):
+        entity_id = data["entity_id"]
+        self.overlaps.append(set(self.active))
+        self.active.add(entity_id)
         time.sleep(0.2)
-        if _execution_lock.locked():
-            _execution_lock.release()
-        _runs.clear()
+        self.active.discard(entity_id)
+        return True, None
 
-    @patch("vacation_mode.executor.call_ha_service")
-    def test_start_vacation_mode(self, mock_call):
-        mock_call.return_value = (True, None)
+    def _run(self, steps):
+        run_id = "test-run-parallel"
+        _begin_run({
+            "run_id": run_id, "mode": "vacation", "status": "running",
+            "steps": [{"alias": s["alias"], "icon": s["icon"], "status": STATUS_PENDING, "attempt": 0, "error": None} for s in steps],
+        })
+        with patch("vacation_mode.executor.call_ha_service", side_effect=self._slow_call), \
+                patch("vacation_mode.executor.verify_entity_state", return_value=(True, None)):
+            run_steps(run_id, steps)
+        return get_run_status(run_id)
+
+    def _step(self, key, entity_id, **extra):
+        return {
+            "alias": key, "icon": "fas fa-test", "key": key, "depends_on": [],
+            "actions": [{"action": "switch/turn_on", "data": {"entity_id": entity_id}}],
+            **extra,
+        }
+
+    def test_independent_steps_run_in_parallel(self):
+        run_data = self._run([self._step("a", "s1"), self._step("b", "s2"), self._step("c", "s3")])
+        self.assertEqual([s["status"] for s in run_data["steps"]], [STATUS_SUCCESS] * 3)
+        self.assertLess(run_data["timing"]["elapsed"], 0.5)
+        self.assertGreaterEqual(run_data["timing"]["serial"], 0.6)
+        self.assertGreaterEqual(run_data["steps"][0]["duration"], 0.2)
+
+    def test_dependent_step_waits(self):
+        run_data = self._run([self._step("a", "s1"), self._step("b", "s2"), self._step("c", "s3", depends_on=["a", "b"])])
+        self.assertEqual(self.overlaps[2], set())
+        self.assertGreaterEqual(run_data["steps"][2]["started_at"], run_data["steps"][0]["finished_at"])
+        self.assertGreaterEqual(run_data["timing"]["critical_path"], 0.4)
+
+    def test_steps_sharing_a_device_or_resource_do_not_overlap(self):
+        a, b, c = self._run([
+            self._step("a", "s1", resources=["hub"]),
+            self._step("b", "s2", resources=["hub"]),
+            self._step("c", "s1"),
+        ])["steps"]
+        # b shares the hub with a, c shares the s1 device; b and c may overlap
+        self.assertGreaterEqual(b["started_at"], a["finished_at"])
+        self.assertGreaterEqual(c["started_at"], a["finished_at"])
+
+
+class RunEventTests(TestCase):
+    """Tests for the run progress pushed to the page."""
+
+    def test_step_deltas_hold_only_changed_fields(self):
+        previous = [
+            {"alias": "A", "status": "running", "attempt": 1, "error": None},
+            {"alias": "B", "status": "pending", "attempt": 0, "error": None},
+        ]
+        current = [
+            {"alias": "A", "status": "retrying", "attempt": 2, "error": None},
+            {"alias": "B", "status": "pending", "attempt": 0, "error": None, "duration": None},
+        ]
+        self.assertEqual(events.step_deltas(previous, current), {
+            "0": {"status": "retrying", "attempt": 2},
+            "1": {"duration": None},
+        })
+
+    async def test_watcher_sends_changed_steps_then_the_finished_run(self):
+        watcher = events.RunWatcher()
+        sent = []
+
+        async def send(update):
+            sent.append(update)
+        watcher._send = send
+        step = {"alias": "S", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None}
+        run = {"run_id": "test-run-events", "mode": "vacation", "status": "running", "steps": [step]}
+        await sync_to_async(run_store.create_run)(run)
+
+        await watcher.check()
+        await watcher.check()  # unchanged: nothing to send
+        await sync_to_async(run_store.save_run)({**run, "steps": [{**step, "status": STATUS_RUNNING, "attempt": 1}]})
+        await watcher.check()
+        await sync_to_async(run_store.save_run)({**run, "status": "complete", "steps": [{**step, "status": STATUS_SUCCESS}]})
+        await watcher.check()
+        await watcher.check()  # nothing active any more
+
+        self.assertEqual([update["type"] for update in sent], ["run", "steps", "run"])
+        self.assertEqual(sent[1]["steps"], {"0": {"status": STATUS_RUNNING, "attempt": 1}})
+        self.assertEqual(sent[2]["run"]["status"], "complete")
+
+
+class VacationRunConsumerTests(TestCase):
+    """New sockets get the active run, then whatever the executor pushes."""
+
+    async def test_connect_sends_snapshot_then_pushes(self):
+        run = {"run_id": "abc", "mode": "vacation", "status": "running", "steps": []}
+        with patch("vacation_mode.consumers.get_active_run", return_value=run):
+            communicator = WebsocketCommunicator(VacationRunConsumer.as_asgi(), "/ws/vacation_mode/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            message = await communicator.receive_json_from()
+            self.assertEqual(message, {"type": "snapshot", "run": run})
+
+            update = {"type": "steps", "run_id": "abc", "steps": {"0": {"status": "success"}}}
+            await get_channel_layer().group_send(events.RUN_GROUP, {"type": "run.update", "update": update})
+            self.assertEqual(await communicator.receive_json_from(), update)
+
+            await communicator.disconnect()
+
+    @patch("vacation_mode.events.RUN_WATCH_INTERVAL", 0.01)
+    @patch("vacation_mode.events.RUN_IDLE_WATCH_INTERVAL", 0.01)
+    async def test_socket_gets_deltas_of_a_run_executed_by_another_worker(self):
+        # Nothing executes here: the run only changes in the run store
+        step = {"alias": "S", "icon": "fas fa-test", "status": STATUS_PENDING, "attempt": 0, "error": None}
+        run = {"run_id": "remote01", "mode": "vacation", "status": "running", "steps": [step]}
+        await sync_to_async(run_store.create_run)(run)
+
+        communicator = WebsocketCommunicator(VacationRunConsumer.as_asgi(), "/ws/vacation_mode/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {"type": "snapshot", "run": run})
+        self.assertEqual(await communicator.receive_json_from(), {"type": "run", "run": run})
+
+        await sync_to_async(run_store.save_run)({**run, "steps": [{**step, "status": STATUS_RUNNING, "attempt": 1}]})
+        self.assertEqual(await communicator.receive_json_from(), {
+            "type": "steps", "run_id": "remote01", "steps": {"0": {"status": STATUS_RUNNING, "attempt": 1}},
+        })
+
+        await sync_to_async(run_store.save_run)({**run, "status": "complete", "steps": [{**step, "status": STATUS_SUCCESS}]})
+        finished = await communicator.receive_json_from()
+        self.assertEqual(finished["type"], "run")
+        self.assertEqual(finished["run"]["status"], "complete")
+
+        await communicator.disconnect()
+        self.assertEqual(events.get_watcher().sockets, 0)
+
+
+class StartExecutionTests(TestCase):
+    """Tests for the start_execution function."""
+
+    def setUp(self):
+        # The runs themselves are covered by RunStepsTests
+        patcher = patch("vacation_mode.executor.run_steps")
+        self.mock_run_steps = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(_runs.clear)
+
+    def test_start_vacation_mode(self):
         run_id, error = start_execution("vacation", dry_run=True)
         self.assertIsNotNone(run_id)
         self.assertIsNone(error)
 
-    @patch("vacation_mode.executor.call_ha_service")
-    def test_start_home_mode(self, mock_call):
-        mock_call.return_value = (True, None)
+    def test_start_home_mode(self):
         run_id, error = start_execution("home", dry_run=True)
         self.assertIsNotNone(run_id)
         self.assertIsNone(error)
 
-    @patch("vacation_mode.executor.call_ha_service")
-    def test_concurrent_execution_blocked(self, mock_call):
+    def test_concurrent_execution_blocked(self):
         """Cannot start a second execution while one is running."""
-        # Simulate a long-running step
-        def slow_call(*args, **kwargs):
-            time.sleep(2)
-            return True, None
-        mock_call.side_effect = slow_call
-
         run_id1, error1 = start_execution("vacation", dry_run=True)
         self.assertIsNotNone(run_id1)
         self.assertIsNone(error1)
@@ -846,20 +1097,78 @@ class StartExecutionTests(TestCase):
         self.assertIsNone(run_id2)
         self.assertIn("already in progress", error2)
 
-    @patch("vacation_mode.executor.call_ha_service")
-    def test_run_stores_dry_run_flag(self, mock_call):
-        mock_call.return_value = (True, None)
+    def test_run_stores_dry_run_flag(self):
         run_id, _ = start_execution("vacation", dry_run=True)
-        self.assertTrue(_runs[run_id]["dry_run"])
+        self.assertTrue(get_run_status(run_id)["dry_run"])
 
-    @patch("vacation_mode.executor.call_ha_service")
-    def test_run_status_has_all_steps(self, mock_call):
-        mock_call.return_value = (True, None)
+    def test_run_status_has_all_steps(self):
         run_id, _ = start_execution("vacation", dry_run=True)
         status = get_run_status(run_id)
         self.assertIsNotNone(status)
         self.assertEqual(len(status["steps"]), len(VACATION_STEPS))
 
+    def test_started_run_is_active(self):
+        run_id, _ = start_execution("home", dry_run=True)
+        self.assertEqual(get_active_run()["run_id"], run_id)
+        self.mock_run_steps.assert_called_once()
+
+
+class RunStoreTests(TestCase):
+    """Tests for the database-backed run store."""
+
+    def _run(self, run_id, status="running"):
+        return {
+            "run_id": run_id, "mode": "vacation", "status": status,
+            "steps": [{"alias": "S", "icon": "fas fa-test", "status": STATUS_RUNNING, "attempt": 1, "error": None}],
+        }
+
+    def test_completed_run_frees_the_slot(self):
+        self.assertTrue(run_store.create_run(self._run("a")))
+        self.assertFalse(run_store.create_run(self._run("b")))
+        run_store.save_run(self._run("a", status="complete"))
+        self.assertIsNone(get_active_run())
+        self.assertTrue(run_store.create_run(self._run("b")))
+        self.assertEqual(get_active_run()["run_id"], "b")
+
+    def test_taken_run_id_is_not_reported_as_a_running_run(self):
+        run_store.create_run(self._run("a"))
+        run_store.save_run(self._run("a", status="complete"))
+        with self.assertRaises(IntegrityError):
+            run_store.create_run(self._run("a"))
+        self.assertIsNone(get_active_run())
+
+    @patch("vacation_mode.executor.threading.Thread")
+    @patch("vacation_mode.executor.uuid.uuid4", side_effect=["taken-id", "fresh-id"])
+    def test_start_execution_retries_a_taken_run_id(self, _uuid, _thread):
+        run_store.create_run(self._run("taken-id"))
+        run_store.save_run(self._run("taken-id", status="complete"))
+        run_id, error = start_execution("home", dry_run=True)
+        self.assertIsNone(error)
+        self.assertEqual(run_id, "fresh-id")
+        self.assertEqual(get_active_run()["run_id"], "fresh-id")
+
+    def test_stale_active_run_is_abandoned(self):
+        run_store.create_run(self._run("a"))
+        VacationRun.objects.filter(run_id="a").update(
+            updated_at=timezone.now() - run_store.RUN_STALE_AFTER - timedelta(seconds=1),
+        )
+        self.assertIsNone(get_active_run())
+        run_data = get_run_status("a")
+        self.assertEqual(run_data["status"], "complete")
+        self.assertTrue(run_data["abandoned"])
+        self.assertEqual(run_data["steps"][0]["status"], STATUS_FAILED)
+        self.assertTrue(run_store.create_run(self._run("b")))
+
+    def test_finished_runs_are_evicted_after_ttl(self):
+        run_store.create_run(self._run("old"))
+        run_store.save_run(self._run("old", status="complete"))
+        VacationRun.objects.filter(run_id="old").update(
+            completed_at=timezone.now() - run_store.RUN_TTL - timedelta(seconds=1),
+        )
+        run_store.create_run(self._run("new"))
+        self.assertIsNone(get_run_status("old"))
+        self.assertIsNotNone(get_run_status("new"))
+
 
 class AdditionalViewTests(TestCase):
     """Additional view tests for edge cases."""
@@ -990,6 +1299,14 @@ class TemplateRenderTests(TestCase):
         self.assertContains(response, 'id="progress-container"')
         self.assertContains(response, 'id="progress-bar"')
 
+    @patch("vacation_mode.views.get_away_mode_state")
+    @patch("vacation_mode.views.get_active_run")
+    def test_active_run_resumes_with_quoted_id(self, mock_active, mock_away):
+        mock_away.return_value = False
+        mock_active.return_value = {"run_id": "1e2f3a4b", "mode": "vacation", "steps": []}
+        response = self.client.get("/vacation_mode/")
+        self.assertContains(response, "let runId = '1e2f3a4b';")
+
     @patch("vacation_mode.views.get_away_mode_state")
     @patch("vacation_mode.views.get_active_run")
     def test_template_has_status_badge(self, mock_active, mock_away):
@@ -62,7 +62,7 @@ def execute_view(request):
 
 @require_GET
 def status_view(request, run_id):
-    """API endpoint to poll the status of a run."""
+    """API endpoint for the status of a run (the page polls it only while its WebSocket is down)."""
     run_data = get_run_status(run_id)
     if not run_data:
         return JsonResponse({"error": "Run not found"}, status=404)